@@ -0,0 +1,124 @@
+# Runs the benchmark suite and compares its results across commits.
+#
+# `run` runs the benchmarks of every area (or those given with --only) at one
+# of the SCALES and writes the results, with the commit and machine they were
+# measured on, to a JSON file (see results.py). `compare` lines up two such
+# files metric by metric and exits with status 1 if any metric got worse by
+# more than the threshold, so it can gate a change:
+#
+#   $ git checkout main && python benchmarks/bench.py run --output main.json
+#   $ git checkout my-branch && python benchmarks/bench.py run --output branch.json
+#   $ python benchmarks/bench.py compare main.json branch.json
+#
+# Only compare runs made on the same machine and scale. Every area can also
+# be run on its own with its *_bench.py script.
+import argparse
+import sys
+import time
+
+import chunker_bench
+import pipeline_bench
+import schedule_file_bench
+import scheduler_bench
+import startup_bench
+import walker_bench
+from results import (DEFAULT_THRESHOLD, REPOSITORY, CompareResults, Environment, LoadResults, PrintComparison,
+                     PrintResults, WriteResults)
+
+# The arguments of each area's RunBenchmark() at each scale. The full scale
+# is the production one: schedules of up to a million jobs (about 2 GB of
+# memory), a million-file tree and multi-GB backups; it runs for a long time.
+SCALES = {
+    "quick": {
+        "scheduler": {"job_counts": [10_000], "ticks": 60},
+        "schedule_file": {"job_counts": [1_000]},
+        "walker": {"file_counts": [5_000], "worker_counts": [1, 8]},
+        "pipeline": {"sizes_in_megabytes": [16]},
+        "chunker": {"sizes_in_megabytes": [16]},
+        "startup": {},
+    },
+    "default": {
+        "scheduler": {"job_counts": [10_000, 100_000]},
+        "schedule_file": {"job_counts": [1_000, 10_000]},
+        "walker": {"file_counts": [10_000, 100_000]},
+        "pipeline": {"sizes_in_megabytes": [64, 256]},
+        "chunker": {"sizes_in_megabytes": [64, 256]},
+        "startup": {},
+    },
+    "full": {
+        # A full parse of the schedule costs about a millisecond per job, so its largest size is kept lower
+        "scheduler": {"job_counts": [10_000, 100_000, 1_000_000], "ticks": 240},
+        "schedule_file": {"job_counts": [10_000, 100_000]},
+        "walker": {"file_counts": [100_000, 1_000_000], "worker_counts": [1, 8, 32]},
+        "pipeline": {"sizes_in_megabytes": [256, 2048]},
+        "chunker": {"sizes_in_megabytes": [256, 2048]},
+        "startup": {},
+    },
+}
+
+AREAS = {
+    "scheduler": scheduler_bench.RunBenchmark,
+    "schedule_file": schedule_file_bench.RunBenchmark,
+    "walker": walker_bench.RunBenchmark,
+    "pipeline": pipeline_bench.RunBenchmark,
+    "chunker": chunker_bench.RunBenchmark,
+    "startup": startup_bench.RunBenchmark,
+}
+
+def Run(args) -> int:
+    results = []
+    for area in args.only or AREAS:
+        print(f"Running the {area} benchmarks ({args.scale})...", file=sys.stderr)
+        started = time.perf_counter()
+        area_results = AREAS[area](**SCALES[args.scale][area], repeat=args.repeat)
+        print(f"  done in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+        results += area_results
+    output = args.output
+    if output is None:
+        environment = Environment()
+        name = (environment["commit"] or "unknown")[:12] + ("-dirty" if environment["dirty"] else "")
+        output = REPOSITORY / "benchmarks" / "results" / f"{name}-{args.scale}.json"
+    WriteResults(output, results, {"scale": args.scale, "only": args.only, "repeat": args.repeat})
+    PrintResults(results)
+    print(f"Results written to {output}", file=sys.stderr)
+    return 0
+
+def Compare(args) -> int:
+    old, new = LoadResults(args.old), LoadResults(args.new)
+    for label, document in (("old", old), ("new", new)):
+        environment = document["environment"]
+        print(f"{label}: {environment['commit']}{' (dirty)' if environment['dirty'] else ''} "
+              f"{document['arguments']['scale']}, {environment['platform']}, Python {environment['python']}")
+    if old["arguments"]["scale"] != new["arguments"]["scale"]:
+        print("warning: the runs were made at different scales; only the sizes they share are compared",
+              file=sys.stderr)
+    rows = CompareResults(old, new)
+    if not rows:
+        print("The runs have no benchmark in common.", file=sys.stderr)
+        return 2
+    regressions = PrintComparison(rows, args.threshold)
+    if regressions:
+        print(f"{regressions} metric(s) regressed by more than {args.threshold:.0%}.")
+        return 1
+    return 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="abackup benchmark suite")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+    run = commands.add_parser("run", help="run the benchmarks and write their results as JSON")
+    run.add_argument("--scale", choices=SCALES, default="default")
+    run.add_argument("--only", nargs="+", choices=AREAS, help="areas to benchmark (default: all)")
+    run.add_argument("--repeat", type=int, default=3, help="runs of each measurement; the best one is kept")
+    run.add_argument("--output", help="results file (default: benchmarks/results/<commit>-<scale>.json)")
+    run.set_defaults(handler=Run)
+    compare = commands.add_parser("compare", help="compare two results files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                         help=f"relative change reported as a regression (default: {DEFAULT_THRESHOLD})")
+    compare.set_defaults(handler=Compare)
+    args = parser.parse_args()
+    return args.handler(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+# Benchmark: content-defined chunking throughput, as a function of the size
+# of the input.
+#
+# The scan benchmark measures Chunker.find_boundary() alone over random data
+# held in memory, with the native scan from the _gearscan extension and with
+# the pure-Python fallback; the Python scan only runs over the first few MB,
+# which is enough for a stable figure. The chunks benchmark reads the data
+# through Chunker.chunks() from an in-memory file, so it adds the buffering.
+# Both use the chunk sizes of chunked backups (see ChunkStore).
+#
+# Usage (after `pip install --editable .`, which builds the extension):
+#   $ python benchmarks/chunker_bench.py --megabytes 16 256
+import argparse
+import io
+import random
+from unittest import mock
+
+from abackup import chunkstore
+from abackup.chunkstore import Chunker
+from results import BestOf, PrintResults, Result
+
+PYTHON_SCAN_MEGABYTES = 4
+
+def RandomData(megabytes: int) -> bytes:
+    return random.Random(megabytes).randbytes(megabytes * 1024 * 1024)
+
+def ScanAll(chunker: Chunker, data: bytes) -> int:
+    start = count = 0
+    while start < len(data):
+        start += chunker.find_boundary(data, start)
+        count += 1
+    return count
+
+def BenchmarkScan(data: bytes, megabytes: int, repeat: int) -> list[dict]:
+    chunker = Chunker()
+    metrics = {}
+    if chunkstore._gearscan is not None:
+        metrics["native_bytes_per_second"] = len(data) / BestOf(lambda: ScanAll(chunker, data), repeat)
+    sample = data[:PYTHON_SCAN_MEGABYTES * 1024 * 1024]
+    with mock.patch.object(chunkstore, "_gearscan", None):
+        metrics["python_bytes_per_second"] = len(sample) / BestOf(lambda: ScanAll(chunker, sample), repeat)
+    return [Result("chunker.scan", {"megabytes": megabytes}, **metrics)]
+
+def BenchmarkChunks(data: bytes, megabytes: int, repeat: int) -> list[dict]:
+    chunker = Chunker()
+    seconds = BestOf(lambda: sum(1 for _ in chunker.chunks(io.BytesIO(data))), repeat)
+    return [Result("chunker.chunks", {"megabytes": megabytes, "native": chunkstore._gearscan is not None},
+                   input_bytes_per_second=len(data) / seconds)]
+
+def RunBenchmark(sizes_in_megabytes, repeat=3) -> list[dict]:
+    results = []
+    for megabytes in sizes_in_megabytes:
+        data = RandomData(megabytes)
+        results += BenchmarkScan(data, megabytes, repeat)
+        results += BenchmarkChunks(data, megabytes, repeat)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-defined chunking benchmark")
+    parser.add_argument("--megabytes", type=int, nargs="+", default=[16, 256], help="sizes of the input")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    PrintResults(RunBenchmark(args.megabytes, args.repeat))
+
+if __name__ == "__main__":
+    main()
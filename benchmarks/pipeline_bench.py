@@ -0,0 +1,92 @@
+# Benchmark: the backup data path on a synthetic source tree, as a function
+# of its size.
+#
+# The compress benchmark packs the tree into an archive with every available
+# codec and discards the output, measuring the walk, tar and parallel
+# compression stages alone. The upload benchmark runs whole backups through
+# RCloneBackupHandler against the local rclone stand-in the tests use
+# (tests/fake_rclone.py), as a streamed compressed archive and as a mirror,
+# so it adds the rc API calls and the upload itself. The stand-in writes to
+# a temporary directory, so network and cloud latency are left out.
+#
+# Usage (after `pip install --editable .`):
+#   $ python benchmarks/pipeline_bench.py --megabytes 64 512
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from abackup.archive import write_archive
+from abackup.backupcore import RCloneBackupHandler, RCloneProcessPool
+from abackup.compression import codec_available
+from abackup.jobs import CompressionCodec
+from abackup.schedule import BackupJobScheduleFileParser
+from results import REPOSITORY, BestOf, PrintResults, Result
+from synthetic import CreateSyntheticTree
+
+FAKE_RCLONE = REPOSITORY / "tests" / "fake_rclone.py"
+
+MEAN_FILE_SIZE = 64 * 1024
+
+# Discards what is written to it, like an upload to an infinitely fast remote
+class NullWriter:
+    def write(self, data) -> int:
+        return len(data)
+
+def MakeJob(source: Path, destination: str, codec: CompressionCodec | None):
+    compression = False if codec is None else {"codec": codec.value}
+    return BackupJobScheduleFileParser(source / "schedule.yaml").parse_job("bench", {
+        "location": str(source), "destination": destination, "compression": compression,
+        "schedule": {"time": "02:00", "timezone": "UTC"}})
+
+def BenchmarkCompress(source: Path, total_bytes: int, megabytes: int, repeat: int) -> list[dict]:
+    results = []
+    for codec in CompressionCodec:
+        if not codec_available(codec):
+            continue
+        job = MakeJob(source, "unused", codec)
+        stats = []
+        seconds = BestOf(lambda: stats.append(write_archive(job, NullWriter())), repeat)
+        results.append(Result("pipeline.compress", {"megabytes": megabytes, "codec": codec.value},
+                              input_bytes_per_second=total_bytes / seconds,
+                              compressed_ratio=stats[-1].bytes_written / total_bytes))
+    return results
+
+def BenchmarkUpload(source: Path, remotes: Path, total_bytes: int, megabytes: int, repeat: int) -> list[dict]:
+    os.environ["FAKE_RCLONE_ROOT"] = str(remotes)
+    pool = RCloneProcessPool(command=(sys.executable, str(FAKE_RCLONE)))
+    handler = RCloneBackupHandler(pool)
+    runs = iter(range(2 * repeat))
+    try:
+        handler.run(MakeJob(source, "bench:warmup", CompressionCodec.GZIP)) # Starts the rclone process
+        # Every run goes to a new destination, so the mirror copies every file each time
+        archive = BestOf(lambda: handler.run(MakeJob(source, f"bench:archive-{next(runs)}", CompressionCodec.GZIP)),
+                         repeat)
+        mirror = BestOf(lambda: handler.run(MakeJob(source, f"bench:mirror-{next(runs)}", None)), repeat)
+    finally:
+        handler.close()
+        pool.close()
+    return [Result("pipeline.upload", {"megabytes": megabytes},
+                   archive_bytes_per_second=total_bytes / archive, mirror_bytes_per_second=total_bytes / mirror)]
+
+def RunBenchmark(sizes_in_megabytes, repeat=3) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        for megabytes in sizes_in_megabytes:
+            source = Path(tempdir) / f"source-{megabytes}"
+            total_bytes = CreateSyntheticTree(source, megabytes * 1024 * 1024 // MEAN_FILE_SIZE,
+                                              mean_file_size=MEAN_FILE_SIZE)
+            results += BenchmarkCompress(source, total_bytes, megabytes, repeat)
+            results += BenchmarkUpload(source, Path(tempdir) / f"remotes-{megabytes}", total_bytes, megabytes, repeat)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress and upload pipeline benchmark")
+    parser.add_argument("--megabytes", type=int, nargs="+", default=[64, 512], help="sizes of the source trees")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    PrintResults(RunBenchmark(args.megabytes, args.repeat))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# Timing helpers and the JSON result files of the benchmark suite.
+#
+# A result is one benchmark at one set of parameters:
+#   {"name": "scheduler.ticks", "params": {"jobs": 100000, "ticks": 120}, "metrics": {"busy_tick_p99_us": 41.2, ...}}
+# The unit of a metric is the suffix of its name. Metrics ending in
+# "_per_second" are throughputs, where higher is better; for every other
+# metric (times, sizes, ratios) lower is better. A results file holds the
+# results of one run together with the commit and machine they were measured
+# on, so that runs can be compared across commits with CompareResults().
+# Measurements run with the garbage collector off and keep the best of
+# several runs, which is the least disturbed by the rest of the machine.
+import gc
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+RESULTS_FORMAT_VERSION = 1
+
+# Changes smaller than this fraction are treated as noise when comparing runs.
+# Timings of a few milliseconds (the quick scale) vary by 10-20% between runs
+# on a busy machine; lower it for runs at a larger scale on a quiet one.
+DEFAULT_THRESHOLD = 0.25
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+
+def Result(name: str, params: dict, **metrics) -> dict:
+    return {"name": name, "params": params, "metrics": metrics}
+
+# Runs function repeat times and returns the shortest time in seconds
+def BestOf(function, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        with NoGC():
+            started = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+'''
+Runs function repeat times and returns the best value of each metric in the
+dicts it returns: the lowest, or the highest for throughputs.
+'''
+def BestRun(function, repeat: int = 3) -> dict:
+    runs = []
+    for _ in range(repeat):
+        with NoGC():
+            runs.append(function())
+    return {metric: (max if _higher_is_better(metric) else min)(run[metric] for run in runs) for metric in runs[0]}
+
+# Keeps the garbage collector out of the measurements, as timeit does
+class NoGC:
+    def __enter__(self):
+        self._enabled = gc.isenabled()
+        gc.collect()
+        gc.disable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._enabled:
+            gc.enable()
+
+'''
+Summarizes latencies in seconds as microsecond percentiles, as metrics named
+prefix_p50_us, prefix_p99_us and prefix_max_us.
+'''
+def LatencyMetrics(prefix: str, samples: list) -> dict:
+    samples = sorted(samples)
+    def percentile(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1e6
+    return {f"{prefix}_p50_us": percentile(0.5), f"{prefix}_p99_us": percentile(0.99),
+            f"{prefix}_max_us": samples[-1] * 1e6}
+
+# The commit and machine results are measured on
+def Environment() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=REPOSITORY, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def WriteResults(path, results: list, arguments: dict):
+    document = {"version": RESULTS_FORMAT_VERSION, "environment": Environment(), "arguments": arguments,
+                "results": results}
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(document, indent=2) + "\n", encoding="utf-8")
+
+def LoadResults(path) -> dict:
+    document = json.loads(Path(path).read_text(encoding="utf-8"))
+    if document.get("version") != RESULTS_FORMAT_VERSION:
+        raise ValueError(f"'{path}' is not a version {RESULTS_FORMAT_VERSION} benchmark results file.")
+    return document
+
+'''
+Compares two results documents and returns one row per metric measured in
+both: (name, params, metric, old value, new value, change, worsening), where
+change is the relative change of the value and worsening is the same change
+counted positive when the new value is worse.
+'''
+def CompareResults(old: dict, new: dict) -> list[tuple]:
+    old_results = {_result_key(entry): entry for entry in old["results"]}
+    rows = []
+    for entry in new["results"]:
+        previous = old_results.get(_result_key(entry))
+        if previous is None:
+            continue
+        for metric, value in entry["metrics"].items():
+            old_value = previous["metrics"].get(metric)
+            if old_value is None or value is None:
+                continue
+            if old_value == 0:
+                change = 0.0 if value == 0 else math.copysign(math.inf, value)
+            else:
+                change = (value - old_value) / abs(old_value)
+            worsening = -change if _higher_is_better(metric) else change
+            rows.append((entry["name"], entry["params"], metric, old_value, value, change, worsening))
+    return rows
+
+def PrintComparison(rows: list, threshold: float = DEFAULT_THRESHOLD, file=sys.stdout) -> int:
+    regressions = 0
+    for name, params, metric, old_value, new_value, change, worsening in rows:
+        flag = ""
+        if worsening > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif worsening < -threshold:
+            flag = "  improved"
+        label = f"{name}[{_format_params(params)}] {metric}"
+        print(f"{label:<72} {old_value:>14.6g} {new_value:>14.6g} {change:>+8.1%}{flag}", file=file)
+    return regressions
+
+def PrintResults(results: list, file=sys.stdout):
+    for entry in results:
+        print(f"{entry['name']}[{_format_params(entry['params'])}]", file=file)
+        for metric, value in entry["metrics"].items():
+            print(f"    {metric:<40} {value:>14.6g}", file=file)
+
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_second")
+
+def _result_key(entry: dict) -> tuple:
+    return entry["name"], json.dumps(entry["params"], sort_keys=True)
+
+def _format_params(params: dict) -> str:
+    return ", ".join(f"{name}={value}" for name, value in params.items())
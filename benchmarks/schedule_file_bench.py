@@ -0,0 +1,74 @@
+# Benchmark: loading and reloading a schedule file, as a function of job count.
+#
+# Cold start is the daemon's startup: reading the schedule, with and without
+# the compiled schedule cache, into a fresh scheduler. Reload is `abackup
+# reload`: re-reading a file where nothing, or EDITED_FRACTION of the jobs,
+# changed and applying the diff to the running scheduler.
+#
+# Usage (after `pip install --editable .`):
+#   $ python benchmarks/schedule_file_bench.py --jobs 100 1000 10000
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from abackup.schedule import BackupJobScheduleFileParser, BackupJobScheduler
+from results import NoGC, PrintResults, Result
+from synthetic import WriteSyntheticSchedule
+
+# Share of the jobs edited between two reloads
+EDITED_FRACTION = 0.01
+
+def TimeColdStart(schedule_path: Path, use_cache: bool) -> float:
+    with NoGC():
+        start = time.perf_counter()
+        scheduler = BackupJobScheduler()
+        scheduler.apply_schedule_diff(BackupJobScheduleFileParser(schedule_path).load(use_cache=use_cache))
+        return time.perf_counter() - start
+
+# Times reloads of the file after each of the rewrites; the rewrite itself is not timed
+def TimeReloads(schedule_path: Path, rewrites) -> float:
+    parser = BackupJobScheduleFileParser(schedule_path)
+    scheduler = BackupJobScheduler()
+    scheduler.apply_schedule_diff(parser.reload())
+    best = None
+    for rewrite in rewrites:
+        rewrite()
+        with NoGC():
+            start = time.perf_counter()
+            scheduler.apply_schedule_diff(parser.reload())
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def RunBenchmark(job_counts, repeat=3) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        for job_count in job_counts:
+            schedule_path = Path(tempdir) / f"schedule-{job_count}.yaml"
+            WriteSyntheticSchedule(schedule_path, job_count, Path(tempdir))
+            full_parse = min(TimeColdStart(schedule_path, use_cache=False) for _ in range(repeat))
+            BackupJobScheduleFileParser(schedule_path).load() # Writes the cache
+            cached = min(TimeColdStart(schedule_path, use_cache=True) for _ in range(repeat))
+            cache_bytes = BackupJobScheduleFileParser(schedule_path).cache_path.stat().st_size
+
+            unchanged = TimeReloads(schedule_path, [lambda: None] * repeat)
+            edited = range(0, job_count, max(1, round(1 / EDITED_FRACTION)))
+            # Every other rewrite puts the edited jobs back, so that each reload sees the same number of changes
+            rewrites = [lambda changed=changed: WriteSyntheticSchedule(schedule_path, job_count, Path(tempdir), changed)
+                        for changed in [edited, ()] * repeat]
+            reload_edited = TimeReloads(schedule_path, rewrites)
+            results.append(Result("schedule_file.load", {"jobs": job_count},
+                                  full_parse_seconds=full_parse, cached_seconds=cached, cache_bytes=cache_bytes,
+                                  reload_unchanged_seconds=unchanged, reload_edited_seconds=reload_edited))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Schedule load and reload benchmark")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    PrintResults(RunBenchmark(args.jobs, args.repeat))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Benchmark: BackupJobPool operations and BackupJobScheduler tick latency on
+# synthetic schedules, as a function of job count.
+#
+# The scheduler is loaded the way the daemon loads it (one ScheduleDiff of
+# every job) and then driven minute by minute, as the daemon's main loop
+# does: every tick asks for the ready jobs and finishes each of them right
+# away, which schedules its next fire.
+#
+# Usage (after `pip install --editable .`):
+#   $ python benchmarks/scheduler_bench.py --jobs 10000 100000 1000000
+import argparse
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from abackup.jobs import JobStatus
+from abackup.schedule import BackupJobPool, BackupJobScheduler, ScheduleDiff
+from results import BestOf, BestRun, LatencyMetrics, PrintResults, Result
+from synthetic import MakeSyntheticJobs
+
+START = datetime(2026, 1, 5, tzinfo=timezone.utc) # A Monday, so the MWF jobs fire on the first day
+IDLE_TICKS = 1000
+
+# Seconds per operation of calling operation on every job
+def TimePerJob(jobs, operation) -> float:
+    started = time.perf_counter()
+    for job in jobs:
+        operation(job)
+    return (time.perf_counter() - started) / len(jobs)
+
+# One pass of the pool operations over every job
+def BenchmarkPool(jobs: list) -> dict:
+    pool = BackupJobPool()
+    add = TimePerJob(jobs, lambda job: pool.add(job, validate=False))
+    job_ids = [job.job_id for job in jobs]
+    get_by_id = TimePerJob(job_ids, pool.get_by_id)
+    def queue_and_reschedule(job_id):
+        pool.set_status(job_id, JobStatus.QUEUED)
+        pool.set_status(job_id, JobStatus.SCHEDULED)
+    set_status = TimePerJob(job_ids, queue_and_reschedule) / 2
+    get_by_status = BestOf(lambda: pool.get_by_status(JobStatus.SCHEDULED), 1)
+    count_by_status = TimePerJob(range(1000), lambda _: pool.count_by_status(JobStatus.SCHEDULED))
+    iterate = BestOf(lambda: sum(1 for _ in pool), 1)
+    replace = TimePerJob(jobs, pool.replace)
+    remove = TimePerJob(job_ids, pool.remove_by_id)
+    return {"add_us": add * 1e6, "get_by_id_us": get_by_id * 1e6, "set_status_us": set_status * 1e6,
+            "replace_us": replace * 1e6, "remove_us": remove * 1e6, "get_by_status_seconds": get_by_status,
+            "count_by_status_us": count_by_status * 1e6, "iterate_seconds": iterate}
+
+# Loads the jobs into a new scheduler and runs it for ticks minutes
+def BenchmarkScheduler(jobs: list, ticks: int) -> dict:
+    scheduler = BackupJobScheduler()
+    diff = ScheduleDiff()
+    diff.added = {job.job_id: job for job in jobs}
+    started = time.perf_counter()
+    scheduler.apply_schedule_diff(diff, START)
+    apply = time.perf_counter() - started
+
+    idle = []
+    for _ in range(IDLE_TICKS):
+        started = time.perf_counter()
+        scheduler.get_ready_jobs(START)
+        idle.append(time.perf_counter() - started)
+
+    busy = []
+    fired = 0
+    finish = 0.0
+    for minute in range(1, ticks + 1):
+        now = START + timedelta(minutes=minute)
+        started = time.perf_counter()
+        ready = scheduler.get_ready_jobs(now)
+        busy.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        for job in ready:
+            scheduler.job_finished(job.job_id, now)
+        finish += time.perf_counter() - started
+        fired += len(ready)
+    return {"apply_diff_seconds": apply, **LatencyMetrics("idle_tick", idle), **LatencyMetrics("busy_tick", busy),
+            "ready_us_per_job": sum(busy) / max(fired, 1) * 1e6, "finished_us_per_job": finish / max(fired, 1) * 1e6,
+            "jobs_fired": fired}
+
+def RunBenchmark(job_counts, ticks=120, repeat=3) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as tempdir:
+        for job_count in job_counts:
+            jobs = MakeSyntheticJobs(job_count, Path(tempdir))
+            results.append(Result("scheduler.pool", {"jobs": job_count}, **BestRun(lambda: BenchmarkPool(jobs), repeat)))
+            results.append(Result("scheduler.ticks", {"jobs": job_count, "ticks": ticks},
+                                  **BestRun(lambda: BenchmarkScheduler(jobs, ticks), repeat)))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Job pool and scheduler benchmark")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--ticks", type=int, default=120, help="minutes of scheduling to simulate")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    PrintResults(RunBenchmark(args.jobs, args.ticks, args.repeat))
+
+if __name__ == "__main__":
+    main()
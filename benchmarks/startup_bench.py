@@ -0,0 +1,73 @@
+# Benchmark: startup time of the CLI's client commands.
+#
+# Commands that talk to the daemon must answer in milliseconds, so only
+# abackup.ui and the control client may be imported before a command runs
+# (tests/startup_tests.py checks which modules are loaded). This measures what
+# those imports cost: the self time `python -X importtime` reports for every
+# module the command loads beyond the bare interpreter's own, and the wall
+# time of the whole process. No daemon is running, so each command fails
+# right after connecting, as quickly as the imports allow.
+#
+# The import time of a client command should stay within STARTUP_BUDGET_MS on
+# a developer machine; run on its own, the script exits with status 1 past it.
+#
+# Usage (after `pip install --editable .`):
+#   $ python benchmarks/startup_bench.py --repeat 10
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from results import PrintResults, Result
+
+# Budget for the imports of a client command, on top of the interpreter's own startup
+STARTUP_BUDGET_MS = 50
+
+COMMANDS = {"help": ["--help"], "status": ["status"], "list": ["list"]}
+
+# Runs python -X importtime with the given arguments and returns the self
+# time in microseconds of every module it imported
+def ImportTimes(*args) -> dict:
+    process = subprocess.run([sys.executable, "-X", "importtime", *args], capture_output=True, text=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:"):
+            self_time, _, name = line[len("import time:"):].split("|")
+            if self_time.strip().isdigit():
+                times[name.strip()] = int(self_time)
+    return times
+
+def BenchmarkCommand(name: str, socket: Path, repeat: int) -> dict:
+    interpreter = ImportTimes("-c", "pass")
+    imports = process = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        times = ImportTimes("-m", "abackup", "--socket", str(socket), *COMMANDS[name])
+        elapsed = time.perf_counter() - started
+        command_imports = sum(self_time for module, self_time in times.items() if module not in interpreter) / 1e6
+        imports = command_imports if imports is None else min(imports, command_imports)
+        process = elapsed if process is None else min(process, elapsed)
+    return Result("startup.cli", {"command": name}, imports_seconds=imports, process_seconds=process)
+
+def RunBenchmark(commands=tuple(COMMANDS), repeat=3) -> list[dict]:
+    with tempfile.TemporaryDirectory() as tempdir:
+        return [BenchmarkCommand(name, Path(tempdir) / "control.sock", repeat) for name in commands]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CLI startup benchmark")
+    parser.add_argument("--commands", nargs="+", choices=COMMANDS, default=list(COMMANDS))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    results = RunBenchmark(args.commands, args.repeat)
+    PrintResults(results)
+    over = [result["params"]["command"] for result in results
+            if result["metrics"]["imports_seconds"] * 1000 > STARTUP_BUDGET_MS]
+    if over:
+        print(f"Over the {STARTUP_BUDGET_MS} ms import budget: {', '.join(over)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
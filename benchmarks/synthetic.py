@@ -0,0 +1,115 @@
+# Synthetic inputs shared by the benchmarks: schedules of many jobs, as job
+# definitions, BackupJobs or a schedule file, and source trees on disk.
+#
+# Everything is derived from an index or a seed, so two runs (and two
+# commits) benchmark exactly the same inputs.
+import json
+import random
+from pathlib import Path
+
+from abackup.schedule import BackupJobScheduleFileParser
+
+TIMEZONES = ("UTC", "America/Los_Angeles", "Europe/Berlin", "Asia/Tokyo")
+
+# The schedules of the synthetic jobs cycle through every recurrence the engine
+# supports, with fire times spread over the minutes of the day
+def SyntheticSchedule(index: int) -> dict:
+    minute_of_day = index * 7919 % 1440 # 7919 is prime, so consecutive jobs land far apart
+    hour, minute = divmod(minute_of_day, 60)
+    timezone = TIMEZONES[index % len(TIMEZONES)]
+    kind = index % 8
+    if kind in (0, 1):
+        return {"time": f"{hour:02d}:{minute:02d}", "timezone": timezone, "days": "MWF"}
+    if kind == 2:
+        return {"time": f"{hour:02d}:{minute:02d}", "timezone": timezone, "day-of-month": index % 31 + 1}
+    if kind == 3:
+        return {"interval": f"{(index % 8 + 1) * 15}m"}
+    if kind == 4:
+        return {"cron": f"{minute} {hour} * * 1-5", "timezone": timezone}
+    if kind == 5:
+        return {"time": f"{hour:02d}:{minute:02d}", "timezone": timezone, "misfire": "skip"}
+    return {"time": f"{hour:02d}:{minute:02d}", "timezone": timezone}
+
+def SyntheticJobId(index: int) -> str:
+    return f"job-{index:07d}"
+
+# The definition of a job as it appears under `jobs:` in a schedule file
+def SyntheticJobData(index: int, source: Path) -> dict:
+    job_id = SyntheticJobId(index)
+    data = {
+        "location": str(source),
+        "type": "Google Drive",
+        "destination": f"gdrive:backups/{job_id}",
+        "schedule": SyntheticSchedule(index),
+        "max-retention-size": "15GB",
+    }
+    if index % 5 == 0:
+        data["compression"] = {"codec": "zstd", "level": 3}
+    if index % 7 == 0:
+        data["exclude"] = ["*.tmp", "cache/"]
+    return data
+
+# Parses the synthetic definitions the way the schedule loader does, without the YAML
+def MakeSyntheticJobs(job_count: int, source: Path) -> list:
+    parser = BackupJobScheduleFileParser(source / "schedule.yaml")
+    return [parser.parse_job(SyntheticJobId(index), SyntheticJobData(index, source)) for index in range(job_count)]
+
+'''
+Writes a schedule file of job_count synthetic jobs whose source is source.
+Jobs listed in changed get a different destination, for benchmarking the
+reload of an edited schedule.
+'''
+def WriteSyntheticSchedule(path: Path, job_count: int, source: Path, changed=()):
+    changed = set(changed)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("version: 0.0\njobs:\n")
+        for index in range(job_count):
+            data = SyntheticJobData(index, source)
+            if index in changed:
+                data["destination"] += "-edited"
+            file.write(_yaml_block(SyntheticJobId(index), data))
+
+# Renders a job definition as YAML; strings are written as JSON strings, which YAML reads back as is
+def _yaml_block(job_id: str, data: dict, indent: str = "    ") -> str:
+    lines = [f"{indent}{job_id}:"]
+    for key, value in data.items():
+        if isinstance(value, dict):
+            lines.append(f"{indent * 2}{key}:")
+            lines += [f"{indent * 3}{name}: {json.dumps(item)}" for name, item in value.items()]
+        else:
+            lines.append(f"{indent * 2}{key}: {json.dumps(value)}")
+    return "\n".join(lines) + "\n"
+
+'''
+Creates a source tree of file_count files under root: a random tree of
+directories of files_per_directory files each, with file sizes drawn around
+mean_file_size (exponentially distributed). About
+compressible of the files hold text, the others random bytes. Returns the
+total size of the files.
+'''
+def CreateSyntheticTree(root: Path, file_count: int, mean_file_size: int = 4096,
+                        files_per_directory: int = 32, compressible: float = 0.5, seed: int = 0) -> int:
+    generator = random.Random(seed)
+    words = [bytes(generator.choices(b"abcdefghijklmnopqrstuvwxyz", k=generator.randint(2, 10))) + b" "
+             for _ in range(512)]
+    directories = [root]
+    root.mkdir(parents=True, exist_ok=True)
+    total = 0
+    for number in range(file_count):
+        if number and number % files_per_directory == 0:
+            parent = directories[generator.randrange(len(directories))]
+            directory = parent / f"dir{len(directories):05d}"
+            directory.mkdir()
+            directories.append(directory)
+        size = max(0, int(generator.expovariate(1 / mean_file_size))) if mean_file_size else 0
+        total += size
+        (directories[-1] / f"file{number:07d}.dat").write_bytes(_content(generator, words, size, compressible))
+    return total
+
+def _content(generator: random.Random, words: list, size: int, compressible: float) -> bytes:
+    if generator.random() >= compressible:
+        return generator.randbytes(size)
+    text = bytearray()
+    while len(text) < size:
+        text += b"".join(generator.choices(words, k=64))
+    return bytes(text[:size])
@@ -6,7 +6,7 @@ https://github.com/pypa/sampleproject
 """
 
 # Always prefer setuptools over distutils
-from setuptools import setup, find_packages
+from setuptools import Extension, setup, find_packages
 import pathlib
 
 here = pathlib.Path(__file__).parent.resolve()
@@ -116,6 +116,9 @@ setup(
     #   py_modules=["my_module"],
     #
     packages=find_packages(where="src"),  # Required
+    # Native boundary scan of the chunker. Optional: without a C compiler the
+    # build goes on and chunkstore.py uses its pure-Python scan instead.
+    ext_modules=[Extension("abackup._gearscan", ["src/abackup/_gearscan.c"], optional=True)],
     # Specify which Python versions you support. In contrast to the
     # 'Programming Language' classifiers above, 'pip install' will check this
     # and refuse to install the project if the version does not match. See
@@ -129,6 +132,7 @@ setup(
     # https://packaging.python.org/discussions/install-requires-vs-requirements/
     install_requires=[
         "tzdata>=2025.2; sys_platform == 'win32'",
+        "PyYAML>=6.0",
         ],  # Optional
     # List additional groups of dependencies here (e.g. development
     # dependencies). Users will be able to install these using the "extras"
@@ -139,6 +143,11 @@ setup(
     # Similar to `install_requires` above, these must be valid existing
     # projects.
     extras_require={  # Optional
+        # Optional compression codecs (gzip is always available)
+        "zstd": ["zstandard>=0.22"],
+        "lz4": ["lz4>=4.0"],
+        # Schedule file change notifications where inotify is unavailable (macOS, Windows)
+        "watch": ["watchdog>=3.0"],
         # "dev": ["check-manifest"],
         # "test": ["coverage"],
     },
@@ -152,7 +161,7 @@ setup(
     entry_points={  # Optional
         "console_scripts": [
             # "sample=sample:main",
-            "abackup=abackup:cli"
+            "abackup=abackup.ui:cli"
         ],
     },
     # List additional URLs that are relevant to your project as a dict.
@@ -1 +1,9 @@
-from abackup.ui import cli
\ No newline at end of file
+# The package itself imports nothing, so that importing one module (or
+# running a CLI command) does not load all the others. `abackup.cli` is still
+# available for entry points installed before it moved to abackup.ui:cli.
+
+def __getattr__(name):
+    if name == "cli":
+        from abackup.ui import cli
+        return cli
+    raise AttributeError(f"module 'abackup' has no attribute '{name}'")
@@ -0,0 +1,6 @@
+import sys
+
+from abackup.ui import cli
+
+# python -m abackup
+sys.exit(cli())
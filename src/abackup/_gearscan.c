@@ -0,0 +1,86 @@
+/*
+ * Native boundary scan of the content-defined chunker (see Chunker in
+ * chunkstore.py), which falls back to an identical pure-Python loop when this
+ * extension is not built.
+ *
+ * The Python loop keeps its rolling hash as an unbounded integer that never
+ * exceeds 65 bits: hash = (hash >> 1) + gear[byte]. Here the low 64 bits and
+ * the 65th bit (the carry of the addition) are kept separately, so that both
+ * implementations cut the same data at the same places. The scan runs with the
+ * GIL released, so chunking threads scan in parallel.
+ */
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+
+#define GEAR_TABLE_SIZE (256 * sizeof(uint64_t))
+
+/*
+ * Returns the index in [begin, end) of the first byte after which the hash has
+ * none of the mask bits set, plus one, or end if there is none.
+ */
+static Py_ssize_t
+scan(const unsigned char *data, Py_ssize_t begin, Py_ssize_t end, const uint64_t *gear, uint64_t mask)
+{
+    uint64_t hash = 0;
+    uint64_t carry = 0;
+    for (Py_ssize_t index = begin; index < end; index++) {
+        uint64_t value = gear[data[index]];
+        hash = ((hash >> 1) | (carry << 63)) + value;
+        carry = hash < value;
+        if (!(hash & mask)) {
+            return index + 1;
+        }
+    }
+    return end;
+}
+
+static PyObject *
+find_boundary(PyObject *module, PyObject *args)
+{
+    Py_buffer data, table;
+    Py_ssize_t begin, end;
+    unsigned long long mask;
+    if (!PyArg_ParseTuple(args, "y*nny*K:find_boundary", &data, &begin, &end, &table, &mask)) {
+        return NULL;
+    }
+    PyObject *result = NULL;
+    if (table.len != (Py_ssize_t)GEAR_TABLE_SIZE) {
+        PyErr_Format(PyExc_ValueError, "The gear table must be %zd bytes.", (Py_ssize_t)GEAR_TABLE_SIZE);
+    }
+    else if (begin < 0 || begin > end || end > data.len) {
+        PyErr_SetString(PyExc_ValueError, "The scanned range is outside the data.");
+    }
+    else {
+        uint64_t gear[256];
+        memcpy(gear, table.buf, GEAR_TABLE_SIZE); /* The table is in native byte order */
+        Py_ssize_t boundary;
+        Py_BEGIN_ALLOW_THREADS
+        boundary = scan((const unsigned char *)data.buf, begin, end, gear, (uint64_t)mask);
+        Py_END_ALLOW_THREADS
+        result = PyLong_FromSsize_t(boundary);
+    }
+    PyBuffer_Release(&table);
+    PyBuffer_Release(&data);
+    return result;
+}
+
+static PyMethodDef gearscan_methods[] = {
+    {"find_boundary", find_boundary, METH_VARARGS,
+     "find_boundary(data, begin, end, table, mask) -> index after the first boundary in data[begin:end], or end"},
+    {NULL, NULL, 0, NULL},
+};
+
+static struct PyModuleDef gearscan_module = {
+    PyModuleDef_HEAD_INIT,
+    "abackup._gearscan",
+    "Native boundary scan of the content-defined chunker.",
+    -1,
+    gearscan_methods,
+};
+
+PyMODINIT_FUNC
+PyInit__gearscan(void)
+{
+    return PyModule_Create(&gearscan_module);
+}
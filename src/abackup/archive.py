@@ -0,0 +1,191 @@
+import logging
+import queue
+import tarfile
+import threading
+from pathlib import Path
+
+from abackup.compression import ParallelCompressor, codec_suffix, is_probably_compressed
+from abackup.jobs import BackupJob
+from abackup.profiling import bind
+from abackup.walker import ParallelWalker, PathMatcher, job_matcher
+
+logger = logging.getLogger(__name__)
+
+# Streaming archive producer for compressed backups.
+#
+# The source tree is walked by a ParallelWalker and packed into a tar stream that
+# goes straight through a ParallelCompressor into the destination: a local
+# file, or (through ArchiveStream) the body of an upload request. No
+# uncompressed or temporary archive is ever written, and memory stays bounded:
+# the compressor and the stream queue hold a fixed number of blocks, and tar
+# members are not kept once they have been written.
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_QUEUE_CHUNKS = 16
+
+# Returns the file name suffix of the job's archives, e.g. ".tar.zst"
+def archive_suffix(job: BackupJob) -> str:
+    return ".tar" + codec_suffix(job.compression_codec)
+
+class ArchiveStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes_read = 0 # Size of the archived file contents
+        self.bytes_written = 0 # Size of the compressed archive
+
+'''
+Writes a compressed tar archive of job.source_path to output (any object
+with a write(bytes) method) and returns its ArchiveStats. Members are named
+relative to the source's parent, so the archive unpacks into one directory.
+'''
+def write_archive(job: BackupJob, output) -> ArchiveStats:
+    stats = ArchiveStats()
+    counter = _CountingWriter(output)
+    source = Path(job.source_path)
+    with ParallelCompressor.for_job(counter, job) as compressor:
+        with tarfile.open(fileobj=compressor, mode="w", format=tarfile.PAX_FORMAT) as tar:
+            for path, arcname in _archive_entries(source, job.recursive, job_matcher(job)):
+                _add_entry(tar, compressor, path, arcname, stats)
+                tar.members.clear() # Only needed for appending, and they add up on large trees
+    stats.bytes_written = counter.bytes_written
+    return stats
+
+# Produces a job's archive on a background thread and yields it as bytes
+# chunks, for use as a streamed request body. At most STREAM_QUEUE_CHUNKS
+# chunks are buffered, so a slow upload slows the producer down rather than
+# growing memory. Errors from the producer are raised by the iterator.
+class ArchiveStream:
+    def __init__(self, job: BackupJob, chunk_size: int = STREAM_CHUNK_SIZE, max_chunks: int = STREAM_QUEUE_CHUNKS):
+        self.job = job
+        self.stats = None # ArchiveStats, once the archive is complete
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._cancelled = threading.Event()
+        self._error = None
+        self._thread = None
+
+    def __iter__(self):
+        if self._thread is not None:
+            raise ValueError("An ArchiveStream can only be iterated once.")
+        self._thread = threading.Thread(target=bind(self._produce), name=f"abackup-archive-{self.job.job_id}",
+                                        daemon=True)
+        self._thread.start()
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+            yield chunk
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    # Stops the producer, e.g. after the upload failed
+    def close(self):
+        self._cancelled.set()
+        if self._thread is not None:
+            while self._thread.is_alive():
+                try:
+                    self._queue.get(timeout=0.1) # Unblock a producer waiting for space
+                except queue.Empty:
+                    pass
+            self._thread.join()
+
+    def _produce(self):
+        writer = _QueueWriter(self._queue, self._chunk_size, self._cancelled)
+        try:
+            stats = write_archive(self.job, writer)
+            writer.flush()
+            self.stats = stats
+        except BaseException as e:
+            self._error = e
+        finally:
+            writer.put(None)
+
+class _StreamCancelled(Exception):
+    pass
+
+class _QueueWriter:
+    def __init__(self, chunks: queue.Queue, chunk_size: int, cancelled: threading.Event):
+        self._chunks = chunks
+        self._chunk_size = chunk_size
+        self._cancelled = cancelled
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def put(self, chunk):
+        while True:
+            if self._cancelled.is_set() and chunk is not None:
+                raise _StreamCancelled("The archive stream was closed.")
+            try:
+                self._chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                if chunk is None and self._cancelled.is_set():
+                    return
+
+class _CountingWriter:
+    def __init__(self, output):
+        self._output = output
+        self.bytes_written = 0
+
+    def write(self, data) -> int:
+        self._output.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+# Yields (path, arcname) for the source and everything below it that the
+# matcher selects, parents first
+def _archive_entries(source: Path, recursive: bool, matcher: PathMatcher | None = None):
+    yield source, source.name
+    if source.is_dir() and not source.is_symlink():
+        for entry in ParallelWalker(source, recursive, matcher):
+            yield Path(entry.path), f"{source.name}/{entry.relative_path}"
+
+def _add_entry(tar: tarfile.TarFile, compressor: ParallelCompressor, path: Path, arcname: str, stats: ArchiveStats):
+    try:
+        tarinfo = tar.gettarinfo(str(path), arcname)
+    except FileNotFoundError:
+        return # Removed since the directory was listed
+    if tarinfo is None:
+        return # Sockets and other types tar cannot store
+    if not tarinfo.isreg():
+        tar.addfile(tarinfo)
+        return
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with file:
+        compressor.set_compressible(not is_probably_compressed(path))
+        tar.addfile(tarinfo, _SizedReader(file, tarinfo.size, path))
+    stats.files += 1
+    stats.bytes_read += tarinfo.size
+
+# Reads exactly `size` bytes from a file that may change while it is archived:
+# growth is cut off and a shrunk file is padded with zeros, so the tar stream
+# always matches the member header written before the data
+class _SizedReader:
+    def __init__(self, file, size: int, path: Path):
+        self._file = file
+        self._remaining = size
+        self._path = path
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        if len(data) < size:
+            logger.warning("'%s' shrank while it was archived; padding it with zeros", self._path)
+            data += bytes(size - len(data))
+        self._remaining -= size
+        return data
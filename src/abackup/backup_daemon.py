@@ -1,12 +1,31 @@
 
+import asyncio
+import logging
+import os
 import platform
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from abackup.backupcore import BackupResult, close_handlers, get_handler
+from abackup.controlserver import CONTROL_SERVER_AVAILABLE, ControlServer
+from abackup.core import BackupJobExecutor
+from abackup.filewatch import open_file_watcher
+from abackup.history import RunHistory, RunRecord, get_run_history
+from abackup.jobs import BackupJob, JobStatus
+from abackup.journal import SchedulerJournal, get_scheduler_journal
+from abackup.metrics import MetricsServer, get_metrics
+from abackup.profiling import profile_run
+from abackup.schedule import BackupJobScheduleFileParser, BackupJobScheduler, ScheduleDiff
+from abackup.throttle import ThrottleSchedule, get_throttle
 
 if platform.system() == "Windows":
     #Do Windows-specific imports here
     pass
 if platform.system() in ["Linux", "Darwin"]:
     #Do Unix-specific imports here
-    pass
+    import signal
+
+logger = logging.getLogger(__name__)
 
 # There should only ever be **one** Backup Daemon instance running per system.
 # This daemon will be responsible for starting/stopping the scheduler, executing the jobs,
@@ -14,29 +33,375 @@ if platform.system() in ["Linux", "Darwin"]:
 
 # The cli commands should be able to find/reach this daemon instance to run commands.
 # To do so, it should use BackupDaemon as an abstraction layer for platform-specific implementations.
+# Given a control_socket, the daemon serves the CLI's commands (status, list,
+# run, enable, disable, reload, metrics) on it while the main loop runs (see
+# control.py). Given a metrics_address (host, port), it also serves its
+# metrics over HTTP for Prometheus to scrape (see metrics.py).
+
+# The main loop is event-driven rather than polling: it sleeps until the
+# scheduler's next fire time and is woken early by control requests (wake(),
+# reload_schedule(), stop()) or by a change to the schedule file. Due jobs are
+# handed to a BackupJobExecutor, which runs them concurrently within its limits.
+# Every finished run is appended to the run history (see history.py). Job
+# status transitions and fires go to the scheduler journal (see journal.py),
+# which is replayed on startup to rerun interrupted jobs and make up for runs
+# missed while the daemon was down. Bandwidth and I/O priority limits (see
+# throttle.py) are re-applied whenever the throttle schedule switches profiles.
+
+# Longest the main loop sleeps without re-reading the wall clock, so that clock
+# steps (NTP, suspend/resume) are noticed even when no job is due for days.
+MAX_SLEEP_SECONDS = 60.0
+
+# How often the schedule file is stat'ed to detect edits where the operating
+# system cannot report them (see filewatch.py)
+SCHEDULE_WATCH_INTERVAL_SECONDS = 2.0
+
+SCHEDULE_LAG = get_metrics().histogram(
+    "abackup_schedule_lag_seconds", "Seconds from the time a run fell due until it started running.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0))
+# Set by the daemon's metrics collector on every scrape
+JOBS = get_metrics().gauge("abackup_jobs", "Scheduled jobs by status.", ("status",))
+EXECUTOR_JOBS = get_metrics().gauge(
+    "abackup_executor_jobs", "Runs waiting for a worker (pending) or running in the executor.", ("state",))
 
 
 class BackupDaemon():
     # Ensure singleton behavior
     # Abstract Base Class
-    def main_loop(self):
-        pass
+    def __init__(self, schedule_path, perform_job=None, max_workers: int = 4,
+                 backup_type_limits: dict | None = None, destination_limit: int | None = None,
+                 history: RunHistory | None = None, log_path=None, journal: SchedulerJournal | None = None,
+                 smoothing_window: timedelta | None = None, throttle_schedule: ThrottleSchedule | None = None,
+                 control_socket=None, metrics_address: tuple[str, int] | None = None, trace_directory=None):
+        self.schedule_path = Path(schedule_path)
+        self.parser = BackupJobScheduleFileParser(self.schedule_path)
+        self.history = history or get_run_history()
+        # With a smoothing window, jobs sharing a fire time are spread out using their median run times
+        self.scheduler = BackupJobScheduler(journal or get_scheduler_journal(), smoothing_window=smoothing_window,
+                                            expected_duration=self._expected_duration,
+                                            definition_digest=self.parser.definition_digest)
+        # Blocking callable that performs one BackupJob and may return its
+        # BackupResult; raising marks the run FAILED
+        self.perform_job = perform_job or self._perform_job
+        self.log_path = log_path # Recorded with each run as the place to look for its log output
+        self.trace_directory = trace_directory # Where profiled runs write their traces (default: state directory)
+        # The backup handlers draw their transfers from the shared throttle
+        self.throttle = get_throttle()
+        if throttle_schedule is not None:
+            self.throttle.schedule = throttle_schedule
+        self.executor = BackupJobExecutor(
+            self._run_and_record,
+            max_workers=max_workers,
+            backup_type_limits=backup_type_limits,
+            destination_limit=destination_limit,
+            set_status=self._set_job_status,
+            on_job_finished=self._job_finished,
+            current_job=self._current_job,
+        )
+
+        self.control_socket = None if control_socket is None else Path(control_socket)
+        self.metrics_address = metrics_address
+        self.metrics_server = None # Serving while the main loop runs, when metrics_address is set
+
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+        self._reload_task = None
+        self._reload_lock = None
+
+    '''
+    Runs until stop() is called (or SIGTERM/SIGINT on Unix). Loads the
+    schedule, then repeatedly dispatches due jobs and sleeps until the next
+    fire time or an explicit wakeup.
+    '''
+    async def main_loop(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._reload_lock = asyncio.Lock()
+        self._stopping = False
+        control_server = None
+        if self.control_socket is not None and not CONTROL_SERVER_AVAILABLE:
+            logger.warning("This platform has no Unix sockets; running without the control channel")
+        elif self.control_socket is not None:
+            # Started first: it refuses to start while another daemon is listening
+            control_server = ControlServer(self.control_socket, self._control_handlers())
+            await control_server.start()
+        try:
+            diff = await asyncio.to_thread(self.parser.load)
+        except BaseException:
+            if control_server is not None:
+                await control_server.close()
+            raise
+        self.scheduler.apply_schedule_diff(diff)
+        recovered = self.scheduler.recover(datetime.now(timezone.utc))
+        if recovered:
+            logger.info("Recovered %d interrupted or missed run(s) from the scheduler journal", recovered)
+        self._install_signal_handlers()
+        get_metrics().add_collector(self._collect_metrics)
+        if self.metrics_address is not None:
+            self.metrics_server = MetricsServer(get_metrics(), *self.metrics_address)
+            try:
+                self.metrics_server.start()
+            except OSError as e:
+                logger.error("Cannot serve metrics on %s:%d: %s", *self.metrics_address, e)
+                self.metrics_server = None
+        file_watcher = open_file_watcher(self.schedule_path, SCHEDULE_WATCH_INTERVAL_SECONDS)
+        watch_task = asyncio.create_task(self._watch_schedule_file(file_watcher))
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                now = datetime.now(timezone.utc)
+                next_throttle_change = self.throttle.apply(now)
+                for job in self.scheduler.get_ready_jobs(now):
+                    self.executor.submit(job)
+
+                now = datetime.now(timezone.utc)
+                timeout = self.scheduler.seconds_until_next_fire(now)
+                timeout = MAX_SLEEP_SECONDS if timeout is None else min(timeout, MAX_SLEEP_SECONDS)
+                if next_throttle_change is not None:
+                    timeout = max(0.0, min(timeout, (next_throttle_change - now).total_seconds()))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # A reload cut short here is never applied; the schedule is read again on the next start
+            reload_task, self._reload_task = self._reload_task, None
+            tasks = [task for task in (watch_task, reload_task) if task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            file_watcher.close()
+            if control_server is not None:
+                await control_server.close()
+            if self.metrics_server is not None:
+                await asyncio.to_thread(self.metrics_server.close)
+                self.metrics_server = None
+            get_metrics().remove_collector(self._collect_metrics)
+            self._remove_signal_handlers()
+            # Jobs that have not started stay QUEUED; running jobs are allowed to finish
+            self.executor.clear_pending()
+            if self.executor.running_count:
+                logger.info("Waiting for %d running job(s) to finish", self.executor.running_count)
+            await self.executor.join()
+            self.executor.shutdown()
+            await asyncio.to_thread(self.history.flush)
+            await asyncio.to_thread(close_handlers)
+            self._loop = None
 
     def start(self):
-        pass
+        asyncio.run(self.main_loop())
 
+    # Thread-safe: may be called from signal handlers, other threads or the loop itself
     def stop(self):
-        pass
+        self._call_in_loop(self._request_stop)
 
     def restart(self):
         pass
 
-    def status(self):
-        pass
+    def status(self) -> dict:
+        pool = self.scheduler.job_pool
+        next_fire_time = self.scheduler.next_fire_time()
+        return {
+            "running": self.is_running(),
+            "jobs": len(pool),
+            "statuses": {status.value: pool.count_by_status(status) for status in JobStatus if pool.count_by_status(status)},
+            "next_fire_time": next_fire_time.isoformat() if next_fire_time else None,
+        }
 
     def is_running(self) -> bool:
+        return self._loop is not None and not self._stopping
+
+    # Thread-safe: makes the main loop re-check the scheduler immediately
+    def wake(self):
+        self._call_in_loop(self._wakeup_set)
+
+    # Thread-safe: re-reads the schedule file and applies the changes in place
+    def reload_schedule(self):
+        self._call_in_loop(self._request_reload)
+
+    # Private helper methods
+
+    def _perform_job(self, job: BackupJob) -> BackupResult:
+        result = get_handler(job).run(job)
+        logger.info("Backup job '%s' finished: %r", job.job_id, result)
+        return result
+
+    # Runs on an executor worker thread. Profiled jobs (job.profile_mode) run
+    # under a trace whose file is linked from the run record.
+    def _run_and_record(self, job: BackupJob):
+        started = datetime.now(timezone.utc)
+        trace = None
+        try:
+            with profile_run(job, self.trace_directory) as trace:
+                result = self.perform_job(job)
+        except Exception as e:
+            self.history.record(RunRecord(job.job_id, started, datetime.now(timezone.utc), JobStatus.FAILED,
+                                          exit_code=getattr(e, "exit_code", 1), log_path=self._log_path(),
+                                          error=str(e) or type(e).__name__, trace_path=_trace_path(trace)))
+            raise
+        run = RunRecord(job.job_id, started, datetime.now(timezone.utc), JobStatus.COMPLETED, log_path=self._log_path(),
+                        trace_path=_trace_path(trace))
+        if isinstance(result, BackupResult):
+            run.started = result.started or run.started
+            run.ended = result.ended or run.ended
+            run.bytes_read, run.bytes_written, run.files = \
+                result.bytes_read, result.bytes_written, result.files_transferred
+        self.history.record(run)
+
+    def _expected_duration(self, job_id: str) -> float | None:
+        return self.history.duration_percentiles(job_id, (50,)).get(50)
+
+    def _log_path(self) -> str | None:
+        return None if self.log_path is None else str(self.log_path)
+
+    def _set_job_status(self, job_id, status: JobStatus):
+        if status == JobStatus.RUNNING:
+            fire_time = self.scheduler.queued_fire_time(job_id)
+            if fire_time is not None:
+                SCHEDULE_LAG.observe(max(0.0, (datetime.now(timezone.utc) - fire_time).total_seconds()))
+        # The job may have been removed from the schedule while it was running
+        self.scheduler.set_job_status(job_id, status)
+
+    # Metrics collector, run on every scrape; it may run on any thread, so it only reads counters
+    def _collect_metrics(self):
+        pool = self.scheduler.job_pool
+        JOBS.set_all({(status.value,): pool.count_by_status(status) for status in JobStatus})
+        EXECUTOR_JOBS.labels("pending").set(self.executor.pending_count)
+        EXECUTOR_JOBS.labels("running").set(self.executor.running_count)
+
+    # The pool's definition of a job waiting in the executor, None once it was removed
+    def _current_job(self, job: BackupJob) -> BackupJob | None:
+        return self.scheduler.job_pool.get_by_id(job.job_id)
+
+    def _job_finished(self, job: BackupJob, status: JobStatus):
+        self.scheduler.job_finished(job.job_id)
+        self._wakeup_set()
+
+    async def _watch_schedule_file(self, watcher):
+        while True:
+            await watcher.wait()
+            self._request_reload()
+
+    async def _reload(self):
+        try:
+            await self._reload_now()
+        except (OSError, ValueError):
+            logger.exception("Failed to reload schedule '%s'; keeping the current schedule", self.schedule_path)
+
+    async def _reload_now(self) -> ScheduleDiff:
+        async with self._reload_lock:
+            diff = await asyncio.to_thread(self.parser.reload)
+            if diff:
+                logger.info("Reloaded schedule: %r", diff)
+                self.scheduler.apply_schedule_diff(diff)
+                self._wakeup_set()
+            return diff
+
+    # Control channel commands, run on the event loop
+
+    def _control_handlers(self) -> dict:
+        return {
+            "status": self._control_status,
+            "list": self._control_list,
+            "run": self._control_run,
+            "enable": self._control_enable,
+            "disable": self._control_disable,
+            "reload": self._control_reload,
+            "metrics": self._control_metrics,
+        }
+
+    async def _control_status(self) -> dict:
+        status = self.status()
+        status["pid"] = os.getpid()
+        status["running_jobs"] = self.executor.running_count
+        status["schedule_path"] = str(self.schedule_path.absolute())
+        return status
+
+    async def _control_list(self) -> list:
+        last_runs = await asyncio.to_thread(self.history.last_runs)
+        jobs = []
+        for job in sorted(self.scheduler.job_pool, key=lambda job: job.job_id):
+            next_fire_time = self.scheduler.job_next_fire_time(job.job_id)
+            last_run = last_runs.get(job.job_id)
+            jobs.append({
+                "job_id": job.job_id,
+                "status": job.status.value,
+                "type": job.BackupType.value,
+                "destination": job.destination_url,
+                "next_fire_time": next_fire_time.isoformat() if next_fire_time else None,
+                "last_run": None if last_run is None else {
+                    "status": last_run.status.value,
+                    "started": last_run.started.isoformat(),
+                    "ended": last_run.ended.isoformat(),
+                    "error": last_run.error,
+                    "trace_path": last_run.trace_path,
+                },
+            })
+        return jobs
+
+    async def _control_run(self, job_id: str) -> dict:
+        self.scheduler.run_now(job_id, datetime.now(timezone.utc))
+        self._wakeup_set()
+        return {"job_id": job_id}
+
+    async def _control_enable(self, job_id: str) -> dict:
+        changed = self.scheduler.set_job_enabled(job_id, True, datetime.now(timezone.utc))
+        self._wakeup_set()
+        return {"job_id": job_id, "changed": changed}
+
+    async def _control_disable(self, job_id: str) -> dict:
+        changed = self.scheduler.set_job_enabled(job_id, False, datetime.now(timezone.utc))
+        self._wakeup_set()
+        return {"job_id": job_id, "changed": changed}
+
+    async def _control_reload(self) -> dict:
+        try:
+            diff = await self._reload_now()
+        except OSError as e:
+            raise ValueError(f"Failed to read schedule '{self.schedule_path}': {e}") from e
+        return {"added": sorted(diff.added), "changed": sorted(diff.changed), "removed": sorted(diff.removed)}
+
+    # Collectors may block (rclone's stats are an HTTP call), so the metrics are rendered off the loop
+    async def _control_metrics(self) -> dict:
+        return {"text": await asyncio.to_thread(get_metrics().render)}
+
+    def _request_reload(self):
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.create_task(self._reload())
+
+    def _request_stop(self):
+        self._stopping = True
+        self._wakeup_set()
+
+    def _wakeup_set(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _call_in_loop(self, callback):
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            callback()
+        else:
+            loop.call_soon_threadsafe(callback)
+
+    # Platform-specific daemons hook process signals here
+    def _install_signal_handlers(self):
         pass
 
+    def _remove_signal_handlers(self):
+        pass
+
+def _trace_path(trace) -> str | None:
+    return None if trace is None or trace.path is None else str(trace.path)
+
+
 class Win32BackupDaemon(BackupDaemon):
     pass
     '''
@@ -47,7 +412,15 @@ class Win32BackupDaemon(BackupDaemon):
     # Check the above imports for Windows service implementation - win32serviceutil.ServiceFramework?
 
 class UnixBackupDaemon(BackupDaemon):
-    pass
+    # SIGTERM/SIGINT stop the daemon after running jobs finish; SIGHUP reloads the schedule
+    def _install_signal_handlers(self):
+        self._loop.add_signal_handler(signal.SIGTERM, self.stop)
+        self._loop.add_signal_handler(signal.SIGINT, self.stop)
+        self._loop.add_signal_handler(signal.SIGHUP, self.reload_schedule)
+
+    def _remove_signal_handlers(self):
+        for signal_number in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            self._loop.remove_signal_handler(signal_number)
 
 
     '''
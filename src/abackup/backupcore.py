@@ -1,3 +1,1030 @@
+import base64
+import contextlib
+import errno
+import itertools
+import json
+import logging
+import os
+import platform
+import queue
+import secrets
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from pathlib import Path
+
+from abackup.archive import ArchiveStream, archive_suffix, write_archive
+from abackup.chunkstore import (ChunkStore, ChunkStoreError, LocalChunkBackend, RCloneChunkBackend,
+                                 manifest_relative_path)
+from abackup.compression import is_probably_compressed
+from abackup.core import destination_key
+from abackup.fileindex import ChangeType, FileStateIndex, get_file_index
+from abackup.jobs import BackupJob, BackupType
+from abackup.metrics import get_metrics
+from abackup.profiling import stage
+from abackup.retention import Artifact, RetentionError, RetentionManager, artifact_created, get_retention_catalog
+from abackup.throttle import (TRANSFERRED_BYTES, IOPriority, JobLimiter, Throttle, ThrottleLimits, get_throttle,
+                              set_io_priority)
+from abackup.walker import ParallelWalker, PathMatcher, job_matcher
+
+if platform.system() == "Linux":
+    # Needed for reflink (FICLONE) copies
+    import fcntl
+else:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+RCLONE_CALL_DURATION = get_metrics().histogram(
+    "abackup_rclone_call_duration_seconds", "Seconds taken by rclone rc calls.", ("method",))
+# Reported by RCloneProcessPool.collect_metrics() for each process of the pool
+RCLONE_UP = get_metrics().gauge("abackup_rclone_up", "Whether the rclone rcd process is running.", ("process",))
+RCLONE_STATS = {
+    "bytes": get_metrics().gauge("abackup_rclone_bytes", "Bytes transferred by the rclone process.", ("process",)),
+    "speed": get_metrics().gauge("abackup_rclone_speed_bytes_per_second",
+                                 "Current transfer speed of the rclone process.", ("process",)),
+    "transfers": get_metrics().gauge("abackup_rclone_transfers", "Files transferred by the rclone process.",
+                                     ("process",)),
+    "errors": get_metrics().gauge("abackup_rclone_errors", "Errors seen by the rclone process.", ("process",)),
+}
+
 # backup core abstract class
 
-# RClone implementation of backup core abstract class
\ No newline at end of file
+# A BackupHandler performs a single run of a BackupJob for one kind of
+# destination. The class tree follows the sketch in core.py:
+# BackupHandler (abstract)
+#   |
+#   +-- LocalBackupHandler
+#   |
+#   +-- ChunkedBackupHandler (local directory or rclone remote)
+#   |
+#   +-- CloudBackupHandler (abstract)
+#         |
+#         +-- RCloneBackupHandler (abstract)
+#               |
+#               +-- GoogleDriveBackupHandler
+
+# Raised when a backup run fails for a reason other than invalid job data.
+# exit_code is the failed command's exit code when there is one.
+class BackupError(Exception):
+    def __init__(self, message, exit_code: int = 1):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+# Summary of one backup run, returned by BackupHandler.run()
+class BackupResult:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.started = None # Aware datetime
+        self.ended = None # Aware datetime
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.files_transferred = 0
+        self.artifact_path = None # Where the backup was written on the destination
+        # For storage modes with one artifact per run: its name relative to the
+        # destination and the bytes it counts against the retention limit
+        self.artifact_name = None
+        self.artifact_size = None
+
+    def __repr__(self):
+        return (f"BackupResult(ID={self.job_id}, files={self.files_transferred}, "
+                f"bytes_written={self.bytes_written}, artifact={self.artifact_path})")
+
+class BackupHandler(ABC):
+    # Enforces the job's retention policy when set (see retention.py)
+    retention: RetentionManager | None = None
+    # Limits the bandwidth of runs when set (see throttle.py)
+    throttle: Throttle | None = None
+
+    '''
+    Performs one run of the job: the pre-backup script, the backup itself and
+    the post-backup script. The post-backup script also runs when the backup
+    fails, so that services stopped by the pre-backup script are restarted.
+    Retention is checked before the scripts run and enforced after a
+    successful backup. Raises BackupError if any step fails.
+    '''
+    def run(self, job: BackupJob) -> BackupResult:
+        started = datetime.now(timezone.utc)
+        if self.retention is not None:
+            try:
+                with stage("retention"):
+                    self.retention.before_backup(job, self)
+            except RetentionError as e:
+                raise BackupError(str(e)) from e
+        self._run_script(job, job.script_pre_path, "pre_script")
+        try:
+            with self.throttle.running(job) if self.throttle is not None else contextlib.nullcontext(), stage("backup"):
+                result = self.backup(job)
+        finally:
+            self._run_script(job, job.script_post_path, "post_script")
+        result.started = started
+        result.ended = datetime.now(timezone.utc)
+        if self.retention is not None and result.artifact_name is not None:
+            self._apply_retention(job, result)
+        return result
+
+    @abstractmethod
+    def backup(self, job: BackupJob) -> BackupResult:
+        pass
+
+    # Releases any resources (processes, connections) held by the handler
+    def close(self):
+        pass
+
+    # Returns the job's artifacts found on its destination, or None if the
+    # handler's storage mode does not write one artifact per run
+    def list_artifacts(self, job: BackupJob) -> list[Artifact] | None:
+        return None
+
+    # Deletes artifacts (paths relative to the job's destination)
+    def delete_artifacts(self, job: BackupJob, paths: list[str]):
+        raise BackupError(f"{type(self).__name__} cannot delete backups.")
+
+    # Returns the JobLimiter the job's transfers go through, or None if they are not throttled
+    def _limiter(self, job: BackupJob) -> JobLimiter | None:
+        return self.throttle.limiter(job.job_id) if self.throttle is not None else None
+
+    # A failure here does not fail the backup that was just written; the
+    # expired artifacts stay in the catalog and are retried after the next run
+    def _apply_retention(self, job: BackupJob, result: BackupResult):
+        created = artifact_created(job.job_id, result.artifact_name) or result.started
+        try:
+            with stage("retention"):
+                self.retention.after_backup(job, self, Artifact(result.artifact_name, result.artifact_size, created))
+        except BackupError:
+            logger.exception("Could not apply the retention policy of job '%s'", job.job_id)
+
+    def _run_script(self, job: BackupJob, script_path: Path | None, stage_name: str):
+        if script_path is None:
+            return
+        environment = dict(os.environ,
+                           ABACKUP_JOB_ID=job.job_id,
+                           ABACKUP_SOURCE=str(job.source_path),
+                           ABACKUP_DESTINATION=str(job.destination_url))
+        with stage(stage_name):
+            completed = subprocess.run([str(script_path)], env=environment, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise BackupError(f"Script '{script_path}' for job '{job.job_id}' exited with code "
+                              f"{completed.returncode}: {completed.stderr.strip()}", completed.returncode)
+
+# Returns the name of the artifact (snapshot directory, archive, ...) written
+# by a run of the job that started at `started`. Names sort chronologically;
+# the microseconds keep two runs started within the same second apart.
+def artifact_name(job: BackupJob, started: datetime) -> str:
+    return f"{job.job_id}-{started.astimezone(timezone.utc):%Y%m%dT%H%M%S%fZ}"
+
+# Suffix of artifacts that are still being written
+PARTIAL_SUFFIX = ".partial"
+
+# Returns the directory named by a local destination (a path or file:// URL)
+def local_destination_path(destination_url) -> Path:
+    destination = str(destination_url)
+    if destination.startswith("file://"):
+        destination = urllib.request.url2pathname(urllib.parse.urlsplit(destination).path)
+    return Path(destination).expanduser()
+
+# Checks that a destination is an rclone remote such as "gdrive:path"
+def rclone_remote_path(destination_url, service: str) -> str:
+    remote, separator, _ = str(destination_url).partition(":")
+    if not separator or not remote or "/" in remote:
+        raise BackupError(f"{service} destination '{destination_url}' must be an rclone remote "
+                          "such as 'gdrive:path'.")
+    return destination_url
+
+# Writes point-in-time snapshots of job.source_path to a local directory, one
+# directory per run: <destination>/<job_id>-<UTC timestamp>/.
+#
+# Each file is placed in the snapshot as cheaply as the filesystem allows:
+#   1. a reflink (FICLONE) copy, which shares data blocks copy-on-write,
+#   2. otherwise a hardlink to the previous snapshot's copy if the file is
+#      unchanged (same size and mtime),
+#   3. otherwise an in-kernel copy with copy_file_range/sendfile.
+# Snapshots are written under a ".partial" name and renamed once complete, so
+# an interrupted run never becomes the base of the next one.
+#
+# With compression on, each run instead streams one compressed tar archive
+# (<job_id>-<UTC timestamp>.tar.gz, .tar.zst, ...) into the destination.
+class LocalBackupHandler(BackupHandler):
+    def __init__(self):
+        self._reflink_unsupported_devices = set()
+
+    def destination_root(self, job: BackupJob) -> Path:
+        return local_destination_path(job.destination_url)
+
+    def backup(self, job: BackupJob) -> BackupResult:
+        root = self.destination_root(job)
+        root.mkdir(parents=True, exist_ok=True)
+        name = artifact_name(job, datetime.now(timezone.utc))
+        if job.compression:
+            return self._backup_archive(job, root / (name + archive_suffix(job)))
+        snapshot = root / name
+        partial = root / (name + PARTIAL_SUFFIX)
+        if partial.exists():
+            shutil.rmtree(partial)
+        previous = self.latest_snapshot(job)
+
+        result = BackupResult(job.job_id)
+        result.artifact_size = 0 # Apparent size, as if no data were shared with other snapshots
+        source = Path(job.source_path)
+        limiter = self._limiter(job)
+        partial.mkdir()
+        with stage("upload"):
+            if source.is_dir():
+                self._snapshot_tree(source, partial, previous, job, result, limiter)
+            else:
+                self._snapshot_file(source, partial / source.name,
+                                    previous / source.name if previous else None, source.stat(), result, limiter)
+        partial.rename(snapshot)
+        result.artifact_path = str(snapshot)
+        result.artifact_name = name
+        return result
+
+    # Writes the compressed archive directly to its (partial) destination file
+    def _backup_archive(self, job: BackupJob, archive: Path) -> BackupResult:
+        partial = archive.with_name(archive.name + PARTIAL_SUFFIX)
+        limiter = self._limiter(job)
+        try:
+            with open(partial, "wb") as file, stage("upload"):
+                stats = write_archive(job, file if limiter is None else limiter.writer(file))
+        except BaseException:
+            partial.unlink(missing_ok=True)
+            raise
+        partial.rename(archive)
+        result = BackupResult(job.job_id)
+        result.files_transferred = stats.files
+        result.bytes_read = stats.bytes_read
+        result.bytes_written = stats.bytes_written
+        result.artifact_path = str(archive)
+        result.artifact_name = archive.name
+        result.artifact_size = stats.bytes_written
+        return result
+
+    # Snapshot directories and archives; a snapshot's size is its apparent size
+    def list_artifacts(self, job: BackupJob) -> list[Artifact]:
+        artifacts = []
+        try:
+            entries = list(os.scandir(self.destination_root(job)))
+        except FileNotFoundError:
+            return artifacts
+        for entry in entries:
+            created = artifact_created(job.job_id, entry.name)
+            if created is None:
+                continue
+            size = _tree_size(entry.path) if entry.is_dir(follow_symlinks=False) else entry.stat().st_size
+            artifacts.append(Artifact(entry.name, size, created))
+        return artifacts
+
+    def delete_artifacts(self, job: BackupJob, paths: list[str]):
+        root = self.destination_root(job)
+        for path in paths:
+            target = root / path
+            try:
+                if target.is_dir() and not target.is_symlink():
+                    shutil.rmtree(target)
+                else:
+                    target.unlink(missing_ok=True)
+            except OSError as e:
+                raise BackupError(f"Could not delete old backup '{target}': {e}") from e
+
+    # Returns the newest complete snapshot of the job, or None. Only names
+    # written for this very job count: "db" must never start from a snapshot
+    # of "db-prod", whose unchanged-looking files it would hardlink.
+    def latest_snapshot(self, job: BackupJob) -> Path | None:
+        root = self.destination_root(job)
+        try:
+            snapshots = [(created, entry.name) for entry in os.scandir(root)
+                         if entry.is_dir(follow_symlinks=False)
+                         and (created := artifact_created(job.job_id, entry.name)) is not None]
+        except FileNotFoundError:
+            return None
+        return root / max(snapshots)[1] if snapshots else None
+
+    # Directories come from the walker before their contents, so each one
+    # exists before anything is placed in it; their times are copied last,
+    # once nothing is added to them any more
+    def _snapshot_tree(self, source: Path, target: Path, previous: Path | None, job: BackupJob, result: BackupResult,
+                       limiter: JobLimiter | None = None):
+        directories = []
+        for entry in ParallelWalker(source, job.recursive, job_matcher(job)):
+            target_path = target / entry.relative_path
+            if entry.is_symlink:
+                os.symlink(os.readlink(entry.path), target_path)
+            elif entry.is_dir:
+                target_path.mkdir()
+                directories.append((entry.path, target_path))
+            elif entry.is_file:
+                previous_path = previous / entry.relative_path if previous else None
+                self._snapshot_file(Path(entry.path), target_path, previous_path, entry.stat, result, limiter)
+        for directory, target_path in directories:
+            shutil.copystat(directory, target_path)
+
+    def _snapshot_file(self, source: Path, target: Path, previous: Path | None, stat: os.stat_result,
+                       result: BackupResult, limiter: JobLimiter | None = None):
+        result.files_transferred += 1
+        result.artifact_size += stat.st_size
+        if stat.st_dev not in self._reflink_unsupported_devices and _reflink_file(source, target):
+            shutil.copystat(source, target)
+            return
+        self._reflink_unsupported_devices.add(stat.st_dev)
+
+        if previous is not None:
+            try:
+                previous_stat = previous.stat()
+            except FileNotFoundError:
+                previous_stat = None
+            if (previous_stat is not None and previous_stat.st_size == stat.st_size and
+                previous_stat.st_mtime_ns == stat.st_mtime_ns):
+                os.link(previous, target)
+                return
+
+        copied = _copy_file_in_kernel(source, target, limiter)
+        shutil.copystat(source, target)
+        result.bytes_read += copied
+        result.bytes_written += copied
+
+# Common base for handlers that write to a remote (cloud) destination
+class CloudBackupHandler(BackupHandler):
+    # Returns the remote location the job writes to
+    @abstractmethod
+    def remote_path(self, job: BackupJob) -> str:
+        pass
+
+# RClone implementation of backup core abstract class
+
+# Longest an rc call waits on the rclone socket (to connect, or for the next
+# bytes of a response) before failing, so that a hung rcd cannot block its
+# caller forever. Streamed uploads get longer: rclone only answers once the
+# remote has the whole file.
+RC_CALL_TIMEOUT = 60.0
+RC_UPLOAD_TIMEOUT = 15 * 60.0
+
+# Drives one long-lived `rclone rcd` process through rclone's remote-control
+# HTTP API, so that jobs do not pay for process startup and config parsing.
+# The server only listens on localhost and is protected by random credentials.
+class RCloneRemoteControl:
+    def __init__(self, command=("rclone",), extra_args=(), startup_timeout: float = 10.0,
+                 call_timeout: float = RC_CALL_TIMEOUT):
+        self.command = list(command)
+        self.extra_args = list(extra_args)
+        self.startup_timeout = startup_timeout
+        self.call_timeout = call_timeout
+        self._process = None
+        self._url = None
+        self._authorization = None
+        self._lock = threading.Lock()
+        self._bandwidth_limit = None # Bytes per second, applied with core/bwlimit
+        self._io_priority = None
+
+    @property
+    def pid(self) -> int | None:
+        return self._process.pid if self._process is not None else None
+
+    def is_running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self):
+        with self._lock:
+            if self.is_running():
+                return
+            port = _free_local_port()
+            user, password = secrets.token_hex(8), secrets.token_hex(16)
+            self._url = f"http://127.0.0.1:{port}/"
+            self._authorization = "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode()
+            try:
+                self._process = subprocess.Popen(
+                    [*self.command, "rcd", f"--rc-addr=127.0.0.1:{port}",
+                     f"--rc-user={user}", f"--rc-pass={password}", *self.extra_args],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+            except OSError as e:
+                raise BackupError(f"Could not start rclone ({self.command[0]}): {e}") from e
+            self._wait_until_ready()
+            if self._bandwidth_limit is not None or self._io_priority is not None:
+                self._apply_throttle()
+
+    '''
+    Limits rclone's own transfers to `bandwidth` bytes per second (None for
+    no limit) and sets its I/O priority. Running transfers slow down or speed
+    up right away; a restarted process gets the same limits.
+    '''
+    def set_throttle(self, bandwidth: int | None, io_priority: IOPriority | None = None):
+        with self._lock:
+            self._bandwidth_limit, self._io_priority = bandwidth, io_priority
+            if self.is_running():
+                self._apply_throttle()
+
+    '''
+    Calls an rc method and returns its JSON output. Starts (or restarts) the
+    rclone process if needed. Raises BackupError if the call fails.
+    '''
+    def call(self, method: str, **params) -> dict:
+        if not self.is_running():
+            self.start()
+        return self._post(method, params)
+
+    '''
+    Runs an rc method as an rclone async job and waits for it to finish.
+    Returns the job's output with its transfer stats under "_stats".
+    '''
+    def run_job(self, method: str, poll_interval: float = 0.1, **params) -> dict:
+        job_id = self.call(method, _async=True, **params)["jobid"]
+        while True:
+            status = self.call("job/status", jobid=job_id)
+            if status.get("finished"):
+                break
+            time.sleep(poll_interval)
+        stats = self.call("core/stats", group=f"job/{job_id}")
+        if not status.get("success"):
+            raise BackupError(f"rclone {method} failed: {status.get('error')}")
+        output = dict(status.get("output") or {})
+        output["_stats"] = stats
+        return output
+
+    def close(self):
+        with self._lock:
+            if self._process is None:
+                return
+            if self._process.poll() is None:
+                try:
+                    self._post("core/quit", {})
+                except BackupError:
+                    pass
+                try:
+                    self._process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+                    self._process.wait()
+            self._process = None
+
+    '''
+    Uploads the bytes yielded by `chunks` to fs:remote/name with
+    operations/uploadfile. The multipart request body is sent with chunked
+    transfer encoding and rclone streams it to the remote as it arrives, so
+    the file never exists as a whole in memory or on local disk.
+    '''
+    def upload_stream(self, fs: str, remote: str, name: str, chunks) -> dict:
+        if not self.is_running():
+            self.start()
+        boundary = secrets.token_hex(16)
+        def body():
+            yield (f'--{boundary}\r\nContent-Disposition: form-data; name="file0"; filename="{name}"\r\n'
+                   'Content-Type: application/octet-stream\r\n\r\n').encode("utf-8")
+            yield from chunks
+            yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+        query = urllib.parse.urlencode({"fs": fs, "remote": remote})
+        request = urllib.request.Request(
+            f"{self._url}operations/uploadfile?{query}", data=body(), method="POST",
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}",
+                     "Authorization": self._authorization})
+        return self._send("operations/uploadfile", request, max(self.call_timeout, RC_UPLOAD_TIMEOUT))
+
+    def _post(self, method: str, params: dict) -> dict:
+        request = urllib.request.Request(
+            self._url + method, data=json.dumps(params).encode("utf-8"), method="POST",
+            headers={"Content-Type": "application/json", "Authorization": self._authorization})
+        return self._send(method, request, self.call_timeout)
+
+    def _send(self, method: str, request: urllib.request.Request, timeout: float) -> dict:
+        try:
+            with RCLONE_CALL_DURATION.labels(method).time(), \
+                 urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            try:
+                error = json.loads(e.read()).get("error", e.reason)
+            except ValueError:
+                error = e.reason
+            raise BackupError(f"rclone {method} failed: {error}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise BackupError(f"rclone {method} failed: {e}") from e
+
+    def _apply_throttle(self):
+        self._post("core/bwlimit", {"rate": _rclone_rate(self._bandwidth_limit)})
+        try:
+            set_io_priority(self._process.pid, self._io_priority)
+        except OSError as e:
+            logger.warning("Could not set the I/O priority of rclone: %s", e)
+
+    def _wait_until_ready(self):
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if self._process.poll() is not None:
+                raise BackupError(f"rclone rcd exited with code {self._process.returncode} during startup.")
+            try:
+                self._post("rc/noop", {})
+                return
+            except BackupError:
+                if time.monotonic() > deadline:
+                    self._process.kill()
+                    raise BackupError("Timed out waiting for rclone rcd to start.")
+                time.sleep(0.05)
+
+# A small pool of rclone rcd processes shared by all rclone-based handlers.
+# One process is usually enough since rclone parallelizes transfers itself.
+#
+# Throttle limits reach the processes from a thread of their own: the daemon
+# changes them on its event loop, which must not wait on an rc call (or on a
+# process that is starting) however long rclone takes to answer. Limits that
+# change again before the thread gets to them are skipped.
+class RCloneProcessPool:
+    def __init__(self, size: int = 1, **remote_control_args):
+        if not isinstance(size, int) or size < 1:
+            raise ValueError("rclone pool size must be a positive integer.")
+        self._remote_controls = [RCloneRemoteControl(**remote_control_args) for _ in range(size)]
+        self._round_robin = itertools.cycle(self._remote_controls)
+        self._lock = threading.Lock()
+        self._throttle_queue = queue.Queue()
+        self._throttle_writer = None
+
+    def acquire(self) -> RCloneRemoteControl:
+        with self._lock:
+            return next(self._round_robin)
+
+    # Calls an rc method on every process, e.g. to change a global option
+    def call_all(self, method: str, **params) -> list[dict]:
+        return [remote_control.call(method, **params) for remote_control in self._remote_controls]
+
+    '''
+    Throttle listener: splits the global bandwidth limit evenly between the
+    processes. Returns immediately; the pool's throttle thread applies them.
+    '''
+    def set_throttle_limits(self, limits: ThrottleLimits):
+        with self._lock:
+            if self._throttle_writer is None:
+                self._throttle_writer = threading.Thread(target=self._throttle_loop, name="abackup-rclone-throttle",
+                                                         daemon=True)
+                self._throttle_writer.start()
+        self._throttle_queue.put(limits)
+
+    # Waits until the limits passed to set_throttle_limits() so far are applied
+    def flush_throttle_limits(self):
+        self._throttle_queue.join()
+
+    def close(self):
+        with self._lock:
+            writer, self._throttle_writer = self._throttle_writer, None
+        if writer is not None:
+            self._throttle_queue.put(None)
+            writer.join()
+        for remote_control in self._remote_controls:
+            remote_control.close()
+
+    def _throttle_loop(self):
+        while True:
+            batch = [self._throttle_queue.get()]
+            while True:
+                try:
+                    batch.append(self._throttle_queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Only the newest limits matter; None asks the thread to stop
+            limits = [item for item in batch if item is not None]
+            try:
+                if limits:
+                    self._apply_throttle_limits(limits[-1])
+            finally:
+                for _ in batch:
+                    self._throttle_queue.task_done()
+            if len(limits) < len(batch):
+                return
+
+    def _apply_throttle_limits(self, limits: ThrottleLimits):
+        bandwidth = limits.bandwidth
+        if bandwidth is not None:
+            bandwidth = max(1, bandwidth // len(self._remote_controls))
+        for remote_control in self._remote_controls:
+            try:
+                remote_control.set_throttle(bandwidth, limits.io_priority)
+            except BackupError as e:
+                logger.warning("Could not apply throttle limits to rclone: %s", e)
+
+    # Metrics collector: reports each process's transfer stats. Processes
+    # that are not running are reported down and never started.
+    def collect_metrics(self):
+        for number, remote_control in enumerate(self._remote_controls):
+            process = str(number)
+            stats = None
+            if remote_control.is_running():
+                try:
+                    stats = remote_control.call("core/stats")
+                except BackupError as e:
+                    logger.debug("Could not read the stats of rclone: %s", e)
+            RCLONE_UP.labels(process).set(0 if stats is None else 1)
+            for key, gauge in RCLONE_STATS.items():
+                if stats is None:
+                    gauge.remove(process)
+                else:
+                    gauge.labels(process).set(stats.get(key, 0))
+
+# rclone limits bandwidth per file (BwLimitFile), not per call, so the mirror
+# transfers of a job with a bandwidth limit copy this many files at a time,
+# each with an equal share of the job's limit
+LIMITED_MIRROR_TRANSFERS = 4
+
+class RCloneBackupHandler(CloudBackupHandler):
+    def __init__(self, rclone_pool: RCloneProcessPool | None = None, file_index: FileStateIndex | None = None):
+        self.rclone_pool = rclone_pool or get_rclone_pool()
+        # Without a file index every run is a full rclone sync
+        self.file_index = file_index
+
+    def remote_path(self, job: BackupJob) -> str:
+        return job.destination_url
+
+    '''
+    With compression on, streams a compressed tar archive of job.source_path
+    to the job's remote path, one archive per run. Otherwise mirrors the
+    source: with a file index only the files added, modified or deleted since
+    the last successful run are transferred, else the whole tree is compared
+    with rclone sync. A single-file source is copied with operations/copyfile.
+    '''
+    def backup(self, job: BackupJob) -> BackupResult:
+        rclone = self.rclone_pool.acquire()
+        source = Path(job.source_path)
+        remote = self.remote_path(job)
+        if job.compression:
+            return self._backup_archive(rclone, job, remote)
+        if source.is_file():
+            with stage("upload"):
+                outputs = [rclone.run_job("operations/copyfile",
+                                          srcFs=str(source.parent), srcRemote=source.name,
+                                          dstFs=remote, dstRemote=source.name, _config=self._bandwidth_config(job, 1))]
+        elif self.file_index is not None:
+            outputs = self._backup_changes(rclone, job, source, remote)
+        else:
+            params = {"srcFs": str(source), "dstFs": remote,
+                      "_config": self._bandwidth_config(job, LIMITED_MIRROR_TRANSFERS)}
+            if not job.recursive:
+                params["_config"]["MaxDepth"] = 1
+            matcher = job_matcher(job)
+            if matcher is not None:
+                params["_filter"] = matcher.rclone_filter()
+            with stage("upload"):
+                outputs = [rclone.run_job("sync/sync", **params)]
+
+        result = BackupResult(job.job_id)
+        for output in outputs:
+            stats = output["_stats"]
+            result.bytes_read += stats.get("bytes", 0)
+            result.files_transferred += stats.get("transfers", 0)
+        result.bytes_written = result.bytes_read
+        # rclone moved these bytes itself, bypassing the throttle's buckets that count the others
+        TRANSFERRED_BYTES.labels(job.job_id, destination_key(job.destination_url)).inc(result.bytes_written)
+        result.artifact_path = remote
+        return result
+
+    # The archive is uploaded under a ".partial" name and renamed once
+    # complete, so an interrupted upload is never mistaken for a backup
+    def _backup_archive(self, rclone, job, remote) -> BackupResult:
+        name = artifact_name(job, datetime.now(timezone.utc)) + archive_suffix(job)
+        stream = ArchiveStream(job)
+        limiter = self._limiter(job)
+        try:
+            with stage("upload"):
+                rclone.upload_stream(remote, "", name + PARTIAL_SUFFIX,
+                                     stream if limiter is None else limiter.chunks(stream))
+        except BaseException:
+            stream.close()
+            try:
+                rclone.call("operations/deletefile", fs=remote, remote=name + PARTIAL_SUFFIX)
+            except BackupError:
+                pass
+            raise
+        rclone.run_job("operations/movefile", srcFs=remote, srcRemote=name + PARTIAL_SUFFIX,
+                       dstFs=remote, dstRemote=name)
+
+        result = BackupResult(job.job_id)
+        result.files_transferred = stream.stats.files
+        result.bytes_read = stream.stats.bytes_read
+        result.bytes_written = stream.stats.bytes_written
+        result.artifact_path = _join_location(remote, name)
+        result.artifact_name = name
+        result.artifact_size = stream.stats.bytes_written
+        return result
+
+    # rclone options that hold a mirror transfer of `transfers` files at a time
+    # to the job's bandwidth limit. rclone fixes BwLimitFile when the transfer
+    # starts and its only live limit (core/bwlimit) is process-wide and kept
+    # at the global one, so a new job limit takes effect at the next transfer.
+    def _bandwidth_config(self, job: BackupJob, transfers: int) -> dict:
+        rate = self.throttle.job_rate(job) if self.throttle is not None else job.bandwidth_limit
+        if rate is None:
+            return {}
+        return {"BwLimitFile": _rclone_rate(rate // transfers), "Transfers": transfers}
+
+    # Archives on the remote. A mirror is a single copy kept up to date, so it
+    # has nothing to expire.
+    def list_artifacts(self, job: BackupJob) -> list[Artifact] | None:
+        if not job.compression:
+            return None
+        rclone = self.rclone_pool.acquire()
+        remote = self.remote_path(job)
+        rclone.run_job("operations/mkdir", fs=remote, remote="")
+        artifacts = []
+        for entry in rclone.run_job("operations/list", fs=remote, remote="").get("list") or []:
+            created = artifact_created(job.job_id, entry["Name"])
+            if created is not None and not entry.get("IsDir"):
+                artifacts.append(Artifact(entry["Name"], entry["Size"], created))
+        return artifacts
+
+    # One rclone call for the whole batch
+    def delete_artifacts(self, job: BackupJob, paths: list[str]):
+        with tempfile.TemporaryDirectory(prefix="abackup-") as list_directory:
+            delete_list = Path(list_directory) / "delete.txt"
+            delete_list.write_text("".join(path + "\n" for path in paths), encoding="utf-8")
+            self.rclone_pool.acquire().run_job("operations/delete", fs=self.remote_path(job),
+                                               _filter={"FilesFromRaw": [str(delete_list)]})
+
+    # Transfers only what the file index reports as changed, as one rclone
+    # copy and one delete driven by file lists, so neither side is listed.
+    # The index is only updated once both succeeded.
+    def _backup_changes(self, rclone, job, source, remote) -> list:
+        scan = self.file_index.scan(job.job_id, source, job.recursive, job_matcher(job))
+        with tempfile.TemporaryDirectory(prefix="abackup-") as list_directory:
+            copy_list = Path(list_directory) / "copy.txt"
+            delete_list = Path(list_directory) / "delete.txt"
+            with open(copy_list, "w", encoding="utf-8") as copies, open(delete_list, "w", encoding="utf-8") as deletes:
+                for change in scan:
+                    (deletes if change.change_type is ChangeType.DELETED else copies).write(change.path + "\n")
+
+            outputs = []
+            try:
+                if scan.counts[ChangeType.ADDED] or scan.counts[ChangeType.MODIFIED]:
+                    with stage("upload"):
+                        config = {"NoTraverse": True, **self._bandwidth_config(job, LIMITED_MIRROR_TRANSFERS)}
+                        outputs.append(rclone.run_job("sync/copy", srcFs=str(source), dstFs=remote,
+                                                      _filter={"FilesFromRaw": [str(copy_list)]}, _config=config))
+                if scan.counts[ChangeType.DELETED]:
+                    outputs.append(rclone.run_job("operations/delete", fs=remote,
+                                                  _filter={"FilesFromRaw": [str(delete_list)]}))
+            except BaseException:
+                scan.discard()
+                raise
+        scan.commit()
+        return outputs
+
+# Backs up to a Google Drive remote configured in rclone, e.g. "gdrive:backups"
+class GoogleDriveBackupHandler(RCloneBackupHandler):
+    def remote_path(self, job: BackupJob) -> str:
+        return rclone_remote_path(job.destination_url, "Google Drive")
+
+# Writes deduplicated snapshots (see chunkstore.py) of job.source_path to the
+# job's destination: a local directory for BackupType.LOCAL, an rclone remote
+# for the rclone-based types. Each run uploads only chunks the store does not
+# have yet plus one manifest. Files whose size and mtime match the previous
+# manifest reuse its chunk list without being read at all.
+#
+# Retention does not cover chunked jobs: chunks are shared by every run (and
+# by every job writing to the same store), so deleting a manifest frees no
+# space. Results carry no artifact_name, so runs are never recorded in the
+# retention catalog and nothing is ever deleted or refused for its size.
+class ChunkedBackupHandler(BackupHandler):
+    # Services of the rclone-based types, for error messages
+    RCLONE_SERVICES = {BackupType.GOOGLEDRIVE: "Google Drive"}
+
+    def __init__(self, rclone_pool: RCloneProcessPool | None = None):
+        self._rclone_pool = rclone_pool # Only started once a remote job runs
+
+    def backup(self, job: BackupJob) -> BackupResult:
+        backend, location = self._backend(job)
+        try:
+            store = ChunkStore(backend, codec=job.compression_codec if job.compression else None,
+                               level=job.compression_level, limiter=self._limiter(job))
+            result = self._backup_to_store(job, store)
+            result.artifact_path = _join_location(location, manifest_relative_path(result.artifact_path))
+            return result
+        except (ChunkStoreError, ValueError) as e: # ValueError: codec not installed
+            raise BackupError(f"Chunked backup of job '{job.job_id}' failed: {e}") from e
+        finally:
+            backend.close()
+
+    def _backend(self, job: BackupJob):
+        if job.BackupType == BackupType.LOCAL:
+            root = local_destination_path(job.destination_url)
+            return LocalChunkBackend(root), str(root)
+        service = self.RCLONE_SERVICES.get(job.BackupType)
+        if service is None:
+            raise BackupError(f"Chunked backups are not available for {job.BackupType}.")
+        remote = rclone_remote_path(job.destination_url, service)
+        rclone_pool = self._rclone_pool or get_rclone_pool()
+        return RCloneChunkBackend(rclone_pool.acquire(), remote), remote
+
+    def _backup_to_store(self, job: BackupJob, store: ChunkStore) -> BackupResult:
+        started = datetime.now(timezone.utc)
+        name = artifact_name(job, started)
+        previous_files = {}
+        previous_name = store.latest_manifest(job.job_id)
+        if previous_name is not None:
+            previous_files = {entry["path"]: entry for entry in store.read_manifest(previous_name)["files"]}
+
+        result = BackupResult(job.job_id)
+        source = Path(job.source_path)
+        directories, files = [], []
+        if source.is_dir():
+            entries = _walk_tree(source, job.recursive, directories, job_matcher(job))
+        else:
+            entries = [(source.name, source, source.stat())]
+        for relative_path, path, stat in entries:
+            if os.path.islink(path):
+                files.append({"path": relative_path, "link": os.readlink(path)})
+                continue
+            previous = previous_files.get(relative_path)
+            if (previous is not None and "chunks" in previous and previous["size"] == stat.st_size and
+                previous["mtime_ns"] == stat.st_mtime_ns and all(map(store.has_chunk, previous["chunks"]))):
+                chunk_ids = previous["chunks"]
+            else:
+                chunk_ids = store.store_file(path, compress=not is_probably_compressed(path))
+                result.files_transferred += 1
+            files.append({"path": relative_path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                          "mode": stat.st_mode & 0o7777, "chunks": chunk_ids})
+
+        # The walk order varies from run to run; sorting keeps manifests of unchanged trees identical
+        directories.sort()
+        files.sort(key=lambda file: file["path"])
+        store.write_manifest(name, {"job_id": job.job_id, "created": started.isoformat(), "source": str(source),
+                                    "directories": directories, "files": files})
+        result.bytes_read = store.bytes_read
+        result.bytes_written = store.bytes_stored
+        result.artifact_path = name
+        return result
+
+# Yields (relative path, path, stat) for the files and symlinks below root and
+# appends the relative path of every directory to `directories`
+def _walk_tree(root: Path, recursive: bool, directories: list, matcher: PathMatcher | None = None):
+    for entry in ParallelWalker(root, recursive, matcher):
+        if entry.is_dir:
+            directories.append(entry.relative_path)
+        elif entry.is_file or entry.is_symlink:
+            yield entry.relative_path, entry.path, entry.stat
+
+def _tree_size(path) -> int:
+    size = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                size += _tree_size(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+def _join_location(location: str, relative_path: str) -> str:
+    if location.endswith((":", "/")):
+        return location + relative_path
+    return f"{location}/{relative_path}"
+
+
+# Maps each BackupType to the handler class that performs it
+BACKUP_HANDLER_CLASSES = {
+    BackupType.GOOGLEDRIVE: GoogleDriveBackupHandler,
+    BackupType.LOCAL: LocalBackupHandler,
+}
+
+_handlers = {}
+_handlers_lock = threading.Lock()
+_rclone_pool = None
+_rclone_pool_settings = {"size": 1}
+
+'''
+Sets how the shared rclone pool is created (e.g. command=("/usr/bin/rclone",)
+or size=2). Must be called before the first rclone-based handler is used.
+'''
+def configure_rclone(**pool_settings):
+    global _rclone_pool_settings
+    with _handlers_lock:
+        if _rclone_pool is not None:
+            raise BackupError("The rclone pool is already running.")
+        _rclone_pool_settings = {"size": 1, **pool_settings}
+
+def get_rclone_pool() -> RCloneProcessPool:
+    global _rclone_pool
+    with _handlers_lock:
+        created = _rclone_pool is None
+        if created:
+            _rclone_pool = RCloneProcessPool(**_rclone_pool_settings)
+        rclone_pool = _rclone_pool
+    if created:
+        # rclone moves the data itself, so it applies the throttle's global limits on its own
+        get_throttle().add_listener(rclone_pool.set_throttle_limits)
+        get_metrics().add_collector(rclone_pool.collect_metrics)
+    return rclone_pool
+
+'''
+Returns the shared handler instance for the job's BackupType.
+Raises BackupError if no handler supports it.
+'''
+def get_handler(job: BackupJob) -> BackupHandler:
+    handler_class = BACKUP_HANDLER_CLASSES.get(job.BackupType)
+    if handler_class is None:
+        raise BackupError(f"No backup handler is available for {job.BackupType}.")
+    if job.chunked:
+        handler_class = ChunkedBackupHandler
+    with _handlers_lock:
+        handler = _handlers.get(handler_class)
+    if handler is None:
+        handler = _create_handler(handler_class)
+        with _handlers_lock:
+            handler = _handlers.setdefault(handler_class, handler)
+    return handler
+
+def _create_handler(handler_class):
+    if issubclass(handler_class, RCloneBackupHandler):
+        handler = handler_class(get_rclone_pool(), get_file_index())
+    else:
+        handler = handler_class()
+    handler.retention = RetentionManager(get_retention_catalog())
+    handler.throttle = get_throttle()
+    return handler
+
+# Closes every shared handler and the shared rclone pool
+def close_handlers():
+    global _rclone_pool
+    with _handlers_lock:
+        handlers = list(_handlers.values())
+        _handlers.clear()
+        rclone_pool, _rclone_pool = _rclone_pool, None
+    for handler in handlers:
+        handler.close()
+    if rclone_pool is not None:
+        get_throttle().remove_listener(rclone_pool.set_throttle_limits)
+        get_metrics().remove_collector(rclone_pool.collect_metrics)
+        rclone_pool.close()
+
+# Linux ioctl that makes dst share src's data blocks (btrfs, XFS, bcachefs, ...)
+FICLONE = 0x40049409
+
+# Returns True if target was created as a reflink of source. Returns False
+# (leaving no target behind) if the platform or filesystem cannot reflink.
+def _reflink_file(source: Path, target: Path) -> bool:
+    if fcntl is None:
+        return False
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        try:
+            fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM):
+                raise
+    target.unlink()
+    return False
+
+# Copies source to target without moving the data through user space where
+# possible (copy_file_range, then sendfile), falling back to a buffered copy.
+# With a limiter the data is copied in THROTTLE_CHUNK_SIZE steps, each paid
+# for before the next. Returns the number of bytes copied.
+def _copy_file_in_kernel(source: Path, target: Path, limiter: JobLimiter | None = None) -> int:
+    with open(source, "rb") as source_file, open(target, "wb") as target_file:
+        source_fd, target_fd = source_file.fileno(), target_file.fileno()
+        size = os.fstat(source_fd).st_size
+        for copy in (_copy_with_copy_file_range, _copy_with_sendfile):
+            try:
+                return copy(source_fd, target_fd, size, limiter)
+            except (OSError, AttributeError) as e:
+                if isinstance(e, OSError) and e.errno not in _IN_KERNEL_COPY_UNSUPPORTED:
+                    raise
+                os.lseek(source_fd, 0, os.SEEK_SET)
+                os.lseek(target_fd, 0, os.SEEK_SET)
+                os.ftruncate(target_fd, 0)
+        shutil.copyfileobj(source_file, target_file if limiter is None else limiter.writer(target_file), COPY_BUFFER_SIZE)
+        return target_file.tell()
+
+_IN_KERNEL_COPY_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP)
+COPY_BUFFER_SIZE = 1 << 20
+THROTTLE_CHUNK_SIZE = 1 << 20
+
+def _copy_with_copy_file_range(source_fd: int, target_fd: int, size: int, limiter: JobLimiter | None = None) -> int:
+    copied = 0
+    step = 1 << 30 if limiter is None else THROTTLE_CHUNK_SIZE
+    while True:
+        count = os.copy_file_range(source_fd, target_fd, step)
+        if count == 0:
+            return copied
+        copied += count
+        if limiter is not None:
+            limiter.consume(count)
+
+def _copy_with_sendfile(source_fd: int, target_fd: int, size: int, limiter: JobLimiter | None = None) -> int:
+    copied = 0
+    step = 1 << 30 if limiter is None else THROTTLE_CHUNK_SIZE
+    while copied < size:
+        count = os.sendfile(target_fd, source_fd, copied, min(size - copied, step))
+        if count == 0:
+            break
+        copied += count
+        if limiter is not None:
+            limiter.consume(count)
+    return copied
+
+# Formats a bandwidth for rclone's --bwlimit and core/bwlimit, which read plain numbers as KiB/s
+def _rclone_rate(bandwidth: int | None) -> str:
+    return "off" if bandwidth is None else f"{max(1, bandwidth // 1024)}K"
+
+def _free_local_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
@@ -0,0 +1,391 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from abackup.compression import compress_block, decompress, require_codec
+from abackup.jobs import CompressionCodec
+from abackup.profiling import stage
+from abackup.retention import artifact_created
+
+# Optional native boundary scan, built from _gearscan.c
+try:
+    from abackup import _gearscan
+except ImportError:
+    _gearscan = None
+
+# Deduplicating chunk store used by chunked backups.
+#
+# Files are split into content-defined chunks with a gear rolling hash
+# (FastCDC-style): a chunk ends where the hash of the last bytes matches a
+# mask, so inserting or removing data only changes the chunks around the edit
+# and every other chunk keeps its boundaries, and therefore its address.
+# Chunks are addressed by their BLAKE2b digest, compressed, and stored once:
+#   <store>/chunks/<first two hex digits>/<digest>
+#   <store>/snapshots/<artifact name>.json.gz   (one manifest per run)
+# A manifest lists every file of the snapshot with the chunks it is made of,
+# so restoring a snapshot never needs any other manifest.
+
+CHUNK_MIN_SIZE = 256 * 1024
+CHUNK_AVERAGE_SIZE = 1024 * 1024
+CHUNK_MAX_SIZE = 4 * 1024 * 1024
+READ_SIZE = 8 * 1024 * 1024
+
+MANIFEST_FORMAT_VERSION = 1
+MANIFEST_SUFFIX = ".json.gz"
+
+# First byte of every stored chunk: how the rest of it is encoded
+CHUNK_ENCODING_RAW = b"r"
+CHUNK_ENCODINGS = {
+    CompressionCodec.GZIP: b"z",
+    CompressionCodec.ZSTD: b"s",
+    CompressionCodec.LZ4: b"l",
+}
+
+# 256 pseudo-random 64-bit values, derived deterministically so that every
+# version of abackup cuts the same data at the same places
+GEAR_TABLE = tuple(int.from_bytes(hashlib.blake2b(bytes([value]), digest_size=8, person=b"abackup-gear").digest(),
+                                  "little") for value in range(256))
+_GEAR_TABLE_BYTES = struct.pack("=256Q", *GEAR_TABLE) # As _gearscan reads it, in native byte order
+
+# Raised when the chunk store is missing data or holds data it cannot read
+class ChunkStoreError(Exception):
+    pass
+
+class Chunker:
+    def __init__(self, min_size: int = CHUNK_MIN_SIZE, average_size: int = CHUNK_AVERAGE_SIZE,
+                 max_size: int = CHUNK_MAX_SIZE):
+        if not 0 < min_size < average_size < max_size:
+            raise ValueError("Chunk sizes must satisfy 0 < min < average < max.")
+        self.min_size = min_size
+        self.max_size = max_size
+        # A boundary is expected every 2**bits bytes past the minimum size
+        bits = max(1, (average_size - min_size).bit_length() - 1)
+        self._mask = ((1 << bits) - 1) << (64 - bits)
+
+    '''
+    Yields the chunks of a binary file object. Chunks are bytes objects of at
+    least min_size (except the last one) and at most max_size bytes.
+    '''
+    def chunks(self, file):
+        buffer = b""
+        start = 0
+        eof = False
+        while True:
+            if not eof and len(buffer) - start < self.max_size:
+                data = file.read(READ_SIZE)
+                if data:
+                    buffer = buffer[start:] + data
+                    start = 0
+                else:
+                    eof = True
+                continue
+            remaining = len(buffer) - start
+            if not remaining:
+                return
+            cut = self.find_boundary(buffer, start) if remaining > self.min_size else remaining
+            yield buffer[start:start + cut]
+            start += cut
+
+    # Returns the length of the chunk starting at data[start]; the data must
+    # hold at least max_size bytes from there, or the rest of the file
+    def find_boundary(self, data, start: int = 0) -> int:
+        limit = min(len(data) - start, self.max_size)
+        if _gearscan is not None:
+            begin = start + min(self.min_size, limit)
+            return _gearscan.find_boundary(data, begin, start + limit, _GEAR_TABLE_BYTES, self._mask) - start
+        return self._find_boundary_python(data, start, limit)
+
+    # The same scan in Python, about a hundred times slower
+    def _find_boundary_python(self, data, start: int, limit: int) -> int:
+        mask = self._mask
+        gear = GEAR_TABLE
+        # Shifting right keeps the hash below 2**65 without masking it; each
+        # byte's contribution is gone after 64 more bytes
+        rolling_hash = 0
+        for length, byte in enumerate(data[start + self.min_size:start + limit], self.min_size + 1):
+            rolling_hash = (rolling_hash >> 1) + gear[byte]
+            if not rolling_hash & mask:
+                return length
+        return limit
+
+# Where the chunks and manifests of a store are kept
+class ChunkStoreBackend(ABC):
+    @abstractmethod
+    def list_chunks(self) -> set:
+        pass
+
+    @abstractmethod
+    def put_chunk(self, chunk_id: str, data: bytes):
+        pass
+
+    @abstractmethod
+    def get_chunk(self, chunk_id: str) -> bytes:
+        pass
+
+    @abstractmethod
+    def list_manifests(self) -> list:
+        pass
+
+    @abstractmethod
+    def put_manifest(self, name: str, data: bytes):
+        pass
+
+    @abstractmethod
+    def get_manifest(self, name: str) -> bytes:
+        pass
+
+    # Makes every chunk put so far durable on the destination
+    def flush(self):
+        pass
+
+    # Releases temporary resources; unflushed chunks are dropped
+    def close(self):
+        pass
+
+def chunk_relative_path(chunk_id: str) -> str:
+    return f"chunks/{chunk_id[:2]}/{chunk_id}"
+
+def manifest_relative_path(name: str) -> str:
+    return f"snapshots/{name}{MANIFEST_SUFFIX}"
+
+# Keeps the store in a local directory. Objects are written to a temporary
+# name and renamed, so a crash never leaves a truncated chunk behind.
+class LocalChunkBackend(ChunkStoreBackend):
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def list_chunks(self) -> set:
+        chunks = set()
+        try:
+            with os.scandir(self.root / "chunks") as prefixes:
+                for prefix in prefixes:
+                    if prefix.is_dir():
+                        chunks.update(entry.name for entry in os.scandir(prefix.path) if not entry.name.startswith("."))
+        except FileNotFoundError:
+            pass
+        return chunks
+
+    def put_chunk(self, chunk_id: str, data: bytes):
+        self._write(chunk_relative_path(chunk_id), data)
+
+    def get_chunk(self, chunk_id: str) -> bytes:
+        return self._read(chunk_relative_path(chunk_id))
+
+    def list_manifests(self) -> list:
+        try:
+            return sorted(name[:-len(MANIFEST_SUFFIX)] for name in os.listdir(self.root / "snapshots")
+                          if name.endswith(MANIFEST_SUFFIX))
+        except FileNotFoundError:
+            return []
+
+    def put_manifest(self, name: str, data: bytes):
+        self._write(manifest_relative_path(name), data)
+
+    def get_manifest(self, name: str) -> bytes:
+        return self._read(manifest_relative_path(name))
+
+    def _write(self, relative_path, data):
+        path = self.root / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name("." + path.name + ".tmp")
+        temporary.write_bytes(data)
+        os.replace(temporary, path)
+
+    def _read(self, relative_path):
+        try:
+            return (self.root / relative_path).read_bytes()
+        except FileNotFoundError as e:
+            raise ChunkStoreError(f"'{relative_path}' is missing from the chunk store at '{self.root}'.") from e
+
+# Keeps the store on an rclone remote. New chunks are staged in a local
+# directory and uploaded in batches with a single rclone copy each, which
+# avoids one round trip per chunk and never lists the remote.
+class RCloneChunkBackend(ChunkStoreBackend):
+    def __init__(self, rclone, remote: str, batch_size: int = 64 * 1024 * 1024):
+        self.rclone = rclone # An RCloneRemoteControl
+        self.remote = remote
+        self.batch_size = batch_size
+        self.bytes_uploaded = 0
+        self._staging = Path(tempfile.mkdtemp(prefix="abackup-chunks-"))
+        self._staged_bytes = 0
+
+    def list_chunks(self) -> set:
+        self.rclone.run_job("operations/mkdir", fs=self.remote, remote="chunks")
+        output = self.rclone.run_job("operations/list", fs=self.remote, remote="chunks",
+                                     opt={"recurse": True, "filesOnly": True})
+        return {entry["Name"] for entry in output.get("list") or [] if not entry.get("IsDir")}
+
+    def put_chunk(self, chunk_id: str, data: bytes):
+        self._stage(chunk_relative_path(chunk_id), data)
+        if self._staged_bytes >= self.batch_size:
+            self.flush()
+
+    def get_chunk(self, chunk_id: str) -> bytes:
+        return self._download(chunk_relative_path(chunk_id))
+
+    def list_manifests(self) -> list:
+        self.rclone.run_job("operations/mkdir", fs=self.remote, remote="snapshots")
+        output = self.rclone.run_job("operations/list", fs=self.remote, remote="snapshots")
+        return sorted(entry["Name"][:-len(MANIFEST_SUFFIX)] for entry in output.get("list") or []
+                      if entry["Name"].endswith(MANIFEST_SUFFIX))
+
+    # The manifest is uploaded after every chunk it refers to
+    def put_manifest(self, name: str, data: bytes):
+        self.flush()
+        self._stage(manifest_relative_path(name), data)
+        self.flush()
+
+    def get_manifest(self, name: str) -> bytes:
+        return self._download(manifest_relative_path(name))
+
+    def flush(self):
+        if not self._staged_bytes:
+            return
+        with stage("upload"):
+            output = self.rclone.run_job("sync/copy", srcFs=str(self._staging), dstFs=self.remote,
+                                         _config={"NoTraverse": True})
+        self.bytes_uploaded += output["_stats"].get("bytes", 0)
+        shutil.rmtree(self._staging)
+        self._staging.mkdir()
+        self._staged_bytes = 0
+
+    def close(self):
+        shutil.rmtree(self._staging, ignore_errors=True)
+
+    def _stage(self, relative_path, data):
+        path = self._staging / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        self._staged_bytes += len(data)
+
+    def _download(self, relative_path) -> bytes:
+        with tempfile.TemporaryDirectory(prefix="abackup-download-") as directory:
+            self.rclone.run_job("operations/copyfile", srcFs=self.remote, srcRemote=relative_path,
+                                dstFs=directory, dstRemote="object")
+            return (Path(directory) / "object").read_bytes()
+
+class ChunkStore:
+    def __init__(self, backend: ChunkStoreBackend, chunker: Chunker | None = None,
+                 codec: CompressionCodec | None = CompressionCodec.GZIP, level: int | None = None, limiter=None):
+        if codec is not None:
+            require_codec(codec)
+        self.backend = backend
+        self.chunker = chunker or Chunker()
+        self.codec = codec # None stores chunks uncompressed
+        self.level = level
+        self.limiter = limiter # Throttles stored chunks when set (a throttle.JobLimiter)
+        self.bytes_read = 0
+        self.bytes_stored = 0 # Encoded size of the new chunks
+        self.chunks_stored = 0
+        self._known_chunks = None
+
+    def has_chunk(self, chunk_id: str) -> bool:
+        return chunk_id in self._chunk_ids()
+
+    '''
+    Splits the file into chunks, stores those the store does not have yet, and
+    returns the list of chunk IDs the file is made of. compress=False stores
+    the chunks as they are, e.g. for files that are compressed already.
+    '''
+    def store_file(self, path, compress: bool = True) -> list:
+        chunk_ids = []
+        with open(path, "rb") as file:
+            for chunk in self.chunker.chunks(file):
+                chunk_ids.append(self.store_chunk(chunk, compress))
+        return chunk_ids
+
+    def store_chunk(self, chunk: bytes, compress: bool = True) -> str:
+        chunk_id = hashlib.blake2b(chunk, digest_size=32).hexdigest()
+        self.bytes_read += len(chunk)
+        known_chunks = self._chunk_ids()
+        if chunk_id not in known_chunks:
+            data = _encode_chunk(chunk, self.codec if compress else None, self.level)
+            if self.limiter is not None:
+                self.limiter.consume(len(data))
+            self.backend.put_chunk(chunk_id, data)
+            known_chunks.add(chunk_id)
+            self.bytes_stored += len(data)
+            self.chunks_stored += 1
+        return chunk_id
+
+    def load_chunk(self, chunk_id: str) -> bytes:
+        chunk = _decode_chunk(self.backend.get_chunk(chunk_id))
+        if hashlib.blake2b(chunk, digest_size=32).hexdigest() != chunk_id:
+            raise ChunkStoreError(f"Chunk {chunk_id} is corrupt.")
+        return chunk
+
+    def write_manifest(self, name: str, manifest: dict):
+        manifest = {"version": MANIFEST_FORMAT_VERSION, **manifest}
+        data = gzip.compress(json.dumps(manifest, separators=(",", ":")).encode("utf-8"), mtime=0)
+        self.backend.put_manifest(name, data)
+
+    def read_manifest(self, name: str) -> dict:
+        try:
+            manifest = json.loads(gzip.decompress(self.backend.get_manifest(name)))
+        except (OSError, ValueError) as e:
+            raise ChunkStoreError(f"Manifest '{name}' is unreadable: {e}") from e
+        if manifest.get("version") != MANIFEST_FORMAT_VERSION:
+            raise ChunkStoreError(f"Manifest '{name}' has unsupported version {manifest.get('version')}.")
+        return manifest
+
+    # Returns the name of the newest manifest written for the job, or None.
+    # Jobs can share a store, so "db" must not pick up a "db-prod-..." manifest.
+    def latest_manifest(self, job_id: str) -> str | None:
+        manifests = [(created, name) for name in self.backend.list_manifests()
+                     if (created := artifact_created(job_id, name)) is not None]
+        return max(manifests)[1] if manifests else None
+
+    '''
+    Recreates the snapshot described by manifest `name` under target.
+    '''
+    def restore(self, name: str, target):
+        target = Path(target)
+        manifest = self.read_manifest(name)
+        for directory in manifest.get("directories", []):
+            (target / directory).mkdir(parents=True, exist_ok=True)
+        for entry in manifest["files"]:
+            path = target / entry["path"]
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if "link" in entry:
+                os.symlink(entry["link"], path)
+                continue
+            with open(path, "wb") as file:
+                for chunk_id in entry["chunks"]:
+                    file.write(self.load_chunk(chunk_id))
+            os.chmod(path, entry["mode"])
+            os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    def flush(self):
+        self.backend.flush()
+
+    def _chunk_ids(self) -> set:
+        if self._known_chunks is None:
+            self._known_chunks = self.backend.list_chunks()
+        return self._known_chunks
+
+def _encode_chunk(chunk: bytes, codec: CompressionCodec | None, level: int | None) -> bytes:
+    if codec is not None:
+        compressed = compress_block(codec, chunk, level)
+        if len(compressed) < len(chunk):
+            return CHUNK_ENCODINGS[codec] + compressed
+    return CHUNK_ENCODING_RAW + chunk # Incompressible (already compressed) data
+
+def _decode_chunk(data: bytes) -> bytes:
+    encoding, payload = data[:1], data[1:]
+    if encoding == CHUNK_ENCODING_RAW:
+        return payload
+    for codec, codec_encoding in CHUNK_ENCODINGS.items():
+        if encoding == codec_encoding:
+            try:
+                return decompress(codec, payload)
+            except ValueError as e:
+                raise ChunkStoreError(f"Chunk needs the {codec.value} codec: {e}") from e
+            except Exception as e: # Each codec raises its own error type for corrupt data
+                raise ChunkStoreError(f"Chunk data is corrupt: {e}") from e
+    raise ChunkStoreError(f"Unknown chunk encoding {encoding!r}.")
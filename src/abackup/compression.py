@@ -0,0 +1,219 @@
+import collections
+import gzip
+import io
+import math
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from abackup.jobs import COMPRESSION_LEVELS, BackupJob, CompressionCodec
+from abackup.profiling import bind, stage
+
+# Optional codecs
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# Parallel block compression.
+#
+# A ParallelCompressor is a writable stream: data written to it is cut into
+# fixed-size blocks, each block is compressed on a thread pool into a complete
+# gzip member / zstd frame / lz4 frame, and the results are written to the
+# output stream in order. Concatenated members and frames are a valid stream
+# for every codec, so the output can be read back with the codec's normal
+# decompressor (gzip -d, zstd -d, lz4 -d). zlib, zstandard and lz4 all release
+# the GIL while compressing, so threads scale across cores without the cost of
+# shipping blocks to worker processes. The number of blocks in flight is
+# bounded, so memory use does not depend on how much data is written.
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_LEVELS = {
+    CompressionCodec.GZIP: 6,
+    CompressionCodec.ZSTD: 3,
+    CompressionCodec.LZ4: 0,
+}
+
+# Files with these extensions are already compressed and are stored instead
+COMPRESSED_EXTENSIONS = frozenset({
+    ".7z", ".apk", ".avif", ".br", ".bz2", ".cab", ".deb", ".docx", ".epub", ".flac", ".gif", ".gz", ".heic",
+    ".jar", ".jpeg", ".jpg", ".lz", ".lz4", ".lzma", ".m4a", ".m4v", ".mkv", ".mov", ".mp3", ".mp4", ".odt",
+    ".ogg", ".opus", ".png", ".pptx", ".rar", ".rpm", ".tbz2", ".tgz", ".txz", ".webm", ".webp", ".whl",
+    ".xlsx", ".xz", ".zip", ".zst",
+})
+ENTROPY_SAMPLE_SIZE = 64 * 1024
+# Bits per byte above which a sample is treated as incompressible (8 is random)
+ENTROPY_THRESHOLD = 7.5
+
+def codec_available(codec: CompressionCodec) -> bool:
+    if codec == CompressionCodec.ZSTD:
+        return zstandard is not None
+    if codec == CompressionCodec.LZ4:
+        return lz4_frame is not None
+    return True
+
+def require_codec(codec: CompressionCodec):
+    if not codec_available(codec):
+        package = "zstandard" if codec == CompressionCodec.ZSTD else "lz4"
+        raise ValueError(f"The {codec.value} codec requires the '{package}' package.")
+
+# Returns the file name suffix of a stream compressed with the codec
+def codec_suffix(codec: CompressionCodec) -> str:
+    return {CompressionCodec.GZIP: ".gz", CompressionCodec.ZSTD: ".zst", CompressionCodec.LZ4: ".lz4"}[codec]
+
+'''
+Compresses data into one self-contained gzip member, zstd frame or lz4 frame.
+store=True uses the codec's cheapest setting, for data that will not shrink.
+'''
+def compress_block(codec: CompressionCodec, data, level: int | None = None, store: bool = False) -> bytes:
+    with stage("compress"):
+        return _compress_block(codec, data, DEFAULT_LEVELS[codec] if level is None else level, store)
+
+def _compress_block(codec: CompressionCodec, data, level: int, store: bool) -> bytes:
+    if codec == CompressionCodec.GZIP:
+        compressor = zlib.compressobj(0 if store else level, zlib.DEFLATED, 31) # 31: gzip container
+        return compressor.compress(data) + compressor.flush()
+    require_codec(codec)
+    if codec == CompressionCodec.ZSTD:
+        return zstandard.ZstdCompressor(level=1 if store else level).compress(data)
+    return lz4_frame.compress(data, compression_level=0 if store else level)
+
+# Decompresses a complete stream of one or more members/frames
+def decompress(codec: CompressionCodec, data: bytes) -> bytes:
+    if codec == CompressionCodec.GZIP:
+        return gzip.decompress(data)
+    require_codec(codec)
+    with open_decompressor(codec, io.BytesIO(data)) as reader:
+        return reader.read()
+
+# Returns a readable binary stream that decompresses `file`
+def open_decompressor(codec: CompressionCodec, file):
+    if codec == CompressionCodec.GZIP:
+        return gzip.GzipFile(fileobj=file, mode="rb")
+    require_codec(codec)
+    if codec == CompressionCodec.ZSTD:
+        return zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True)
+    return lz4_frame.LZ4FrameFile(file, mode="rb")
+
+# Shannon entropy of data in bits per byte
+def byte_entropy(data) -> float:
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(count / total * math.log2(count / total) for count in collections.Counter(data).values())
+
+'''
+Returns True if the file is most likely compressed already: it has a known
+compressed extension, or a sample of its content looks random.
+'''
+def is_probably_compressed(path, sample: bytes | None = None) -> bool:
+    if Path(path).suffix.lower() in COMPRESSED_EXTENSIONS:
+        return True
+    if sample is None:
+        try:
+            with open(path, "rb") as file:
+                sample = file.read(ENTROPY_SAMPLE_SIZE)
+        except OSError:
+            return False
+    # Tiny files are not worth sampling
+    return len(sample) >= 4096 and byte_entropy(sample) > ENTROPY_THRESHOLD
+
+class ParallelCompressor:
+    def __init__(self, output, codec: CompressionCodec = CompressionCodec.GZIP, level: int | None = None,
+                 threads: int | None = None, block_size: int = DEFAULT_BLOCK_SIZE):
+        require_codec(codec)
+        if level is not None:
+            lowest, highest = COMPRESSION_LEVELS[codec]
+            if not lowest <= level <= highest:
+                raise ValueError(f"Compression level for {codec.value} must be between {lowest} and {highest}.")
+        self.output = output # Any object with a write(bytes) method
+        self.codec = codec
+        self.level = level
+        self.threads = threads or os.cpu_count() or 1
+        self.block_size = block_size
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compressible = True
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._max_pending = self.threads * 2
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="abackup-compress")
+        self._compress_block = bind(compress_block) # Compressed in the trace of the run being profiled, if any
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @classmethod
+    def for_job(cls, output, job: BackupJob, **args) -> "ParallelCompressor":
+        return cls(output, job.compression_codec, job.compression_level, job.compression_threads, **args)
+
+    def write(self, data) -> int:
+        if self._closed:
+            raise ValueError("write to a closed ParallelCompressor")
+        with self._lock:
+            self._buffer += data
+            self.bytes_in += len(data)
+            while len(self._buffer) >= self.block_size:
+                block = bytes(self._buffer[:self.block_size])
+                del self._buffer[:self.block_size]
+                self._submit(block)
+        return len(data)
+
+    '''
+    Tells the compressor whether the data written next is worth compressing.
+    Blocks never mix the two kinds: the current block is cut at the change.
+    '''
+    def set_compressible(self, compressible: bool):
+        with self._lock:
+            if compressible != self.compressible and self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            self.compressible = compressible
+
+    # Position in the uncompressed stream (tarfile needs it)
+    def tell(self) -> int:
+        return self.bytes_in
+
+    # Compresses and writes out everything written so far
+    def flush(self):
+        with self._lock:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._write_result(self._pending.popleft())
+
+    def close(self):
+        if self._closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._closed = True
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._closed = True
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _submit(self, block: bytes):
+        while len(self._pending) >= self._max_pending:
+            self._write_result(self._pending.popleft())
+        self._pending.append(self._executor.submit(self._compress_block, self.codec, block, self.level,
+                                                   not self.compressible))
+
+    def _write_result(self, future):
+        data = future.result()
+        self.output.write(data)
+        self.bytes_out += len(data)
@@ -0,0 +1,125 @@
+import json
+import os
+import socket
+import struct
+from pathlib import Path
+
+from abackup.paths import runtime_directory
+
+# Control channel between the abackup CLI and the running daemon.
+#
+# The daemon listens on a Unix domain socket in the runtime directory. Every
+# message is one JSON object preceded by its length as a 4-byte big-endian
+# integer, so either side reads a message with two exact-size reads and never
+# has to scan for a delimiter. A request is {"command": name, "args": {...}};
+# the reply is {"ok": true, "result": ...} or {"ok": false, "error": message}.
+# A connection may carry any number of requests, answered in order.
+#
+# This module is the protocol and the client side, and only imports a few small
+# standard library modules, so CLI commands connect and get their answer in
+# milliseconds without importing the scheduler or the backup handlers. The
+# daemon's side is ControlServer in controlserver.py. The socket is only
+# accessible to the user running the daemon. Platforms without Unix domain
+# sockets (Windows) have no control channel: the daemon runs without it.
+
+CONTROL_SOCKET_NAME = "control.sock"
+MESSAGE_HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# Seconds the client waits for a reply. Reloading a large schedule is the slowest command.
+DEFAULT_TIMEOUT_SECONDS = 30.0
+
+CONTROL_CHANNEL_AVAILABLE = hasattr(socket, "AF_UNIX")
+
+class ControlError(Exception):
+    pass
+
+# The daemon is not running, or not listening on the socket
+class DaemonNotRunningError(ControlError):
+    pass
+
+def control_socket_path() -> Path:
+    return runtime_directory() / CONTROL_SOCKET_NAME
+
+def encode_message(message) -> bytes:
+    payload = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    if len(payload) > MAX_MESSAGE_SIZE:
+        raise ControlError(f"Control message of {len(payload)} bytes exceeds {MAX_MESSAGE_SIZE} bytes.")
+    return MESSAGE_HEADER.pack(len(payload)) + payload
+
+def decode_message(payload: bytes):
+    try:
+        return json.loads(payload.decode("utf-8"))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise ControlError(f"Malformed control message: {e}") from None
+
+def message_size(header: bytes) -> int:
+    size, = MESSAGE_HEADER.unpack(header)
+    if size > MAX_MESSAGE_SIZE:
+        raise ControlError(f"Control message of {size} bytes exceeds {MAX_MESSAGE_SIZE} bytes.")
+    return size
+
+# Blocking client for the CLI. Connects lazily and keeps the connection open
+# for further calls until close().
+class ControlClient:
+    def __init__(self, path=None, timeout: float = DEFAULT_TIMEOUT_SECONDS):
+        self.path = Path(path) if path is not None else control_socket_path()
+        self.timeout = timeout
+        self._socket = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    '''
+    Sends a command to the daemon and returns its result. Raises
+    DaemonNotRunningError if the daemon cannot be reached and ControlError
+    if it rejects the command.
+    '''
+    def call(self, command: str, **args):
+        connection = self._connect()
+        try:
+            connection.sendall(encode_message({"command": command, "args": args}))
+            reply = decode_message(self._read(message_size(self._read(MESSAGE_HEADER.size))))
+        except (OSError, ControlError):
+            self.close()
+            raise
+        if not isinstance(reply, dict) or "ok" not in reply:
+            raise ControlError("Malformed reply from the daemon.")
+        if not reply["ok"]:
+            raise ControlError(reply.get("error") or "The daemon rejected the command.")
+        return reply.get("result")
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _connect(self) -> socket.socket:
+        if self._socket is None:
+            if not CONTROL_CHANNEL_AVAILABLE:
+                raise ControlError("The abackup daemon cannot be controlled on this platform (no Unix sockets).")
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            try:
+                connection.connect(str(self.path))
+            except (FileNotFoundError, ConnectionRefusedError):
+                connection.close()
+                raise DaemonNotRunningError(f"The abackup daemon is not running (no listener on {self.path}).") \
+                    from None
+            except OSError:
+                connection.close()
+                raise
+            self._socket = connection
+        return self._socket
+
+    def _read(self, size: int) -> bytes:
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise ControlError("The daemon closed the connection.")
+            data += chunk
+        return bytes(data)
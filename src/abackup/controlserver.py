@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+import socket
+from pathlib import Path
+
+from abackup.control import MESSAGE_HEADER, ControlError, decode_message, encode_message, message_size
+
+logger = logging.getLogger(__name__)
+
+# asyncio only serves Unix domain sockets on Unix
+CONTROL_SERVER_AVAILABLE = hasattr(socket, "AF_UNIX") and hasattr(asyncio, "start_unix_server")
+
+# Serves control requests on the daemon's event loop. `handlers` maps command
+# names to coroutine functions taking the request's args as keyword arguments.
+# A ValueError raised by a handler is reported to the client as the command's
+# error.
+class ControlServer:
+    def __init__(self, path, handlers: dict):
+        self.path = Path(path)
+        self.handlers = handlers
+        self._server = None
+        self._connections = set()
+
+    '''
+    Starts listening. Removes a socket left behind by a daemon that did not
+    shut down cleanly; raises ControlError if another daemon is listening.
+    '''
+    async def start(self):
+        self._remove_stale_socket()
+        self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        umask = os.umask(0o177)
+        try:
+            self._server = await asyncio.start_unix_server(self._serve, path=str(self.path))
+        finally:
+            os.umask(umask)
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    async def _serve(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(MESSAGE_HEADER.size)
+                    request = decode_message(await reader.readexactly(message_size(header)))
+                except asyncio.IncompleteReadError:
+                    return # Client disconnected
+                writer.write(encode_message(await self._dispatch(request)))
+                await writer.drain()
+        except (ConnectionError, ControlError) as e:
+            logger.debug("Dropping control connection: %s", e)
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, request) -> dict:
+        if not isinstance(request, dict) or not isinstance(request.get("args", {}), dict):
+            return {"ok": False, "error": "Malformed request."}
+        command = request.get("command")
+        handler = self.handlers.get(command)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown command '{command}'."}
+        try:
+            call = handler(**request.get("args", {}))
+        except TypeError as e: # Raised before the coroutine runs
+            return {"ok": False, "error": f"Invalid arguments for '{command}': {e}"}
+        try:
+            result = await call
+        except ValueError as e:
+            return {"ok": False, "error": str(e)}
+        except Exception as e:
+            logger.exception("Control command '%s' failed", command)
+            return {"ok": False, "error": f"Command '{command}' failed: {e}"}
+        return {"ok": True, "result": result}
+
+    def _remove_stale_socket(self):
+        if not self.path.exists():
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(self.path))
+        except (ConnectionRefusedError, FileNotFoundError):
+            self.path.unlink(missing_ok=True)
+        else:
+            raise ControlError(f"Another abackup daemon is listening on {self.path}.")
+        finally:
+            probe.close()
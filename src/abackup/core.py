@@ -1,9 +1,184 @@
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from abackup.jobs import BackupJob, JobStatus
+
+logger = logging.getLogger(__name__)
+
 # Core class
 
-## Stores a job queue
-## Polls and regularly calls Update method on queue
-## Checks for jobs in queue after update
-## If jobs in queue, perform the job, pop from queue
+## The scheduler marks due jobs QUEUED and hands them to the executor
+## The executor runs QUEUED jobs concurrently, bounded by a global worker cap
+## and optional caps per BackupType and per destination
+## Each job moves QUEUED -> RUNNING -> COMPLETED/FAILED, then goes back to the scheduler
+
+'''
+Returns the key used to group jobs by destination for concurrency limits:
+the scheme and host of a URL, or the remote name of an rclone-style
+"remote:path" destination, so that jobs writing to different folders of the
+same remote share one limit.
+'''
+def destination_key(destination_url: str | None) -> str:
+    if not destination_url:
+        return ""
+    parts = urlsplit(destination_url)
+    if parts.scheme and parts.netloc:
+        return f"{parts.scheme}://{parts.netloc}"
+    remote, separator, _ = destination_url.partition(":")
+    if separator and "/" not in remote:
+        return remote + ":"
+    return destination_url
+
+
+# Runs QUEUED BackupJobs in parallel on a bounded thread pool.
+#
+# Dispatch order is first-come, first-served, but a job whose BackupType or
+# destination is at its limit does not block the jobs queued behind it.
+# All bookkeeping (queue, counters and status transitions) happens on the
+# event loop thread, so transitions are never interleaved; only perform_job
+# runs on worker threads. submit() must be called from the event loop thread.
+#
+# A job can change while it waits: with current_job, each pending job is
+# looked up again right before it starts, so that a job removed from the pool
+# is dropped and a job whose definition was reloaded runs the new definition.
+class BackupJobExecutor:
+    def __init__(self, perform_job, max_workers: int = 4, backup_type_limits: dict | None = None,
+                 destination_limit: int | None = None, set_status=None, on_job_finished=None, current_job=None):
+        if not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError("max_workers must be a positive integer.")
+        self.perform_job = perform_job # Blocking callable(job); raising marks the run FAILED
+        self.max_workers = max_workers
+        self.backup_type_limits = dict(backup_type_limits or {}) # BackupType -> max concurrent jobs
+        self.destination_limit = destination_limit # Max concurrent jobs per destination_key()
+        self.set_status = set_status # Optional callable(job_id, status), e.g. BackupJobPool.set_status
+        self.on_job_finished = on_job_finished # Optional callable(job, status)
+        self.current_job = current_job # Optional callable(job) -> the job's current definition, or None if it is gone
+
+        self._pending = deque()
+        self._running = {} # job_id -> asyncio.Task
+        self._running_by_type = {}
+        self._running_by_destination = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._thread_pool = None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+
+    def is_active(self, job_id: str) -> bool:
+        return job_id in self._running or any(job.job_id == job_id for job in self._pending)
+
+    '''
+    Queues a QUEUED job for execution and starts it as soon as the limits allow.
+    Raises ValueError if the job is not QUEUED or is already queued or running.
+    '''
+    def submit(self, job: BackupJob):
+        if job.status != JobStatus.QUEUED:
+            raise ValueError(f"Only QUEUED jobs can be executed; job '{job.job_id}' is {job.status}.")
+        if self.is_active(job.job_id):
+            raise ValueError(f"Job '{job.job_id}' is already queued or running.")
+        self._pending.append(job)
+        self._idle.clear()
+        self._dispatch()
+
+    '''
+    Drops jobs that have not started yet and returns them. Their status is left
+    QUEUED so that they can be resubmitted.
+    '''
+    def clear_pending(self) -> list[BackupJob]:
+        dropped = list(self._pending)
+        self._pending.clear()
+        self._update_idle()
+        return dropped
+
+    '''
+    Waits until no job is pending or running.
+    '''
+    async def join(self):
+        await self._idle.wait()
+
+    def shutdown(self):
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False)
+            self._thread_pool = None
+
+    # Private dispatch methods
+
+    def _dispatch(self):
+        blocked = deque()
+        while self._pending and len(self._running) < self.max_workers:
+            job = self._pending.popleft()
+            if self.current_job is not None:
+                job = self.current_job(job)
+            if job is None or job.status != JobStatus.QUEUED:
+                continue # Disabled or removed while waiting
+            if self._has_capacity(job):
+                self._start(job)
+            else:
+                blocked.append(job)
+        blocked.extend(self._pending)
+        self._pending = blocked
+        self._update_idle()
+
+    def _has_capacity(self, job: BackupJob) -> bool:
+        type_limit = self.backup_type_limits.get(job.BackupType)
+        if type_limit is not None and self._running_by_type.get(job.BackupType, 0) >= type_limit:
+            return False
+        if (self.destination_limit is not None and
+            self._running_by_destination.get(destination_key(job.destination_url), 0) >= self.destination_limit):
+            return False
+        return True
+
+    def _start(self, job: BackupJob):
+        self._set_status(job, JobStatus.RUNNING)
+        _increment(self._running_by_type, job.BackupType, 1)
+        _increment(self._running_by_destination, destination_key(job.destination_url), 1)
+        self._running[job.job_id] = asyncio.create_task(self._run(job))
+
+    async def _run(self, job: BackupJob):
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="abackup-job")
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._thread_pool, self.perform_job, job)
+        except Exception:
+            logger.exception("Backup job '%s' failed", job.job_id)
+            status = JobStatus.FAILED
+        else:
+            status = JobStatus.COMPLETED
+        finally:
+            del self._running[job.job_id]
+            _increment(self._running_by_type, job.BackupType, -1)
+            _increment(self._running_by_destination, destination_key(job.destination_url), -1)
+
+        self._set_status(job, status)
+        if self.on_job_finished is not None:
+            self.on_job_finished(job, status)
+        self._dispatch()
+
+    def _set_status(self, job: BackupJob, status: JobStatus):
+        if self.set_status is None:
+            job.status = status
+        else:
+            self.set_status(job.job_id, status)
+
+    def _update_idle(self):
+        if not self._pending and not self._running:
+            self._idle.set()
+
+def _increment(counts: dict, key, amount: int):
+    value = counts.get(key, 0) + amount
+    if value:
+        counts[key] = value
+    else:
+        counts.pop(key, None)
 
 
 # Food for thought:
@@ -0,0 +1,157 @@
+import calendar
+from datetime import datetime, timedelta
+
+# Cron expressions for JobRecurrence.CRON.
+#
+# The five standard fields (minute, hour, day of month, month, day of week) are
+# parsed once into integer bitsets, bit n set when value n matches. Finding
+# the next match is then a handful of "lowest set bit at or above n" operations,
+# one per field, carrying into the next larger field when a field has no match
+# left, instead of stepping through the calendar minute by minute.
+#
+# Supported syntax: *, values, ranges (1-5), steps (*/15, 1-30/5), lists
+# (1,15,30), month and weekday names (jan, mon), 7 for Sunday and the macros
+# @hourly, @daily, @midnight, @weekly, @monthly, @yearly and @annually. As in
+# Vixie cron, when both day fields are restricted a day matches either of them.
+
+MONTH_NAMES = ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")
+WEEKDAY_NAMES = ("sun", "mon", "tue", "wed", "thu", "fri", "sat")
+
+MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+# The weekday/day-of-month calendar repeats within 28 years (no skipped leap
+# years between 1901 and 2099), so a search that finds nothing in that span never will
+MAX_SEARCH_YEARS = 28
+
+class CronExpression:
+    __slots__ = ("text", "minutes", "hours", "days", "months", "weekdays", "_day_or", "_weekday_days")
+
+    def __init__(self, text: str):
+        self.text = str(text).strip()
+        fields = MACROS.get(self.text.lower(), self.text).split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression '{self.text}' must have 5 fields.")
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12, MONTH_NAMES)
+        weekdays = _parse_field(fields[4], 0, 7, WEEKDAY_NAMES)
+        self.weekdays = (weekdays | weekdays >> 7) & 0x7F # 7 is Sunday too
+        # Day-of-month bitsets of the matching weekdays, for months that start on each weekday
+        self._weekday_days = tuple(
+            sum(1 << day for day in range(1, 32) if self.weekdays >> ((first + day - 1) % 7) & 1)
+            for first in range(7))
+        day_restricted, weekday_restricted = not fields[2].startswith("*"), not fields[4].startswith("*")
+        self._day_or = day_restricted and weekday_restricted
+        if not self._day_or and not weekday_restricted:
+            # Only the day of month restricts days: it must exist in some selected month
+            longest = max(_days_in_month(2000, month) for month in range(1, 13) if self.months >> month & 1)
+            if not self.days & ((2 << longest) - 2):
+                raise ValueError(f"Cron expression '{self.text}' never matches.")
+
+    def __eq__(self, other):
+        return isinstance(other, CronExpression) and self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def __repr__(self):
+        return f"CronExpression({self.text!r})"
+
+    def matches(self, date_time: datetime) -> bool:
+        return (self.minutes >> date_time.minute & 1 and self.hours >> date_time.hour & 1 and
+                self.months >> date_time.month & 1 and
+                self._month_days(date_time.year, date_time.month) >> date_time.day & 1) == 1
+
+    '''
+    Returns the first matching minute at or after `start` (a naive wall-clock
+    datetime; seconds round up to the next minute), or None if there is none
+    within MAX_SEARCH_YEARS.
+    '''
+    def next_time(self, start: datetime) -> datetime | None:
+        if start.second or start.microsecond:
+            start = start.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        year, month, day, hour, minute = start.year, start.month, start.day, start.hour, start.minute
+        while year <= start.year + MAX_SEARCH_YEARS:
+            next_month = _next_bit(self.months, month)
+            if next_month is None:
+                year, month, day, hour, minute = year + 1, 1, 1, 0, 0
+                continue
+            if next_month != month:
+                month, day, hour, minute = next_month, 1, 0, 0
+            next_day = _next_bit(self._month_days(year, month), day)
+            if next_day is None:
+                year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+                day, hour, minute = 1, 0, 0
+                continue
+            if next_day != day:
+                day, hour, minute = next_day, 0, 0
+            next_hour = _next_bit(self.hours, hour)
+            if next_hour is None:
+                tomorrow = datetime(year, month, day) + timedelta(days=1)
+                year, month, day, hour, minute = tomorrow.year, tomorrow.month, tomorrow.day, 0, 0
+                continue
+            if next_hour != hour:
+                hour, minute = next_hour, 0
+            next_minute = _next_bit(self.minutes, minute)
+            if next_minute is None:
+                following = datetime(year, month, day, hour) + timedelta(hours=1)
+                year, month, day, hour, minute = following.year, following.month, following.day, following.hour, 0
+                continue
+            return datetime(year, month, day, hour, next_minute)
+        return None
+
+    # Bitset of the days of the given month that match
+    def _month_days(self, year: int, month: int) -> int:
+        weekday_days = self._weekday_days[(calendar.weekday(year, month, 1) + 1) % 7]
+        if self._day_or:
+            days = self.days | weekday_days
+        else:
+            days = self.days & weekday_days
+        return days & ((2 << _days_in_month(year, month)) - 2)
+
+    def _fields(self) -> tuple:
+        return (self.minutes, self.hours, self.days, self.months, self.weekdays, self._day_or)
+
+def _parse_field(text: str, lowest: int, highest: int, names=()) -> int:
+    bits = 0
+    for part in text.lower().split(","):
+        value_range, _, step = part.partition("/")
+        try:
+            step = int(step) if step else 1
+            if value_range == "*":
+                start, end = lowest, highest
+            else:
+                start_text, _, end_text = value_range.partition("-")
+                start = _parse_value(start_text, lowest, names)
+                end = _parse_value(end_text, lowest, names) if end_text else (highest if step > 1 else start)
+        except ValueError:
+            raise ValueError(f"Invalid cron field '{text}'.") from None
+        if step < 1 or not lowest <= start <= end <= highest:
+            raise ValueError(f"Invalid cron field '{text}': values must be between {lowest} and {highest}.")
+        for value in range(start, end + 1, step):
+            bits |= 1 << value
+    return bits
+
+def _parse_value(text: str, lowest: int, names) -> int:
+    if text in names:
+        return names.index(text) + (lowest if names is MONTH_NAMES else 0)
+    return int(text)
+
+# Returns the lowest set bit of mask at or above position, or None
+def _next_bit(mask: int, position: int) -> int | None:
+    rest = mask >> position
+    if not rest:
+        return None
+    return position + (rest & -rest).bit_length() - 1
+
+def _days_in_month(year: int, month: int) -> int:
+    return calendar.monthrange(year, month)[1]
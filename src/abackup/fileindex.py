@@ -0,0 +1,239 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from enum import Enum
+from pathlib import Path
+
+from abackup.paths import state_directory
+
+# Persistent per-job index of the files a backup has already seen.
+#
+# Each row holds a file's (path, size, mtime_ns, inode) and, optionally, a
+# content digest. A scan walks the source tree with os.scandir and compares it
+# with the index one directory at a time, so memory use is bounded by the
+# largest directory rather than the size of the tree. Only added, modified and
+# deleted files are emitted; unchanged files are never opened.
+#
+# Scans are two-phase: new file states are staged in the database while the
+# handler transfers the changes, and only become the new baseline when the
+# scan is committed. A failed backup therefore leaves the index untouched.
+
+class ChangeType(Enum):
+    ADDED = "added"
+    MODIFIED = "modified"
+    DELETED = "deleted"
+
+class FileChange:
+    __slots__ = ("change_type", "path", "size", "mtime_ns", "inode")
+
+    def __init__(self, change_type: ChangeType, path: str, size: int = 0, mtime_ns: int = 0, inode: int = 0):
+        self.change_type = change_type
+        self.path = path # Relative to the scanned root, with "/" separators
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.inode = inode
+
+    def __repr__(self):
+        return f"FileChange({self.change_type.value}, {self.path!r})"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_state (
+    job_id TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest BLOB,
+    PRIMARY KEY (job_id, dir, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS file_state_pending (
+    job_id TEXT NOT NULL,
+    dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    deleted INTEGER NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest BLOB,
+    PRIMARY KEY (job_id, dir, name)
+) WITHOUT ROWID;
+"""
+
+class FileStateIndex:
+    def __init__(self, db_path, hash_contents: bool = False):
+        self.db_path = Path(db_path)
+        # When set, files whose metadata changed are hashed and only reported
+        # as modified if their content changed too (e.g. after a plain touch)
+        self.hash_contents = hash_contents
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+
+    '''
+    Starts a scan of root for the job. Iterate the returned IndexScan for the
+    changes, then call commit() once they were backed up (or discard()).
+    '''
+    def scan(self, job_id: str, root, recursive: bool = True, matcher=None) -> "IndexScan":
+        return IndexScan(self, job_id, Path(root), recursive, matcher)
+
+    # Returns the number of files indexed for the job
+    def count(self, job_id: str) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM file_state WHERE job_id = ? AND is_dir = 0", (job_id,)).fetchone()[0]
+
+    # Forgets everything indexed for the job, forcing a full backup next time
+    def clear(self, job_id: str):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM file_state WHERE job_id = ?", (job_id,))
+            connection.execute("DELETE FROM file_state_pending WHERE job_id = ?", (job_id,))
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    # One connection per thread; WAL lets scans of different jobs overlap
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+class IndexScan:
+    def __init__(self, index: FileStateIndex, job_id: str, root: Path, recursive: bool, matcher=None):
+        self.index = index
+        self.job_id = job_id
+        self.root = root
+        self.recursive = recursive
+        self.matcher = matcher # A walker.PathMatcher; paths it rejects are treated as absent
+        self.counts = {change_type: 0 for change_type in ChangeType}
+        self.unchanged = 0
+        self._started = False
+
+    def __iter__(self):
+        if self._started:
+            raise ValueError("An IndexScan can only be iterated once.")
+        self._started = True
+        connection = self.index._connection()
+        with connection:
+            connection.execute("DELETE FROM file_state_pending WHERE job_id = ?", (self.job_id,))
+        directories = [""]
+        while directories:
+            directory = directories.pop()
+            staged = []
+            for change in self._scan_directory(connection, directory, directories, staged):
+                self.counts[change.change_type] += 1
+                yield change
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO file_state_pending VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", staged)
+
+    '''
+    Makes the staged file states the job's new baseline.
+    '''
+    def commit(self):
+        with self.index._connection() as connection:
+            connection.execute(
+                "DELETE FROM file_state WHERE (job_id, dir, name) IN "
+                "(SELECT job_id, dir, name FROM file_state_pending WHERE job_id = ? AND deleted = 1)", (self.job_id,))
+            connection.execute(
+                "INSERT OR REPLACE INTO file_state "
+                "SELECT job_id, dir, name, is_dir, size, mtime_ns, inode, digest FROM file_state_pending "
+                "WHERE job_id = ? AND deleted = 0", (self.job_id,))
+            connection.execute("DELETE FROM file_state_pending WHERE job_id = ?", (self.job_id,))
+
+    def discard(self):
+        with self.index._connection() as connection:
+            connection.execute("DELETE FROM file_state_pending WHERE job_id = ?", (self.job_id,))
+
+    # Private scanning methods
+
+    def _scan_directory(self, connection, directory, directories, staged):
+        known = {row[0]: row[1:] for row in connection.execute(
+            "SELECT name, is_dir, size, mtime_ns, inode, digest FROM file_state WHERE job_id = ? AND dir = ?",
+            (self.job_id, directory))}
+        try:
+            entries = list(os.scandir(self.root / directory))
+        except (FileNotFoundError, NotADirectoryError):
+            entries = [] # Removed while scanning; its contents are reported as deleted
+
+        for entry in entries:
+            path = f"{directory}/{entry.name}" if directory else entry.name
+            if self.matcher is not None and not self.matcher.matches(path, entry.is_dir(follow_symlinks=False)):
+                continue # Reported as deleted below if it was backed up before
+            previous = known.pop(entry.name, None)
+            if entry.is_dir(follow_symlinks=False):
+                if not self.recursive:
+                    if previous is not None:
+                        known[entry.name] = previous # Reported as deleted below
+                    continue
+                if previous is not None and not previous[0]:
+                    yield from self._delete(connection, directory, entry.name, previous, staged)
+                if previous is None or not previous[0]:
+                    staged.append((self.job_id, directory, entry.name, 0, 1, 0, 0, 0, None))
+                directories.append(path)
+            elif entry.is_file(follow_symlinks=False):
+                if previous is not None and previous[0]:
+                    yield from self._delete(connection, directory, entry.name, previous, staged)
+                    previous = None
+                change = self._compare_file(directory, entry, path, previous, staged)
+                if change is not None:
+                    yield change
+
+        for name, previous in known.items():
+            yield from self._delete(connection, directory, name, previous, staged)
+
+    def _compare_file(self, directory, entry, path, previous, staged):
+        stat = entry.stat(follow_symlinks=False)
+        if previous is not None and previous[1:4] == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            self.unchanged += 1
+            return None
+
+        digest = _file_digest(entry.path) if self.index.hash_contents else None
+        staged.append((self.job_id, directory, entry.name, 0, 0, stat.st_size, stat.st_mtime_ns, stat.st_ino, digest))
+        if previous is not None and digest is not None and digest == previous[4]:
+            self.unchanged += 1 # Only the metadata changed
+            return None
+        change_type = ChangeType.ADDED if previous is None else ChangeType.MODIFIED
+        return FileChange(change_type, path, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    # Yields deletions for a vanished entry (and everything below it if it was a directory)
+    def _delete(self, connection, directory, name, previous, staged):
+        staged.append((self.job_id, directory, name, 1, previous[0], 0, 0, 0, None))
+        path = f"{directory}/{name}" if directory else name
+        if not previous[0]:
+            yield FileChange(ChangeType.DELETED, path)
+            return
+        rows = connection.execute(
+            "SELECT dir, name, is_dir FROM file_state WHERE job_id = ? AND (dir = ? OR (dir >= ? AND dir < ?))",
+            (self.job_id, path, path + "/", path + "0")).fetchall()
+        for row_directory, row_name, is_dir in rows:
+            staged.append((self.job_id, row_directory, row_name, 1, is_dir, 0, 0, 0, None))
+            if not is_dir:
+                yield FileChange(ChangeType.DELETED, f"{row_directory}/{row_name}")
+
+def _file_digest(path) -> bytes:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.digest()
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+# Returns the index shared by handlers, stored in the abackup state directory
+def get_file_index() -> FileStateIndex:
+    global _shared_index
+    with _shared_index_lock:
+        if _shared_index is None:
+            _shared_index = FileStateIndex(state_directory() / "file-index.sqlite3")
+        return _shared_index
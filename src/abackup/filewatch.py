@@ -0,0 +1,196 @@
+import asyncio
+import ctypes
+import logging
+import os
+import platform
+import struct
+from pathlib import Path
+
+# Optional cross-platform file system notifications
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = None
+    Observer = None
+
+logger = logging.getLogger(__name__)
+
+# Watching a single file for changes from the event loop.
+#
+# Editors and configuration tools rarely rewrite a file in place: most write
+# a temporary file and rename it over the original, which replaces the inode.
+# The watchers therefore watch the file's directory and react to any event
+# naming the file. open_file_watcher() picks the best one available:
+#
+#   - InotifyFileWatcher, on Linux: the kernel's inotify API through libc, read
+#     on the event loop with add_reader(). Only completed writes, renames,
+#     creations and deletions count, so a reload never sees a half-written file.
+#     When the kernel's event queue overflows, the events it dropped may have
+#     named the file, so an overflow counts as a change.
+#   - WatchdogFileWatcher, when the watchdog package is installed (FSEvents on
+#     macOS, ReadDirectoryChangesW on Windows).
+#   - PollingFileWatcher everywhere else, or when the others cannot start (e.g.
+#     the inotify watch limit is reached): compares the file's modification
+#     time and size every poll_interval seconds.
+#
+# A watcher may report a change that did not alter the file's content; the
+# daemon's reload only applies what actually changed.
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+INOTIFY_EVENT = struct.Struct("iIII") # wd, mask, cookie, len; followed by len bytes of NUL-padded name
+INOTIFY_FILE_EVENTS = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_DIRECTORY_EVENTS = IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED
+
+_libc = None
+
+'''
+Returns a watcher for the file at path, notified by the operating system when
+possible and polling every poll_interval seconds otherwise. Must be called on
+the event loop the watcher is awaited on.
+'''
+def open_file_watcher(path, poll_interval: float):
+    path = Path(path).absolute()
+    if platform.system() == "Linux":
+        try:
+            return InotifyFileWatcher(path, poll_interval)
+        except (OSError, AttributeError) as e: # AttributeError: a libc without inotify
+            logger.warning("Cannot watch '%s' with inotify (%s); polling it instead", path, e)
+    if Observer is not None:
+        try:
+            return WatchdogFileWatcher(path)
+        except OSError as e:
+            logger.warning("Cannot watch '%s' with watchdog (%s); polling it instead", path, e)
+    return PollingFileWatcher(path, poll_interval)
+
+class PollingFileWatcher:
+    def __init__(self, path, poll_interval: float):
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self._signature = _file_signature(self.path)
+
+    # Returns once the file's modification time or size differs from the last time it returned
+    async def wait(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            signature = _file_signature(self.path)
+            if signature != self._signature:
+                self._signature = signature
+                return
+
+    def close(self):
+        pass
+
+# If the watched directory itself goes away, the kernel drops the watch and
+# this watcher falls back to polling.
+class InotifyFileWatcher:
+    def __init__(self, path, poll_interval: float):
+        global _libc
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self._name = os.fsencode(self.path.name)
+        self._changed = asyncio.Event()
+        self._fallback = None
+        self._loop = asyncio.get_running_loop()
+        if _libc is None:
+            _libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            _raise_errno()
+        try:
+            mask = INOTIFY_FILE_EVENTS | INOTIFY_DIRECTORY_EVENTS | IN_ONLYDIR
+            if _libc.inotify_add_watch(self._fd, os.fsencode(self.path.parent), mask) < 0:
+                _raise_errno()
+            self._loop.add_reader(self._fd, self._read_events)
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    # Returns once the file was written, replaced, created or deleted since the last time it returned
+    async def wait(self):
+        if self._fallback is not None:
+            await self._fallback.wait()
+            return
+        await self._changed.wait()
+        self._changed.clear()
+
+    def close(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def _read_events(self):
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+            offset = 0
+            while offset < len(data):
+                _, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + name_length].rstrip(b"\0")
+                offset += name_length
+                if mask & INOTIFY_DIRECTORY_EVENTS:
+                    self._lose_watch()
+                    return
+                if mask & IN_Q_OVERFLOW or name == self._name:
+                    self._changed.set()
+
+    def _lose_watch(self):
+        logger.warning("Lost the inotify watch on '%s'; polling it instead", self.path.parent)
+        self._fallback = PollingFileWatcher(self.path, self.poll_interval)
+        self.close()
+        self._changed.set() # Whatever happened to the directory may have changed the file
+
+class WatchdogFileWatcher:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._changed = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        target = os.path.normcase(str(self.path))
+
+        # Runs on the observer's thread
+        def on_any_event(event):
+            paths = (event.src_path, getattr(event, "dest_path", None))
+            if any(path and os.path.normcase(os.fsdecode(path)) == target for path in paths):
+                loop.call_soon_threadsafe(self._changed.set)
+
+        handler = FileSystemEventHandler()
+        handler.on_any_event = on_any_event
+        self._observer = Observer()
+        self._observer.schedule(handler, str(self.path.parent), recursive=False)
+        self._observer.start()
+
+    # Returns once the file changed since the last time it returned
+    async def wait(self):
+        await self._changed.wait()
+        self._changed.clear()
+
+    def close(self):
+        self._observer.stop()
+        self._observer.join()
+
+def _file_signature(path: Path):
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _raise_errno():
+    error = ctypes.get_errno()
+    raise OSError(error, os.strerror(error))
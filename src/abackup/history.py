@@ -0,0 +1,249 @@
+import logging
+import math
+import queue
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+from abackup.jobs import JobStatus
+from abackup.paths import state_directory
+
+logger = logging.getLogger(__name__)
+
+# Run history of backup jobs.
+#
+# Every finished run (COMPLETED or FAILED) is appended to the runs table;
+# rows are never updated. Writes go through a queue to a single writer
+# thread, which commits everything that is waiting in one transaction, so many
+# jobs finishing at once cost one commit instead of one each and never
+# contend for the write lock. Reads use their own connection per thread and
+# see a run once its batch is committed (flush() waits for that).
+#
+# Queries are served by indexes: last_runs holds the newest run of each job
+# (maintained by a trigger), runs_by_status finds recent failures, and
+# runs_by_duration answers duration percentiles without sorting.
+
+WRITE_BATCH_SIZE = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    started INTEGER NOT NULL,
+    ended INTEGER NOT NULL,
+    duration INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    bytes_read INTEGER NOT NULL,
+    bytes_written INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    exit_code INTEGER NOT NULL,
+    log_path TEXT,
+    error TEXT,
+    trace_path TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_job ON runs (job_id, started);
+CREATE INDEX IF NOT EXISTS runs_by_status ON runs (status, started);
+CREATE INDEX IF NOT EXISTS runs_by_duration ON runs (job_id, status, duration);
+CREATE TABLE IF NOT EXISTS last_runs (
+    job_id TEXT PRIMARY KEY,
+    run_id INTEGER NOT NULL,
+    started INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS runs_insert AFTER INSERT ON runs BEGIN
+    INSERT INTO last_runs VALUES (NEW.job_id, NEW.id, NEW.started)
+        ON CONFLICT (job_id) DO UPDATE SET run_id = excluded.run_id, started = excluded.started
+        WHERE excluded.started >= last_runs.started;
+END;
+"""
+
+_COLUMNS = "job_id, started, ended, status, bytes_read, bytes_written, files, exit_code, log_path, error, trace_path"
+
+# Columns added after the first release, with their definitions, for histories created before them
+_ADDED_COLUMNS = {"trace_path": "TEXT"}
+
+# One finished run of a job. Times are aware datetimes.
+class RunRecord:
+    __slots__ = ("job_id", "started", "ended", "status", "bytes_read", "bytes_written", "files", "exit_code",
+                 "log_path", "error", "trace_path")
+
+    def __init__(self, job_id: str, started: datetime, ended: datetime, status: JobStatus, bytes_read: int = 0,
+                 bytes_written: int = 0, files: int = 0, exit_code: int = 0, log_path: str | None = None,
+                 error: str | None = None, trace_path: str | None = None):
+        self.job_id = job_id
+        self.started = started
+        self.ended = ended
+        self.status = status # JobStatus.COMPLETED or JobStatus.FAILED
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.files = files
+        self.exit_code = exit_code # 0 for a completed run
+        self.log_path = log_path # Where the run's log output can be found
+        self.error = error # The failure message of a failed run
+        self.trace_path = trace_path # The run's profile trace, for jobs that are profiled (see profiling.py)
+
+    @property
+    def duration(self) -> float:
+        return (self.ended - self.started).total_seconds()
+
+    def __repr__(self):
+        return f"RunRecord({self.job_id!r}, {self.status.value}, started={self.started.isoformat()})"
+
+class RunHistory:
+    def __init__(self, db_path, batch_size: int = WRITE_BATCH_SIZE):
+        self.db_path = Path(db_path)
+        self.batch_size = batch_size
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+            existing = {row[1] for row in connection.execute("PRAGMA table_info(runs)")}
+            for column, definition in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    connection.execute(f"ALTER TABLE runs ADD COLUMN {column} {definition}")
+
+    '''
+    Appends a run. Returns immediately; the row is written by the writer
+    thread together with any other runs recorded in the meantime.
+    '''
+    def record(self, run: RunRecord):
+        if run.status not in (JobStatus.COMPLETED, JobStatus.FAILED):
+            raise ValueError(f"Only finished runs can be recorded, not {run.status}.")
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="abackup-history", daemon=True)
+                self._writer.start()
+        self._queue.put(run)
+
+    # Waits until every run recorded so far is committed
+    def flush(self):
+        self._queue.join()
+
+    # Returns the newest run of the job, or None if it never ran
+    def last_run(self, job_id: str) -> RunRecord | None:
+        row = self._connection().execute(
+            f"SELECT {_COLUMNS} FROM runs WHERE job_id = ? ORDER BY started DESC LIMIT 1", (job_id,)).fetchone()
+        return _run_record(row) if row else None
+
+    # Returns the newest run of every job that has run, by job ID
+    def last_runs(self) -> dict[str, RunRecord]:
+        rows = self._connection().execute(
+            f"SELECT {_COLUMNS} FROM runs WHERE id IN (SELECT run_id FROM last_runs)")
+        return {row[0]: _run_record(row) for row in rows}
+
+    # Returns the job's runs, newest first
+    def runs(self, job_id: str, limit: int | None = None) -> list[RunRecord]:
+        return [_run_record(row) for row in self._connection().execute(
+            f"SELECT {_COLUMNS} FROM runs WHERE job_id = ? ORDER BY started DESC LIMIT ?",
+            (job_id, -1 if limit is None else limit))]
+
+    # Returns the failed runs that started at or after `since`, newest first
+    def failures_since(self, since: datetime, job_id: str | None = None) -> list[RunRecord]:
+        query = f"SELECT {_COLUMNS} FROM runs WHERE status = ? AND started >= ?"
+        params = [JobStatus.FAILED.value, _timestamp(since)]
+        if job_id is not None:
+            query += " AND job_id = ?"
+            params.append(job_id)
+        return [_run_record(row) for row in self._connection().execute(query + " ORDER BY started DESC", params)]
+
+    '''
+    Returns {percentile: seconds} for the durations of the job's completed
+    runs (nearest-rank method), or an empty dict if it has none. Each
+    percentile is read in order from runs_by_duration; nothing is sorted.
+    '''
+    def duration_percentiles(self, job_id: str, percentiles=(50, 90, 99)) -> dict:
+        connection = self._connection()
+        status = JobStatus.COMPLETED.value
+        count = connection.execute("SELECT count(*) FROM runs WHERE job_id = ? AND status = ?",
+                                   (job_id, status)).fetchone()[0]
+        result = {}
+        if count == 0:
+            return result
+        for percentile in percentiles:
+            if not 0 < percentile <= 100:
+                raise ValueError(f"Percentiles must be in (0, 100], not {percentile}.")
+            rank = max(1, math.ceil(percentile / 100 * count))
+            row = connection.execute(
+                "SELECT duration FROM runs WHERE job_id = ? AND status = ? ORDER BY duration LIMIT 1 OFFSET ?",
+                (job_id, status, rank - 1)).fetchone()
+            result[percentile] = row[0] / 1000
+        return result
+
+    # Writes any queued runs, stops the writer and closes this thread's connection
+    def close(self):
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _write_loop(self):
+        connection = self._connection()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                # Everything that queued up during the previous commit goes into this one
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                runs = [run for run in batch if run is not None]
+                try:
+                    if runs:
+                        with connection:
+                            connection.executemany(
+                                f"INSERT INTO runs ({_COLUMNS}, duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                (_row(run) for run in runs))
+                except sqlite3.Error:
+                    logger.exception("Could not record %d run(s) in the run history", len(runs))
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+                if len(runs) < len(batch):
+                    return # Closed
+        finally:
+            connection.close()
+            self._local.connection = None
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # WAL commits are durable across crashes of the process with NORMAL
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+def _timestamp(value: datetime) -> int:
+    return round(value.timestamp() * 1000)
+
+def _datetime(value: int) -> datetime:
+    return datetime.fromtimestamp(value / 1000, timezone.utc)
+
+def _row(run: RunRecord) -> tuple:
+    started, ended = _timestamp(run.started), _timestamp(run.ended)
+    return (run.job_id, started, ended, run.status.value, run.bytes_read, run.bytes_written, run.files,
+            run.exit_code, run.log_path, run.error, run.trace_path, ended - started)
+
+def _run_record(row) -> RunRecord:
+    return RunRecord(row[0], _datetime(row[1]), _datetime(row[2]), JobStatus(row[3]), row[4], row[5], row[6],
+                     row[7], row[8], row[9], row[10])
+
+_shared_history = None
+_shared_history_lock = threading.Lock()
+
+# Returns the run history shared by the daemon and the CLI, stored in the abackup state directory
+def get_run_history() -> RunHistory:
+    global _shared_history
+    with _shared_history_lock:
+        if _shared_history is None:
+            _shared_history = RunHistory(state_directory() / "history.sqlite3")
+        return _shared_history
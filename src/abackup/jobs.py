@@ -1,6 +1,8 @@
 from enum import Enum
 from pathlib import Path
-from datetime import time, tzinfo
+from datetime import time, timedelta, tzinfo
+
+from abackup.cron import CronExpression
 
 # Job class
 
@@ -26,10 +28,12 @@ class JobStatus(Enum):
 # The BackupType enum defines the types of backup destinations supported.
 # Currently supported types are:
 #   - GOOGLEDRIVE: Backup to Google Drive
+#   - LOCAL: Snapshot to a directory on a local filesystem (destination_url is a path or file:// URL)
 #   - NULL: No backup type specified—either it is the default value at initialization or something went wrong
-# TODO: Add more backup types in the future (e.g., Local, OneDrive, FTP, S3, etc.)
+# TODO: Add more backup types in the future (e.g., OneDrive, FTP, S3, etc.)
 class BackupType(Enum):
     GOOGLEDRIVE = "Google Drive"
+    LOCAL = "Local"
     NULL = "null"
 
 # <bcbielecki> 2025-11-02 alphaV0.1
@@ -40,13 +44,51 @@ class BackupRetentionPolicy(Enum):
     KEEP_ALL = "keep_all"
     DELETE_OLDEST = "delete_old"
 
+# Codecs available for compressed backups. GZIP is always available; ZSTD and
+# LZ4 need the optional zstandard and lz4 packages.
+class CompressionCodec(Enum):
+    GZIP = "gzip"
+    ZSTD = "zstd"
+    LZ4 = "lz4"
+
+# Valid (lowest, highest) compression level of each codec
+COMPRESSION_LEVELS = {
+    CompressionCodec.GZIP: (0, 9),
+    CompressionCodec.ZSTD: (1, 22),
+    CompressionCodec.LZ4: (0, 16),
+}
+
 # <bcbielecki> 2025-11-02 alphaV0.1
 # These values are more self-explanatory, but one should expect that with each value,
 # different properties will be needed to specify the job schedule
+# INTERVAL jobs run every schedule_interval and CRON jobs whenever schedule_cron matches
 class JobRecurrence(Enum):
     DAILY = "daily"
     WEEKLY = "weekly"
     MONTHLY = "monthly"
+    INTERVAL = "interval"
+    CRON = "cron"
+
+# Shortest schedule_interval an INTERVAL job may have
+MIN_SCHEDULE_INTERVAL = timedelta(minutes=1)
+
+# What the scheduler does with runs that were due while the daemon was not running:
+#    - SKIP: Drop them and wait for the next fire time
+#    - RUN_ONCE: Run the job once to catch up, however many runs were missed
+#    - RUN_ALL: Run the job once for every missed run (bounded by schedule.MAX_MISSED_RUNS)
+class MisfirePolicy(Enum):
+    SKIP = "skip"
+    RUN_ONCE = "run once"
+    RUN_ALL = "run all"
+
+# How the runs of a job are profiled (see profiling.py):
+#    - OFF: Not at all
+#    - SPANS: Write a trace of the time spent in each stage of every run
+#    - SAMPLING: Also sample the Python stacks of the run's threads into the trace
+class ProfileMode(Enum):
+    OFF = "off"
+    SPANS = "spans"
+    SAMPLING = "sampling"
 
 # <bcbielecki> 2025-11-02 alphaV0.1
 # Days of the week for scheduling purposes—should be used in conjunction with
@@ -84,19 +126,31 @@ class BackupJob:
         # Backup source file/folder settings
         self.source_path = None # Should be a Path object
         self.recursive = True
+        self.include_patterns = [] # Glob patterns of the paths to back up; empty means everything
+        self.exclude_patterns = [] # Glob patterns of the paths to leave out (see walker.PathMatcher)
 
         # Backup destination settings
         self.compression = True
+        self.compression_codec = CompressionCodec.GZIP
+        self.compression_level = None # Should be an integer in COMPRESSION_LEVELS[compression_codec], or None for the codec default
+        self.compression_threads = None # Should be a positive integer, or None to use every CPU
+        self.chunked = False # Store deduplicated content-defined chunks instead of a plain copy
         self.BackupType = BackupType.NULL
         self.destination_url = None # Should be a URL string
         self.max_file_retention_size = None # Should be an interger in MB
         self.retention_policy = BackupRetentionPolicy.DELETE_OLDEST
+        self.bandwidth_limit = None # Should be a positive integer in bytes per second, or None for no limit
+        self.profile_mode = ProfileMode.OFF
         
         # Backup scheduling settings
         self.schedule_time = None # Should be a datetime.time object w/ timezone specified
         self.schedule_days = [] # Should be a list of JobScheduleDays enum values—meant only for JobRecurrence.WEEKLY
         self.schedule_day_of_month = None # Should be an integer between 1 and 31—meant only for JobRecurrence.MONTHLY
         self.schedule_recurrence_policy = JobRecurrence.DAILY
+        self.schedule_interval = None # Should be a timedelta—meant only for JobRecurrence.INTERVAL
+        self.schedule_cron = None # Should be a CronExpression—meant only for JobRecurrence.CRON
+        self.schedule_timezone = None # Should be a tzinfo the cron expression is evaluated in (UTC if None)
+        self.misfire_policy = MisfirePolicy.RUN_ONCE
 
         # Backup script settings (Optional)
         self.script_pre_path = None # Should be a Path object
@@ -136,10 +190,28 @@ class BackupJob:
             raise ValueError(f"Source path '{self.source_path}' does not exist.")
         if not isinstance(self.recursive, bool):
             raise ValueError("Recursive flag must be a boolean value.")
+        for patterns in (self.include_patterns, self.exclude_patterns):
+            if not isinstance(patterns, list) or not all(isinstance(pattern, str) and pattern.strip()
+                                                          for pattern in patterns):
+                raise ValueError("Include and exclude patterns must be lists of non-empty strings.")
         
         # Backup destination settings
         if not isinstance(self.compression, bool):
             raise ValueError("Compression flag must be a boolean value.")
+        if not isinstance(self.compression_codec, CompressionCodec):
+            raise ValueError(f"Invalid compression codec: {self.compression_codec}")
+        if self.compression_level is not None:
+            lowest, highest = COMPRESSION_LEVELS[self.compression_codec]
+            if (not isinstance(self.compression_level, int) or isinstance(self.compression_level, bool) or
+                not lowest <= self.compression_level <= highest):
+                raise ValueError(f"Compression level for {self.compression_codec.value} must be an integer "
+                                 f"between {lowest} and {highest}.")
+        if self.compression_threads is not None and (not isinstance(self.compression_threads, int) or
+                                                     isinstance(self.compression_threads, bool) or
+                                                     self.compression_threads < 1):
+            raise ValueError("Compression threads must be a positive integer.")
+        if not isinstance(self.chunked, bool):
+            raise ValueError("Chunked flag must be a boolean value.")
         
         if self.BackupType not in BackupType:
             raise ValueError(f"Invalid backup type: {self.BackupType}")
@@ -155,6 +227,11 @@ class BackupJob:
             
         if self.retention_policy not in BackupRetentionPolicy:
             raise ValueError(f"Invalid retention policy: {self.retention_policy}")
+        if self.bandwidth_limit is not None and (not isinstance(self.bandwidth_limit, int) or
+                                                 isinstance(self.bandwidth_limit, bool) or self.bandwidth_limit <= 0):
+            raise ValueError("Bandwidth limit must be a positive integer in bytes per second.")
+        if not isinstance(self.profile_mode, ProfileMode):
+            raise ValueError(f"Invalid profile mode: {self.profile_mode}")
 
         # Backup scheduling settings
         self._validate_schedule_time()
@@ -166,10 +243,16 @@ class BackupJob:
                 self._validate_monthly_schedule()
             elif self.schedule_recurrence_policy == JobRecurrence.DAILY:
                 self._validate_daily_schedule()
+            elif self.schedule_recurrence_policy == JobRecurrence.INTERVAL:
+                self._validate_interval_schedule()
+            elif self.schedule_recurrence_policy == JobRecurrence.CRON:
+                self._validate_cron_schedule()
             else:
                 raise ValueError(f"Recurrence policy with unimplemented validation: {self.schedule_recurrence_policy}")
         else:
             raise ValueError(f"Invalid recurrence policy: {self.schedule_recurrence_policy}")
+        if not isinstance(self.misfire_policy, MisfirePolicy):
+            raise ValueError(f"Invalid misfire policy: {self.misfire_policy}")
 
         # Backup script settings
         if self.script_pre_path is not None:
@@ -208,4 +291,16 @@ class BackupJob:
     def _validate_daily_schedule(self):
         pass  # No additional validation needed for daily recurrence
 
+    def _validate_interval_schedule(self):
+        if not isinstance(self.schedule_interval, timedelta):
+            raise ValueError("Schedule interval must be a timedelta.")
+        if self.schedule_interval < MIN_SCHEDULE_INTERVAL:
+            raise ValueError(f"Schedule interval must be at least {MIN_SCHEDULE_INTERVAL}.")
+
+    def _validate_cron_schedule(self):
+        if not isinstance(self.schedule_cron, CronExpression):
+            raise ValueError("Schedule cron must be a CronExpression.")
+        if self.schedule_timezone is not None and not isinstance(self.schedule_timezone, tzinfo):
+            raise ValueError("Schedule timezone must be a tzinfo object.")
+
 # Job Queue class
\ No newline at end of file
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+from abackup.jobs import JobStatus
+from abackup.paths import state_directory
+
+logger = logging.getLogger(__name__)
+
+# Write-ahead journal of scheduler state.
+#
+# The scheduler's job statuses and fire times only live in memory, so the
+# journal records every status transition and every fire as one JSON line,
+# appended before the transition takes effect. On startup, replaying the file
+# rebuilds each job's last status and last fire time; BackupJobScheduler.recover()
+# uses them to restart interrupted runs and catch up on missed ones. Jobs
+# enabled or disabled over the control channel are recorded too, together
+# with a digest of the definition they were switched under, so that they keep
+# that state across restarts until the schedule file changes them.
+#
+# Records are written with a single unbuffered write() to a file opened with
+# O_APPEND, so they reach the OS immediately and survive a crash of the
+# daemon; sync=True also fsyncs each record to survive a power loss. A record
+# torn by a crash is ignored on replay. Once the file holds many more records
+# than there are jobs, it is replaced atomically by one record per job, so
+# replay stays proportional to the number of jobs.
+
+COMPACT_MIN_RECORDS = 1024
+
+# The state of one job as of its last journal record
+class JournalEntry:
+    __slots__ = ("status", "last_fire", "enabled", "definition")
+
+    def __init__(self, status: JobStatus | None = None, last_fire: datetime | None = None,
+                 enabled: bool | None = None, definition: str | None = None):
+        self.status = status
+        self.last_fire = last_fire # Aware datetime of the last fire time that was run, in UTC
+        self.enabled = enabled # Set over the control channel, or None to follow the schedule file
+        self.definition = definition # Hex digest of the job's definition when enabled was set, if known
+
+    def __eq__(self, other):
+        return isinstance(other, JournalEntry) and (
+            (self.status, self.last_fire, self.enabled, self.definition) ==
+            (other.status, other.last_fire, other.enabled, other.definition))
+
+    def __repr__(self):
+        return (f"JournalEntry({self.status}, last_fire={self.last_fire}, enabled={self.enabled}, "
+                f"definition={self.definition})")
+
+class SchedulerJournal:
+    def __init__(self, path, sync: bool = False):
+        self.path = Path(path)
+        self.sync = sync
+        self.entries = {} # job_id -> JournalEntry, as replayed and updated since
+        self._records = 0
+        self._lock = threading.Lock()
+        self._replay()
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        if self._records > self._compact_threshold():
+            self.compact()
+
+    # Records a status transition
+    def record_status(self, job_id: str, status: JobStatus):
+        self._append({"job": job_id, "status": status.value})
+
+    # Records that the job's fire time arrived and it was queued to run
+    def record_fire(self, job_id: str, fire_time: datetime):
+        self._append({"job": job_id, "status": JobStatus.QUEUED.value, "fired": fire_time.timestamp()})
+
+    # Records that the job was enabled or disabled over the control channel; None clears it
+    def record_enabled(self, job_id: str, enabled: bool | None, definition: str | None = None):
+        record = {"job": job_id, "enabled": enabled}
+        if enabled is not None and definition is not None:
+            record["definition"] = definition
+        self._append(record)
+
+    # Drops a job that left the schedule
+    def forget(self, job_id: str):
+        if job_id in self.entries:
+            self._append({"job": job_id, "forget": True})
+
+    # Rewrites the journal as one record per job
+    def compact(self):
+        with self._lock:
+            temporary = self.path.with_name(self.path.name + ".tmp")
+            with open(temporary, "w", encoding="utf-8") as file:
+                for job_id, entry in self.entries.items():
+                    file.write(_encode(_entry_record(job_id, entry)))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, self.path)
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            self._records = len(self.entries)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def _append(self, record: dict):
+        with self._lock:
+            if self._fd is None:
+                raise ValueError("The scheduler journal is closed.")
+            os.write(self._fd, _encode(record).encode("utf-8"))
+            if self.sync:
+                os.fsync(self._fd)
+            self._apply(record)
+            self._records += 1
+            compact = self._records > self._compact_threshold()
+        if compact:
+            self.compact()
+
+    def _replay(self):
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            # The last record was torn by a crash; cut it off so that new records start on a fresh line
+            logger.warning("Dropping an incomplete record at the end of scheduler journal '%s'", self.path)
+            os.truncate(self.path, complete)
+        for line in data[:complete].splitlines():
+            try:
+                record = json.loads(line)
+                self._apply(record)
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Ignoring a damaged record in scheduler journal '%s'", self.path)
+                continue
+            self._records += 1
+
+    def _apply(self, record: dict):
+        job_id = record["job"]
+        if record.get("forget"):
+            self.entries.pop(job_id, None)
+            return
+        entry = self.entries.get(job_id)
+        if entry is None:
+            entry = self.entries[job_id] = JournalEntry()
+        if "status" in record:
+            entry.status = JobStatus(record["status"])
+        if "fired" in record:
+            entry.last_fire = datetime.fromtimestamp(record["fired"], timezone.utc)
+        if "enabled" in record:
+            entry.enabled = None if record["enabled"] is None else bool(record["enabled"])
+            entry.definition = record.get("definition")
+
+    def _compact_threshold(self) -> int:
+        return max(COMPACT_MIN_RECORDS, 4 * len(self.entries))
+
+def _encode(record: dict) -> str:
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+def _entry_record(job_id: str, entry: JournalEntry) -> dict:
+    record = {"job": job_id}
+    if entry.status is not None:
+        record["status"] = entry.status.value
+    if entry.last_fire is not None:
+        record["fired"] = entry.last_fire.timestamp()
+    if entry.enabled is not None:
+        record["enabled"] = entry.enabled
+        if entry.definition is not None:
+            record["definition"] = entry.definition
+    return record
+
+_shared_journal = None
+_shared_journal_lock = threading.Lock()
+
+# Returns the daemon's journal, stored in the abackup state directory
+def get_scheduler_journal() -> SchedulerJournal:
+    global _shared_journal
+    with _shared_journal_lock:
+        if _shared_journal is None:
+            _shared_journal = SchedulerJournal(state_directory() / "scheduler.journal")
+        return _shared_journal
@@ -0,0 +1,364 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Metrics in the Prometheus text exposition format.
+#
+# Modules declare their metrics once, at import time, on the shared registry
+# (get_metrics()) and keep a reference to them. Updating a metric on a hot path
+# is a dict lookup for its labels and a few arithmetic operations under an
+# uncontended lock; no string is formatted until the metrics are scraped.
+# Values that are cheaper to read than to track (job counts, queue depth,
+# rclone's own stats) are filled in by collectors, callables that the
+# registry runs on every scrape.
+#
+# The daemon serves the metrics over HTTP with MetricsServer (GET /metrics)
+# when it is given a metrics address, and always on its control socket
+# (`abackup metrics`).
+
+# Upper bounds of the default histogram buckets, in seconds: sub-second stages
+# up to runs of several hours
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0,
+                   3600.0, 14400.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# A metric and its children, one per combination of label values. A metric
+# without labels has a single child and can be updated directly.
+class _Metric:
+    type_name = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children = {} # Label values -> child
+        self._lock = threading.Lock()
+        if not self.label_names:
+            self._unlabelled = self.labels()
+
+    '''
+    Returns the child for the given label values (strings), creating it on
+    first use. Callers on hot paths can keep the child instead of looking it
+    up again.
+    '''
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"Metric '{self.name}' takes the labels {self.label_names}, got {values}.")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    # Drops the children whose label values are no longer of interest, e.g. of a removed job
+    def remove(self, *values):
+        with self._lock:
+            self._children.pop(values, None)
+
+    def samples(self):
+        with self._lock:
+            children = sorted(self._children.items(), key=lambda item: tuple(map(str, item[0])))
+        for values, child in children:
+            yield from child.samples(self.name, dict(zip(self.label_names, values)))
+
+    def _new_child(self):
+        raise NotImplementedError
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        if amount < 0:
+            raise ValueError("A counter can only increase.")
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: dict):
+        yield name + "_total", labels, self.value
+
+# Monotonically increasing total, e.g. bytes transferred
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled.inc(amount)
+
+    def _new_child(self):
+        return _CounterChild()
+
+class _GaugeChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def samples(self, name: str, labels: dict):
+        yield name, labels, self.value
+
+# Value that goes up and down, e.g. the number of queued jobs
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float):
+        self._unlabelled.set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._unlabelled.dec(amount)
+
+    # Sets the children given as {label values: value} and drops the others, for collectors
+    def set_all(self, values: dict):
+        for label_values, value in values.items():
+            self.labels(*label_values).set(value)
+        with self._lock:
+            self._children = {label_values: child for label_values, child in self._children.items()
+                              if label_values in values}
+
+    def _new_child(self):
+        return _GaugeChild()
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # The last one counts values above every bound
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    # Observes the seconds spent in a with block
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def samples(self, name: str, labels: dict):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), counts):
+            cumulative += count
+            yield name + "_bucket", {**labels, "le": bound}, cumulative
+        yield name + "_sum", labels, total
+        yield name + "_count", labels, cumulative
+
+class _Timer:
+    __slots__ = ("_histogram", "_started")
+
+    def __init__(self, histogram: _HistogramChild):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._started)
+
+# Distribution of observed values, e.g. durations, in cumulative buckets
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(sorted(float(bound) for bound in buckets))
+        if not self.bounds:
+            raise ValueError(f"Histogram '{name}' needs at least one bucket.")
+        super().__init__(name, help, labels)
+
+    def observe(self, value: float):
+        self._unlabelled.observe(value)
+
+    def time(self) -> _Timer:
+        return self._unlabelled.time()
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+# The set of metrics exported by one process
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {} # name -> _Metric
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels=()) -> Gauge:
+        return self._register(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labels, buckets=buckets)
+
+    def get(self, name: str) -> _Metric | None:
+        return self._metrics.get(name)
+
+    # Registers a callable run before every scrape to update gauges
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    '''
+    Runs the collectors and returns every metric in the Prometheus text
+    exposition format. A failing collector is logged and skipped.
+    '''
+    def render(self) -> str:
+        with self._lock:
+            collectors = list(self._collectors)
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception:
+                logger.exception("Metrics collector %r failed", collector)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    # Registering the same metric again returns the existing one, so modules can be reloaded
+    def _register(self, metric_class, name: str, help: str, labels, **args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, help, labels, **args)
+            elif type(metric) is not metric_class or metric.label_names != tuple(labels):
+                raise ValueError(f"Metric '{name}' is already registered with a different type or labels.")
+            return metric
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(_format_value(value) if name == "le" else value)}"'
+                          for name, value in labels.items()) + "}"
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+    return repr(value)
+
+# Serves a registry over HTTP at /metrics on a background thread
+class MetricsServer:
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9464):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    @property
+    def address(self) -> tuple[str, int] | None:
+        return self._server.server_address[:2] if self._server is not None else None
+
+    def start(self):
+        registry = self.registry
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("Metrics request from %s: " + format, self.address_string(), *args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="abackup-metrics", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = self._thread = None
+
+'''
+Parses a metrics address "host:port" or ":port" (localhost); a bare port
+number is also accepted. Raises ValueError for anything else.
+'''
+def parse_metrics_address(value) -> tuple[str, int]:
+    host, separator, port = str(value).strip().rpartition(":")
+    if not separator:
+        host = ""
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError(f"Invalid metrics address '{value}': expected host:port.") from None
+    if not 0 <= port <= 65535:
+        raise ValueError(f"Invalid metrics address '{value}': port must be between 0 and 65535.")
+    return host.strip("[]") or "127.0.0.1", port
+
+_shared_registry = None
+_shared_registry_lock = threading.Lock()
+
+# Returns the registry shared by the whole process
+def get_metrics() -> MetricsRegistry:
+    global _shared_registry
+    with _shared_registry_lock:
+        if _shared_registry is None:
+            _shared_registry = MetricsRegistry()
+        return _shared_registry
+
+# Shared by the stages of a backup run, timed with profiling.stage()
+STAGE_DURATION = get_metrics().histogram(
+    "abackup_stage_duration_seconds",
+    "Seconds spent in one execution of a stage of a backup run (backup, walk, compress, upload, retention, "
+    "pre_script, post_script). Stages of a streamed run overlap; backup contains the others except retention "
+    "and the scripts.",
+    ("stage",))
@@ -0,0 +1,32 @@
+import os
+from pathlib import Path
+
+# Locations of abackup's own files.
+#
+# Persistent state (file indexes, catalogs, run history, ...) lives in the
+# state directory: $ABACKUP_STATE_DIR if set, otherwise $XDG_STATE_HOME/abackup
+# (~/.local/state/abackup).
+#
+# Runtime files such as the daemon's control socket live in the runtime
+# directory: $ABACKUP_RUNTIME_DIR if set, otherwise $XDG_RUNTIME_DIR/abackup,
+# falling back to the state directory.
+
+def state_directory() -> Path:
+    directory = os.environ.get("ABACKUP_STATE_DIR")
+    if directory is None:
+        xdg_state_home = os.environ.get("XDG_STATE_HOME") or Path.home() / ".local" / "state"
+        directory = Path(xdg_state_home) / "abackup"
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+def runtime_directory() -> Path:
+    directory = os.environ.get("ABACKUP_RUNTIME_DIR")
+    if directory is None:
+        xdg_runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+        if not xdg_runtime_dir:
+            return state_directory()
+        directory = Path(xdg_runtime_dir) / "abackup"
+    directory = Path(directory)
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return directory
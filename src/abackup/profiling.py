@@ -0,0 +1,270 @@
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from abackup.jobs import BackupJob, ProfileMode
+from abackup.metrics import STAGE_DURATION
+from abackup.paths import state_directory
+
+logger = logging.getLogger(__name__)
+
+# Per-run profiling of backup jobs.
+#
+# The stages of a run (walk, compress, upload, retention, the pre/post
+# scripts) are wrapped in stage(), which always feeds the stage duration
+# metric and, while the run has a Trace, also records the stage as a span.
+# A job whose profile setting is "spans" or "sampling" gets a Trace for each
+# run; "sampling" also samples the Python stacks of the run's threads every
+# few milliseconds. The trace is written as a Chrome trace file (open it in
+# https://ui.perfetto.dev or chrome://tracing) whose path is recorded with the
+# run in the run history. Samples are merged into nested spans per thread, so
+# the sampled stacks show as a flame chart under the stage spans.
+#
+# The active Trace is held in a context variable, so it follows the run's own
+# thread; threads the run hands work to pick it up through bind(). When no
+# job is being profiled, stage() costs one context variable lookup on top of
+# the metric and bind() returns the function unchanged.
+
+# Seconds between two samples of the stacks of a profiled run
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+# Events kept per trace; later events are dropped and counted, so that a long
+# run with sampling does not grow its trace without bound
+MAX_TRACE_EVENTS = 500_000
+
+# Trace files kept per job; older ones are deleted when a new one is written
+TRACES_KEPT_PER_JOB = 10
+
+_STAGES_PID = 1 # Chrome trace "process" holding the stage spans
+_SAMPLES_PID = 2 # and the one holding the sampled stacks
+
+_current_trace = contextvars.ContextVar("abackup_trace", default=None)
+
+# The spans and samples of one profiled run
+class Trace:
+    def __init__(self, job_id: str, sample_interval: float | None = None):
+        self.job_id = job_id
+        self.sample_interval = sample_interval # None: spans only
+        self.path = None # Where the trace was written
+        self.dropped = 0 # Events over MAX_TRACE_EVENTS
+        self._origin = time.perf_counter()
+        self._events = []
+        self._threads = {} # ident -> number of activations, the threads sampled
+        self._thread_names = {}
+        self._stacks = {} # ident -> [(code, start)] of the last sample, root first
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+
+    # Records a span of the current thread between two time.perf_counter() readings
+    def add_span(self, name: str, started: float, ended: float, category: str = "stage", **args):
+        thread = threading.current_thread()
+        with self._lock:
+            self._thread_names.setdefault(thread.ident, thread.name)
+            self._add_event(_STAGES_PID, thread.ident, name, category, started, ended, args)
+
+    @contextmanager
+    def span(self, name: str, category: str = "stage", **args):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, started, time.perf_counter(), category, **args)
+
+    '''
+    Makes this the current thread's trace for the duration of the block and,
+    when sampling, samples the thread while it is in the block.
+    '''
+    @contextmanager
+    def activate(self):
+        ident = threading.get_ident()
+        token = _current_trace.set(self)
+        with self._lock:
+            self._threads[ident] = self._threads.get(ident, 0) + 1
+            self._thread_names[ident] = threading.current_thread().name # Idents of finished threads are reused
+        try:
+            yield self
+        finally:
+            with self._lock:
+                count = self._threads.pop(ident) - 1
+                if count:
+                    self._threads[ident] = count
+            _current_trace.reset(token)
+
+    def start_sampling(self):
+        if self.sample_interval is None or self._sampler is not None:
+            return
+        self._sampler = threading.Thread(target=self._sample_loop, name="abackup-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop_sampling(self):
+        if self._sampler is None:
+            return
+        self._stop_sampling.set()
+        self._sampler.join()
+        self._sampler = None
+        now = time.perf_counter()
+        with self._lock:
+            for ident in list(self._stacks):
+                self._close_frames(ident, 0, now)
+
+    # Returns the trace in the Chrome trace event format
+    def to_chrome_trace(self) -> dict:
+        with self._lock:
+            events = list(self._events)
+            thread_names = dict(self._thread_names)
+        metadata = [
+            {"name": "process_name", "ph": "M", "pid": _STAGES_PID, "args": {"name": f"{self.job_id} stages"}},
+            {"name": "process_name", "ph": "M", "pid": _SAMPLES_PID, "args": {"name": f"{self.job_id} samples"}},
+        ]
+        for pid in (_STAGES_PID, _SAMPLES_PID):
+            metadata += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": ident, "args": {"name": name}}
+                         for ident, name in thread_names.items()]
+        return {
+            "traceEvents": metadata + events,
+            "displayTimeUnit": "ms",
+            "otherData": {"job_id": self.job_id, "sample_interval": self.sample_interval,
+                          "dropped_events": self.dropped},
+        }
+
+    def write(self, path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name("." + path.name + ".tmp")
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(self.to_chrome_trace(), file, separators=(",", ":"))
+        os.replace(temporary, path)
+        self.path = path
+
+    def _add_event(self, pid: int, tid: int, name: str, category: str, started: float, ended: float, args=None):
+        if len(self._events) >= MAX_TRACE_EVENTS:
+            self.dropped += 1
+            return
+        event = {"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                 "ts": round((started - self._origin) * 1e6, 1), "dur": round((ended - started) * 1e6, 1)}
+        if args:
+            event["args"] = args
+        self._events.append(event)
+
+    def _sample_loop(self):
+        while not self._stop_sampling.wait(self.sample_interval):
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            with self._lock:
+                for ident in set(self._threads) | set(self._stacks):
+                    self._sample(ident, frames.get(ident) if ident in self._threads else None, now)
+
+    # Keeps the frames shared with the previous sample of the thread open and
+    # closes the others as spans
+    def _sample(self, ident: int, frame, now: float):
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        stack = self._stacks.setdefault(ident, [])
+        common = 0
+        while common < len(stack) and common < len(codes) and stack[common][0] is codes[common]:
+            common += 1
+        self._close_frames(ident, common, now)
+        stack.extend((code, now) for code in codes[common:])
+        if not stack:
+            del self._stacks[ident]
+
+    def _close_frames(self, ident: int, keep: int, now: float):
+        stack = self._stacks.get(ident, [])
+        while len(stack) > keep:
+            code, started = stack.pop()
+            self._add_event(_SAMPLES_PID, ident, f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                                                 f"{code.co_firstlineno})", "sample", started, now)
+
+# Returns the trace of the run the current thread works for, or None
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+# Times a stage of a backup run: feeds the stage duration metric and records a span in the current trace
+def stage(name: str) -> "_Stage":
+    return _Stage(name)
+
+class _Stage:
+    __slots__ = ("name", "_trace", "_started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self._trace = _current_trace.get()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_stage(self.name, self._started, time.perf_counter(), self._trace)
+
+'''
+Records a stage that was timed by hand, e.g. one that started on another
+thread. trace defaults to the current thread's.
+'''
+def record_stage(name: str, started: float, ended: float, trace: Trace | None = None):
+    STAGE_DURATION.labels(name).observe(ended - started)
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, started, ended)
+
+'''
+Returns a callable that runs function in the current trace, for handing work
+to other threads (thread targets, thread pool tasks). Without a current trace
+the function is returned unchanged.
+'''
+def bind(function):
+    trace = _current_trace.get()
+    if trace is None:
+        return function
+    def run(*args, **kwargs):
+        with trace.activate():
+            return function(*args, **kwargs)
+    return run
+
+'''
+Profiles one run of the job according to its profile setting. Yields the
+Trace, or None if the job is not profiled; once the block exits the trace is
+written to trace_directory and its path is in Trace.path. A trace that
+cannot be written is logged and left without a path.
+'''
+@contextmanager
+def profile_run(job: BackupJob, trace_directory=None):
+    if job.profile_mode == ProfileMode.OFF:
+        yield None
+        return
+    sample_interval = SAMPLE_INTERVAL_SECONDS if job.profile_mode == ProfileMode.SAMPLING else None
+    trace = Trace(job.job_id, sample_interval)
+    started = datetime.now(timezone.utc)
+    try:
+        with trace.activate():
+            trace.start_sampling()
+            try:
+                with trace.span("run", "run"):
+                    yield trace
+            finally:
+                trace.stop_sampling()
+    finally:
+        directory = Path(trace_directory) if trace_directory is not None else state_directory() / "traces"
+        try:
+            trace.write(directory / f"{job.job_id}-{started:%Y%m%dT%H%M%S%fZ}.trace.json")
+            _delete_old_traces(directory, job.job_id)
+        except OSError:
+            logger.exception("Could not write the profile trace of job '%s'", job.job_id)
+
+def _delete_old_traces(directory: Path, job_id: str):
+    # Names sort chronologically; matching the whole timestamp keeps "nightly" apart from "nightly-2"
+    pattern = re.compile(re.escape(job_id) + r"-\d{8}T\d{12}Z\.trace\.json")
+    traces = sorted(entry.name for entry in os.scandir(directory) if pattern.fullmatch(entry.name))
+    for name in traces[:-TRACES_KEPT_PER_JOB]:
+        (directory / name).unlink(missing_ok=True)
@@ -0,0 +1,258 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from abackup.jobs import BackupJob, BackupRetentionPolicy
+from abackup.paths import state_directory
+
+logger = logging.getLogger(__name__)
+
+# Retention of backup artifacts (archives, snapshot directories).
+#
+# The catalog records every artifact of every job with its size and creation
+# time, and keeps each job's running total in job_totals (maintained by
+# triggers, so it can never drift from the rows). Enforcing a size limit is
+# then a walk over the job's oldest artifacts through an index, stopping as
+# soon as enough space is freed, followed by one batched delete on the
+# destination; the destination is never listed for it. Because artifacts can
+# also be removed or added behind abackup's back, each job is periodically
+# reconciled against a listing of its destination.
+
+RECONCILE_INTERVAL_SECONDS = 7 * 24 * 60 * 60
+
+MB = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    job_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (job_id, path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS artifacts_by_age ON artifacts (job_id, created, path);
+CREATE TABLE IF NOT EXISTS job_totals (
+    job_id TEXT PRIMARY KEY,
+    total_size INTEGER NOT NULL DEFAULT 0,
+    artifact_count INTEGER NOT NULL DEFAULT 0,
+    reconciled INTEGER
+);
+CREATE TRIGGER IF NOT EXISTS artifacts_insert AFTER INSERT ON artifacts BEGIN
+    INSERT INTO job_totals (job_id) VALUES (NEW.job_id) ON CONFLICT (job_id) DO NOTHING;
+    UPDATE job_totals SET total_size = total_size + NEW.size, artifact_count = artifact_count + 1
+        WHERE job_id = NEW.job_id;
+END;
+CREATE TRIGGER IF NOT EXISTS artifacts_delete AFTER DELETE ON artifacts BEGIN
+    UPDATE job_totals SET total_size = total_size - OLD.size, artifact_count = artifact_count - 1
+        WHERE job_id = OLD.job_id;
+END;
+CREATE TRIGGER IF NOT EXISTS artifacts_update AFTER UPDATE OF size ON artifacts BEGIN
+    UPDATE job_totals SET total_size = total_size - OLD.size + NEW.size WHERE job_id = NEW.job_id;
+END;
+"""
+
+# Raised when retention prevents a run (KEEP_ALL with a full destination)
+class RetentionError(Exception):
+    pass
+
+# One backup artifact. `path` is relative to the job's destination.
+class Artifact:
+    __slots__ = ("path", "size", "created")
+
+    def __init__(self, path: str, size: int, created: datetime):
+        self.path = path
+        self.size = size
+        self.created = created # Aware datetime
+
+    def __eq__(self, other):
+        return isinstance(other, Artifact) and (self.path, self.size, self.created) == \
+            (other.path, other.size, other.created)
+
+    def __repr__(self):
+        return f"Artifact({self.path!r}, size={self.size})"
+
+'''
+Returns the creation time encoded in an artifact name written for the job
+("<job_id>-<UTC timestamp>" plus an optional suffix such as ".tar.gz"), or
+None if the name does not belong to the job or is still being written.
+'''
+def artifact_created(job_id: str, name: str) -> datetime | None:
+    # Names written before microseconds were added end the timestamp at the seconds
+    match = re.fullmatch(re.escape(job_id) + r"-(\d{8}T\d{6})(\d{6})?Z((?:\.\w+)*)", name)
+    if match is None or match.group(3).endswith(".partial"):
+        return None
+    created = datetime.strptime(match.group(1), "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc)
+    return created.replace(microsecond=int(match.group(2) or 0))
+
+class RetentionCatalog:
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(_SCHEMA)
+
+    def record(self, job_id: str, artifact: Artifact):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO artifacts VALUES (?, ?, ?, ?) ON CONFLICT (job_id, path) DO UPDATE SET size = excluded.size",
+                (job_id, artifact.path, _timestamp(artifact.created), artifact.size))
+
+    def remove(self, job_id: str, paths):
+        with self._connection() as connection:
+            connection.executemany("DELETE FROM artifacts WHERE job_id = ? AND path = ?",
+                                   ((job_id, path) for path in paths))
+
+    def total_size(self, job_id: str) -> int:
+        row = self._connection().execute("SELECT total_size FROM job_totals WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else 0
+
+    def artifact_count(self, job_id: str) -> int:
+        row = self._connection().execute("SELECT artifact_count FROM job_totals WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else 0
+
+    # Returns the job's artifacts, oldest first
+    def artifacts(self, job_id: str) -> list[Artifact]:
+        return [_artifact(row) for row in self._connection().execute(
+            "SELECT path, size, created FROM artifacts WHERE job_id = ? ORDER BY created, path", (job_id,))]
+
+    '''
+    Returns the oldest artifacts that have to go for the job's total to fit in
+    limit bytes. Only as many rows as are returned are read. The newest `keep`
+    artifacts are never returned, even if the limit is still exceeded.
+    '''
+    def oldest_to_delete(self, job_id: str, limit: int, keep: int = 1) -> list[Artifact]:
+        row = self._connection().execute(
+            "SELECT total_size, artifact_count FROM job_totals WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return []
+        excess, deletable = row[0] - limit, row[1] - keep
+        selected = []
+        if excess <= 0 or deletable <= 0:
+            return selected
+        cursor = self._connection().execute(
+            "SELECT path, size, created FROM artifacts WHERE job_id = ? ORDER BY created, path LIMIT ?",
+            (job_id, deletable))
+        for row in cursor:
+            selected.append(_artifact(row))
+            excess -= row[1]
+            if excess <= 0:
+                break
+        cursor.close()
+        return selected
+
+    def needs_reconciliation(self, job_id: str, interval: float = RECONCILE_INTERVAL_SECONDS,
+                             now: float | None = None) -> bool:
+        row = self._connection().execute("SELECT reconciled FROM job_totals WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None or row[0] is None:
+            return True
+        return (time.time() if now is None else now) - row[0] >= interval
+
+    '''
+    Makes the job's catalog match `listed`, the artifacts actually found on
+    its destination. Returns the (added, removed) artifact paths.
+    '''
+    def reconcile(self, job_id: str, listed, now: float | None = None) -> tuple[list, list]:
+        listed = {artifact.path: artifact for artifact in listed}
+        with self._connection() as connection:
+            known = {row[0]: row[1] for row in connection.execute(
+                "SELECT path, size FROM artifacts WHERE job_id = ?", (job_id,))}
+            removed = sorted(set(known) - set(listed))
+            added = sorted(path for path, artifact in listed.items() if known.get(path) != artifact.size)
+            connection.executemany("DELETE FROM artifacts WHERE job_id = ? AND path = ?",
+                                   ((job_id, path) for path in removed))
+            connection.executemany(
+                "INSERT INTO artifacts VALUES (?, ?, ?, ?) ON CONFLICT (job_id, path) DO UPDATE SET size = excluded.size",
+                ((job_id, path, _timestamp(listed[path].created), listed[path].size) for path in added))
+            connection.execute("INSERT INTO job_totals (job_id) VALUES (?) ON CONFLICT (job_id) DO NOTHING", (job_id,))
+            connection.execute("UPDATE job_totals SET reconciled = ? WHERE job_id = ?",
+                               (int(time.time() if now is None else now), job_id))
+        return added, removed
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+# Applies a job's retention policy around its runs. `handler` is the job's
+# BackupHandler; it provides list_artifacts() and delete_artifacts().
+class RetentionManager:
+    def __init__(self, catalog: RetentionCatalog, reconcile_interval: float = RECONCILE_INTERVAL_SECONDS):
+        self.catalog = catalog
+        self.reconcile_interval = reconcile_interval
+
+    '''
+    Called before a run. Reconciles the catalog when it is due and, for
+    KEEP_ALL jobs, raises RetentionError if the destination is already full.
+    '''
+    def before_backup(self, job: BackupJob, handler):
+        if self.catalog.needs_reconciliation(job.job_id, self.reconcile_interval):
+            self.reconcile(job, handler)
+        limit = _limit_bytes(job)
+        if limit is not None and job.retention_policy == BackupRetentionPolicy.KEEP_ALL:
+            total = self.catalog.total_size(job.job_id)
+            if total >= limit:
+                raise RetentionError(f"Job '{job.job_id}' keeps all backups and already uses {total // MB} MB of its "
+                                     f"{job.max_file_retention_size} MB limit.")
+
+    '''
+    Called after a successful run that wrote `artifact`. Records it and, for
+    DELETE_OLDEST jobs over their limit, deletes the oldest artifacts (never
+    the new one). Returns the deleted artifacts.
+    '''
+    def after_backup(self, job: BackupJob, handler, artifact: Artifact) -> list[Artifact]:
+        self.catalog.record(job.job_id, artifact)
+        limit = _limit_bytes(job)
+        if limit is None or job.retention_policy != BackupRetentionPolicy.DELETE_OLDEST:
+            return []
+        expired = self.catalog.oldest_to_delete(job.job_id, limit)
+        if expired:
+            handler.delete_artifacts(job, [expired_artifact.path for expired_artifact in expired])
+            self.catalog.remove(job.job_id, [expired_artifact.path for expired_artifact in expired])
+            logger.info("Deleted %d old backup(s) of job '%s' to stay under %d MB", len(expired), job.job_id,
+                        job.max_file_retention_size)
+        return expired
+
+    # Repairs drift between the catalog and the job's destination
+    def reconcile(self, job: BackupJob, handler):
+        listed = handler.list_artifacts(job)
+        if listed is None:
+            return # The handler's storage mode has no per-run artifacts
+        added, removed = self.catalog.reconcile(job.job_id, listed)
+        if added or removed:
+            logger.info("Reconciled job '%s' with its destination: %d artifact(s) found, %d missing",
+                        job.job_id, len(added), len(removed))
+
+def _limit_bytes(job: BackupJob) -> int | None:
+    if job.max_file_retention_size is None:
+        return None
+    return job.max_file_retention_size * MB
+
+def _timestamp(created: datetime) -> int:
+    return int(created.timestamp())
+
+def _artifact(row) -> Artifact:
+    return Artifact(row[0], row[1], datetime.fromtimestamp(row[2], timezone.utc))
+
+_shared_catalog = None
+_shared_catalog_lock = threading.Lock()
+
+# Returns the catalog shared by handlers, stored in the abackup state directory
+def get_retention_catalog() -> RetentionCatalog:
+    global _shared_catalog
+    with _shared_catalog_lock:
+        if _shared_catalog is None:
+            _shared_catalog = RetentionCatalog(state_directory() / "retention.sqlite3")
+        return _shared_catalog
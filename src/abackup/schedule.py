@@ -1,94 +1,1306 @@
-from abackup.jobs import BackupJob, JobStatus, JobRecurrence
-from datetime import datetime
+from abackup.jobs import (BackupJob, BackupType, BackupRetentionPolicy, CompressionCodec, JobStatus, JobRecurrence,
+                          JobScheduleDays, MisfirePolicy, ProfileMode)
+from abackup.cron import CronExpression
+from abackup.journal import SchedulerJournal
+from abackup.throttle import parse_bandwidth
+from collections import deque
+from datetime import date, datetime, time, timedelta, timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import calendar
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import os
+import re
+import struct
+import yaml
 
 
-class BackupJobPool(set):
+# The job pool is keyed by job ID, so lookup, membership, removal and
+# replacement are all constant time. Secondary indexes map each JobStatus,
+# BackupType and JobRecurrence value to the jobs that currently have it.
+# BackupJob is a dumb object and cannot notify the pool when it changes, so
+# indexed fields must be updated through set_status() or followed by reindex().
+class BackupJobPool:
     def __init__(self):
-        super().__init__()
-        self.__job_pool_by_id = set()
+        self.__jobs_by_id = {}
+        self.__jobs_by_status = {}
+        self.__jobs_by_backup_type = {}
+        self.__jobs_by_recurrence = {}
+        self.__index_keys = {} # job_id -> (status, BackupType, recurrence) it is indexed under
 
-    def add(self, o: BackupJob):
+    def add(self, o: BackupJob, validate: bool = True):
         if not isinstance(o, BackupJob):
             raise ValueError("Only BackupJob instances can be added to the job pool.")
-        if o in self.job_pool:
-            return ValueError("Job with id '{job.job_id}' already exists in the scheduler.")
-        o.validate() # Will raise ValueError if invalid
-        
-        self.__job_pool_by_id.add(o.job_id)
-        super().add(o)
-    
-    def __contains__(self, o: BackupJob):
-        return isinstance(o, BackupJob) and o.job_id in self.__job_pool_by_id
-    
+        if o.job_id in self.__jobs_by_id:
+            raise ValueError(f"Job with id '{o.job_id}' already exists in the scheduler.")
+        if validate:
+            o.validate() # Will raise ValueError if invalid
+
+        self.__jobs_by_id[o.job_id] = o
+        self.__index(o)
+
+    '''
+    Swaps in a new definition for a job that is already in the pool.
+    Returns the job instance that was replaced.
+    '''
+    def replace(self, o: BackupJob, validate: bool = True) -> BackupJob:
+        if not isinstance(o, BackupJob):
+            raise ValueError("Only BackupJob instances can be added to the job pool.")
+        old_job = self.__jobs_by_id.get(o.job_id)
+        if old_job is None:
+            raise ValueError(f"Job with id '{o.job_id}' does not exist in the scheduler.")
+        if validate:
+            o.validate() # Will raise ValueError if invalid
+
+        self.__unindex(o.job_id)
+        self.__jobs_by_id[o.job_id] = o
+        self.__index(o)
+        return old_job
+
+    # Accepts either a BackupJob or a job ID
+    def __contains__(self, o):
+        if isinstance(o, BackupJob):
+            o = o.job_id
+        return o in self.__jobs_by_id
+
+    def __iter__(self):
+        return iter(list(self.__jobs_by_id.values()))
+
+    def __len__(self):
+        return len(self.__jobs_by_id)
+
     def get_by_id(self, job_id: str) -> BackupJob | None:
-        for job in self:
-            if job.job_id == job_id:
-                return job
-        return None
-    
-    def remove_by_id(self, job_id: str):
-        job_to_remove = self.get_by_id(job_id)
-        if job_to_remove:
-            super().remove(job_to_remove)
-            self.__job_pool_by_id.remove(job_id)
+        return self.__jobs_by_id.get(job_id)
+
+    '''
+    Removes a job by its ID. Returns True if the job was found and removed.
+    '''
+    def remove_by_id(self, job_id: str) -> bool:
+        if self.__jobs_by_id.pop(job_id, None) is None:
+            return False
+        self.__unindex(job_id)
+        return True
+
+    '''
+    Sets a job's status and moves it to the matching status index.
+    '''
+    def set_status(self, job_id: str, status: JobStatus):
+        job = self.__jobs_by_id.get(job_id)
+        if job is None:
+            raise ValueError(f"Job with id '{job_id}' does not exist in the scheduler.")
+        job.status = status
+        self.reindex(job)
+
+    '''
+    Refreshes the secondary indexes after a job's status, BackupType or
+    recurrence policy was changed directly on the BackupJob instance.
+    '''
+    def reindex(self, o: BackupJob):
+        if self.__jobs_by_id.get(o.job_id) is not o:
+            raise ValueError(f"Job with id '{o.job_id}' does not exist in the scheduler.")
+        if self.__index_keys[o.job_id] != self.__index_key(o):
+            self.__unindex(o.job_id)
+            self.__index(o)
 
+    def get_by_status(self, status: JobStatus) -> list[BackupJob]:
+        return list(self.__jobs_by_status.get(status, {}).values())
 
+    def get_by_backup_type(self, backup_type: BackupType) -> list[BackupJob]:
+        return list(self.__jobs_by_backup_type.get(backup_type, {}).values())
+
+    def get_by_recurrence(self, recurrence: JobRecurrence) -> list[BackupJob]:
+        return list(self.__jobs_by_recurrence.get(recurrence, {}).values())
+
+    def count_by_status(self, status: JobStatus) -> int:
+        return len(self.__jobs_by_status.get(status, ()))
+
+    # Private index maintenance methods
+
+    @staticmethod
+    def __index_key(o: BackupJob):
+        return (o.status, o.BackupType, o.schedule_recurrence_policy)
+
+    def __index(self, o: BackupJob):
+        key = self.__index_key(o)
+        self.__index_keys[o.job_id] = key
+        for index, value in zip(self.__indexes(), key):
+            index.setdefault(value, {})[o.job_id] = o
+
+    def __unindex(self, job_id: str):
+        key = self.__index_keys.pop(job_id)
+        for index, value in zip(self.__indexes(), key):
+            bucket = index[value]
+            del bucket[job_id]
+            if not bucket:
+                del index[value]
+
+    def __indexes(self):
+        return (self.__jobs_by_status, self.__jobs_by_backup_type, self.__jobs_by_recurrence)
+
+
+# Result of reloading a schedule file: the jobs whose definitions appeared,
+# changed or disappeared since the previous reload. BackupJobScheduler can apply
+# it in place with apply_schedule_diff().
+class ScheduleDiff:
+    def __init__(self):
+        self.added = {} # job_id -> BackupJob
+        self.changed = {} # job_id -> BackupJob
+        self.removed = set() # job_ids
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+    def __repr__(self):
+        return (f"ScheduleDiff(added={sorted(self.added)}, changed={sorted(self.changed)}, "
+                f"removed={sorted(self.removed)})")
+
+
+# Day letters accepted in the compact `days: MWF` form. R and U follow the
+# common convention for Thursday and Sunday.
+SCHEDULE_DAY_LETTERS = {
+    "M": JobScheduleDays.MONDAY,
+    "T": JobScheduleDays.TUESDAY,
+    "W": JobScheduleDays.WEDNESDAY,
+    "R": JobScheduleDays.THURSDAY,
+    "F": JobScheduleDays.FRIDAY,
+    "S": JobScheduleDays.SATURDAY,
+    "U": JobScheduleDays.SUNDAY,
+}
+
+SIZE_UNITS_IN_MB = {"MB": 1, "GB": 1024, "TB": 1024 * 1024}
+
+_JOB_KEY_PATTERN = re.compile(r"""^("[^"]*"|'[^']*'|[^\s#][^#]*?)\s*:(?:\s|$)""")
+
+# Parses a schedule YAML file of the form documented in docs/requirements.md:
+#
+#   version: 0.0
+#   jobs:
+#       backup-job-1:
+#           location: /usr/home/myfiles
+#           ...
+#
+# The file is read line by line and split into one source block per job, so a
+# reload never materializes the whole document. Each block is hashed; reload()
+# only parses and validates the blocks whose hash changed since the last reload.
+#
+# load() additionally keeps a compiled cache of the validated job table next to
+# the YAML file (see write_cache()). The cache is keyed by the file's mtime,
+# size and content hash, and lets a daemon start without re-parsing YAML or
+# re-validating (and stat'ing) every job.
 class BackupJobScheduleFileParser:
     def __init__(self, filepath):
-        self.filepath = filepath
+        self.filepath = Path(filepath)
+        self._job_table = {} # job_id -> (digest of its source block, parsed job data) at the last reload
+
+    @property
+    def cache_path(self) -> Path:
+        return self.filepath.with_name(self.filepath.name + ".cache")
+
+    '''
+    Parses and validates every job in the file. Does not affect reload() state.
+    '''
+    def parse(self) -> list[BackupJob]:
+        return [self._parse_block(job_id, block)[0] for job_id, block in self.iter_job_blocks()]
+
+    '''
+    Re-reads the file and returns a ScheduleDiff of the jobs that were added,
+    changed or removed since the previous reload(). Unchanged jobs are neither
+    parsed nor validated again. Raises ValueError (and keeps the previous
+    state) if any changed job is invalid.
+    '''
+    def reload(self) -> ScheduleDiff:
+        diff = ScheduleDiff()
+        job_table = {}
+        for job_id, block in self.iter_job_blocks():
+            if job_id in job_table:
+                raise ValueError(f"Job ID '{job_id}' is defined more than once in '{self.filepath}'.")
+            digest = hashlib.blake2b(block.encode("utf-8"), digest_size=16).digest()
+
+            previous = self._job_table.get(job_id)
+            if previous is not None and previous[0] == digest:
+                job_table[job_id] = previous
+                continue
+            job, job_data = self._parse_block(job_id, block)
+            job_table[job_id] = (digest, job_data)
+            if previous is None:
+                diff.added[job_id] = job
+            else:
+                diff.changed[job_id] = job
+
+        diff.removed = set(self._job_table) - set(job_table)
+        self._job_table = job_table
+        return diff
+
+    # Returns a digest of the job's source block as of the last reload, or None if the file does not define it
+    def definition_digest(self, job_id) -> bytes | None:
+        entry = self._job_table.get(job_id)
+        return None if entry is None else bytes(entry[0])
+
+    '''
+    Loads the schedule, preferring the compiled cache when it is still fresh.
+    Jobs restored from the cache are not re-validated. Falls back to reload()
+    and rewrites the cache when the cache is missing or stale.
+    '''
+    def load(self, use_cache: bool = True) -> ScheduleDiff:
+        if use_cache:
+            job_table = self.read_cache()
+            if job_table is not None:
+                return self._apply_job_table(job_table)
+        diff = self.reload()
+        if use_cache:
+            self.write_cache()
+        return diff
+
+    '''
+    Writes the current job table to cache_path. Returns False if the table
+    cannot be cached (e.g. it holds values JSON cannot represent).
+    '''
+    def write_cache(self) -> bool:
+        stat = self.filepath.stat()
+        content_hash = self._file_content_hash()
+
+        records = []
+        for job_id, (digest, job_data) in self._job_table.items():
+            try:
+                encoded_data = json.dumps(job_data, separators=(",", ":")).encode("utf-8")
+            except (TypeError, ValueError):
+                return False
+            encoded_id = job_id.encode("utf-8")
+            records.append(CACHE_RECORD_HEADER.pack(len(encoded_id), len(encoded_data)))
+            records += (encoded_id, digest, encoded_data)
+
+        header = CACHE_HEADER.pack(CACHE_MAGIC, CACHE_FORMAT_VERSION, stat.st_mtime_ns, stat.st_size,
+                                   content_hash, len(self._job_table))
+        temp_path = self.cache_path.with_name(self.cache_path.name + ".tmp")
+        with open(temp_path, "wb") as file:
+            file.write(header)
+            file.writelines(records)
+        os.replace(temp_path, self.cache_path)
+        return True
+
+    '''
+    Memory-maps cache_path and returns its job table, or None if the cache is
+    missing, corrupt, from another format version or stale.
+    '''
+    def read_cache(self):
+        try:
+            stat = self.filepath.stat()
+            with open(self.cache_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                (magic, version, mtime_ns, size, content_hash,
+                 job_count) = CACHE_HEADER.unpack_from(view, 0)
+                if magic != CACHE_MAGIC or version != CACHE_FORMAT_VERSION or size != stat.st_size:
+                    return None
+                if mtime_ns != stat.st_mtime_ns and content_hash != self._file_content_hash():
+                    return None # The file was touched and its content changed
+
+                job_table = {}
+                offset = CACHE_HEADER.size
+                for _ in range(job_count):
+                    id_length, data_length = CACHE_RECORD_HEADER.unpack_from(view, offset)
+                    offset += CACHE_RECORD_HEADER.size
+                    job_id = view[offset:offset + id_length].decode("utf-8")
+                    offset += id_length
+                    digest = view[offset:offset + CACHE_DIGEST_SIZE]
+                    offset += CACHE_DIGEST_SIZE
+                    job_table[job_id] = (digest, json.loads(view[offset:offset + data_length]))
+                    offset += data_length
+                return job_table
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def _file_content_hash(self) -> bytes:
+        content_hash = hashlib.sha256()
+        with open(self.filepath, "rb") as file:
+            while chunk := file.read(1 << 20):
+                content_hash.update(chunk)
+        return content_hash.digest()
+
+    def _apply_job_table(self, job_table) -> ScheduleDiff:
+        diff = ScheduleDiff()
+        for job_id, (digest, job_data) in job_table.items():
+            previous = self._job_table.get(job_id)
+            if previous is not None and previous[0] == digest:
+                continue
+            try:
+                job = self.parse_job(job_id, job_data)
+            except ValueError as e:
+                raise ValueError(f"Invalid definition for job '{job_id}' in '{self.cache_path}': {e}") from e
+            if previous is None:
+                diff.added[job_id] = job
+            else:
+                diff.changed[job_id] = job
+        diff.removed = set(self._job_table) - set(job_table)
+        self._job_table = job_table
+        return diff
+
+    '''
+    Streams (job_id, block) pairs from the file, where block is the dedented
+    YAML text defining that single job.
+    '''
+    def iter_job_blocks(self):
+        in_jobs_section = False
+        job_indent = None
+        job_id = None
+        block_lines = []
+
+        with open(self.filepath, "r", encoding="utf-8") as file:
+            for line_number, line in enumerate(file, start=1):
+                stripped = line.strip()
+                if not in_jobs_section:
+                    if line.startswith("jobs:"):
+                        if line[len("jobs:"):].split("#", 1)[0].strip():
+                            raise ValueError(f"{self.filepath}:{line_number}: the jobs mapping must use block style.")
+                        in_jobs_section = True
+                    continue
+
+                if stripped == "" or stripped.startswith("#"):
+                    if job_id is not None:
+                        block_lines.append(line)
+                    continue
+
+                indent = len(line) - len(line.lstrip(" "))
+                if indent == 0:
+                    break # Next top-level key ends the jobs section
+                if job_indent is None:
+                    job_indent = indent
+
+                if indent == job_indent:
+                    if job_id is not None:
+                        yield job_id, _dedent_block(block_lines, job_indent)
+                    job_id = _parse_job_key(line[indent:], self.filepath, line_number)
+                    block_lines = [line]
+                elif indent > job_indent:
+                    block_lines.append(line)
+                else:
+                    raise ValueError(f"{self.filepath}:{line_number}: inconsistent indentation in jobs section.")
+
+        if job_id is not None:
+            yield job_id, _dedent_block(block_lines, job_indent)
+
+    '''
+    Builds a BackupJob from the mapping that defines it in the schedule file.
+    The job is not validated.
+    '''
+    def parse_job(self, job_id, job_data) -> BackupJob:
+        if not isinstance(job_data, dict):
+            raise ValueError("Job definition must be a mapping.")
+        job_data = dict(job_data)
+        schedule = _pop_mapping(job_data, "schedule")
+        scripts = _pop_mapping(job_data, "scripts")
+
+        job = BackupJob(job_id)
+        job.status = JobStatus.SCHEDULED if job_data.pop("enabled", True) else JobStatus.DISABLED
+        if "location" in job_data:
+            job.source_path = Path(str(job_data.pop("location"))).expanduser()
+        job.recursive = job_data.pop("recursive", job.recursive)
+        if "include" in job_data:
+            job.include_patterns = _parse_patterns(job_data.pop("include"))
+        if "exclude" in job_data:
+            job.exclude_patterns = _parse_patterns(job_data.pop("exclude"))
+        if "compression" in job_data:
+            _parse_compression(job, job_data.pop("compression"))
+        job.chunked = job_data.pop("chunked", job.chunked)
+        if "type" in job_data:
+            job.BackupType = _parse_enum(BackupType, job_data.pop("type"), "backup type")
+        job.destination_url = job_data.pop("destination", job.destination_url)
+        if "max-retention-size" in job_data:
+            job.max_file_retention_size = _parse_size_mb(job_data.pop("max-retention-size"))
+        if "retention-policy" in job_data:
+            job.retention_policy = _parse_enum(BackupRetentionPolicy, job_data.pop("retention-policy"), "retention policy")
+        if "bandwidth" in job_data:
+            job.bandwidth_limit = parse_bandwidth(job_data.pop("bandwidth"))
+        if "profile" in job_data:
+            job.profile_mode = _parse_profile(job_data.pop("profile"))
+
+        _check_recurrence_keys(schedule)
+        if "interval" in schedule:
+            job.schedule_interval = _parse_interval(schedule.pop("interval"))
+            job.schedule_recurrence_policy = JobRecurrence.INTERVAL
+        if "cron" in schedule:
+            job.schedule_cron = CronExpression(schedule.pop("cron"))
+            job.schedule_recurrence_policy = JobRecurrence.CRON
+            if "timezone" in schedule:
+                job.schedule_timezone = _parse_timezone(schedule.pop("timezone"))
+        if "time" in schedule:
+            job.schedule_time = _parse_time(schedule.pop("time"), schedule.pop("timezone", None))
+        if "days" in schedule:
+            job.schedule_days = _parse_days(schedule.pop("days"))
+            job.schedule_recurrence_policy = JobRecurrence.WEEKLY
+        if "day-of-month" in schedule:
+            job.schedule_day_of_month = schedule.pop("day-of-month")
+            job.schedule_recurrence_policy = JobRecurrence.MONTHLY
+        if "recurrence" in schedule:
+            job.schedule_recurrence_policy = _parse_enum(JobRecurrence, schedule.pop("recurrence"), "recurrence policy")
+        if "misfire" in schedule:
+            job.misfire_policy = _parse_enum(MisfirePolicy, schedule.pop("misfire"), "misfire policy")
+
+        if "pre" in scripts:
+            job.script_pre_path = Path(str(scripts.pop("pre"))).expanduser()
+        if "post" in scripts:
+            job.script_post_path = Path(str(scripts.pop("post"))).expanduser()
+
+        unknown_keys = sorted(str(key) for key in [*job_data, *schedule, *scripts])
+        if unknown_keys:
+            raise ValueError(f"Unknown job settings: {', '.join(unknown_keys)}")
+        return job
+
+    def _parse_block(self, job_id, block):
+        try:
+            job_data = yaml.safe_load(block)[job_id]
+            job = self.parse_job(job_id, job_data)
+            job.validate() # Will raise ValueError if invalid
+        except (ValueError, yaml.YAMLError) as e:
+            raise ValueError(f"Invalid definition for job '{job_id}' in '{self.filepath}': {e}") from e
+        return job, job_data
+
+# Compiled schedule cache layout (little-endian):
+#   header: magic, format version, YAML mtime_ns, YAML size, YAML sha256, job count
+#   records: id length, data length, job ID (UTF-8), block digest, job data (JSON)
+# Bump CACHE_FORMAT_VERSION whenever the layout or the meaning of job data changes.
+CACHE_MAGIC = b"ABSC"
+CACHE_FORMAT_VERSION = 2
+CACHE_HEADER = struct.Struct("<4sHqq32sI")
+CACHE_RECORD_HEADER = struct.Struct("<HI")
+CACHE_DIGEST_SIZE = 16
+
+# Private schedule file helpers
+
+def _parse_job_key(text, filepath, line_number) -> str:
+    match = _JOB_KEY_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"{filepath}:{line_number}: expected a job ID followed by ':'.")
+    key = match.group(1)
+    if key[0] in "\"'":
+        key = key[1:-1]
+    return key
 
-    def parse(self) -> list(BackupJob):
-        # Logic to parse the YAML file and return a list of BackupJob instances
-        pass
-    
-    def parse_job(self, job_data) -> BackupJob:
-        # Logic to parse individual job data and return a BackupJob instance
-        pass
+def _dedent_block(lines, indent) -> str:
+    while lines and not lines[-1].strip():
+        lines.pop()
+    return "".join(line[indent:] if line[:indent].isspace() else line.lstrip(" ") for line in lines)
+
+def _pop_mapping(job_data, key) -> dict:
+    value = job_data.pop(key, None) or {}
+    if not isinstance(value, dict):
+        raise ValueError(f"'{key}' must be a mapping.")
+    return dict(value)
+
+# Keys of the schedule mapping that each set the job's recurrence
+_RECURRENCE_KEYS = {
+    "interval": JobRecurrence.INTERVAL,
+    "cron": JobRecurrence.CRON,
+    "days": JobRecurrence.WEEKLY,
+    "day-of-month": JobRecurrence.MONTHLY,
+}
+
+# Rejects schedules that name more than one recurrence, or a time for a
+# recurrence that does not use one, instead of letting one setting win
+def _check_recurrence_keys(schedule: dict):
+    keys = [key for key in _RECURRENCE_KEYS if key in schedule]
+    if len(keys) > 1:
+        raise ValueError(f"Conflicting schedule settings: {', '.join(keys)}. A job has one recurrence.")
+    if keys and keys[0] in ("interval", "cron") and "time" in schedule:
+        raise ValueError(f"Schedule setting 'time' does not apply to {keys[0]} schedules.")
+    if keys and "recurrence" in schedule:
+        recurrence = _parse_enum(JobRecurrence, schedule["recurrence"], "recurrence policy")
+        if recurrence != _RECURRENCE_KEYS[keys[0]]:
+            raise ValueError(f"Recurrence '{recurrence.value}' conflicts with schedule setting '{keys[0]}'.")
+
+def _parse_enum(enum_class, value, description):
+    for member in enum_class:
+        if str(value).lower() in (member.value.lower(), member.name.lower()):
+            return member
+    raise ValueError(f"Invalid {description}: {value}")
+
+# profile: true/false (YAML also reads on/off as booleans) or a ProfileMode value
+def _parse_profile(value) -> ProfileMode:
+    if isinstance(value, bool):
+        return ProfileMode.SPANS if value else ProfileMode.OFF
+    return _parse_enum(ProfileMode, value, "profile mode")
+
+# compression: true/false, a codec name, or a mapping of codec/level/threads
+def _parse_compression(job, value):
+    if isinstance(value, bool):
+        job.compression = value
+        return
+    if isinstance(value, str):
+        value = {"codec": value}
+    if not isinstance(value, dict):
+        raise ValueError("Compression must be true, false, a codec name or a mapping.")
+    settings = dict(value)
+    job.compression = settings.pop("enabled", True)
+    if "codec" in settings:
+        job.compression_codec = _parse_enum(CompressionCodec, settings.pop("codec"), "compression codec")
+    job.compression_level = settings.pop("level", job.compression_level)
+    job.compression_threads = settings.pop("threads", job.compression_threads)
+    if settings:
+        raise ValueError(f"Unknown compression settings: {', '.join(sorted(str(key) for key in settings))}")
+
+def _parse_timezone(timezone_name) -> ZoneInfo:
+    try:
+        return ZoneInfo(str(timezone_name))
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"Unknown timezone: {timezone_name}") from e
+
+def _parse_time(value, timezone_name) -> time:
+    if timezone_name is None:
+        raise ValueError("Schedule time requires a timezone.")
+    tz = _parse_timezone(timezone_name)
+
+    # YAML 1.1 reads unquoted 2:30 as the base-60 integer 150
+    if isinstance(value, int) and not isinstance(value, bool):
+        hours, minutes = divmod(value, 60)
+        seconds = 0
+    else:
+        parts = str(value).split(":")
+        if len(parts) not in (2, 3) or not all(part.isdigit() for part in parts):
+            raise ValueError(f"Invalid schedule time: {value}")
+        hours, minutes, seconds = (int(part) for part in parts + ["0"] * (3 - len(parts)))
+    if not (0 <= hours < 24 and 0 <= minutes < 60 and 0 <= seconds < 60):
+        raise ValueError(f"Invalid schedule time: {value}")
+    return time(hours, minutes, seconds, tzinfo=tz)
+
+# interval: a number of minutes, or amounts with units such as 15m, 1h30m or 1d
+def _parse_interval(value) -> timedelta:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return timedelta(minutes=value)
+    text = str(value).strip().lower()
+    if not re.fullmatch(r"(\d+\s*[smhd]\s*)+", text):
+        raise ValueError(f"Invalid schedule interval: {value}")
+    units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+    interval = timedelta()
+    for amount, unit in re.findall(r"(\d+)\s*([smhd])", text):
+        interval += timedelta(**{units[unit]: int(amount)})
+    return interval
+
+# include/exclude: one glob pattern or a list of them
+def _parse_patterns(value) -> list[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list):
+        raise ValueError("Include and exclude patterns must be a pattern or a list of patterns.")
+    return [str(pattern) for pattern in value]
+
+def _parse_days(value) -> list[JobScheduleDays]:
+    if isinstance(value, str) and value and all(letter in SCHEDULE_DAY_LETTERS for letter in value):
+        return [SCHEDULE_DAY_LETTERS[letter] for letter in value]
+    if isinstance(value, str):
+        value = [value]
+    days = []
+    for day in value:
+        name = str(day).upper()
+        matches = [member for member in JobScheduleDays if len(name) >= 3 and member.name.startswith(name)]
+        if len(matches) != 1:
+            raise ValueError(f"Invalid schedule day: {day}")
+        days.append(matches[0])
+    return days
+
+def _parse_size_mb(value) -> int:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    match = re.fullmatch(r"\s*(\d+)\s*([KMGT]?B)?\s*", str(value).upper())
+    if match is None or match.group(2) == "KB":
+        raise ValueError(f"Invalid size: {value}")
+    return int(match.group(1)) * SIZE_UNITS_IN_MB[match.group(2) or "MB"]
+
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Most runs MisfirePolicy.RUN_ALL makes up for after downtime; older ones are dropped
+MAX_MISSED_RUNS = 100
+
+# Recurrence engine
+#
+# A job fires at its schedule_time (a wall-clock time with a tzinfo) on each of
+# its days: every day (DAILY), the listed weekdays (WEEKLY) or the day of the
+# month (MONTHLY). A day of the month past the end of a shorter month is
+# clamped to its last day, so a job pinned to the 31st still runs in
+# February. Wall times are resolved to UTC instants through the job's tzinfo
+# and every comparison is made in UTC, which settles DST transitions:
+#   - A wall time skipped by a spring-forward transition (02:30) fires
+#     shifted forward by the length of the gap (03:30), as PEP 495 maps it.
+#   - A wall time that occurs twice on a fall-back day (01:30) fires once, at
+#     its first occurrence.
+# INTERVAL jobs fire at every multiple of their interval since the Unix epoch,
+# so an hourly job runs on the hour and a 15 minute one at :00, :15, :30 and
+# :45 (UTC); the next fire time is one division away. CRON jobs fire at each
+# wall-clock minute their CronExpression matches in schedule_timezone, with
+# DST handled as above.
+# Jobs with the same schedule fire at the same times, so the batched functions
+# below evaluate each distinct schedule once, however many jobs share it.
+
+'''
+Returns the first fire time (in UTC) of the job strictly after `after`, or
+None if the job has no usable schedule.
+'''
+def next_fire_time(job: BackupJob, after: datetime) -> datetime | None:
+    fire_times = next_fire_times(job, after, 1)
+    return fire_times[0] if fire_times else None
+
+'''
+Returns the first n fire times (in UTC, in order) of the job strictly after
+`after`, or an empty list if the job has no usable schedule.
+'''
+def next_fire_times(job: BackupJob, after: datetime, n: int) -> list[datetime]:
+    key = _schedule_key(job)
+    if key is None:
+        return []
+    return list(itertools.islice(_fire_times(key, after), n))
+
+'''
+Returns {job_id: next fire time in UTC, or None} for many jobs at once.
+'''
+def next_fire_time_batch(jobs, after: datetime) -> dict[str, datetime | None]:
+    by_schedule = {}
+    result = {}
+    for job in jobs:
+        key = _schedule_key(job)
+        if key not in by_schedule:
+            by_schedule[key] = None if key is None else next(_fire_times(key, after), None)
+        result[job.job_id] = by_schedule[key]
+    return result
+
+'''
+Returns (fire time in UTC, job) for every fire of the jobs after `after` and
+up to `until`, in chronological order (jobs firing together by job ID).
+'''
+def fire_times_between(jobs, after: datetime, until: datetime) -> list[tuple[datetime, BackupJob]]:
+    _require_aware(until)
+    until = until.astimezone(timezone.utc)
+    by_schedule = {}
+    for job in jobs:
+        key = _schedule_key(job)
+        if key is not None:
+            by_schedule.setdefault(key, []).append(job)
+    result = []
+    for key, schedule_jobs in by_schedule.items():
+        for fire_time in _fire_times(key, after):
+            if fire_time > until:
+                break
+            result.extend((fire_time, job) for job in schedule_jobs)
+    result.sort(key=lambda item: (item[0], item[1].job_id))
+    return result
+
+'''
+Returns the fire times of the job after last_fire and up to now (in UTC,
+oldest first) that its misfire policy says should still be run.
+'''
+def missed_fire_times(job: BackupJob, last_fire: datetime, now: datetime) -> list[datetime]:
+    key = _schedule_key(job)
+    if key is None or job.misfire_policy == MisfirePolicy.SKIP:
+        return []
+    _require_aware(now)
+    now = now.astimezone(timezone.utc)
+    missed = deque(maxlen=1 if job.misfire_policy == MisfirePolicy.RUN_ONCE else MAX_MISSED_RUNS)
+    for fire_time in _fire_times(key, last_fire):
+        if fire_time > now:
+            break
+        missed.append(fire_time)
+    return list(missed)
+
+'''
+Returns {job_id: offset} spreading jobs that share a trigger across `window`.
+With expected_duration (a callable returning a job's typical run time in
+seconds, or None if unknown) the jobs are packed longest first, each
+starting when the ones before it are expected to finish, compressed to fit
+the window; jobs without history count as the average of the others.
+Without any durations, each job gets a deterministic jitter derived from
+its job ID. A job alone on its trigger is not moved.
+'''
+def smoothing_offsets(jobs, window: timedelta, expected_duration=None) -> dict[str, timedelta]:
+    if len(jobs) < 2:
+        return {job.job_id: timedelta(0) for job in jobs}
+    durations = {job.job_id: expected_duration(job.job_id) if expected_duration else None for job in jobs}
+    known = [duration for duration in durations.values() if duration]
+    if not known:
+        return {job.job_id: window * _jitter_fraction(job.job_id) for job in jobs}
+    average = sum(known) / len(known)
+    durations = {job_id: duration or average for job_id, duration in durations.items()}
+    scale = min(1.0, window.total_seconds() / sum(durations.values()))
+    offsets = {}
+    elapsed = 0.0
+    for job in sorted(jobs, key=lambda job: (-durations[job.job_id], job.job_id)):
+        offsets[job.job_id] = timedelta(seconds=elapsed * scale)
+        elapsed += durations[job.job_id]
+    return offsets
+
+'''
+Parses a smoothing window written like a schedule interval, e.g. 30m or
+1h30m. Raises ValueError unless it is longer than zero.
+'''
+def parse_smoothing_window(value) -> timedelta:
+    try:
+        window = _parse_interval(value)
+    except ValueError:
+        raise ValueError(f"Invalid smoothing window '{value}': expected a duration such as 30m or 1h.") from None
+    if window <= timedelta(0):
+        raise ValueError(f"Invalid smoothing window '{value}': it must be longer than zero.")
+    return window
+
+# A stable fraction in [0, 1) derived from the job ID
+def _jitter_fraction(job_id: str) -> float:
+    digest = hashlib.blake2b(job_id.encode("utf-8"), digest_size=8, person=b"abackup-jitter").digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+# Returns what determines a job's fire times, or None if it never fires:
+# (recurrence, tzinfo, wall time, rule) where the rule is the weekdays, the day
+# of month, the interval or the cron expression
+def _schedule_key(job: BackupJob) -> tuple | None:
+    match job.schedule_recurrence_policy:
+        case JobRecurrence.INTERVAL:
+            if job.schedule_interval is None:
+                return None
+            return (JobRecurrence.INTERVAL, timezone.utc, None, job.schedule_interval)
+        case JobRecurrence.CRON:
+            if job.schedule_cron is None:
+                return None
+            return (JobRecurrence.CRON, job.schedule_timezone or timezone.utc, None, job.schedule_cron)
+        case JobRecurrence.DAILY:
+            rule = None
+        case JobRecurrence.WEEKLY:
+            rule = frozenset(day.value for day in job.schedule_days)
+            if not rule:
+                return None
+        case JobRecurrence.MONTHLY:
+            rule = job.schedule_day_of_month
+            if rule is None:
+                return None
+        case _: # Wildcard for default case
+            raise ValueError(f"Invalid job recurrence policy: {job.schedule_recurrence_policy}")
+    if job.schedule_time is None:
+        return None
+    return (job.schedule_recurrence_policy, job.schedule_time.tzinfo, job.schedule_time.replace(tzinfo=None), rule)
+
+# Yields the fire times of a schedule strictly after `after`, in UTC, forever
+def _fire_times(key: tuple, after: datetime):
+    _require_aware(after)
+    recurrence, tz, wall_time, rule = key
+    after = after.astimezone(timezone.utc)
+    if recurrence == JobRecurrence.INTERVAL:
+        fire_time = UNIX_EPOCH + ((after - UNIX_EPOCH) // rule + 1) * rule
+        while True:
+            yield fire_time
+            fire_time += rule
+    if recurrence == JobRecurrence.CRON:
+        yield from _cron_fire_times(rule, tz, after)
+        return
+    for day in _schedule_days(recurrence, rule, after.astimezone(tz).date()):
+        # fold=0 gives the first occurrence of an ambiguous time and shifts a skipped one forward
+        fire_time = datetime.combine(day, wall_time, tzinfo=tz).astimezone(timezone.utc)
+        if fire_time > after:
+            yield fire_time
+
+def _cron_fire_times(cron: CronExpression, tz, after: datetime):
+    # Whole minutes after `after`, on the wall clock of tz
+    local = after.astimezone(tz).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+    while True:
+        local = cron.next_time(local)
+        if local is None:
+            return
+        fire_time = local.replace(tzinfo=tz).astimezone(timezone.utc)
+        # Wall times shifted by a DST transition can map to instants already passed
+        if fire_time > after:
+            yield fire_time
+            after = fire_time
+        local += timedelta(minutes=1)
+
+# Yields the local dates a schedule fires on, from `start` onwards
+def _schedule_days(recurrence: JobRecurrence, rule, start: date):
+    if recurrence == JobRecurrence.MONTHLY:
+        day_of_month = rule
+        year, month = start.year, start.month
+        while True:
+            day = date(year, month, min(day_of_month, calendar.monthrange(year, month)[1]))
+            if day >= start:
+                yield day
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    day = start
+    while True:
+        if rule is None or day.weekday() in rule:
+            yield day
+        day += timedelta(days=1)
+
+def _require_aware(date_time: datetime):
+    if date_time.tzinfo is None or date_time.utcoffset() is None:
+        raise ValueError("Scheduler date_time must be timezone-aware.")
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
 
 # Schedule class
 
 # Holds a job pool and hands jobs to core for execution when
-# their scheduled time arrives
+# their scheduled time arrives.
+#
+# Instead of scanning the whole pool on every tick, the scheduler keeps each
+# job's next fire time (as an absolute UTC datetime) in a min-heap. Finding the
+# due jobs costs O(k log n) for k due jobs, and the head of the heap tells the
+# daemon exactly how long it may sleep. Heap entries are invalidated lazily: an
+# entry is live only while it matches the job's entry in _next_fire_times.
+#
+# With a smoothing_window, jobs that share a trigger (e.g. everything at 02:00)
+# are spread across the window by smoothing_offsets() instead of all firing
+# at once; each fire happens at its nominal time plus the job's offset, capped
+# at half the gap to the following nominal time so that runs keep their order.
+# Jobs are kept grouped by trigger, and only the groups a job joins or leaves
+# are replanned when the pool changes. Expected durations are cached per job
+# until its next run finishes.
+#
+# With a SchedulerJournal, every fire and status transition is journaled so
+# that recover() can restart interrupted runs and catch up on missed ones
+# after the daemon restarts. Jobs with catch-up runs left are due immediately
+# until they have all run.
+#
+# run_now() and set_job_enabled() serve the daemon's control channel. A job
+# enabled or disabled there keeps that state until its definition in the
+# schedule file changes. The journal keeps that state across restarts; with
+# definition_digest, recover() drops it for jobs whose definition changed
+# while the daemon was down.
 class BackupJobScheduler:
-    def __init__(self):
+    def __init__(self, journal: SchedulerJournal | None = None, smoothing_window: timedelta | None = None,
+                 expected_duration=None, definition_digest=None):
         self.job_pool = BackupJobPool()
+        self.journal = journal
+        self.smoothing_window = smoothing_window
+        self.expected_duration = expected_duration # Optional callable(job_id) -> seconds or None, for smoothing
+        self.definition_digest = definition_digest # Optional callable(job_id) -> bytes identifying its definition
+        self._fire_heap = [] # (fire time in UTC, job_id)
+        self._next_fire_times = {} # job_id -> fire time in UTC
+        self._catch_up = {} # job_id -> deque of missed fire times in UTC still to run
+        self._offsets = {} # job_id -> smoothing offset
+        self._smoothing_groups = {} # _schedule_key() -> set of the job_ids of enabled jobs sharing that trigger
+        self._group_keys = {} # job_id -> its key in _smoothing_groups
+        self._durations = {} # job_id -> cached expected_duration()
+        self._nominal_fire_times = {} # job_id -> unsmoothed time of the scheduled fire
+        self._last_nominal_fire_times = {} # job_id -> unsmoothed time of the last fire
+        self._disable_after_run = set() # job_ids disabled while QUEUED or RUNNING
+        self._queued_fire_times = {} # job_id -> fire time in UTC of the run handed out by get_ready_jobs()
 
     '''
-    Adds a BackupJob to the scheduler's job pool after validating it.
-    May return ValueError if the job is invalid or already exists.
+    Adds a BackupJob to the scheduler's job pool after validating it and
+    schedules its first fire time after date_time (defaults to now).
+    May raise ValueError if the job is invalid or already exists.
     '''
-    def add_job(self, job):
+    def add_job(self, job, date_time: datetime | None = None):
         # Jobs are validated in the BackupJobPool.add() method
         self.job_pool.add(job)
-    
+        date_time = date_time or _utc_now()
+        self._schedule_next_fires([job] + self._replan_smoothing(self._regroup(job.job_id)), date_time)
+
     '''
     Removes a BackupJob from the scheduler's job pool by its job ID.
-    May return True if the job was found and removed, False otherwise.
+    Returns True if the job was found and removed, False otherwise.
+    '''
+    def remove_job_by_id(self, job_id, date_time: datetime | None = None) -> bool:
+        if not self._forget_job(job_id):
+            return False
+        self._schedule_next_fires(self._replan_smoothing(self._regroup(job_id)), date_time or _utc_now())
+        self._compact_fire_heap()
+        return True
+
+    '''
+    Sets the status of a job in the pool and journals the transition.
+    Returns False if the job is not in the pool.
+    '''
+    def set_job_status(self, job_id, status: JobStatus) -> bool:
+        if job_id not in self.job_pool:
+            return False
+        if self.journal is not None:
+            self.journal.record_status(job_id, status)
+        self.job_pool.set_status(job_id, status)
+        return True
+
+    '''
+    Restores the scheduler's state from its journal after a restart. Call it
+    once, after the schedule has been loaded. Jobs enabled or disabled over the
+    control channel get that state back unless their definition changed. Runs
+    that were QUEUED or RUNNING when the daemon stopped are run again, and runs
+    that fell due while it was down are made up according to each job's
+    misfire policy. Returns the number of runs that are now due.
+    '''
+    def recover(self, date_time: datetime | None = None) -> int:
+        if self.journal is None:
+            return 0
+        date_time = date_time or _utc_now()
+        _require_aware(date_time)
+        now = date_time.astimezone(timezone.utc)
+        recovered = 0
+        enabled = []
+        regrouped = set()
+        for job_id, entry in list(self.journal.entries.items()):
+            job = self.job_pool.get_by_id(job_id)
+            if job is None:
+                self.journal.forget(job_id) # Removed from the schedule while the daemon was down
+                continue
+            if entry.enabled is not None:
+                if entry.definition != self._definition(job_id):
+                    self.journal.record_enabled(job_id, None) # Changed while the daemon was down
+                elif entry.enabled and job.status == JobStatus.DISABLED:
+                    self.job_pool.set_status(job_id, JobStatus.SCHEDULED)
+                    enabled.append(job)
+                    regrouped |= self._regroup(job_id)
+                elif not entry.enabled and job.status != JobStatus.DISABLED:
+                    self._disable(job)
+                    regrouped |= self._regroup(job_id)
+            if job.status != JobStatus.SCHEDULED or entry.last_fire is None:
+                continue
+            runs = deque()
+            if entry.status in (JobStatus.QUEUED, JobStatus.RUNNING):
+                runs.append(entry.last_fire) # Interrupted; the run did not happen
+            runs.extend(missed_fire_times(job, entry.last_fire, now))
+            if runs:
+                self._catch_up[job_id] = runs
+                self._schedule_next_fire(job, now)
+                recovered += len(runs)
+        self._schedule_next_fires(enabled + self._replan_smoothing(regrouped), now)
+        self._compact_fire_heap()
+        return recovered
+
+    '''
+    Applies a ScheduleDiff from BackupJobScheduleFileParser.reload() in place.
+    Jobs in the diff were validated by the parser. Changed jobs that are
+    currently QUEUED or RUNNING keep that status so the run is not lost.
     '''
-    def remove_job_by_id(self, job_id) -> bool:
-        return self.job_pool.remove_by_id(job_id)
+    def apply_schedule_diff(self, diff, date_time: datetime | None = None):
+        date_time = date_time or _utc_now()
+        to_schedule = []
+        regrouped = set()
+        for job_id in diff.removed:
+            if self._forget_job(job_id):
+                regrouped |= self._regroup(job_id)
+        for job in diff.changed.values():
+            self._disable_after_run.discard(job.job_id)
+            self._journal_enabled(job.job_id, None) # The new definition decides
+            old_job = self.job_pool.get_by_id(job.job_id)
+            if old_job is None:
+                self.job_pool.add(job, validate=False)
+            else:
+                if old_job.status in (JobStatus.QUEUED, JobStatus.RUNNING) and job.status != JobStatus.DISABLED:
+                    job.status = old_job.status
+                self.job_pool.replace(job, validate=False)
+            if job.status in (JobStatus.QUEUED, JobStatus.RUNNING):
+                self._next_fire_times.pop(job.job_id, None)
+            else:
+                to_schedule.append(job)
+            regrouped |= self._regroup(job.job_id)
+        for job in diff.added.values():
+            self.job_pool.add(job, validate=False)
+            to_schedule.append(job)
+            regrouped |= self._regroup(job.job_id)
+        scheduled = {job.job_id for job in to_schedule}
+        moved = [job for job in self._replan_smoothing(regrouped) if job.job_id not in scheduled]
+        self._schedule_next_fires(to_schedule + moved, date_time)
+        self._compact_fire_heap()
 
     '''
     Returns a list of BackupJob instances that are ready to be executed
-    at the given date_time.
+    at the given date_time and marks them QUEUED. Ready jobs leave the heap
+    until job_finished() is called for them; jobs that are due but not
+    SCHEDULED (e.g. DISABLED) skip this occurrence and are rescheduled.
     '''
-    def get_ready_jobs(self, date_time: datetime) -> list(BackupJob):
+    def get_ready_jobs(self, date_time: datetime) -> list[BackupJob]:
+        _require_aware(date_time)
+        now = date_time.astimezone(timezone.utc)
         ready_jobs = []
-        for job in self.job_pool:
+        while self._fire_heap and self._fire_heap[0][0] <= now:
+            fire_time, job_id = heapq.heappop(self._fire_heap)
+            if self._next_fire_times.get(job_id) != fire_time:
+                continue # Stale entry left behind by a removal or reschedule
+            del self._next_fire_times[job_id]
+            job = self.job_pool.get_by_id(job_id)
+            nominal_fire_time = self._nominal_fire_times.pop(job_id, None)
+            if nominal_fire_time is not None:
+                self._last_nominal_fire_times[job_id] = nominal_fire_time
             if job.status == JobStatus.SCHEDULED:
-                match job.schedule_recurrence_policy:
-                    case JobRecurrence.DAILY:
-                        if job.schedule_time >= date_time.time():
-                            ready_jobs.append(job)
-                    case JobRecurrence.WEEKLY:
-                        if (job.schedule_time >= date_time.time() and
-                            date_time.weekday() in (day.value for day in job.schedule_days)):
-                            ready_jobs.append(job)
-                    case JobRecurrence.MONTHLY:
-                        if (job.schedule_time >= date_time.time() and
-                            job.schedule_day_of_month >= date_time.day):
-                            ready_jobs.append(job)
-                    case _: # Wildcard for default case
-                        ValueError(f"Invalid job recurrence policy: {job.schedule_recurrence_policy}")
+                if self.journal is not None:
+                    self.journal.record_fire(job_id, self._pop_catch_up(job_id) or fire_time)
+                else:
+                    self._pop_catch_up(job_id)
+                self.job_pool.set_status(job_id, JobStatus.QUEUED)
+                self._queued_fire_times[job_id] = fire_time
+                ready_jobs.append(job)
+            else:
+                self._catch_up.pop(job_id, None)
+                self._schedule_next_fire(job, date_time)
         return ready_jobs
 
+    '''
+    Returns a job that has finished running back to SCHEDULED and pushes its
+    next fire time after date_time (defaults to now) onto the heap.
+    Returns False if the job is not in the pool.
+    '''
+    def job_finished(self, job_id, date_time: datetime | None = None) -> bool:
+        job = self.job_pool.get_by_id(job_id)
+        if job is None:
+            return False
+        self._queued_fire_times.pop(job_id, None)
+        self._durations.pop(job_id, None) # The run changes the job's expected duration
+        date_time = date_time or _utc_now()
+        if job_id in self._disable_after_run:
+            self._disable_after_run.discard(job_id)
+            self.set_job_status(job_id, JobStatus.DISABLED)
+            self._schedule_next_fires(self._replan_smoothing(self._regroup(job_id)), date_time)
+            return True
+        if job.status in (JobStatus.QUEUED, JobStatus.RUNNING, JobStatus.COMPLETED, JobStatus.FAILED):
+            self.set_job_status(job_id, JobStatus.SCHEDULED)
+        self._schedule_next_fire(job, date_time)
+        return True
+
+    '''
+    Makes a SCHEDULED job due at date_time (defaults to now), so that the next
+    get_ready_jobs() call returns it. Its scheduled fire times are not
+    skipped. Raises ValueError if the job does not exist or is not SCHEDULED.
+    '''
+    def run_now(self, job_id, date_time: datetime | None = None):
+        job = self._get_job(job_id)
+        if job.status != JobStatus.SCHEDULED:
+            raise ValueError(f"Job '{job_id}' is {job.status.value}.")
+        now = (date_time or _utc_now()).astimezone(timezone.utc)
+        # Not a scheduled fire, so it must not count as the last nominal fire when smoothing
+        self._nominal_fire_times.pop(job_id, None)
+        self._next_fire_times[job_id] = now
+        heapq.heappush(self._fire_heap, (now, job_id))
+
+    '''
+    Enables or disables a job. A disabled job stays in the pool but never
+    fires; a QUEUED or RUNNING job is disabled once its run finishes. Returns
+    False if the job already was in the requested state. Raises ValueError if
+    the job does not exist.
+    '''
+    def set_job_enabled(self, job_id, enabled: bool, date_time: datetime | None = None) -> bool:
+        job = self._get_job(job_id)
+        date_time = date_time or _utc_now()
+        if enabled:
+            if job_id in self._disable_after_run:
+                self._disable_after_run.discard(job_id)
+                self._journal_enabled(job_id, True)
+                return True
+            if job.status != JobStatus.DISABLED:
+                return False
+            self._journal_enabled(job_id, True)
+            self.set_job_status(job_id, JobStatus.SCHEDULED)
+            self._schedule_next_fires([job] + self._replan_smoothing(self._regroup(job_id)), date_time)
+            return True
+        if job.status == JobStatus.DISABLED or job_id in self._disable_after_run:
+            return False
+        self._journal_enabled(job_id, False)
+        if job.status in (JobStatus.QUEUED, JobStatus.RUNNING):
+            self._disable_after_run.add(job_id)
+            return True
+        self._disable(job)
+        self._schedule_next_fires(self._replan_smoothing(self._regroup(job_id)), date_time)
+        self._compact_fire_heap()
+        return True
+
+    '''
+    Returns the UTC time at which the current run of a QUEUED or RUNNING job
+    fell due, or None if get_ready_jobs() has not handed the job out.
+    '''
+    def queued_fire_time(self, job_id) -> datetime | None:
+        return self._queued_fire_times.get(job_id)
+
+    # Returns the job's next fire time in UTC, or None if it has none scheduled
+    def job_next_fire_time(self, job_id) -> datetime | None:
+        return self._next_fire_times.get(job_id)
+
+    '''
+    Returns the earliest upcoming fire time (in UTC) of any job, or None if
+    no job is scheduled. The daemon can sleep until this instant.
+    '''
+    def next_fire_time(self) -> datetime | None:
+        while self._fire_heap:
+            fire_time, job_id = self._fire_heap[0]
+            if self._next_fire_times.get(job_id) == fire_time:
+                return fire_time
+            heapq.heappop(self._fire_heap)
+        return None
+
+    '''
+    Returns (fire time in UTC, job) for every run of an enabled job that is
+    scheduled after date_time and within the given window, in order.
+    '''
+    def upcoming(self, date_time: datetime, within: timedelta = timedelta(hours=24)) -> list[tuple[datetime, BackupJob]]:
+        _require_aware(date_time)
+        jobs = [job for job in self.job_pool if job.status != JobStatus.DISABLED]
+        if not self._offsets:
+            return fire_times_between(jobs, date_time, date_time + within)
+        # Nominal times can be up to a window earlier than the fires they cause
+        fires = [(fire_time + self._offsets.get(job.job_id, timedelta(0)), job) for fire_time, job in
+                 fire_times_between(jobs, date_time - self.smoothing_window, date_time + within)]
+        return sorted(((fire_time, job) for fire_time, job in fires if date_time < fire_time <= date_time + within),
+                      key=lambda item: (item[0], item[1].job_id))
+
+    '''
+    Returns how many seconds remain from date_time until the next fire time
+    (never negative), or None if no job is scheduled.
+    '''
+    def seconds_until_next_fire(self, date_time: datetime) -> float | None:
+        _require_aware(date_time)
+        fire_time = self.next_fire_time()
+        if fire_time is None:
+            return None
+        return max(0.0, (fire_time - date_time).total_seconds())
+
+    def _get_job(self, job_id) -> BackupJob:
+        job = self.job_pool.get_by_id(job_id)
+        if job is None:
+            raise ValueError(f"No job with ID '{job_id}'.")
+        return job
+
+    # Removes a job from the pool and drops its state, without replanning smoothing
+    def _forget_job(self, job_id) -> bool:
+        if not self.job_pool.remove_by_id(job_id):
+            return False
+        self._next_fire_times.pop(job_id, None)
+        self._catch_up.pop(job_id, None)
+        self._nominal_fire_times.pop(job_id, None)
+        self._last_nominal_fire_times.pop(job_id, None)
+        self._disable_after_run.discard(job_id)
+        self._queued_fire_times.pop(job_id, None)
+        self._durations.pop(job_id, None)
+        if self.journal is not None:
+            self.journal.forget(job_id)
+        return True
+
+    # Marks a job DISABLED and unschedules it; the caller regroups it for smoothing
+    def _disable(self, job: BackupJob):
+        self.set_job_status(job.job_id, JobStatus.DISABLED)
+        self._next_fire_times.pop(job.job_id, None)
+        self._nominal_fire_times.pop(job.job_id, None)
+        self._catch_up.pop(job.job_id, None)
+
+    # Hex digest of the job's current definition, or None if there is no way to tell
+    def _definition(self, job_id) -> str | None:
+        digest = self.definition_digest(job_id) if self.definition_digest is not None else None
+        return None if digest is None else digest.hex()
+
+    # Journals the state set over the control channel; None returns the job to its schedule file state
+    def _journal_enabled(self, job_id, enabled: bool | None):
+        if self.journal is None:
+            return
+        entry = self.journal.entries.get(job_id)
+        if enabled is None and (entry is None or entry.enabled is None):
+            return # Nothing to clear
+        self.journal.record_enabled(job_id, enabled, self._definition(job_id))
+
+    # Private heap maintenance methods
+
+    def _schedule_next_fire(self, job: BackupJob, after: datetime):
+        self._schedule_next_fires([job], after)
+
+    def _schedule_next_fires(self, jobs, after: datetime):
+        _require_aware(after)
+        regular = [job for job in jobs if job.job_id not in self._catch_up]
+        if self.smoothing_window is None:
+            fire_times = next_fire_time_batch(regular, after)
+        else:
+            fire_times = {job.job_id: self._smoothed_fire_time(job, after) for job in regular}
+        entries = []
+        for job in jobs:
+            if job.job_id in self._catch_up:
+                fire_time = after.astimezone(timezone.utc) # Catch-up runs are due right away
+            else:
+                fire_time = fire_times[job.job_id]
+            if fire_time is None:
+                self._next_fire_times.pop(job.job_id, None)
+                continue
+            self._next_fire_times[job.job_id] = fire_time
+            entries.append((fire_time, job.job_id))
+        if len(entries) > len(self._fire_heap):
+            # Heapifying everything at once is linear, cheaper than pushing many entries one by one
+            self._fire_heap.extend(entries)
+            heapq.heapify(self._fire_heap)
+        else:
+            for entry in entries:
+                heapq.heappush(self._fire_heap, entry)
+
+    # Returns the first smoothed fire time after `after` of a nominal fire that has not run yet
+    def _smoothed_fire_time(self, job: BackupJob, after: datetime) -> datetime | None:
+        self._nominal_fire_times.pop(job.job_id, None)
+        key = _schedule_key(job)
+        if key is None:
+            return None
+        offset = self._offsets.get(job.job_id, timedelta(0))
+        start = after - offset
+        last_nominal = self._last_nominal_fire_times.get(job.job_id)
+        if last_nominal is not None and last_nominal > start:
+            start = last_nominal # Never repeat a fire when the offset shrinks
+        nominal_fire_times = _fire_times(key, start)
+        nominal = next(nominal_fire_times)
+        while True:
+            following = next(nominal_fire_times, None)
+            fire_time = nominal + (offset if following is None else min(offset, (following - nominal) / 2))
+            if fire_time > after.astimezone(timezone.utc) or following is None:
+                self._nominal_fire_times[job.job_id] = nominal
+                return fire_time
+            nominal = following
+
+    '''
+    Moves a job to the smoothing group of its current trigger, or out of the
+    groups if it was removed, is disabled or never fires. Returns the keys of
+    the groups it left or joined, for _replan_smoothing().
+    '''
+    def _regroup(self, job_id) -> set:
+        if self.smoothing_window is None:
+            return set()
+        regrouped = set()
+        old_key = self._group_keys.pop(job_id, None)
+        if old_key is not None:
+            group = self._smoothing_groups[old_key]
+            group.discard(job_id)
+            if not group:
+                del self._smoothing_groups[old_key]
+            regrouped.add(old_key)
+        job = self.job_pool.get_by_id(job_id)
+        key = None if job is None or job.status == JobStatus.DISABLED else _schedule_key(job)
+        if key is None:
+            self._offsets.pop(job_id, None)
+        else:
+            self._smoothing_groups.setdefault(key, set()).add(job_id)
+            self._group_keys[job_id] = key
+            regrouped.add(key)
+        return regrouped
+
+    # Recomputes the offsets of the given smoothing groups and returns their scheduled jobs whose offset changed
+    def _replan_smoothing(self, keys) -> list[BackupJob]:
+        if self.smoothing_window is None:
+            return []
+        expected_duration = self._expected_duration if self.expected_duration is not None else None
+        moved = []
+        for key in keys:
+            job_ids = self._smoothing_groups.get(key)
+            if not job_ids:
+                continue
+            group = [self.job_pool.get_by_id(job_id) for job_id in job_ids]
+            for job_id, offset in smoothing_offsets(group, self.smoothing_window, expected_duration).items():
+                if offset != self._offsets.get(job_id, timedelta(0)):
+                    self._offsets[job_id] = offset
+                    if job_id in self._next_fire_times:
+                        moved.append(self.job_pool.get_by_id(job_id))
+        return moved
+
+    def _expected_duration(self, job_id) -> float | None:
+        if job_id not in self._durations:
+            self._durations[job_id] = self.expected_duration(job_id)
+        return self._durations[job_id]
+
+    # Returns the missed fire time the job's next run makes up for, if any
+    def _pop_catch_up(self, job_id) -> datetime | None:
+        runs = self._catch_up.get(job_id)
+        if runs is None:
+            return None
+        fire_time = runs.popleft()
+        if not runs:
+            del self._catch_up[job_id]
+        return fire_time
+
+    def _compact_fire_heap(self):
+        # Rebuild once stale entries outnumber live ones so removals stay amortized O(log n)
+        if len(self._fire_heap) > 2 * len(self._next_fire_times) + 64:
+            self._fire_heap = [(fire_time, job_id) for job_id, fire_time in self._next_fire_times.items()]
+            heapq.heapify(self._fire_heap)
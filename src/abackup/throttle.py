@@ -0,0 +1,456 @@
+import ctypes
+import logging
+import os
+import platform
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, time as wall_time, timedelta, tzinfo
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import yaml
+
+from abackup.core import destination_key
+from abackup.jobs import BackupJob
+from abackup.metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Bandwidth and disk I/O throttling of backup runs.
+#
+# Every byte a running job transfers is drawn from two token buckets: the
+# job's own (job.bandwidth_limit, capped by the active limits' job_bandwidth)
+# and a global one shared by every job. A bucket refills at its rate and holds
+# at most one second's worth of tokens, so a job that was idle can burst
+# briefly but never sustains more than the rate. Changing a rate wakes the
+# threads waiting on the bucket, so new limits take effect on transfers that
+# are already running. The bytes drawn are also counted per job and destination
+# in TRANSFERRED_BYTES (see metrics.py).
+#
+# rclone moves the data of mirror and chunked uploads itself, so those bytes
+# never pass through the buckets; instead rclone's own limiter is kept at the
+# global rate through its rc API (core/bwlimit, see RCloneProcessPool). Mirror
+# transfers of a job with a bandwidth limit also carry that limit as rclone's
+# per-file BwLimitFile (see RCloneBackupHandler), taken when the transfer starts.
+#
+# Disk reads are deprioritized with the Linux I/O priority (ioprio_set) of the
+# daemon's threads and of the rclone processes; threads started later inherit
+# it. On other platforms I/O priorities are ignored.
+#
+# A ThrottleSchedule holds the default limits and time-of-day profiles that
+# replace them, e.g. a low cap during business hours. The daemon calls
+# Throttle.apply() at every profile boundary.
+
+# Longest a consumer sleeps before re-checking its bucket
+MAX_WAIT_SECONDS = 0.25
+
+# Counted as the bytes are drawn from the buckets; rate() of it is a job's throughput
+TRANSFERRED_BYTES = get_metrics().counter(
+    "abackup_transferred_bytes", "Bytes transferred by backup runs.", ("job", "destination"))
+
+_RATE_UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2, "G": 1024 ** 3, "GB": 1024 ** 3}
+
+'''
+Parses a bandwidth such as 500KB/s, 10MB/s, 1G or a plain number of bytes
+per second. Returns None for "off", "unlimited" or None.
+'''
+def parse_bandwidth(value) -> int | None:
+    if value is None:
+        return None
+    if isinstance(value, int) and not isinstance(value, bool):
+        rate = value
+    else:
+        text = str(value).strip().upper()
+        if text in ("OFF", "UNLIMITED"):
+            return None
+        match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMG]?B?)(?:/S)?", text)
+        if match is None:
+            raise ValueError(f"Invalid bandwidth: {value}")
+        rate = int(float(match.group(1)) * _RATE_UNITS[match.group(2)])
+    if rate <= 0:
+        raise ValueError(f"Bandwidth must be positive: {value}")
+    return rate
+
+class TokenBucket:
+    def __init__(self, rate: int | None = None, clock=time.monotonic):
+        self._clock = clock
+        self._condition = threading.Condition()
+        self.rate = None
+        self._tokens = 0.0
+        self._updated = clock()
+        self.set_rate(rate)
+
+    # Changes the rate (bytes per second, None for unlimited) for current and future consumers
+    def set_rate(self, rate: int | None):
+        with self._condition:
+            self._refill()
+            self.rate = rate
+            if rate is not None:
+                self._tokens = min(self._tokens, rate)
+            self._condition.notify_all()
+
+    '''
+    Takes `amount` tokens, waiting until the bucket has them. An amount larger
+    than the bucket goes through once it is full and leaves it in debt, which
+    later consumers wait out.
+    '''
+    def consume(self, amount: int):
+        with self._condition:
+            while self.rate is not None:
+                self._refill()
+                needed = min(amount, self.rate)
+                if self._tokens >= needed:
+                    self._tokens -= amount
+                    return
+                self._condition.wait(min((needed - self._tokens) / self.rate, MAX_WAIT_SECONDS))
+
+    def _refill(self):
+        now = self._clock()
+        if self.rate is None:
+            self._tokens = 0.0
+        else:
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+# Draws a running job's transfers from its own bucket and the global one
+class JobLimiter:
+    def __init__(self, job_bucket: TokenBucket, global_bucket: TokenBucket, transferred=None):
+        self.job_bucket = job_bucket
+        self.global_bucket = global_bucket
+        self.transferred = transferred # Optional counter of the bytes consumed, e.g. a TRANSFERRED_BYTES child
+
+    def consume(self, amount: int):
+        self.job_bucket.consume(amount)
+        self.global_bucket.consume(amount)
+        if self.transferred is not None:
+            self.transferred.inc(amount)
+
+    # Wraps an object with a write(bytes) method
+    def writer(self, output) -> "_ThrottledWriter":
+        return _ThrottledWriter(output, self)
+
+    # Wraps an iterable of bytes chunks, e.g. a streamed request body
+    def chunks(self, chunks):
+        for chunk in chunks:
+            self.consume(len(chunk))
+            yield chunk
+
+class _ThrottledWriter:
+    def __init__(self, output, limiter: JobLimiter):
+        self._output = output
+        self._limiter = limiter
+
+    def write(self, data) -> int:
+        self._limiter.consume(len(data))
+        return self._output.write(data)
+
+    def flush(self):
+        flush = getattr(self._output, "flush", None)
+        if flush is not None:
+            flush()
+
+# Linux I/O scheduling classes, from most to least favoured
+IO_PRIORITY_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+
+class IOPriority:
+    __slots__ = ("io_class", "level")
+
+    def __init__(self, io_class: str, level: int = 4):
+        if io_class not in IO_PRIORITY_CLASSES:
+            raise ValueError(f"Invalid I/O priority class: {io_class}")
+        if not isinstance(level, int) or isinstance(level, bool) or not 0 <= level <= 7:
+            raise ValueError("I/O priority level must be an integer between 0 and 7.")
+        self.io_class = io_class
+        self.level = 0 if io_class == "idle" else level
+
+    # Parses "idle", "best-effort" or "best-effort:7"
+    @classmethod
+    def parse(cls, value) -> "IOPriority":
+        io_class, _, level = str(value).strip().lower().partition(":")
+        try:
+            return cls(io_class, int(level) if level else 4)
+        except ValueError as e:
+            raise ValueError(f"Invalid I/O priority '{value}': {e}") from None
+
+    # The ioprio_set() value
+    @property
+    def value(self) -> int:
+        return IO_PRIORITY_CLASSES[self.io_class] << 13 | self.level
+
+    def __eq__(self, other):
+        return isinstance(other, IOPriority) and (self.io_class, self.level) == (other.io_class, other.level)
+
+    def __repr__(self):
+        return f"IOPriority({self.io_class!r}, {self.level})"
+
+# ioprio_set syscall numbers by machine; there is no libc wrapper
+_IOPRIO_SET_SYSCALLS = {"x86_64": 251, "aarch64": 30, "i386": 289, "i686": 289, "armv7l": 314, "ppc64le": 273}
+IOPRIO_WHO_PROCESS = 1
+
+_libc = None
+
+'''
+Sets the I/O priority of a process or thread (None restores the default,
+which follows the CPU nice value). Returns False where I/O priorities are not
+supported; raises OSError if the kernel refuses.
+'''
+def set_io_priority(task_id: int, priority: IOPriority | None) -> bool:
+    global _libc
+    syscall = _IOPRIO_SET_SYSCALLS.get(platform.machine()) if platform.system() == "Linux" else None
+    if syscall is None:
+        return False
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+    if _libc.syscall(syscall, IOPRIO_WHO_PROCESS, task_id, 0 if priority is None else priority.value) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return True
+
+# Sets the I/O priority of every thread of this process
+def set_process_io_priority(priority: IOPriority | None) -> bool:
+    try:
+        task_ids = [int(name) for name in os.listdir("/proc/self/task")]
+    except OSError:
+        task_ids = [os.getpid()]
+    return all([set_io_priority(task_id, priority) for task_id in task_ids])
+
+class ThrottleLimits:
+    __slots__ = ("bandwidth", "job_bandwidth", "io_priority")
+
+    def __init__(self, bandwidth: int | None = None, job_bandwidth: int | None = None,
+                 io_priority: IOPriority | None = None):
+        self.bandwidth = bandwidth # Bytes per second shared by every job, or None
+        self.job_bandwidth = job_bandwidth # Bytes per second any one job may use, or None
+        self.io_priority = io_priority
+
+    def __eq__(self, other):
+        return isinstance(other, ThrottleLimits) and \
+            (self.bandwidth, self.job_bandwidth, self.io_priority) == \
+            (other.bandwidth, other.job_bandwidth, other.io_priority)
+
+    def __repr__(self):
+        return (f"ThrottleLimits(bandwidth={self.bandwidth}, job_bandwidth={self.job_bandwidth}, "
+                f"io_priority={self.io_priority})")
+
+# Limits that apply every day from `start` until `end` (wall-clock times of
+# the schedule's timezone). A profile whose end is not after its start runs
+# past midnight.
+class ThrottleProfile:
+    __slots__ = ("start", "end", "limits")
+
+    def __init__(self, start: wall_time, end: wall_time, limits: ThrottleLimits):
+        if start == end:
+            raise ValueError("A throttle profile must not start and end at the same time.")
+        self.start = start
+        self.end = end
+        self.limits = limits
+
+    def contains(self, moment: wall_time) -> bool:
+        if self.start < self.end:
+            return self.start <= moment < self.end
+        return moment >= self.start or moment < self.end
+
+    def __repr__(self):
+        return f"ThrottleProfile({self.start:%H:%M}-{self.end:%H:%M}, {self.limits})"
+
+class ThrottleSchedule:
+    def __init__(self, default: ThrottleLimits | None = None, profiles=(), tz: tzinfo | None = None):
+        self.default = default or ThrottleLimits()
+        self.profiles = list(profiles) # The first profile that contains a time wins
+        self.tz = tz # None uses the system's local timezone
+
+    def limits_at(self, date_time: datetime) -> ThrottleLimits:
+        moment = self._local(date_time).time().replace(tzinfo=None)
+        for profile in self.profiles:
+            if profile.contains(moment):
+                return profile.limits
+        return self.default
+
+    # Returns the next time after date_time at which a profile starts or ends, or None
+    def next_change(self, date_time: datetime) -> datetime | None:
+        local = self._local(date_time)
+        changes = []
+        for profile in self.profiles:
+            for boundary in (profile.start, profile.end):
+                for day in (local.date(), local.date() + timedelta(days=1)):
+                    candidate = datetime.combine(day, boundary, local.tzinfo)
+                    if self.tz is None:
+                        candidate = candidate.replace(tzinfo=None).astimezone()
+                    if candidate > local:
+                        changes.append(candidate)
+                        break
+        return min(changes, default=None)
+
+    def _local(self, date_time: datetime) -> datetime:
+        return date_time.astimezone(self.tz) if self.tz is not None else date_time.astimezone()
+
+'''
+Builds a ThrottleSchedule from a mapping such as
+
+    bandwidth: 50MB/s
+    job-bandwidth: 20MB/s
+    io-priority: best-effort:4
+    timezone: Europe/Berlin
+    profiles:
+        - start: "08:00"
+          end: "18:00"
+          bandwidth: 5MB/s
+          io-priority: idle
+
+Profiles inherit the top-level limits they do not set.
+'''
+def parse_throttle_schedule(data: dict) -> ThrottleSchedule:
+    if not isinstance(data, dict):
+        raise ValueError("Throttle settings must be a mapping.")
+    data = dict(data)
+    tz = None
+    if "timezone" in data:
+        try:
+            tz = ZoneInfo(str(data.pop("timezone")))
+        except (ZoneInfoNotFoundError, ValueError) as e:
+            raise ValueError(f"Unknown timezone: {e}") from None
+    profiles = data.pop("profiles", None) or []
+    default = _parse_limits(data, ThrottleLimits())
+    schedule = ThrottleSchedule(default, tz=tz)
+    for profile in profiles:
+        if not isinstance(profile, dict):
+            raise ValueError("Each throttle profile must be a mapping.")
+        profile = dict(profile)
+        try:
+            start, end = _parse_wall_time(profile.pop("start")), _parse_wall_time(profile.pop("end"))
+        except KeyError as e:
+            raise ValueError(f"Throttle profile is missing '{e.args[0]}'.") from None
+        schedule.profiles.append(ThrottleProfile(start, end, _parse_limits(profile, default)))
+    return schedule
+
+'''
+Reads a ThrottleSchedule from a YAML file holding the mapping that
+parse_throttle_schedule() takes. Raises ValueError if the file cannot be read
+or is invalid.
+'''
+def load_throttle_schedule(path) -> ThrottleSchedule:
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            data = yaml.safe_load(file)
+    except (OSError, yaml.YAMLError) as e:
+        raise ValueError(f"Cannot read throttle settings '{path}': {e}") from e
+    try:
+        return parse_throttle_schedule(data)
+    except ValueError as e:
+        raise ValueError(f"Invalid throttle settings '{path}': {e}") from e
+
+def _parse_limits(data: dict, base: ThrottleLimits) -> ThrottleLimits:
+    limits = ThrottleLimits(base.bandwidth, base.job_bandwidth, base.io_priority)
+    if "bandwidth" in data:
+        limits.bandwidth = parse_bandwidth(data.pop("bandwidth"))
+    if "job-bandwidth" in data:
+        limits.job_bandwidth = parse_bandwidth(data.pop("job-bandwidth"))
+    if "io-priority" in data:
+        value = data.pop("io-priority")
+        limits.io_priority = None if value is None else IOPriority.parse(value)
+    if data:
+        raise ValueError(f"Unknown throttle settings: {', '.join(sorted(str(key) for key in data))}")
+    return limits
+
+def _parse_wall_time(value) -> wall_time:
+    # YAML 1.1 reads unquoted 8:00 as the base-60 integer 480
+    if isinstance(value, int) and not isinstance(value, bool):
+        return wall_time(*divmod(value, 60))
+    try:
+        return wall_time.fromisoformat(str(value).zfill(5))
+    except ValueError:
+        raise ValueError(f"Invalid throttle profile time: {value}") from None
+
+# Applies the limits of a ThrottleSchedule to running jobs
+class Throttle:
+    def __init__(self, schedule: ThrottleSchedule | None = None):
+        self.schedule = schedule or ThrottleSchedule()
+        self.limits = ThrottleLimits() # As last applied
+        self._global_bucket = TokenBucket()
+        self._running = {} # job_id -> (BackupJob, JobLimiter)
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    '''
+    Applies the limits the schedule sets for date_time, if they changed.
+    Returns when they change next (None if they never do); the daemon calls
+    apply() again then.
+    '''
+    def apply(self, date_time: datetime) -> datetime | None:
+        self.set_limits(self.schedule.limits_at(date_time))
+        return self.schedule.next_change(date_time)
+
+    def set_limits(self, limits: ThrottleLimits):
+        with self._lock:
+            if limits == self.limits:
+                return
+            previous, self.limits = self.limits, limits
+            self._global_bucket.set_rate(limits.bandwidth)
+            for job, limiter in self._running.values():
+                limiter.job_bucket.set_rate(self._job_rate(job))
+            listeners = list(self._listeners)
+        logger.info("Applying throttle limits %r", limits)
+        if limits.io_priority != previous.io_priority:
+            try:
+                set_process_io_priority(limits.io_priority)
+            except OSError as e:
+                logger.warning("Could not set the I/O priority to %r: %s", limits.io_priority, e)
+        for listener in listeners:
+            listener(limits)
+
+    '''
+    Registers a callable that is called with the new ThrottleLimits whenever
+    they change, and once right away.
+    '''
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+            limits = self.limits
+        listener(limits)
+
+    def remove_listener(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    # Registers the job as running for the duration of the block and yields its JobLimiter
+    @contextmanager
+    def running(self, job: BackupJob):
+        limiter = JobLimiter(TokenBucket(), self._global_bucket,
+                             TRANSFERRED_BYTES.labels(job.job_id, destination_key(job.destination_url)))
+        with self._lock:
+            limiter.job_bucket.set_rate(self._job_rate(job))
+            self._running[job.job_id] = (job, limiter)
+        try:
+            yield limiter
+        finally:
+            with self._lock:
+                if self._running.get(job.job_id, (None, None))[1] is limiter:
+                    del self._running[job.job_id]
+
+    # Returns the bandwidth in bytes per second the job may use right now, or None if it is not limited
+    def job_rate(self, job: BackupJob) -> int | None:
+        with self._lock:
+            return self._job_rate(job)
+
+    # Returns the limiter of a running job, or None
+    def limiter(self, job_id: str) -> JobLimiter | None:
+        with self._lock:
+            entry = self._running.get(job_id)
+        return entry[1] if entry else None
+
+    def _job_rate(self, job: BackupJob) -> int | None:
+        rates = [rate for rate in (job.bandwidth_limit, self.limits.job_bandwidth) if rate is not None]
+        return min(rates, default=None)
+
+_shared_throttle = None
+_shared_throttle_lock = threading.Lock()
+
+# Returns the throttle shared by the daemon and the backup handlers
+def get_throttle() -> Throttle:
+    global _shared_throttle
+    with _shared_throttle_lock:
+        if _shared_throttle is None:
+            _shared_throttle = Throttle()
+        return _shared_throttle
@@ -1,2 +1,149 @@
-def cli():
-    print("This is the abackup command line interface.")
\ No newline at end of file
+import argparse
+import json
+import sys
+from datetime import datetime
+
+from abackup.control import ControlClient, ControlError, control_socket_path
+
+# The abackup command line interface.
+#
+# Every command except `daemon` is a request to the running daemon over its
+# control socket (see control.py); the CLI itself never parses the schedule
+# or imports the backup machinery, so commands answer in milliseconds. The
+# `daemon` command runs the daemon in the foreground, e.g. under systemd.
+#
+# Each subcommand names the function that runs it, and that function imports
+# what the command needs. Only this module and the control client are loaded
+# up front: tests/startup_tests.py checks that a client command loads none of
+# the daemon's modules, and benchmarks/startup_bench.py measures what the
+# imports cost.
+
+def cli(argv=None) -> int:
+    parser = _argument_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    return args.run(args)
+
+# Runs a command in the daemon and prints its reply
+def _client_command(args) -> int:
+    call_args = {"job_id": args.job_id} if "job_id" in args else {}
+    try:
+        with ControlClient(args.socket) as client:
+            result = client.call(args.command, **call_args)
+    except ControlError as e:
+        print(f"abackup: {e}", file=sys.stderr)
+        return 1
+    except OSError as e:
+        print(f"abackup: Cannot reach the daemon: {e}", file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(_FORMATTERS[args.command](result))
+    return 0
+
+def _argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="abackup", description="Schedule and run file backups.")
+    parser.add_argument("--socket", help="control socket of the daemon (default: control.sock in the runtime directory)")
+    parser.add_argument("--json", action="store_true", help="print the daemon's reply as JSON")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.add_parser("status", help="show whether the daemon is running and what it is doing") \
+        .set_defaults(run=_client_command)
+    commands.add_parser("list", help="list the scheduled jobs").set_defaults(run=_client_command)
+    for command, description in (("run", "run a job now"), ("enable", "enable a job"),
+                                 ("disable", "disable a job; a running job finishes first")):
+        job_command = commands.add_parser(command, help=description)
+        job_command.add_argument("job_id", metavar="job")
+        job_command.set_defaults(run=_client_command)
+    commands.add_parser("reload", help="re-read the schedule file").set_defaults(run=_client_command)
+    commands.add_parser("metrics", help="print the daemon's metrics in the Prometheus text format") \
+        .set_defaults(run=_client_command)
+    daemon = commands.add_parser("daemon", help="run the backup daemon in the foreground")
+    daemon.add_argument("schedule", help="path of the schedule file")
+    daemon.add_argument("--workers", type=int, default=4, help="jobs run at the same time (default: 4)")
+    daemon.add_argument("--metrics", metavar="HOST:PORT", help="serve metrics over HTTP at /metrics on this address")
+    daemon.add_argument("--smoothing-window", metavar="DURATION",
+                        help="spread jobs that start at the same time over this long, e.g. 30m")
+    daemon.add_argument("--throttle", metavar="FILE",
+                        help="YAML file of global bandwidth and I/O priority limits and their time-of-day profiles")
+    daemon.set_defaults(run=_run_daemon)
+    return parser
+
+# Runs the daemon in the foreground until it is stopped
+def _run_daemon(args) -> int:
+    import logging
+    import platform
+    from abackup.backup_daemon import BackupDaemon, UnixBackupDaemon
+    from abackup.metrics import parse_metrics_address
+    from abackup.schedule import parse_smoothing_window
+    from abackup.throttle import load_throttle_schedule
+    try:
+        metrics_address = None if args.metrics is None else parse_metrics_address(args.metrics)
+        smoothing_window = None if args.smoothing_window is None else parse_smoothing_window(args.smoothing_window)
+        throttle_schedule = None if args.throttle is None else load_throttle_schedule(args.throttle)
+    except ValueError as e:
+        print(f"abackup: {e}", file=sys.stderr)
+        return 2
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    daemon_class = UnixBackupDaemon if platform.system() in ["Linux", "Darwin"] else BackupDaemon
+    # Without Unix sockets the daemon runs without a control channel, and says so
+    daemon = daemon_class(args.schedule, max_workers=args.workers, control_socket=args.socket or control_socket_path(),
+                          metrics_address=metrics_address, smoothing_window=smoothing_window,
+                          throttle_schedule=throttle_schedule)
+    try:
+        daemon.start()
+    except ControlError as e:
+        print(f"abackup: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+# Output formatting
+
+def _format_time(value: str | None) -> str:
+    if value is None:
+        return "-"
+    return datetime.fromisoformat(value).astimezone().strftime("%Y-%m-%d %H:%M")
+
+def _format_status(status: dict) -> str:
+    statuses = ", ".join(f"{count} {name}" for name, count in sorted(status["statuses"].items()))
+    return "\n".join([
+        f"Daemon:   running (pid {status['pid']})" if status["running"] else "Daemon:   stopping",
+        f"Schedule: {status['schedule_path']}",
+        f"Jobs:     {status['jobs']}" + (f" ({statuses})" if statuses else ""),
+        f"Next run: {_format_time(status['next_fire_time'])}",
+    ])
+
+def _format_list(jobs: list) -> str:
+    if not jobs:
+        return "No jobs are scheduled."
+    rows = [("JOB", "STATUS", "NEXT RUN", "LAST RUN")]
+    for job in jobs:
+        last_run = job["last_run"]
+        rows.append((job["job_id"], job["status"], _format_time(job["next_fire_time"]),
+                     "-" if last_run is None else f"{_format_time(last_run['ended'])} {last_run['status']}"))
+    widths = [max(len(row[column]) for row in rows) for column in range(3)]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(row, widths)) + "  " + row[3]
+                     for row in rows)
+
+def _format_changed(verb: str):
+    def format_result(result: dict) -> str:
+        if not result.get("changed", True):
+            return f"Job '{result['job_id']}' is already {verb}."
+        return f"Job '{result['job_id']}' {verb}."
+    return format_result
+
+def _format_reload(diff: dict) -> str:
+    return (f"Reloaded schedule: {len(diff['added'])} added, {len(diff['changed'])} changed, "
+            f"{len(diff['removed'])} removed.")
+
+_FORMATTERS = {
+    "status": _format_status,
+    "list": _format_list,
+    "run": lambda result: f"Job '{result['job_id']}' queued to run now.",
+    "enable": _format_changed("enabled"),
+    "disable": _format_changed("disabled"),
+    "reload": _format_reload,
+    "metrics": lambda result: result["text"].rstrip("\n"),
+}
@@ -0,0 +1,259 @@
+import functools
+import os
+import queue
+import re
+import stat as stat_module
+import threading
+import time
+from pathlib import Path
+
+from abackup.jobs import BackupJob
+from abackup.profiling import bind, current_trace, record_stage
+
+# Concurrent directory walker for large source trees.
+#
+# On trees with millions of entries, and on network filesystems where every
+# directory listing and stat is a round trip, a walk is dominated by waiting
+# on the filesystem. ParallelWalker lists directories with os.scandir on a pool
+# of threads (scandir and stat release the GIL), so many round trips are in
+# flight at once. Entries are streamed to the consumer (the archive packer,
+# the snapshot writer or the chunk uploader) through a bounded queue: the walk
+# never runs more than max_queued entries ahead, so memory stays flat however
+# large the tree is.
+#
+# Include and exclude patterns of a job are compiled once into a PathMatcher,
+# one regular expression per list, and applied while walking: an excluded
+# directory is never listed.
+
+# Threads listing directories. Walks wait on I/O rather than the CPU, so more
+# threads than cores keep a network filesystem busy.
+WALK_WORKERS = min(32, 2 * (os.cpu_count() or 1))
+WALK_QUEUE_SIZE = 4096
+
+# One file, directory or symlink found below the walked root
+class WalkEntry:
+    __slots__ = ("path", "relative_path", "is_dir", "is_symlink", "stat")
+
+    def __init__(self, path: str, relative_path: str, is_dir: bool, is_symlink: bool, stat: os.stat_result):
+        self.path = path
+        self.relative_path = relative_path # Relative to the root, with "/" separators
+        self.is_dir = is_dir
+        self.is_symlink = is_symlink
+        self.stat = stat # Not following symlinks
+
+    @property
+    def is_file(self) -> bool:
+        return stat_module.S_ISREG(self.stat.st_mode)
+
+    def __repr__(self):
+        return f"WalkEntry({self.relative_path!r})"
+
+# Glob patterns over paths relative to a source root:
+#   - a pattern without "/" matches a name at any depth ("*.tmp", "node_modules")
+#   - a pattern with "/" is anchored at the root ("build/cache", "/logs")
+#   - "*" and "?" do not cross "/", "**" does, and [...] matches one character
+#   - a pattern that matches a directory also matches everything below it
+# Excludes win over includes. Without include patterns everything is included.
+class PathMatcher:
+    def __init__(self, include=(), exclude=()):
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self._include = _compile_patterns(self.include)
+        self._exclude = _compile_patterns(self.exclude)
+
+    '''
+    Returns True if the path is backed up. Directories are only subject to
+    the exclude patterns, since included files may be anywhere below them.
+    '''
+    def matches(self, relative_path: str, is_dir: bool = False) -> bool:
+        if self._exclude is not None and self._exclude.fullmatch(relative_path):
+            return False
+        return is_dir or self._include is None or self._include.fullmatch(relative_path) is not None
+
+    # The patterns as rclone filter rules, for the _filter option of rc calls.
+    # rclone applies the first rule that matches, and puts IncludeRule before
+    # ExcludeRule, so the rules go in one ordered list with the excludes first.
+    def rclone_filter(self) -> dict:
+        rules = [f"- {rule}" for pattern in self.exclude for rule in _rclone_rules(pattern)]
+        rules += [f"+ {rule}" for pattern in self.include for rule in _rclone_rules(pattern)]
+        if self.include:
+            rules.append("- **")
+        return {"FilterRule": rules} if rules else {}
+
+    def __repr__(self):
+        return f"PathMatcher(include={list(self.include)}, exclude={list(self.exclude)})"
+
+# Returns the job's compiled matcher, or None if it has no patterns
+def job_matcher(job: BackupJob) -> PathMatcher | None:
+    if not job.include_patterns and not job.exclude_patterns:
+        return None
+    return _cached_matcher(tuple(job.include_patterns), tuple(job.exclude_patterns))
+
+@functools.lru_cache(maxsize=256)
+def _cached_matcher(include: tuple, exclude: tuple) -> PathMatcher:
+    return PathMatcher(include, exclude)
+
+def _compile_patterns(patterns):
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{_glob_regex(pattern)})" for pattern in patterns), re.DOTALL)
+
+def _glob_regex(pattern: str) -> str:
+    anchored = "/" in pattern.strip().rstrip("/")
+    pattern = pattern.strip().strip("/")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            characters = pattern[i + 1:end]
+            negate = characters.startswith("!")
+            characters = characters[1 if negate else 0:].replace("\\", "\\\\")
+            if characters.startswith("^"):
+                characters = "\\" + characters
+            parts.append(("[^/" if negate else "[") + characters + "]")
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return ("" if anchored else "(?:.*/)?") + "".join(parts) + "(?:/.*)?"
+
+def _rclone_rules(pattern: str) -> list[str]:
+    pattern = pattern.strip()
+    if "/" in pattern.rstrip("/"):
+        pattern = "/" + pattern.strip("/")
+    pattern = pattern.rstrip("/")
+    return [pattern, pattern + "/**"]
+
+class _WalkCancelled(Exception):
+    pass
+
+_DONE = object()
+
+# Iterates the entries below root (not root itself). A directory is always
+# yielded before anything inside it; otherwise entries come in no particular
+# order. Entries that vanish during the walk are skipped; any other OSError
+# stops the walk and is raised by the iterator. Breaking out of the iteration
+# stops the worker threads.
+class ParallelWalker:
+    def __init__(self, root, recursive: bool = True, matcher: PathMatcher | None = None, workers: int | None = None,
+                 max_queued: int = WALK_QUEUE_SIZE):
+        self.root = Path(root)
+        self.recursive = recursive
+        self.matcher = matcher
+        self.workers = workers or WALK_WORKERS
+        self.max_queued = max_queued
+        self._started = False
+
+    def __iter__(self):
+        if self._started:
+            raise ValueError("A ParallelWalker can only be iterated once.")
+        self._started = True
+        walk = _Walk(self)
+        threads = [threading.Thread(target=bind(walk.work), name=f"abackup-walker-{number}", daemon=True)
+                   for number in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                entry = walk.entries.get()
+                if entry is _DONE:
+                    break
+                yield entry
+            if walk.error is not None:
+                raise walk.error
+        finally:
+            walk.closed.set()
+            walk.cancelled.set()
+            for _ in threads:
+                walk.directories.put(None)
+            for thread in threads:
+                thread.join()
+
+# The state shared by the threads of one walk
+class _Walk:
+    def __init__(self, walker: ParallelWalker):
+        self.walker = walker
+        self.entries = queue.Queue(maxsize=walker.max_queued)
+        self.directories = queue.SimpleQueue()
+        self.cancelled = threading.Event() # Stop listing directories
+        self.closed = threading.Event() # The consumer stopped reading
+        self.error = None
+        self._pending = 1 # Directories queued or being listed
+        self._lock = threading.Lock()
+        self._started = time.perf_counter() # The walk stage lasts until the last directory is listed
+        self._trace = current_trace()
+        self.directories.put((str(walker.root), ""))
+
+    def work(self):
+        while True:
+            directory = self.directories.get()
+            if directory is None:
+                return
+            try:
+                if not self.cancelled.is_set():
+                    self._list(*directory)
+            except _WalkCancelled:
+                pass
+            except BaseException as e:
+                with self._lock:
+                    self.error = self.error or e
+                self.cancelled.set()
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    done = self._pending == 0
+            if done:
+                record_stage("walk", self._started, time.perf_counter(), self._trace)
+                self._put(_DONE)
+                for _ in range(self.walker.workers):
+                    self.directories.put(None)
+
+    def _list(self, path: str, relative_path: str):
+        walker = self.walker
+        try:
+            scanner = os.scandir(path)
+        except (FileNotFoundError, NotADirectoryError):
+            if not relative_path:
+                raise
+            return # Removed since its parent was listed
+        with scanner:
+            for entry in scanner:
+                entry_path = f"{relative_path}/{entry.name}" if relative_path else entry.name
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if is_dir and not walker.recursive:
+                        continue
+                    if walker.matcher is not None and not walker.matcher.matches(entry_path, is_dir):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                self._put(WalkEntry(entry.path, entry_path, is_dir, entry.is_symlink(), stat))
+                if is_dir:
+                    with self._lock:
+                        self._pending += 1
+                    self.directories.put((entry.path, entry_path))
+
+    def _put(self, item):
+        while True:
+            if self.cancelled.is_set() and item is not _DONE:
+                raise _WalkCancelled()
+            try:
+                self.entries.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self.closed.is_set():
+                    return # Nobody is reading any more
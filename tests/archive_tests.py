@@ -0,0 +1,107 @@
+import unittest
+import io
+import os
+import tarfile
+import tempfile
+import abackup.jobs as jobs
+from abackup.archive import ArchiveStream, archive_suffix, write_archive
+from abackup.compression import codec_available, open_decompressor
+from pathlib import Path
+from unittest import mock
+from jobs_tests import InitializeJobWithGoodValues
+
+def ReadArchiveBytes(codec, data):
+    with tarfile.open(fileobj=open_decompressor(codec, io.BytesIO(data)), mode="r|") as archive:
+        return {member.name: archive.extractfile(member).read() if member.isfile() else None for member in archive}
+
+class TestWriteArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.source = Path(self.tempdir.name) / "source"
+        (self.source / "sub").mkdir(parents=True)
+        (self.source / "a.txt").write_text("alpha")
+        (self.source / "sub" / "b.txt").write_text("bravo")
+        self.job = InitializeJobWithGoodValues()
+        self.job.source_path = self.source
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_archive_contains_tree(self):
+        output = io.BytesIO()
+        stats = write_archive(self.job, output)
+        self.assertEqual(ReadArchiveBytes(self.job.compression_codec, output.getvalue()),
+                         {"source": None, "source/a.txt": b"alpha", "source/sub": None, "source/sub/b.txt": b"bravo"})
+        self.assertEqual((stats.files, stats.bytes_read, stats.bytes_written), (2, 10, len(output.getvalue())))
+
+    def test_non_recursive_archive_skips_subdirectories(self):
+        self.job.recursive = False
+        output = io.BytesIO()
+        write_archive(self.job, output)
+        self.assertEqual(set(ReadArchiveBytes(self.job.compression_codec, output.getvalue())), {"source", "source/a.txt"})
+
+    def test_excluded_paths_are_left_out(self):
+        self.job.exclude_patterns = ["sub"]
+        output = io.BytesIO()
+        write_archive(self.job, output)
+        self.assertEqual(set(ReadArchiveBytes(self.job.compression_codec, output.getvalue())), {"source", "source/a.txt"})
+
+    @unittest.skipUnless(codec_available(jobs.CompressionCodec.ZSTD), "zstandard is not installed")
+    def test_zstd_archive(self):
+        self.job.compression_codec = jobs.CompressionCodec.ZSTD
+        self.assertEqual(archive_suffix(self.job), ".tar.zst")
+        output = io.BytesIO()
+        write_archive(self.job, output)
+        self.assertEqual(ReadArchiveBytes(self.job.compression_codec, output.getvalue())["source/a.txt"], b"alpha")
+
+    def test_file_shrinking_during_archiving_is_padded(self):
+        real_open = open
+        def ShrinkingOpen(path, *args, **kwargs):
+            file = real_open(path, *args, **kwargs)
+            if Path(path).name == "a.txt":
+                Path(path).write_text("al")
+            return file
+        output = io.BytesIO()
+        with mock.patch("builtins.open", ShrinkingOpen), self.assertLogs("abackup.archive", "WARNING"):
+            write_archive(self.job, output)
+        self.assertEqual(ReadArchiveBytes(self.job.compression_codec, output.getvalue())["source/a.txt"], b"al\0\0\0")
+
+class TestArchiveStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.source = Path(self.tempdir.name) / "source"
+        self.source.mkdir()
+        for index in range(20):
+            (self.source / f"file-{index}.txt").write_text(f"file {index} " * 2000)
+        self.job = InitializeJobWithGoodValues()
+        self.job.source_path = self.source
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_stream_matches_written_archive(self):
+        stream = ArchiveStream(self.job, chunk_size=1024)
+        data = b"".join(stream)
+        self.assertEqual(stream.stats.files, 20)
+        self.assertEqual(stream.stats.bytes_written, len(data))
+        self.assertEqual(len(ReadArchiveBytes(self.job.compression_codec, data)), 21)
+
+    def test_producer_errors_are_raised(self):
+        with mock.patch("abackup.archive.write_archive", side_effect=OSError("disk error")):
+            with self.assertRaises(OSError):
+                b"".join(ArchiveStream(self.job))
+
+    def test_close_stops_a_blocked_producer(self):
+        (self.source / "random.bin").write_bytes(os.urandom(4 * 1024 * 1024))
+        stream = ArchiveStream(self.job, chunk_size=64 * 1024, max_chunks=2)
+        chunks = iter(stream)
+        next(chunks)
+        stream.close()
+        self.assertFalse(stream._thread.is_alive())
+        self.assertIsNone(stream.stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
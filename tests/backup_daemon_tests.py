@@ -0,0 +1,316 @@
+import unittest
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import abackup.backup_daemon as backup_daemon
+from abackup.backup_daemon import BackupDaemon, UnixBackupDaemon
+from abackup.control import ControlClient, ControlError
+from abackup.filewatch import PollingFileWatcher
+from abackup.history import RunHistory
+from abackup.journal import SchedulerJournal
+from abackup.jobs import JobStatus
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+
+JOB_TEMPLATE = """    {job_id}:
+        location: {source}
+        type: Google Drive
+        destination: gdrive:backups/{job_id}
+        schedule:
+            time: "{time}"
+            timezone: UTC
+"""
+
+def WriteSchedule(path: Path, source: Path, **job_times):
+    text = "version: 0.0\njobs:\n"
+    for job_id, fire_time in job_times.items():
+        text += JOB_TEMPLATE.format(job_id=job_id, source=source, time=fire_time.strftime("%H:%M:%S"))
+    path.write_text(text, encoding="utf-8")
+
+def InSeconds(seconds):
+    return datetime.now(timezone.utc) + timedelta(seconds=seconds)
+
+class TestBackupDaemonMainLoop(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.source = Path(self.tempdir.name)
+        self.schedule_path = self.source / "schedule.yaml"
+        self.performed = []
+        self.performed_event = threading.Event()
+        self.history = RunHistory(self.source / "history.sqlite3")
+        history_patch = mock.patch.object(backup_daemon, "get_run_history", return_value=self.history)
+        history_patch.start()
+        self.addCleanup(history_patch.stop)
+        self.journal = SchedulerJournal(self.source / "scheduler.journal")
+        journal_patch = mock.patch.object(backup_daemon, "get_scheduler_journal", return_value=self.journal)
+        journal_patch.start()
+        self.addCleanup(journal_patch.stop)
+
+    def tearDown(self):
+        self.history.close()
+        self.journal.close()
+        self.tempdir.cleanup()
+
+    def PerformJob(self, job):
+        self.performed.append((job.job_id, time.monotonic()))
+        self.performed_event.set()
+
+    async def WaitForJobs(self, count, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while len(self.performed) < count and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    async def test_job_dispatched_at_fire_time(self):
+        fire_time = InSeconds(1).replace(microsecond=0) + timedelta(seconds=1)
+        WriteSchedule(self.schedule_path, self.source, job1=fire_time)
+        daemon = BackupDaemon(self.schedule_path, perform_job=self.PerformJob)
+        loop_task = asyncio.create_task(daemon.main_loop())
+        await self.WaitForJobs(1)
+        dispatched_at = datetime.now(timezone.utc)
+        daemon.stop()
+        await loop_task
+
+        self.assertEqual([job_id for job_id, _ in self.performed], ["job1"])
+        self.assertLess((dispatched_at - fire_time).total_seconds(), 0.5)
+        job = daemon.scheduler.job_pool.get_by_id("job1")
+        self.assertEqual(job.status, JobStatus.SCHEDULED)
+        self.assertGreater(daemon.scheduler.next_fire_time(), fire_time)
+        self.assertEqual(self.history.last_run("job1").status, JobStatus.COMPLETED)
+
+    async def test_failed_job_is_rescheduled(self):
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(1))
+        daemon = BackupDaemon(self.schedule_path)
+        handler_patch = mock.patch.object(backup_daemon, "get_handler", side_effect=RuntimeError("no handler"))
+        handler_patch.start()
+        self.addCleanup(handler_patch.stop)
+        statuses = []
+        original_set_status = daemon.scheduler.job_pool.set_status
+        def RecordStatus(job_id, status):
+            statuses.append(status)
+            original_set_status(job_id, status)
+        daemon.scheduler.job_pool.set_status = RecordStatus
+        with self.assertLogs("abackup.core", "ERROR"):
+            loop_task = asyncio.create_task(daemon.main_loop())
+            deadline = time.monotonic() + 5
+            while JobStatus.FAILED not in statuses and time.monotonic() < deadline:
+                await asyncio.sleep(0.01)
+            daemon.stop()
+            await loop_task
+        self.assertIn(JobStatus.FAILED, statuses)
+        self.assertEqual(statuses[-1], JobStatus.SCHEDULED)
+        run = self.history.last_run("job1")
+        self.assertEqual((run.status, run.exit_code, run.error), (JobStatus.FAILED, 1, "no handler"))
+
+    async def test_interrupted_job_is_run_on_startup(self):
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(3600))
+        self.journal.record_fire("job1", InSeconds(-60))
+        self.journal.record_status("job1", JobStatus.RUNNING)
+        daemon = BackupDaemon(self.schedule_path, perform_job=self.PerformJob)
+        loop_task = asyncio.create_task(daemon.main_loop())
+        await self.WaitForJobs(1)
+        daemon.stop()
+        await loop_task
+        self.assertEqual([job_id for job_id, _ in self.performed], ["job1"])
+        self.assertEqual(self.journal.entries["job1"].status, JobStatus.SCHEDULED)
+
+    async def test_idle_loop_sleeps_until_stopped(self):
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(3600))
+        daemon = BackupDaemon(self.schedule_path, perform_job=self.PerformJob)
+        with mock.patch.object(daemon.scheduler, "get_ready_jobs", wraps=daemon.scheduler.get_ready_jobs) as get_ready_jobs:
+            loop_task = asyncio.create_task(daemon.main_loop())
+            await asyncio.sleep(0.3)
+            self.assertTrue(daemon.is_running())
+            daemon.stop()
+            await asyncio.wait_for(loop_task, 1)
+        self.assertLessEqual(get_ready_jobs.call_count, 2)
+        self.assertFalse(daemon.is_running())
+
+    async def test_schedule_file_change_is_picked_up(self):
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(3600))
+        daemon = BackupDaemon(self.schedule_path, perform_job=self.PerformJob)
+        with mock.patch.object(backup_daemon, "SCHEDULE_WATCH_INTERVAL_SECONDS", 0.05):
+            loop_task = asyncio.create_task(daemon.main_loop())
+            await asyncio.sleep(0.1)
+            WriteSchedule(self.schedule_path, self.source, job1=InSeconds(3600), job2=InSeconds(1))
+            await self.WaitForJobs(1)
+            daemon.stop()
+            await loop_task
+        self.assertEqual([job_id for job_id, _ in self.performed], ["job2"])
+
+    @unittest.skipIf(sys.platform == "win32", "the control channel uses Unix sockets")
+    async def test_control_commands(self):
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(3600), job2=InSeconds(3600))
+        # Keeps the file watcher from applying the rewrite below before the reload command does
+        watcher_patch = mock.patch.object(backup_daemon, "open_file_watcher", lambda path, _: PollingFileWatcher(path, 3600))
+        watcher_patch.start()
+        self.addCleanup(watcher_patch.stop)
+        socket_path = self.source / "control.sock"
+        daemon = BackupDaemon(self.schedule_path, perform_job=self.PerformJob, control_socket=socket_path)
+        loop_task = asyncio.create_task(daemon.main_loop())
+        while not socket_path.exists():
+            await asyncio.sleep(0.01)
+        client = ControlClient(socket_path)
+        self.addCleanup(client.close)
+        status = await asyncio.to_thread(client.call, "status")
+        self.assertEqual((status["jobs"], status["statuses"], status["pid"]), (2, {"scheduled": 2}, os.getpid()))
+
+        await asyncio.to_thread(client.call, "run", job_id="job1")
+        await self.WaitForJobs(1)
+        self.assertEqual([job_id for job_id, _ in self.performed], ["job1"])
+        while daemon.scheduler.job_pool.get_by_id("job1").status != JobStatus.SCHEDULED:
+            await asyncio.sleep(0.01)
+        self.assertTrue((await asyncio.to_thread(client.call, "disable", job_id="job2"))["changed"])
+        jobs = await asyncio.to_thread(client.call, "list")
+        self.assertEqual([(job["job_id"], job["status"]) for job in jobs], [("job1", "scheduled"), ("job2", "disabled")])
+        self.assertIsNone(jobs[1]["next_fire_time"])
+        with self.assertRaisesRegex(ControlError, "disabled"):
+            await asyncio.to_thread(client.call, "run", job_id="job2")
+        with self.assertRaisesRegex(ControlError, "No job"):
+            await asyncio.to_thread(client.call, "enable", job_id="job3")
+
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(3600), job3=InSeconds(3600))
+        diff = await asyncio.to_thread(client.call, "reload")
+        self.assertEqual(diff, {"added": ["job3"], "changed": [], "removed": ["job2"]})
+        daemon.stop()
+        await loop_task
+        self.assertFalse(socket_path.exists())
+
+    async def test_stop_cancels_a_reload_and_closes_the_watcher(self):
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(3600))
+        watchers = []
+        def OpenWatcher(path, _):
+            watchers.append(PollingFileWatcher(path, 3600))
+            watchers[-1].close = mock.Mock()
+            return watchers[-1]
+        reloading = asyncio.Event()
+        async def HangingReload():
+            reloading.set()
+            await asyncio.Event().wait()
+        daemon = BackupDaemon(self.schedule_path, perform_job=self.PerformJob)
+        with mock.patch.object(backup_daemon, "open_file_watcher", OpenWatcher), \
+             mock.patch.object(daemon, "_reload_now", HangingReload):
+            loop_task = asyncio.create_task(daemon.main_loop())
+            while not watchers:
+                await asyncio.sleep(0.01)
+            daemon._request_reload()
+            reload_task = daemon._reload_task
+            await reloading.wait()
+            daemon.stop()
+            await asyncio.wait_for(loop_task, 5)
+        self.assertTrue(reload_task.cancelled())
+        self.assertIsNone(daemon._reload_task)
+        watchers[0].close.assert_called_once_with()
+
+    async def test_daemon_runs_without_the_control_channel_where_unix_sockets_are_missing(self):
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(1))
+        socket_path = self.source / "control.sock"
+        daemon = BackupDaemon(self.schedule_path, perform_job=self.PerformJob, control_socket=socket_path)
+        with mock.patch.object(backup_daemon, "CONTROL_SERVER_AVAILABLE", False), \
+             self.assertLogs(backup_daemon.logger, "WARNING") as logs:
+            loop_task = asyncio.create_task(daemon.main_loop())
+            await self.WaitForJobs(1)
+            daemon.stop()
+            await loop_task
+        self.assertEqual([job_id for job_id, _ in self.performed], ["job1"])
+        self.assertIn("without the control channel", logs.output[0])
+        self.assertFalse(socket_path.exists())
+
+    async def test_disabled_job_stays_disabled_after_restart(self):
+        job1_time = InSeconds(3600)
+        WriteSchedule(self.schedule_path, self.source, job1=job1_time, job2=InSeconds(3600))
+        async def Restart():
+            daemon = BackupDaemon(self.schedule_path, perform_job=self.PerformJob)
+            loop_task = asyncio.create_task(daemon.main_loop())
+            while daemon.scheduler.job_pool.get_by_id("job1") is None:
+                await asyncio.sleep(0.01)
+            return daemon, loop_task
+        async def Stop(daemon, loop_task):
+            daemon.stop()
+            await loop_task
+
+        daemon, loop_task = await Restart()
+        daemon.scheduler.set_job_enabled("job1", False)
+        await Stop(daemon, loop_task)
+        daemon, loop_task = await Restart()
+        self.assertEqual(daemon.scheduler.job_pool.get_by_id("job1").status, JobStatus.DISABLED)
+        self.assertEqual(daemon.scheduler.job_pool.get_by_id("job2").status, JobStatus.SCHEDULED)
+        await Stop(daemon, loop_task)
+
+        # A new definition of the job replaces the state set over the control channel
+        WriteSchedule(self.schedule_path, self.source, job1=job1_time + timedelta(minutes=1), job2=InSeconds(3600))
+        daemon, loop_task = await Restart()
+        self.assertEqual(daemon.scheduler.job_pool.get_by_id("job1").status, JobStatus.SCHEDULED)
+        await Stop(daemon, loop_task)
+
+    @unittest.skipIf(sys.platform == "win32", "the control channel uses Unix sockets")
+    async def test_metrics(self):
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(3600), job2=InSeconds(3600))
+        socket_path = self.source / "control.sock"
+        daemon = BackupDaemon(self.schedule_path, perform_job=self.PerformJob, control_socket=socket_path,
+                              metrics_address=("127.0.0.1", 0))
+        lag_runs = backup_daemon.SCHEDULE_LAG.labels().count
+        loop_task = asyncio.create_task(daemon.main_loop())
+        while daemon.metrics_server is None:
+            await asyncio.sleep(0.01)
+        client = ControlClient(socket_path)
+        self.addCleanup(client.close)
+        await asyncio.to_thread(client.call, "run", job_id="job1")
+        await self.WaitForJobs(1)
+        while daemon.scheduler.job_pool.get_by_id("job1").status != JobStatus.SCHEDULED:
+            await asyncio.sleep(0.01)
+        self.assertEqual(backup_daemon.SCHEDULE_LAG.labels().count, lag_runs + 1)
+
+        host, port = daemon.metrics_server.address
+        with await asyncio.to_thread(urllib.request.urlopen, f"http://{host}:{port}/metrics") as response:
+            scraped = response.read().decode("utf-8")
+        self.assertIn('abackup_jobs{status="scheduled"} 2', scraped.splitlines())
+        self.assertIn('abackup_executor_jobs{state="running"} 0', scraped.splitlines())
+        self.assertIn("# TYPE abackup_schedule_lag_seconds histogram", scraped)
+        text = (await asyncio.to_thread(client.call, "metrics"))["text"]
+        self.assertIn('abackup_jobs{status="scheduled"} 2', text.splitlines())
+        daemon.stop()
+        await loop_task
+        self.assertIsNone(daemon.metrics_server)
+
+    async def test_profiled_run_links_its_trace(self):
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(3600))
+        text = self.schedule_path.read_text(encoding="utf-8")
+        self.schedule_path.write_text(text.replace("type: Google Drive", "type: Google Drive\n        profile: spans"),
+                                      encoding="utf-8")
+        daemon = BackupDaemon(self.schedule_path, perform_job=self.PerformJob, trace_directory=self.source / "traces")
+        loop_task = asyncio.create_task(daemon.main_loop())
+        while daemon.scheduler.next_fire_time() is None:
+            await asyncio.sleep(0.01)
+        daemon.scheduler.run_now("job1")
+        daemon.wake()
+        await self.WaitForJobs(1)
+        daemon.stop()
+        await loop_task
+        await asyncio.to_thread(self.history.flush)
+        trace_path = Path(self.history.last_run("job1").trace_path)
+        self.assertEqual(trace_path.parent, self.source / "traces")
+        events = json.loads(trace_path.read_text(encoding="utf-8"))["traceEvents"]
+        self.assertIn("run", [event["name"] for event in events])
+
+    @unittest.skipUnless(platform.system() in ["Linux", "Darwin"], "Unix signals only")
+    async def test_sigterm_stops_unix_daemon(self):
+        WriteSchedule(self.schedule_path, self.source, job1=InSeconds(3600))
+        daemon = UnixBackupDaemon(self.schedule_path, perform_job=self.PerformJob)
+        loop_task = asyncio.create_task(daemon.main_loop())
+        while daemon.scheduler.next_fire_time() is None:
+            await asyncio.sleep(0.01)
+        os.kill(os.getpid(), backup_daemon.signal.SIGTERM)
+        await asyncio.wait_for(loop_task, 2)
+        self.assertFalse(daemon.is_running())
+
+
+if __name__ == '__main__':
+    unittest.main()
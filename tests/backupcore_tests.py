@@ -0,0 +1,513 @@
+import unittest
+import errno
+import os
+import shutil
+import socket
+import stat
+import sys
+import tarfile
+import tempfile
+import threading
+import abackup.jobs as jobs
+import abackup.backupcore as backupcore
+from abackup.backupcore import (BackupError, ChunkedBackupHandler, GoogleDriveBackupHandler, LocalBackupHandler,
+                                RCloneProcessPool, RCloneRemoteControl, close_handlers, get_handler)
+from abackup.chunkstore import ChunkStore, LocalChunkBackend
+from abackup.retention import RetentionCatalog, RetentionManager
+from abackup.fileindex import FileStateIndex
+from abackup.throttle import Throttle, ThrottleLimits
+from abackup.walker import ParallelWalker, job_matcher
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+from jobs_tests import InitializeJobWithGoodValues
+
+FAKE_RCLONE = Path(__file__).with_name("fake_rclone.py")
+
+def StartFakeRClonePool(root):
+    os.environ["FAKE_RCLONE_ROOT"] = str(root)
+    return RCloneProcessPool(command=(sys.executable, str(FAKE_RCLONE)))
+
+def CreateSourceTree(root: Path):
+    (root / "sub").mkdir(parents=True)
+    (root / "a.txt").write_text("alpha")
+    (root / "sub" / "b.txt").write_text("bravo")
+    return root
+
+def ReadArchive(path: Path):
+    with tarfile.open(path, "r:gz") as archive:
+        return {member.name: archive.extractfile(member).read() for member in archive if member.isfile()}
+
+def WriteScript(path: Path, body: str):
+    path.write_text("#!/bin/sh\n" + body + "\n")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return path
+
+@unittest.skipIf(sys.platform == "win32", "fake rclone tests use POSIX scripts")
+class TestRCloneBackupHandler(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.TemporaryDirectory()
+        cls.environment = mock.patch.dict(os.environ)
+        cls.environment.start()
+        cls.remote_root = Path(cls.tempdir.name) / "remotes"
+        cls.pool = StartFakeRClonePool(cls.remote_root)
+        cls.handler = GoogleDriveBackupHandler(cls.pool)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.handler.close()
+        cls.pool.close()
+        cls.environment.stop()
+        cls.tempdir.cleanup()
+
+    def setUp(self):
+        self.workdir = Path(tempfile.mkdtemp(dir=self.tempdir.name))
+        self.source = CreateSourceTree(self.workdir / "source")
+
+    def InitializeJob(self, destination, compression=False):
+        job = InitializeJobWithGoodValues()
+        job.source_path = self.source
+        job.destination_url = destination
+        job.compression = compression
+        return job
+
+    def test_backup_mirrors_source_tree(self):
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/mirror")
+        result = self.handler.run(job)
+        mirror = self.remote_root / "gdrive" / self.workdir.name / "mirror"
+        self.assertEqual((mirror / "a.txt").read_text(), "alpha")
+        self.assertEqual((mirror / "sub" / "b.txt").read_text(), "bravo")
+        self.assertEqual(result.files_transferred, 2)
+        self.assertEqual(result.bytes_written, 10)
+        self.assertIsNotNone(result.started)
+        self.assertIsNotNone(result.ended)
+
+    def test_mirror_excludes_win_over_includes(self):
+        (self.source / "c.log").write_text("charlie")
+        (self.source / "sub" / "d.txt").write_text("delta")
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/filtered")
+        job.include_patterns = ["*.txt"]
+        job.exclude_patterns = ["sub/"]
+        self.handler.run(job)
+        mirror = self.remote_root / "gdrive" / self.workdir.name / "filtered"
+        mirrored = {path.relative_to(mirror).as_posix() for path in mirror.rglob("*") if path.is_file()}
+        walked = {entry.relative_path for entry in ParallelWalker(self.source, True, job_matcher(job))
+                  if entry.is_file}
+        self.assertEqual(mirrored, {"a.txt"})
+        self.assertEqual(mirrored, walked)
+
+    def test_runs_reuse_one_rclone_process(self):
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/mirror")
+        self.handler.run(job)
+        pid = self.pool.acquire().pid
+        result = self.handler.run(job)
+        self.assertEqual(self.pool.acquire().pid, pid)
+        self.assertEqual(result.files_transferred, 0) # Nothing changed since the first run
+
+    def test_non_recursive_backup_skips_subdirectories(self):
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/flat")
+        job.recursive = False
+        self.handler.run(job)
+        flat = self.remote_root / "gdrive" / self.workdir.name / "flat"
+        self.assertTrue((flat / "a.txt").exists())
+        self.assertFalse((flat / "sub").exists())
+
+    def test_single_file_source(self):
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/single")
+        job.source_path = self.source / "a.txt"
+        self.handler.run(job)
+        self.assertTrue((self.remote_root / "gdrive" / self.workdir.name / "single" / "a.txt").exists())
+
+    def test_pre_and_post_scripts_run_around_backup(self):
+        log = self.workdir / "log.txt"
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/scripted")
+        job.script_pre_path = WriteScript(self.workdir / "pre.sh", f'echo "pre $ABACKUP_JOB_ID" >> {log}')
+        job.script_post_path = WriteScript(self.workdir / "post.sh", f'echo post >> {log}')
+        self.handler.run(job)
+        self.assertEqual(log.read_text().split("\n")[:2], ["pre test-job-001", "post"])
+
+    def test_post_script_runs_when_backup_fails(self):
+        log = self.workdir / "log.txt"
+        job = self.InitializeJob("not-a-remote")
+        job.script_post_path = WriteScript(self.workdir / "post.sh", f'echo post >> {log}')
+        with self.assertRaises(BackupError):
+            self.handler.run(job)
+        self.assertEqual(log.read_text(), "post\n")
+
+    def test_failing_pre_script_aborts_backup(self):
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/aborted")
+        job.script_pre_path = WriteScript(self.workdir / "pre.sh", "exit 3")
+        with self.assertRaises(BackupError):
+            self.handler.run(job)
+        self.assertFalse((self.remote_root / "gdrive" / self.workdir.name / "aborted").exists())
+
+    def test_indexed_backup_transfers_only_changes(self):
+        handler = GoogleDriveBackupHandler(self.pool, FileStateIndex(self.workdir / "index.sqlite3"))
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/indexed")
+        mirror = self.remote_root / "gdrive" / self.workdir.name / "indexed"
+        self.assertEqual(handler.run(job).files_transferred, 2)
+
+        (self.source / "a.txt").write_text("alpha, again")
+        (self.source / "sub" / "b.txt").unlink()
+        (self.source / "c.txt").write_text("charlie")
+        result = handler.run(job)
+        self.assertEqual(result.files_transferred, 2)
+        self.assertEqual((mirror / "a.txt").read_text(), "alpha, again")
+        self.assertEqual((mirror / "c.txt").read_text(), "charlie")
+        self.assertFalse((mirror / "sub" / "b.txt").exists())
+        self.assertEqual(handler.run(job).files_transferred, 0)
+
+    def test_failed_indexed_backup_is_retried_in_full(self):
+        index = FileStateIndex(self.workdir / "index.sqlite3")
+        handler = GoogleDriveBackupHandler(self.pool, index)
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/retried")
+        with mock.patch.object(backupcore.RCloneRemoteControl, "run_job", side_effect=BackupError("offline")):
+            with self.assertRaises(BackupError):
+                handler.run(job)
+        self.assertEqual(index.count(job.job_id), 0)
+        self.assertEqual(handler.run(job).files_transferred, 2)
+        self.assertEqual(index.count(job.job_id), 2)
+
+    def test_compressed_backup_streams_archive(self):
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/archives", compression=True)
+        result = self.handler.run(job)
+        self.assertTrue(result.artifact_path.endswith(".tar.gz"))
+        self.assertEqual(result.files_transferred, 2)
+        archives = list((self.remote_root / "gdrive" / self.workdir.name / "archives").iterdir())
+        self.assertEqual([path.name for path in archives], [result.artifact_path.rsplit("/", 1)[1]])
+        self.assertEqual(ReadArchive(archives[0]), {"source/a.txt": b"alpha", "source/sub/b.txt": b"bravo"})
+
+    def test_failed_archive_upload_leaves_no_partial_file(self):
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/broken", compression=True)
+        with mock.patch("abackup.archive.write_archive", side_effect=OSError("disk error")):
+            with self.assertRaises(BackupError):
+                self.handler.run(job)
+        broken = self.remote_root / "gdrive" / self.workdir.name / "broken"
+        self.assertEqual(list(broken.iterdir()) if broken.exists() else [], [])
+
+    def test_delete_oldest_removes_remote_archives_in_one_call(self):
+        handler = GoogleDriveBackupHandler(self.pool)
+        handler.retention = RetentionManager(RetentionCatalog(self.workdir / "retention.sqlite3"))
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/expiring", compression=True)
+        job.max_file_retention_size = 0 # Only the newest archive is ever kept
+        for day in (1, 2, 3):
+            with mock.patch.object(backupcore, "artifact_name", return_value=f"test-job-001-202511{day:02d}T020000Z"):
+                handler.run(job)
+        archives = self.remote_root / "gdrive" / self.workdir.name / "expiring"
+        self.assertEqual([path.name for path in archives.iterdir()], ["test-job-001-20251103T020000Z.tar.gz"])
+
+    def test_throttled_archive_upload_and_rclone_bandwidth_limit(self):
+        handler = GoogleDriveBackupHandler(self.pool)
+        handler.throttle = Throttle()
+        handler.throttle.set_limits(ThrottleLimits(bandwidth=64 * 1024 * 1024))
+        handler.throttle.add_listener(self.pool.set_throttle_limits)
+        try:
+            self.pool.flush_throttle_limits()
+            self.assertEqual(self.pool.acquire().call("core/bwlimit"), {"rate": "65536K"})
+            job = self.InitializeJob(f"gdrive:{self.workdir.name}/throttled", compression=True)
+            limiters = []
+            limiter = handler.throttle.limiter
+            with mock.patch.object(handler.throttle, "limiter", lambda job_id: limiters.append(limiter(job_id)) or limiters[-1]):
+                result = handler.run(job)
+            self.assertEqual(len(limiters), 1)
+            self.assertIsNotNone(limiters[0])
+            archive = self.remote_root / "gdrive" / self.workdir.name / "throttled" / result.artifact_name
+            self.assertEqual(ReadArchive(archive), {"source/a.txt": b"alpha", "source/sub/b.txt": b"bravo"})
+        finally:
+            handler.throttle.set_limits(ThrottleLimits())
+        self.pool.flush_throttle_limits()
+        self.assertEqual(self.pool.acquire().call("core/bwlimit"), {"rate": "off"})
+
+    def test_mirror_transfers_carry_the_job_bandwidth_limit(self):
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/limited")
+        job.bandwidth_limit = 4 * 1024 * 1024
+        indexed = GoogleDriveBackupHandler(self.pool, FileStateIndex(self.workdir / "index.sqlite3"))
+        indexed.throttle = Throttle()
+        indexed.throttle.set_limits(ThrottleLimits(job_bandwidth=1024 * 1024)) # Lower than the job's own limit
+        unlimited = self.InitializeJob(f"gdrive:{self.workdir.name}/unlimited")
+        run_job = RCloneRemoteControl.run_job
+        with mock.patch.object(RCloneRemoteControl, "run_job", autospec=True, side_effect=run_job) as calls:
+            self.handler.run(job)
+            indexed.run(job)
+            self.handler.run(unlimited)
+            job.source_path = self.source / "a.txt"
+            self.handler.run(job)
+        configs = [(call.args[1], call.kwargs.get("_config")) for call in calls.call_args_list]
+        self.assertEqual(configs, [
+            ("sync/sync", {"BwLimitFile": "1024K", "Transfers": 4}),
+            ("sync/copy", {"NoTraverse": True, "BwLimitFile": "256K", "Transfers": 4}),
+            ("sync/sync", {}),
+            ("operations/copyfile", {"BwLimitFile": "4096K", "Transfers": 1}),
+        ])
+
+    def test_chunked_backup_to_remote(self):
+        handler = ChunkedBackupHandler(self.pool)
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/chunked")
+        job.chunked = True
+        result = handler.run(job)
+        store_root = self.remote_root / "gdrive" / self.workdir.name / "chunked"
+        self.assertTrue(result.artifact_path.startswith(f"gdrive:{self.workdir.name}/chunked/snapshots/"))
+        self.assertEqual(len(list((store_root / "snapshots").iterdir())), 1)
+        restored = self.workdir / "restored"
+        store = ChunkStore(LocalChunkBackend(store_root))
+        store.restore(store.latest_manifest(job.job_id), restored)
+        self.assertEqual((restored / "sub" / "b.txt").read_text(), "bravo")
+
+    def test_new_job_limit_applies_from_the_next_transfer(self):
+        job = self.InitializeJob(f"gdrive:{self.workdir.name}/relimited")
+        handler = GoogleDriveBackupHandler(self.pool)
+        handler.throttle = Throttle()
+        handler.throttle.set_limits(ThrottleLimits(job_bandwidth=4 * 1024 * 1024))
+        run_job = RCloneRemoteControl.run_job
+        def lower_the_limit_during_the_transfer(remote_control, method, **params):
+            handler.throttle.set_limits(ThrottleLimits(job_bandwidth=1024 * 1024))
+            return run_job(remote_control, method, **params)
+        with mock.patch.object(RCloneRemoteControl, "run_job", autospec=True,
+                               side_effect=lower_the_limit_during_the_transfer) as calls:
+            handler.run(job)
+            handler.run(job)
+        self.assertEqual([call.kwargs["_config"]["BwLimitFile"] for call in calls.call_args_list], ["1024K", "256K"])
+
+class TestRCloneProcessPool(unittest.TestCase):
+
+    def test_rc_calls_time_out(self):
+        with socket.socket() as server: # Accepts connections and never answers
+            server.bind(("127.0.0.1", 0))
+            server.listen()
+            remote_control = RCloneRemoteControl(call_timeout=0.2)
+            remote_control._url = f"http://127.0.0.1:{server.getsockname()[1]}/"
+            remote_control._authorization = "Basic unused"
+            with self.assertRaises(BackupError):
+                remote_control._post("rc/noop", {})
+
+    def test_throttle_limits_are_applied_off_the_caller_thread(self):
+        pool = RCloneProcessPool()
+        self.addCleanup(pool.close)
+        applying, release = threading.Event(), threading.Event()
+        applied = []
+        def set_throttle(bandwidth, io_priority=None):
+            applying.set()
+            release.wait(5) # As if rclone hung
+            applied.append(bandwidth)
+        with mock.patch.object(pool.acquire(), "set_throttle", side_effect=set_throttle):
+            pool.set_throttle_limits(ThrottleLimits(bandwidth=1000))
+            self.assertTrue(applying.wait(5))
+            pool.set_throttle_limits(ThrottleLimits(bandwidth=2000))
+            pool.set_throttle_limits(ThrottleLimits(bandwidth=3000))
+            self.assertEqual(applied, [])
+            release.set()
+            pool.flush_throttle_limits()
+        self.assertEqual(applied, [1000, 3000]) # The superseded limits are skipped
+
+class TestLocalBackupHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.workdir = Path(self.tempdir.name)
+        self.source = CreateSourceTree(self.workdir / "source")
+        self.job = InitializeJobWithGoodValues()
+        self.job.BackupType = jobs.BackupType.LOCAL
+        self.job.source_path = self.source
+        self.job.destination_url = str(self.workdir / "snapshots")
+        self.job.compression = False
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def RunTwice(self):
+        handler = LocalBackupHandler()
+        first = Path(handler.run(self.job).artifact_path)
+        (self.source / "a.txt").write_text("alpha, changed")
+        with mock.patch.object(backupcore, "artifact_name", return_value="test-job-001-20990101T000000Z"):
+            second = Path(handler.run(self.job).artifact_path)
+        return first, second
+
+    def test_snapshot_copies_tree(self):
+        result = LocalBackupHandler().run(self.job)
+        snapshot = Path(result.artifact_path)
+        self.assertTrue(snapshot.name.startswith("test-job-001-"))
+        self.assertEqual((snapshot / "a.txt").read_text(), "alpha")
+        self.assertEqual((snapshot / "sub" / "b.txt").read_text(), "bravo")
+        self.assertEqual(result.files_transferred, 2)
+
+    def test_snapshot_leaves_out_excluded_paths(self):
+        self.job.exclude_patterns = ["sub/*.txt"]
+        snapshot = Path(LocalBackupHandler().run(self.job).artifact_path)
+        self.assertEqual((snapshot / "a.txt").read_text(), "alpha")
+        self.assertTrue((snapshot / "sub").is_dir())
+        self.assertFalse((snapshot / "sub" / "b.txt").exists())
+
+    def test_file_url_destination(self):
+        self.job.destination_url = (self.workdir / "snapshots").as_uri()
+        snapshot = Path(LocalBackupHandler().run(self.job).artifact_path)
+        self.assertEqual(snapshot.parent, self.workdir / "snapshots")
+
+    def test_unchanged_files_are_hardlinked_without_reflink(self):
+        with mock.patch.object(backupcore, "_reflink_file", return_value=False):
+            first, second = self.RunTwice()
+        self.assertTrue(os.path.samefile(first / "sub" / "b.txt", second / "sub" / "b.txt"))
+        self.assertFalse(os.path.samefile(first / "a.txt", second / "a.txt"))
+        self.assertEqual((first / "a.txt").read_text(), "alpha")
+        self.assertEqual((second / "a.txt").read_text(), "alpha, changed")
+
+    def test_snapshots_are_independent_copies_with_reflink(self):
+        first, second = self.RunTwice()
+        self.assertEqual((first / "a.txt").read_text(), "alpha")
+        self.assertEqual((second / "a.txt").read_text(), "alpha, changed")
+        self.assertEqual((second / "sub" / "b.txt").read_text(), "bravo")
+
+    def test_copy_falls_back_to_sendfile(self):
+        unsupported = OSError(errno.EXDEV, "cross-device")
+        with mock.patch.object(backupcore, "_reflink_file", return_value=False), \
+             mock.patch.object(backupcore, "_copy_with_copy_file_range", side_effect=unsupported):
+            snapshot = Path(LocalBackupHandler().run(self.job).artifact_path)
+        self.assertEqual((snapshot / "a.txt").read_text(), "alpha")
+
+    def test_throttled_copy_is_paid_for_in_steps(self):
+        consumed = []
+        limiter = mock.Mock(consume=consumed.append)
+        source = self.workdir / "large.bin"
+        source.write_bytes(os.urandom(backupcore.THROTTLE_CHUNK_SIZE * 2 + 100))
+        copied = backupcore._copy_file_in_kernel(source, self.workdir / "copy.bin", limiter)
+        self.assertEqual(copied, source.stat().st_size)
+        self.assertEqual(sum(consumed), copied)
+        self.assertLessEqual(max(consumed), backupcore.THROTTLE_CHUNK_SIZE)
+        self.assertEqual((self.workdir / "copy.bin").read_bytes(), source.read_bytes())
+
+    def test_interrupted_snapshot_is_not_used_as_base(self):
+        handler = LocalBackupHandler()
+        (self.workdir / "snapshots").mkdir()
+        (self.workdir / "snapshots" / "test-job-001-20990101T000000Z.partial").mkdir()
+        self.assertIsNone(handler.latest_snapshot(self.job))
+        snapshot = Path(handler.run(self.job).artifact_path)
+        self.assertEqual(handler.latest_snapshot(self.job), snapshot)
+
+    def test_snapshot_of_another_job_is_not_used_as_base(self):
+        other = self.workdir / "snapshots" / "test-job-001-prod-20990101T000000Z"
+        (other / "sub").mkdir(parents=True)
+        (other / "sub" / "b.txt").write_text("other")
+        shutil.copystat(self.source / "sub" / "b.txt", other / "sub" / "b.txt")
+        handler = LocalBackupHandler()
+        self.assertIsNone(handler.latest_snapshot(self.job))
+        with mock.patch.object(backupcore, "_reflink_file", return_value=False):
+            snapshot = Path(handler.run(self.job).artifact_path)
+        self.assertEqual((snapshot / "sub" / "b.txt").read_text(), "bravo")
+        self.assertEqual(handler.latest_snapshot(self.job), snapshot)
+
+    def test_runs_started_within_one_second_get_their_own_names(self):
+        started = datetime(2025, 11, 3, 2, 0, tzinfo=timezone.utc)
+        names = {backupcore.artifact_name(self.job, started + timedelta(microseconds=offset)) for offset in (0, 1)}
+        self.assertEqual(len(names), 2)
+        self.assertEqual(max(names), "test-job-001-20251103T020000000001Z")
+
+    def test_compressed_backup_writes_archive(self):
+        self.job.compression = True
+        result = LocalBackupHandler().run(self.job)
+        archive = Path(result.artifact_path)
+        self.assertEqual(archive.parent, self.workdir / "snapshots")
+        self.assertEqual(ReadArchive(archive), {"source/a.txt": b"alpha", "source/sub/b.txt": b"bravo"})
+        self.assertEqual(result.bytes_written, archive.stat().st_size)
+
+    def RunArchivesWithRetention(self, count, limit_mb, policy=jobs.BackupRetentionPolicy.DELETE_OLDEST):
+        handler = LocalBackupHandler()
+        handler.retention = RetentionManager(RetentionCatalog(self.workdir / "retention.sqlite3"))
+        self.job.compression = True
+        self.job.max_file_retention_size = limit_mb
+        self.job.retention_policy = policy
+        (self.source / "random.bin").write_bytes(os.urandom(700 * 1024))
+        for day in range(1, count + 1):
+            with mock.patch.object(backupcore, "artifact_name", return_value=f"test-job-001-202511{day:02d}T020000Z"):
+                handler.run(self.job)
+        return handler
+
+    def test_delete_oldest_keeps_archives_under_limit(self):
+        handler = self.RunArchivesWithRetention(4, limit_mb=2)
+        self.assertEqual(sorted(path.name for path in (self.workdir / "snapshots").iterdir()),
+                         ["test-job-001-20251103T020000Z.tar.gz", "test-job-001-20251104T020000Z.tar.gz"])
+        self.assertEqual(handler.retention.catalog.artifact_count(self.job.job_id), 2)
+
+    def test_keep_all_fails_once_limit_is_reached(self):
+        with self.assertRaises(BackupError):
+            self.RunArchivesWithRetention(4, limit_mb=2, policy=jobs.BackupRetentionPolicy.KEEP_ALL)
+        self.assertEqual(len(list((self.workdir / "snapshots").iterdir())), 3)
+
+    def test_reconciliation_finds_existing_backups(self):
+        self.job.compression = True
+        LocalBackupHandler().run(self.job)
+        handler = LocalBackupHandler()
+        handler.retention = RetentionManager(RetentionCatalog(self.workdir / "retention.sqlite3"))
+        with mock.patch.object(backupcore, "artifact_name", return_value="test-job-001-20990101T000000Z"):
+            handler.run(self.job)
+        self.assertEqual(handler.retention.catalog.artifact_count(self.job.job_id), 2)
+
+    def test_chunked_snapshot_reuses_unchanged_files(self):
+        self.job.chunked = True
+        handler = ChunkedBackupHandler()
+        first = handler.run(self.job)
+        self.assertEqual(first.files_transferred, 2)
+        (self.source / "a.txt").write_text("alpha, changed")
+        with mock.patch.object(backupcore, "artifact_name", return_value="test-job-001-20990101T000000Z"):
+            second = handler.run(self.job)
+        self.assertEqual(second.files_transferred, 1)
+        self.assertEqual(second.bytes_read, len("alpha, changed"))
+
+        store = ChunkStore(LocalChunkBackend(self.workdir / "snapshots"))
+        store.restore("test-job-001-20990101T000000Z", self.workdir / "restored")
+        self.assertEqual((self.workdir / "restored" / "a.txt").read_text(), "alpha, changed")
+        self.assertEqual((self.workdir / "restored" / "sub" / "b.txt").read_text(), "bravo")
+
+    def test_chunked_snapshot_ignores_manifests_of_another_job(self):
+        self.job.chunked = True
+        store = ChunkStore(LocalChunkBackend(self.workdir / "snapshots"))
+        stat = (self.source / "a.txt").stat()
+        store.write_manifest("test-job-001-prod-20990101T000000Z", {"files": [
+            {"path": "a.txt", "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "mode": 0o644,
+             "chunks": store.store_file(self.source / "sub" / "b.txt")}]})
+        result = ChunkedBackupHandler().run(self.job)
+        self.assertEqual(result.files_transferred, 2)
+        store.restore(store.latest_manifest(self.job.job_id), self.workdir / "restored")
+        self.assertEqual((self.workdir / "restored" / "a.txt").read_text(), "alpha")
+
+    def test_retention_does_not_cover_chunked_jobs(self):
+        self.job.chunked = True
+        self.job.max_file_retention_size = 1
+        self.job.retention_policy = jobs.BackupRetentionPolicy.KEEP_ALL
+        handler = ChunkedBackupHandler()
+        handler.retention = RetentionManager(RetentionCatalog(self.workdir / "retention.sqlite3"))
+        (self.source / "random.bin").write_bytes(os.urandom(2 * 1024 * 1024))
+        for day in range(1, 4):
+            with mock.patch.object(backupcore, "artifact_name", return_value=f"test-job-001-202511{day:02d}T020000Z"):
+                self.assertIsNone(handler.run(self.job).artifact_name)
+        self.assertEqual(handler.retention.catalog.artifact_count(self.job.job_id), 0)
+        self.assertEqual(len(list((self.workdir / "snapshots" / "snapshots").iterdir())), 3)
+
+    def test_get_handler_for_chunked_job(self):
+        self.addCleanup(close_handlers)
+        self.job.chunked = True
+        with mock.patch("abackup.backupcore.get_retention_catalog"):
+            self.assertIsInstance(get_handler(self.job), ChunkedBackupHandler)
+
+    def test_get_handler_for_local_type(self):
+        self.addCleanup(close_handlers)
+        with mock.patch("abackup.backupcore.get_retention_catalog"):
+            self.assertIsInstance(get_handler(self.job), LocalBackupHandler)
+
+class TestGetHandler(unittest.TestCase):
+
+    def test_google_drive_handler(self):
+        self.addCleanup(close_handlers)
+        with mock.patch("abackup.backupcore.get_rclone_pool"), mock.patch("abackup.backupcore.get_file_index"), \
+             mock.patch("abackup.backupcore.get_retention_catalog"):
+            self.assertIsInstance(get_handler(InitializeJobWithGoodValues()), GoogleDriveBackupHandler)
+
+    def test_null_backup_type_has_no_handler(self):
+        job = InitializeJobWithGoodValues()
+        job.BackupType = jobs.BackupType.NULL
+        with self.assertRaises(BackupError):
+            get_handler(job)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import unittest
+import importlib.util
+import io
+import os
+import random
+import sys
+import tempfile
+import abackup
+from abackup import chunkstore
+from abackup.chunkstore import Chunker, ChunkStore, ChunkStoreError, LocalChunkBackend
+from pathlib import Path
+from unittest import mock
+
+def RandomBytes(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+def InitializeSmallChunker():
+    return Chunker(min_size=1024, average_size=4096, max_size=16384)
+
+# Imports a separate copy of chunkstore as if the _gearscan extension had failed to build
+def ImportChunkstoreWithoutExtension():
+    extension = abackup.__dict__.pop("_gearscan", None)
+    try:
+        with mock.patch.dict(sys.modules, {"abackup._gearscan": None}):
+            spec = importlib.util.spec_from_file_location("chunkstore_without_extension", chunkstore.__file__)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+    finally:
+        if extension is not None:
+            abackup._gearscan = extension
+    return module
+
+class TestChunker(unittest.TestCase):
+
+    def test_chunks_reassemble_input(self):
+        data = RandomBytes(200_000)
+        chunks = list(InitializeSmallChunker().chunks(io.BytesIO(data)))
+        self.assertEqual(b"".join(chunks), data)
+        self.assertTrue(all(1024 <= len(chunk) <= 16384 for chunk in chunks[:-1]))
+
+    def test_insertion_only_changes_nearby_chunks(self):
+        chunker = InitializeSmallChunker()
+        data = RandomBytes(400_000)
+        edited = data[:100_000] + b"inserted bytes" + data[100_000:]
+        before = list(chunker.chunks(io.BytesIO(data)))
+        after = list(chunker.chunks(io.BytesIO(edited)))
+        self.assertLessEqual(len(set(after) - set(before)), 3)
+
+    def test_repetitive_data_is_cut_at_max_size(self):
+        chunks = list(InitializeSmallChunker().chunks(io.BytesIO(bytes(50_000))))
+        self.assertEqual([len(chunk) for chunk in chunks], [16384, 16384, 16384, 848])
+
+    def test_empty_file_has_no_chunks(self):
+        self.assertEqual(list(InitializeSmallChunker().chunks(io.BytesIO(b""))), [])
+
+    def test_invalid_sizes_raise(self):
+        with self.assertRaises(ValueError):
+            Chunker(min_size=4096, average_size=1024, max_size=16384)
+
+    def test_python_fallback_cuts_at_the_same_places(self):
+        data = RandomBytes(300_000, seed=1)
+        chunks = list(InitializeSmallChunker().chunks(io.BytesIO(data)))
+        with mock.patch.object(chunkstore, "_gearscan", None):
+            self.assertEqual(list(InitializeSmallChunker().chunks(io.BytesIO(data))), chunks)
+
+    def test_chunker_works_when_the_extension_cannot_be_imported(self):
+        module = ImportChunkstoreWithoutExtension()
+        self.assertIsNone(module._gearscan)
+        data = RandomBytes(300_000, seed=3)
+        chunker = module.Chunker(min_size=1024, average_size=4096, max_size=16384)
+        self.assertEqual(list(chunker.chunks(io.BytesIO(data))), list(InitializeSmallChunker().chunks(io.BytesIO(data))))
+
+    @unittest.skipIf(chunkstore._gearscan is None, "the _gearscan extension is not built")
+    def test_native_scan_matches_the_python_scan(self):
+        data = RandomBytes(100_000, seed=2)
+        for min_size, average_size, max_size in ((1024, 4096, 16384), (64, 256, 1024), (1, 2, 3)):
+            chunker = Chunker(min_size=min_size, average_size=average_size, max_size=max_size)
+            for start in (0, 1, 50_000, 99_990, 100_000):
+                limit = min(len(data) - start, max_size)
+                self.assertEqual(chunker.find_boundary(data, start), chunker._find_boundary_python(data, start, limit))
+
+    @unittest.skipIf(chunkstore._gearscan is None, "the _gearscan extension is not built")
+    def test_native_scan_rejects_a_range_outside_the_data(self):
+        with self.assertRaises(ValueError):
+            chunkstore._gearscan.find_boundary(b"abc", 0, 4, chunkstore._GEAR_TABLE_BYTES, 0)
+
+class TestChunkStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tempdir.name)
+        self.backend = LocalChunkBackend(self.root / "store")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def InitializeStore(self):
+        return ChunkStore(self.backend, InitializeSmallChunker())
+
+    def test_identical_chunks_are_stored_once(self):
+        path = self.root / "data.bin"
+        path.write_bytes(RandomBytes(100_000) * 2)
+        store = self.InitializeStore()
+        chunk_ids = store.store_file(path)
+        self.assertEqual(store.chunks_stored, len(set(chunk_ids)))
+        self.assertEqual(self.backend.list_chunks(), set(chunk_ids))
+
+    def test_second_store_only_writes_new_chunks(self):
+        path = self.root / "data.bin"
+        data = RandomBytes(100_000)
+        path.write_bytes(data)
+        self.InitializeStore().store_file(path)
+        path.write_bytes(data + RandomBytes(20_000, seed=1))
+        store = self.InitializeStore()
+        store.store_file(path)
+        self.assertLess(store.bytes_stored, 40_000)
+
+    def test_compressible_chunks_are_compressed(self):
+        path = self.root / "text.txt"
+        path.write_bytes(b"abackup " * 10_000)
+        store = self.InitializeStore()
+        store.store_file(path)
+        self.assertLess(store.bytes_stored, 10_000)
+
+    def test_manifest_round_trip_and_latest(self):
+        store = self.InitializeStore()
+        store.write_manifest("job-20251103T020000Z", {"files": []})
+        store.write_manifest("job-20251104T020000Z", {"files": []})
+        store.write_manifest("job-b-20251105T020000Z", {"files": []})
+        self.assertEqual(store.latest_manifest("job"), "job-20251104T020000Z")
+        self.assertEqual(store.latest_manifest("job-b"), "job-b-20251105T020000Z")
+        self.assertIsNone(store.latest_manifest("other"))
+        self.assertEqual(store.read_manifest("job-20251103T020000Z")["files"], [])
+
+    def test_restore_recreates_files(self):
+        path = self.root / "data.bin"
+        path.write_bytes(RandomBytes(50_000))
+        store = self.InitializeStore()
+        stat = path.stat()
+        store.write_manifest("snap", {"directories": ["empty"], "files": [
+            {"path": "sub/data.bin", "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "mode": 0o640,
+             "chunks": store.store_file(path)}]})
+        store.restore("snap", self.root / "restored")
+        restored = self.root / "restored" / "sub" / "data.bin"
+        self.assertEqual(restored.read_bytes(), path.read_bytes())
+        self.assertEqual(restored.stat().st_mtime_ns, stat.st_mtime_ns)
+        self.assertTrue((self.root / "restored" / "empty").is_dir())
+
+    def test_corrupt_chunk_raises(self):
+        store = self.InitializeStore()
+        chunk_id = store.store_chunk(b"some data")
+        self.backend.put_chunk(chunk_id, b"r" + b"other data")
+        with self.assertRaises(ChunkStoreError):
+            store.load_chunk(chunk_id)
+
+    def test_missing_manifest_raises(self):
+        with self.assertRaises(ChunkStoreError):
+            self.InitializeStore().read_manifest("missing")
+
+
+if __name__ == '__main__':
+    unittest.main()
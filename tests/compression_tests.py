@@ -0,0 +1,112 @@
+import unittest
+import io
+import os
+import random
+import tempfile
+from abackup import compression
+from abackup.compression import (ParallelCompressor, byte_entropy, codec_available, compress_block, decompress,
+                                 is_probably_compressed)
+from abackup.jobs import CompressionCodec
+from pathlib import Path
+from unittest import mock
+
+def CompressibleBytes(size):
+    words = [b"backup", b"schedule", b"rclone", b"snapshot", b"chunk", b"daemon"]
+    generator = random.Random(0)
+    data = bytearray()
+    while len(data) < size:
+        data += generator.choice(words) + b" "
+    return bytes(data[:size])
+
+class TestCompressBlock(unittest.TestCase):
+
+    def test_round_trip_for_available_codecs(self):
+        data = CompressibleBytes(100_000)
+        for codec in CompressionCodec:
+            if not codec_available(codec):
+                continue
+            with self.subTest(codec=codec):
+                compressed = compress_block(codec, data, None)
+                self.assertLess(len(compressed), len(data))
+                self.assertEqual(decompress(codec, compressed), data)
+
+    def test_store_mode_does_not_compress_gzip(self):
+        data = CompressibleBytes(100_000)
+        self.assertGreater(len(compress_block(CompressionCodec.GZIP, data, store=True)), len(data))
+
+    def test_missing_optional_codec_raises(self):
+        with mock.patch.object(compression, "zstandard", None):
+            self.assertFalse(codec_available(CompressionCodec.ZSTD))
+            with self.assertRaises(ValueError):
+                compress_block(CompressionCodec.ZSTD, b"data")
+
+class TestParallelCompressor(unittest.TestCase):
+
+    def test_output_is_one_valid_stream(self):
+        data = CompressibleBytes(1_000_000)
+        for codec in CompressionCodec:
+            if not codec_available(codec):
+                continue
+            with self.subTest(codec=codec):
+                output = io.BytesIO()
+                with ParallelCompressor(output, codec, threads=4, block_size=64 * 1024) as compressor:
+                    for offset in range(0, len(data), 10_000):
+                        compressor.write(data[offset:offset + 10_000])
+                self.assertEqual(decompress(codec, output.getvalue()), data)
+                self.assertEqual(compressor.bytes_in, len(data))
+                self.assertEqual(compressor.bytes_out, len(output.getvalue()))
+
+    def test_pending_blocks_are_bounded(self):
+        written = []
+        compressor = ParallelCompressor(mock.Mock(write=written.append), threads=2, block_size=1024)
+        compressor.write(CompressibleBytes(100 * 1024))
+        self.assertLessEqual(len(compressor._pending), 4)
+        self.assertGreater(len(written), 0)
+        compressor.close()
+        self.assertEqual(len(written), 100)
+
+    def test_incompressible_data_is_stored(self):
+        data = random.Random(1).randbytes(200_000)
+        output = io.BytesIO()
+        with mock.patch.object(compression, "compress_block", wraps=compress_block) as compress:
+            with ParallelCompressor(output, threads=2, block_size=64 * 1024) as compressor:
+                compressor.write(b"text " * 1000)
+                compressor.set_compressible(False)
+                compressor.write(data)
+        self.assertEqual(decompress(CompressionCodec.GZIP, output.getvalue()), b"text " * 1000 + data)
+        stored = [call.args[3] for call in compress.call_args_list]
+        self.assertEqual(stored[0], False)
+        self.assertTrue(all(stored[1:]))
+
+    def test_invalid_level_raises(self):
+        with self.assertRaises(ValueError):
+            ParallelCompressor(io.BytesIO(), CompressionCodec.GZIP, level=42)
+
+class TestIsProbablyCompressed(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tempdir.name)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_compressed_extension(self):
+        path = self.root / "photo.JPG"
+        path.write_bytes(b"not really a photo")
+        self.assertTrue(is_probably_compressed(path))
+
+    def test_random_content(self):
+        path = self.root / "blob.bin"
+        path.write_bytes(os.urandom(64 * 1024))
+        self.assertTrue(is_probably_compressed(path))
+
+    def test_text_content(self):
+        path = self.root / "notes.txt"
+        path.write_bytes(CompressibleBytes(64 * 1024))
+        self.assertFalse(is_probably_compressed(path))
+        self.assertLess(byte_entropy(path.read_bytes()), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import asyncio
+import socket
+import sys
+import tempfile
+import abackup.control as control
+from pathlib import Path
+from abackup.control import ControlClient, ControlError, DaemonNotRunningError, MESSAGE_HEADER, decode_message, encode_message
+from abackup.controlserver import ControlServer
+from unittest import mock
+
+class TestControlMessages(unittest.TestCase):
+
+    def test_round_trip(self):
+        message = {"command": "run", "args": {"job_id": "nightly-é"}}
+        encoded = encode_message(message)
+        size, = MESSAGE_HEADER.unpack(encoded[:MESSAGE_HEADER.size])
+        self.assertEqual(size, len(encoded) - MESSAGE_HEADER.size)
+        self.assertEqual(decode_message(encoded[MESSAGE_HEADER.size:]), message)
+        with self.assertRaises(ControlError):
+            decode_message(b"{not json")
+
+    def test_client_without_unix_sockets(self):
+        with mock.patch.object(control, "CONTROL_CHANNEL_AVAILABLE", False), \
+             self.assertRaisesRegex(ControlError, "cannot be controlled on this platform"):
+            ControlClient("control.sock").call("status")
+
+@unittest.skipIf(sys.platform == "win32", "the control channel uses Unix sockets")
+class TestControlServer(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tempdir.name) / "control.sock"
+        self.calls = []
+        self.server = ControlServer(self.path, {"echo": self.Echo, "fail": self.Fail})
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+        self.tempdir.cleanup()
+
+    async def Echo(self, value):
+        self.calls.append(value)
+        return {"value": value}
+
+    async def Fail(self):
+        raise ValueError("Job 'x' is disabled.")
+
+    async def Call(self, client, command, **args):
+        return await asyncio.to_thread(client.call, command, **args)
+
+    async def test_requests_share_a_connection(self):
+        with ControlClient(self.path) as client:
+            self.assertEqual(await self.Call(client, "echo", value=1), {"value": 1})
+            connection = client._socket
+            self.assertEqual(await self.Call(client, "echo", value=[2]), {"value": [2]})
+            self.assertIs(client._socket, connection)
+        self.assertEqual(self.calls, [1, [2]])
+        self.assertEqual(self.path.stat().st_mode & 0o777, 0o600)
+
+    async def test_errors_are_reported_to_the_client(self):
+        with ControlClient(self.path) as client:
+            with self.assertRaisesRegex(ControlError, "is disabled"):
+                await self.Call(client, "fail")
+            with self.assertRaisesRegex(ControlError, "Unknown command"):
+                await self.Call(client, "explode")
+            with self.assertRaisesRegex(ControlError, "Invalid arguments"):
+                await self.Call(client, "echo", other=1)
+            # The connection survives rejected commands
+            self.assertEqual(await self.Call(client, "echo", value="ok"), {"value": "ok"})
+
+    async def test_second_server_is_refused_and_stale_socket_replaced(self):
+        with self.assertRaisesRegex(ControlError, "Another abackup daemon"):
+            await ControlServer(self.path, {}).start()
+        await self.server.close()
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(str(self.path))
+        stale.close()
+        self.server = ControlServer(self.path, {"echo": self.Echo})
+        await self.server.start()
+        with ControlClient(self.path) as client:
+            self.assertEqual(await self.Call(client, "echo", value=3), {"value": 3})
+
+    def test_client_without_daemon(self):
+        with self.assertRaises(DaemonNotRunningError):
+            ControlClient(Path(self.tempdir.name) / "missing.sock").call("status")
+
+if __name__ == "__main__":
+    unittest.main()
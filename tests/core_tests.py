@@ -0,0 +1,182 @@
+import unittest
+import asyncio
+import threading
+import abackup.jobs as jobs
+from abackup.core import BackupJobExecutor, destination_key
+from jobs_tests import InitializeJobWithGoodValues
+
+def InitializeQueuedJob(job_id, destination_url="gdrive:backups", backup_type=jobs.BackupType.GOOGLEDRIVE):
+    job = InitializeJobWithGoodValues(job_id)
+    job.status = jobs.JobStatus.QUEUED
+    job.destination_url = destination_url
+    job.BackupType = backup_type
+    return job
+
+# Blocks each job until released so tests can observe what runs concurrently
+class GatedPerformer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+        self.running = 0
+        self.max_running = 0
+        self.gates = {}
+
+    def __call__(self, job):
+        with self.lock:
+            self.started.append(job.job_id)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            gate = self.gates.setdefault(job.job_id, threading.Event())
+        gate.wait(5)
+        with self.lock:
+            self.running -= 1
+        if job.job_id.startswith("fail"):
+            raise RuntimeError("job failed")
+
+    def release(self, job_id):
+        with self.lock:
+            self.gates.setdefault(job_id, threading.Event()).set()
+
+    def release_all(self):
+        with self.lock:
+            for gate in self.gates.values():
+                gate.set()
+
+async def WaitUntil(predicate, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate() and loop.time() < deadline:
+        await asyncio.sleep(0.005)
+
+class TestDestinationKey(unittest.TestCase):
+
+    def test_rclone_remote(self):
+        self.assertEqual(destination_key("gdrive:backups/a"), destination_key("gdrive:other/b"))
+
+    def test_url_host(self):
+        self.assertEqual(destination_key("https://bucket.example.com/a"), "https://bucket.example.com")
+
+    def test_local_path(self):
+        self.assertEqual(destination_key("/mnt/backups"), "/mnt/backups")
+
+class TestBackupJobExecutor(unittest.IsolatedAsyncioTestCase):
+
+    async def test_global_worker_cap(self):
+        performer = GatedPerformer()
+        executor = BackupJobExecutor(performer, max_workers=2)
+        for index in range(5):
+            executor.submit(InitializeQueuedJob(f"job-{index}", destination_url=f"remote{index}:"))
+        await WaitUntil(lambda: len(performer.started) == 2)
+        self.assertEqual(executor.running_count, 2)
+        self.assertEqual(executor.pending_count, 3)
+        performer.release_all()
+        for index in range(5):
+            performer.release(f"job-{index}")
+        await asyncio.wait_for(executor.join(), 5)
+        self.assertEqual(performer.max_running, 2)
+        self.assertEqual(performer.started, [f"job-{index}" for index in range(5)])
+        executor.shutdown()
+
+    async def test_destination_limit_does_not_block_other_destinations(self):
+        performer = GatedPerformer()
+        executor = BackupJobExecutor(performer, max_workers=4, destination_limit=1)
+        executor.submit(InitializeQueuedJob("a1", destination_url="remote-a:x"))
+        executor.submit(InitializeQueuedJob("a2", destination_url="remote-a:y"))
+        executor.submit(InitializeQueuedJob("b1", destination_url="remote-b:x"))
+        await WaitUntil(lambda: len(performer.started) == 2)
+        self.assertEqual(sorted(performer.started), ["a1", "b1"])
+        self.assertEqual(executor.pending_count, 1)
+        performer.release("a1")
+        await WaitUntil(lambda: "a2" in performer.started)
+        self.assertIn("a2", performer.started)
+        performer.release_all()
+        performer.release("a2")
+        await asyncio.wait_for(executor.join(), 5)
+        executor.shutdown()
+
+    async def test_backup_type_limit(self):
+        performer = GatedPerformer()
+        executor = BackupJobExecutor(performer, max_workers=4,
+                                     backup_type_limits={jobs.BackupType.GOOGLEDRIVE: 1})
+        executor.submit(InitializeQueuedJob("g1", destination_url="r1:"))
+        executor.submit(InitializeQueuedJob("g2", destination_url="r2:"))
+        await WaitUntil(lambda: len(performer.started) == 1)
+        await asyncio.sleep(0.05)
+        self.assertEqual(performer.started, ["g1"])
+        performer.release("g1")
+        performer.release("g2")
+        await asyncio.wait_for(executor.join(), 5)
+        self.assertEqual(performer.max_running, 1)
+        executor.shutdown()
+
+    async def test_status_transitions(self):
+        performer = GatedPerformer()
+        transitions = []
+        finished = []
+        def SetStatus(job_id, status):
+            transitions.append((job_id, status))
+            jobs_by_id[job_id].status = status
+        good = InitializeQueuedJob("good")
+        bad = InitializeQueuedJob("fail-1")
+        jobs_by_id = {"good": good, "fail-1": bad}
+        executor = BackupJobExecutor(performer, max_workers=2, set_status=SetStatus,
+                                     on_job_finished=lambda job, status: finished.append((job.job_id, status)))
+        executor.submit(good)
+        executor.submit(bad)
+        await WaitUntil(lambda: good.status == jobs.JobStatus.RUNNING and bad.status == jobs.JobStatus.RUNNING)
+        performer.release("good")
+        performer.release("fail-1")
+        with self.assertLogs("abackup.core", "ERROR"):
+            await asyncio.wait_for(executor.join(), 5)
+        self.assertEqual(good.status, jobs.JobStatus.COMPLETED)
+        self.assertEqual(bad.status, jobs.JobStatus.FAILED)
+        self.assertEqual([status for job_id, status in transitions if job_id == "good"],
+                         [jobs.JobStatus.RUNNING, jobs.JobStatus.COMPLETED])
+        self.assertEqual(sorted(finished), [("fail-1", jobs.JobStatus.FAILED), ("good", jobs.JobStatus.COMPLETED)])
+        executor.shutdown()
+
+    async def test_submit_rejects_non_queued_and_duplicate_jobs(self):
+        performer = GatedPerformer()
+        executor = BackupJobExecutor(performer, max_workers=1)
+        with self.assertRaises(ValueError):
+            executor.submit(InitializeJobWithGoodValues()) # SCHEDULED, not QUEUED
+        job = InitializeQueuedJob("job")
+        executor.submit(job)
+        with self.assertRaises(ValueError):
+            executor.submit(job)
+        performer.release("job")
+        await asyncio.wait_for(executor.join(), 5)
+        executor.shutdown()
+
+    async def test_job_disabled_while_pending_is_dropped(self):
+        performer = GatedPerformer()
+        executor = BackupJobExecutor(performer, max_workers=1)
+        executor.submit(InitializeQueuedJob("first"))
+        second = InitializeQueuedJob("second")
+        executor.submit(second)
+        second.status = jobs.JobStatus.DISABLED
+        performer.release("first")
+        await asyncio.wait_for(executor.join(), 5)
+        self.assertEqual(performer.started, ["first"])
+        executor.shutdown()
+
+    async def test_pending_job_is_looked_up_again_before_it_starts(self):
+        performer = GatedPerformer()
+        ran = []
+        pool = {job_id: InitializeQueuedJob(job_id) for job_id in ("first", "removed", "changed")}
+        executor = BackupJobExecutor(lambda job: (ran.append(job), performer(job)), max_workers=1,
+                                     current_job=lambda job: pool.get(job.job_id))
+        for job in list(pool.values()):
+            executor.submit(job)
+        del pool["removed"]
+        pool["changed"] = InitializeQueuedJob("changed", destination_url="gdrive:elsewhere")
+        performer.release("first")
+        performer.release("changed")
+        await asyncio.wait_for(executor.join(), 5)
+        self.assertEqual(performer.started, ["first", "changed"])
+        self.assertIs(ran[1], pool["changed"])
+        executor.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from abackup.cron import CronExpression
+from datetime import datetime, timedelta
+
+def NextTimeByStepping(cron, start):
+    date_time = start
+    while not cron.matches(date_time):
+        date_time += timedelta(minutes=1)
+    return date_time
+
+class TestCronExpression(unittest.TestCase):
+
+    def test_every_fifteen_minutes(self):
+        cron = CronExpression("*/15 * * * *")
+        self.assertEqual(cron.next_time(datetime(2025, 11, 3, 2, 1)), datetime(2025, 11, 3, 2, 15))
+        self.assertEqual(cron.next_time(datetime(2025, 11, 3, 2, 15)), datetime(2025, 11, 3, 2, 15))
+        self.assertEqual(cron.next_time(datetime(2025, 11, 3, 23, 50)), datetime(2025, 11, 4, 0, 0))
+
+    def test_seconds_round_up(self):
+        cron = CronExpression("* * * * *")
+        self.assertEqual(cron.next_time(datetime(2025, 11, 3, 2, 0, 1)), datetime(2025, 11, 3, 2, 1))
+
+    def test_names_ranges_and_lists(self):
+        cron = CronExpression("30 4 * jan-mar mon,wed,fri")
+        self.assertEqual(cron.next_time(datetime(2025, 11, 3)), datetime(2026, 1, 2, 4, 30)) # First Friday
+        self.assertEqual(CronExpression("0 0 * * 7"), CronExpression("0 0 * * sun"))
+
+    def test_restricted_day_fields_match_either(self):
+        cron = CronExpression("0 0 13 * fri")
+        self.assertEqual(cron.next_time(datetime(2025, 11, 3)), datetime(2025, 11, 7)) # Friday before the 13th
+        self.assertTrue(cron.matches(datetime(2025, 11, 13)))
+
+    def test_leap_day(self):
+        self.assertEqual(CronExpression("0 0 29 2 *").next_time(datetime(2025, 3, 1)), datetime(2028, 2, 29))
+
+    def test_macros(self):
+        self.assertEqual(CronExpression("@hourly"), CronExpression("0 * * * *"))
+        self.assertEqual(CronExpression("@weekly").next_time(datetime(2025, 11, 3)), datetime(2025, 11, 9))
+
+    def test_matches_stepping_search(self):
+        start = datetime(2025, 1, 1, 0, 0)
+        for text in ("5/20 */3 31 * *", "0 12 * jan-mar mon-fri", "59 23 31 12 *", "0 0 1,15 * 3"):
+            cron = CronExpression(text)
+            for days in (0, 37, 200, 300):
+                date_time = start + timedelta(days=days, minutes=days * 7)
+                with self.subTest(text=text, start=date_time):
+                    self.assertEqual(cron.next_time(date_time), NextTimeByStepping(cron, date_time))
+
+    def test_invalid_expressions_raise(self):
+        for text in ("* * * *", "60 * * * *", "*/0 * * * *", "0 0 * foo *", "0 0 30 2 *", "5-1 * * * *"):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                CronExpression(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,290 @@
+# A local stand-in for `rclone rcd` used to test the rclone handlers offline.
+#
+# Usage mirrors rclone: fake_rclone.py rcd --rc-addr=127.0.0.1:PORT --rc-user=U --rc-pass=P
+# Remotes are plain directories: "remote:path" maps to $FAKE_RCLONE_ROOT/remote/path,
+# and anything without a remote prefix is treated as a local path.
+# Only the subset of the rc API used by abackup is implemented.
+import base64
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(os.environ.get("FAKE_RCLONE_ROOT", "."))
+
+def ResolveFs(fs: str) -> Path:
+    remote, separator, path = fs.partition(":")
+    if separator and remote and "/" not in remote and len(remote) > 1:
+        return ROOT / remote / path
+    return Path(fs)
+
+class FakeRCloneState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.job_ids = itertools.count(1)
+        self.jobs = {}
+        self.stats = {} # group -> {"bytes": int, "transfers": int}
+        self.bwlimit = "off"
+        self.calls = []
+
+    def add_transfer(self, group, size):
+        with self.lock:
+            stats = self.stats.setdefault(group, {"bytes": 0, "transfers": 0})
+            stats["bytes"] += size
+            stats["transfers"] += 1
+
+STATE = FakeRCloneState()
+
+def CopyFile(source: Path, destination: Path, group):
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(source, destination)
+    STATE.add_transfer(group, source.stat().st_size)
+
+# Returns the relative paths named by a _filter FilesFromRaw option, or None
+def FilesFrom(params):
+    lists = (params.get("_filter") or {}).get("FilesFromRaw")
+    if not lists:
+        return None
+    return [Path(line) for name in lists for line in Path(name).read_text(encoding="utf-8").splitlines() if line]
+
+# Translates an rclone filter glob into a regular expression over paths
+# relative to the root of the transfer
+def RCloneGlob(pattern: str):
+    anchored = pattern.startswith("/")
+    pattern = pattern.lstrip("/")
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile(("" if anchored else "(?:.*/)?") + "".join(parts))
+
+# Returns the _filter option's rules as (include, regex) pairs, in the order
+# rclone applies them: IncludeRule, ExcludeRule, FilterRule, then an implicit
+# "- **" if there were include rules. The first rule that matches decides.
+def FilterRules(params):
+    options = params.get("_filter") or {}
+    rules = [(True, RCloneGlob(rule)) for rule in options.get("IncludeRule") or []]
+    rules += [(False, RCloneGlob(rule)) for rule in options.get("ExcludeRule") or []]
+    for rule in options.get("FilterRule") or []:
+        sign, _, pattern = rule.partition(" ")
+        rules.append((sign == "+", RCloneGlob(pattern)))
+    if options.get("IncludeRule"):
+        rules.append((False, RCloneGlob("**")))
+    return rules
+
+def Included(rules, relative: Path) -> bool:
+    for include, regex in rules:
+        if regex.fullmatch(relative.as_posix()):
+            return include
+    return True
+
+def SyncTree(params, group, delete_extra):
+    source, destination = ResolveFs(params["srcFs"]), ResolveFs(params["dstFs"])
+    files_from = FilesFrom(params)
+    if files_from is not None:
+        for relative in files_from:
+            CopyFile(source / relative, destination / relative, group)
+        return {}
+    max_depth = (params.get("_config") or {}).get("MaxDepth", -1)
+    rules = FilterRules(params)
+    destination.mkdir(parents=True, exist_ok=True)
+    seen = set()
+    for directory, subdirectories, files in os.walk(source):
+        relative_directory = Path(directory).relative_to(source)
+        depth = 0 if relative_directory == Path(".") else len(relative_directory.parts)
+        if max_depth >= 0 and depth + 1 >= max_depth:
+            subdirectories.clear()
+        for name in files:
+            relative = relative_directory / name
+            if not Included(rules, relative):
+                continue
+            seen.add(relative)
+            target = destination / relative
+            source_stat = (source / relative).stat()
+            if target.exists() and target.stat().st_size == source_stat.st_size and \
+               int(target.stat().st_mtime) == int(source_stat.st_mtime):
+                continue
+            CopyFile(source / relative, target, group)
+    if delete_extra:
+        for directory, _, files in os.walk(destination):
+            for name in files:
+                relative = Path(directory).relative_to(destination) / name
+                if relative not in seen and Included(rules, relative): # rclone leaves excluded files alone
+                    (destination / relative).unlink()
+    return {}
+
+def OperationsCopyFile(params, group):
+    CopyFile(ResolveFs(params["srcFs"]) / params["srcRemote"],
+             ResolveFs(params["dstFs"]) / params["dstRemote"], group)
+    return {}
+
+def OperationsMoveFile(params, group):
+    source = ResolveFs(params["srcFs"]) / params["srcRemote"]
+    destination = ResolveFs(params["dstFs"]) / params["dstRemote"]
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    source.rename(destination)
+    return {}
+
+def OperationsDeleteFile(params, group):
+    (ResolveFs(params["fs"]) / params["remote"]).unlink()
+    return {}
+
+def OperationsDelete(params, group):
+    base = ResolveFs(params["fs"])
+    files_from = FilesFrom(params)
+    paths = files_from if files_from is not None else [p.relative_to(base) for p in base.rglob("*") if p.is_file()]
+    for relative in paths:
+        (base / relative).unlink(missing_ok=True)
+    return {}
+
+def OperationsPurge(params, group):
+    shutil.rmtree(ResolveFs(params["fs"]) / params.get("remote", ""))
+    return {}
+
+def OperationsMkdir(params, group):
+    (ResolveFs(params["fs"]) / params.get("remote", "")).mkdir(parents=True, exist_ok=True)
+    return {}
+
+def OperationsList(params, group):
+    base = ResolveFs(params["fs"]) / params.get("remote", "")
+    options = params.get("opt") or {}
+    entries = []
+    if base.exists():
+        paths = base.rglob("*") if options.get("recurse") else base.iterdir()
+        for path in sorted(paths):
+            if options.get("filesOnly") and path.is_dir():
+                continue
+            stat = path.stat()
+            entries.append({"Path": str(path.relative_to(base)), "Name": path.name, "Size": stat.st_size if path.is_file() else -1,
+                            "IsDir": path.is_dir(), "ModTime": stat.st_mtime})
+    return {"list": entries}
+
+ASYNC_METHODS = {
+    "sync/sync": lambda params, group: SyncTree(params, group, delete_extra=True),
+    "sync/copy": lambda params, group: SyncTree(params, group, delete_extra=False),
+    "operations/copyfile": OperationsCopyFile,
+    "operations/deletefile": OperationsDeleteFile,
+    "operations/movefile": OperationsMoveFile,
+    "operations/delete": OperationsDelete,
+    "operations/purge": OperationsPurge,
+    "operations/mkdir": OperationsMkdir,
+    "operations/list": OperationsList,
+}
+
+def RunJob(job_id, method, params):
+    group = f"job/{job_id}"
+    try:
+        output = ASYNC_METHODS[method](params, group)
+        STATE.jobs[job_id].update(finished=True, success=True, output=output)
+    except Exception as e:
+        STATE.jobs[job_id].update(finished=True, success=False, error=str(e))
+
+class FakeRCloneRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if self.headers.get("Authorization") != self.server.authorization:
+            return self.Reply(401, {"error": "authentication required"})
+        method, _, query = self.path.strip("/").partition("?")
+        STATE.calls.append(method)
+        if method == "operations/uploadfile":
+            try:
+                return self.Reply(200, self.UploadFile(urllib.parse.parse_qs(query)))
+            except Exception as e:
+                return self.Reply(500, {"error": str(e)})
+        length = int(self.headers.get("Content-Length") or 0)
+        params = json.loads(self.rfile.read(length) or b"{}")
+        try:
+            self.Reply(200, self.Dispatch(method, params))
+        except KeyError as e:
+            self.Reply(500, {"error": f"missing or unknown {e}"})
+        except Exception as e:
+            self.Reply(500, {"error": str(e)})
+        if method == "core/quit":
+            threading.Thread(target=self.server.shutdown).start()
+
+    # Like rclone, accepts a multipart body, here only with chunked encoding
+    def UploadFile(self, query):
+        if self.headers.get("Transfer-Encoding", "").lower() != "chunked":
+            raise ValueError("fake rclone only accepts chunked uploads")
+        body = bytearray()
+        while True:
+            size = int(self.rfile.readline().split(b";")[0], 16)
+            if size == 0:
+                self.rfile.readline()
+                break
+            body += self.rfile.read(size)
+            self.rfile.readline()
+        boundary = self.headers.get("Content-Type").split("boundary=")[1].encode()
+        part = bytes(body).split(b"--" + boundary)[1]
+        headers, _, data = part.partition(b"\r\n\r\n")
+        name = re.search(rb'filename="([^"]*)"', headers).group(1).decode()
+        target = ResolveFs(query["fs"][0]) / query.get("remote", [""])[0] / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data[:-2]) # Strip the CRLF before the closing boundary
+        STATE.add_transfer("global", len(data) - 2)
+        return {}
+
+    def Dispatch(self, method, params):
+        if method in ("rc/noop", "core/quit"):
+            return {}
+        if method == "core/pid":
+            return {"pid": os.getpid()}
+        if method == "core/stats":
+            with STATE.lock:
+                return dict(STATE.stats.get(params.get("group"), {"bytes": 0, "transfers": 0}))
+        if method == "core/bwlimit":
+            if "rate" in params:
+                STATE.bwlimit = params["rate"]
+            return {"rate": STATE.bwlimit}
+        if method == "job/status":
+            return dict(STATE.jobs[params["jobid"]])
+        if method in ASYNC_METHODS:
+            if params.pop("_async", False):
+                job_id = next(STATE.job_ids)
+                STATE.jobs[job_id] = {"id": job_id, "finished": False, "success": False, "error": "", "output": None}
+                threading.Thread(target=RunJob, args=(job_id, method, params)).start()
+                return {"jobid": job_id}
+            return ASYNC_METHODS[method](params, "global")
+        raise KeyError(method)
+
+    def Reply(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def main(argv):
+    if not argv or argv[0] != "rcd":
+        print("fake_rclone only supports the rcd command", file=sys.stderr)
+        return 2
+    options = dict(arg[2:].split("=", 1) for arg in argv[1:] if arg.startswith("--") and "=" in arg)
+    host, port = options["rc-addr"].rsplit(":", 1)
+    server = ThreadingHTTPServer((host, int(port)), FakeRCloneRequestHandler)
+    credentials = f"{options['rc-user']}:{options['rc-pass']}".encode()
+    server.authorization = "Basic " + base64.b64encode(credentials).decode()
+    server.serve_forever()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,103 @@
+import unittest
+import os
+import tempfile
+from abackup.fileindex import ChangeType, FileStateIndex
+from abackup.walker import PathMatcher
+from pathlib import Path
+from unittest import mock
+
+def ScanChanges(index, root, job_id="job", recursive=True, commit=True):
+    scan = index.scan(job_id, root, recursive)
+    changes = {(change.change_type, change.path) for change in scan}
+    if commit:
+        scan.commit()
+    return changes
+
+class TestFileStateIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tempdir.name) / "source"
+        (self.root / "sub" / "deeper").mkdir(parents=True)
+        (self.root / "a.txt").write_text("alpha")
+        (self.root / "sub" / "b.txt").write_text("bravo")
+        (self.root / "sub" / "deeper" / "c.txt").write_text("charlie")
+        self.index = FileStateIndex(Path(self.tempdir.name) / "index.sqlite3")
+
+    def tearDown(self):
+        self.index.close()
+        self.tempdir.cleanup()
+
+    def test_first_scan_adds_every_file(self):
+        self.assertEqual(ScanChanges(self.index, self.root), {
+            (ChangeType.ADDED, "a.txt"), (ChangeType.ADDED, "sub/b.txt"), (ChangeType.ADDED, "sub/deeper/c.txt")})
+        self.assertEqual(self.index.count("job"), 3)
+
+    def test_unchanged_files_are_not_read(self):
+        ScanChanges(self.index, self.root)
+        with mock.patch("builtins.open") as open_file:
+            self.assertEqual(ScanChanges(self.index, self.root), set())
+        open_file.assert_not_called()
+
+    def test_modified_added_and_deleted(self):
+        ScanChanges(self.index, self.root)
+        (self.root / "a.txt").write_text("alpha, longer")
+        (self.root / "sub" / "b.txt").unlink()
+        (self.root / "sub" / "new.txt").write_text("new")
+        self.assertEqual(ScanChanges(self.index, self.root), {
+            (ChangeType.MODIFIED, "a.txt"), (ChangeType.DELETED, "sub/b.txt"), (ChangeType.ADDED, "sub/new.txt")})
+        self.assertEqual(ScanChanges(self.index, self.root), set())
+
+    def test_removed_directory_deletes_its_subtree(self):
+        ScanChanges(self.index, self.root)
+        for path in sorted((self.root / "sub").rglob("*"), reverse=True):
+            path.rmdir() if path.is_dir() else path.unlink()
+        (self.root / "sub").rmdir()
+        (self.root / "sub").write_text("now a file")
+        self.assertEqual(ScanChanges(self.index, self.root), {
+            (ChangeType.DELETED, "sub/b.txt"), (ChangeType.DELETED, "sub/deeper/c.txt"), (ChangeType.ADDED, "sub")})
+        self.assertEqual(self.index.count("job"), 2)
+
+    def test_discarded_scan_leaves_baseline(self):
+        ScanChanges(self.index, self.root)
+        (self.root / "a.txt").write_text("alpha, longer")
+        scan = self.index.scan("job", self.root)
+        list(scan)
+        scan.discard()
+        self.assertEqual(ScanChanges(self.index, self.root), {(ChangeType.MODIFIED, "a.txt")})
+
+    def test_uncommitted_scan_reports_changes_again(self):
+        self.assertEqual(len(ScanChanges(self.index, self.root, commit=False)), 3)
+        self.assertEqual(len(ScanChanges(self.index, self.root)), 3)
+
+    def test_non_recursive_scan_ignores_subdirectories(self):
+        self.assertEqual(ScanChanges(self.index, self.root, recursive=False), {(ChangeType.ADDED, "a.txt")})
+
+    def test_newly_excluded_files_are_reported_deleted(self):
+        ScanChanges(self.index, self.root)
+        scan = self.index.scan("job", self.root, matcher=PathMatcher(exclude=["deeper", "a.txt"]))
+        self.assertEqual({(change.change_type, change.path) for change in scan},
+                         {(ChangeType.DELETED, "a.txt"), (ChangeType.DELETED, "sub/deeper/c.txt")})
+        scan.commit()
+        self.assertEqual(self.index.count("job"), 1)
+
+    def test_jobs_are_indexed_separately(self):
+        ScanChanges(self.index, self.root, job_id="job-1")
+        self.assertEqual(len(ScanChanges(self.index, self.root, job_id="job-2")), 3)
+        self.index.clear("job-1")
+        self.assertEqual(self.index.count("job-1"), 0)
+        self.assertEqual(self.index.count("job-2"), 3)
+
+    def test_content_hash_ignores_touched_files(self):
+        index = FileStateIndex(Path(self.tempdir.name) / "hashed.sqlite3", hash_contents=True)
+        self.addCleanup(index.close)
+        ScanChanges(index, self.root)
+        stat = (self.root / "a.txt").stat()
+        os.utime(self.root / "a.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        self.assertEqual(ScanChanges(index, self.root), set())
+        (self.root / "a.txt").write_text("ALPHA")
+        self.assertEqual(ScanChanges(index, self.root), {(ChangeType.MODIFIED, "a.txt")})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import asyncio
+import os
+import platform
+import tempfile
+from pathlib import Path
+from unittest import mock
+import abackup.filewatch as filewatch
+from abackup.filewatch import InotifyFileWatcher, PollingFileWatcher, open_file_watcher
+
+class FileWatcherTests:
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tempdir.name) / "schedule.yaml"
+        self.path.write_text("version: 0.0\n", encoding="utf-8")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def OpenWatcher(self):
+        raise NotImplementedError
+
+    async def AssertChanged(self, watcher, timeout=2.0):
+        await asyncio.wait_for(watcher.wait(), timeout)
+
+    async def AssertUnchanged(self, watcher):
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(watcher.wait(), 0.2)
+
+    async def test_write_is_reported(self):
+        watcher = self.OpenWatcher()
+        self.addCleanup(watcher.close)
+        await self.AssertUnchanged(watcher)
+        self.path.write_text("version: 0.0\njobs:\n", encoding="utf-8")
+        await self.AssertChanged(watcher)
+        await self.AssertUnchanged(watcher)
+
+    async def test_replacing_rename_is_reported(self):
+        watcher = self.OpenWatcher()
+        self.addCleanup(watcher.close)
+        temporary = self.path.with_name("schedule.yaml.tmp")
+        temporary.write_text("version: 0.0\njobs: {}\n", encoding="utf-8")
+        os.replace(temporary, self.path)
+        await self.AssertChanged(watcher)
+
+class TestPollingFileWatcher(FileWatcherTests, unittest.IsolatedAsyncioTestCase):
+
+    def OpenWatcher(self):
+        return PollingFileWatcher(self.path, 0.01)
+
+@unittest.skipUnless(platform.system() == "Linux", "inotify is Linux-only")
+class TestInotifyFileWatcher(FileWatcherTests, unittest.IsolatedAsyncioTestCase):
+
+    def OpenWatcher(self):
+        return InotifyFileWatcher(self.path, 0.01)
+
+    async def test_other_files_are_ignored(self):
+        watcher = self.OpenWatcher()
+        self.addCleanup(watcher.close)
+        (self.path.parent / "other.yaml").write_text("", encoding="utf-8")
+        await self.AssertUnchanged(watcher)
+
+    async def test_queue_overflow_is_reported(self):
+        watcher = self.OpenWatcher()
+        self.addCleanup(watcher.close)
+        events = filewatch.INOTIFY_EVENT.pack(-1, filewatch.IN_Q_OVERFLOW, 0, 0)
+        with mock.patch.object(filewatch.os, "read", side_effect=[events, BlockingIOError()]):
+            watcher._read_events()
+        await self.AssertChanged(watcher)
+        await self.AssertUnchanged(watcher)
+
+    async def test_lost_watch_falls_back_to_polling(self):
+        directory = self.path.parent / "config"
+        directory.mkdir()
+        self.path = directory / "schedule.yaml"
+        self.path.write_text("version: 0.0\n", encoding="utf-8")
+        watcher = self.OpenWatcher()
+        self.addCleanup(watcher.close)
+        moved = directory.with_name("moved")
+        with self.assertLogs("abackup.filewatch", "WARNING"):
+            directory.rename(moved)
+            await self.AssertChanged(watcher)
+        moved.rename(directory)
+        self.path.write_text("version: 0.0\njobs:\n", encoding="utf-8")
+        await self.AssertChanged(watcher)
+
+    async def test_falls_back_to_polling_without_inotify(self):
+        with mock.patch.object(filewatch, "InotifyFileWatcher", side_effect=OSError(24, "Too many open files")), \
+             mock.patch.object(filewatch, "Observer", None), self.assertLogs("abackup.filewatch", "WARNING"):
+            watcher = open_file_watcher(self.path, 0.01)
+        self.assertIsInstance(watcher, PollingFileWatcher)
+
+
+if __name__ == '__main__':
+    unittest.main()
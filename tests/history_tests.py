@@ -0,0 +1,113 @@
+import unittest
+import sqlite3
+import tempfile
+import threading
+from abackup.history import RunHistory, RunRecord
+from abackup.jobs import JobStatus
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+START = datetime(2025, 11, 1, 2, 0, tzinfo=timezone.utc)
+
+def InitializeRun(job_id, hour, seconds, status=JobStatus.COMPLETED):
+    started = START + timedelta(hours=hour)
+    return RunRecord(job_id, started, started + timedelta(seconds=seconds), status, bytes_read=100,
+                     bytes_written=50, files=2, exit_code=0 if status == JobStatus.COMPLETED else 3,
+                     error=None if status == JobStatus.COMPLETED else "script failed")
+
+class TestRunHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tempdir.name) / "history.sqlite3"
+        self.history = RunHistory(self.db_path)
+
+    def tearDown(self):
+        self.history.close()
+        self.tempdir.cleanup()
+
+    def test_record_round_trip(self):
+        run = InitializeRun("job", 0, 90, JobStatus.FAILED)
+        run.log_path = "/var/log/abackup.log"
+        run.trace_path = "/var/lib/abackup/traces/job.trace.json"
+        self.history.record(run)
+        self.history.flush()
+        stored = self.history.last_run("job")
+        self.assertEqual((stored.started, stored.ended, stored.status, stored.exit_code, stored.error),
+                         (run.started, run.ended, JobStatus.FAILED, 3, "script failed"))
+        self.assertEqual((stored.bytes_read, stored.bytes_written, stored.files, stored.log_path, stored.trace_path),
+                         (100, 50, 2, "/var/log/abackup.log", "/var/lib/abackup/traces/job.trace.json"))
+        self.assertEqual(stored.duration, 90)
+        self.assertIsNone(self.history.last_run("other"))
+
+    def test_only_finished_runs_are_recorded(self):
+        with self.assertRaises(ValueError):
+            self.history.record(InitializeRun("job", 0, 1, JobStatus.RUNNING))
+
+    def test_last_runs_keeps_newest_per_job(self):
+        for job_id, hour in (("a", 2), ("a", 1), ("b", 0), ("b", 3)):
+            self.history.record(InitializeRun(job_id, hour, 10))
+        self.history.flush()
+        last_runs = self.history.last_runs()
+        self.assertEqual({job_id: run.started for job_id, run in last_runs.items()},
+                         {"a": START + timedelta(hours=2), "b": START + timedelta(hours=3)})
+        self.assertEqual([run.started for run in self.history.runs("a")],
+                         [START + timedelta(hours=2), START + timedelta(hours=1)])
+
+    def test_failures_since(self):
+        self.history.record(InitializeRun("a", 0, 10, JobStatus.FAILED))
+        self.history.record(InitializeRun("a", 5, 10, JobStatus.FAILED))
+        self.history.record(InitializeRun("b", 6, 10, JobStatus.FAILED))
+        self.history.record(InitializeRun("a", 7, 10))
+        self.history.flush()
+        since = START + timedelta(hours=1)
+        self.assertEqual([(run.job_id, run.started.hour) for run in self.history.failures_since(since)],
+                         [("b", 8), ("a", 7)])
+        self.assertEqual(len(self.history.failures_since(since, job_id="a")), 1)
+
+    def test_duration_percentiles(self):
+        for seconds in range(1, 101):
+            self.history.record(InitializeRun("job", seconds, seconds))
+        self.history.record(InitializeRun("job", 200, 5000, JobStatus.FAILED)) # Failures are not counted
+        self.history.flush()
+        self.assertEqual(self.history.duration_percentiles("job"), {50: 50, 90: 90, 99: 99})
+        self.assertEqual(self.history.duration_percentiles("job", (100,)), {100: 100})
+        self.assertEqual(self.history.duration_percentiles("other"), {})
+
+    def test_concurrent_records_are_all_written(self):
+        def RecordRuns(job_id):
+            for hour in range(50):
+                self.history.record(InitializeRun(job_id, hour, 1))
+        threads = [threading.Thread(target=RecordRuns, args=(f"job{i}",)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.history.flush()
+        self.assertEqual(len(self.history.last_runs()), 8)
+        self.assertEqual(sum(len(self.history.runs(f"job{i}")) for i in range(8)), 400)
+
+    def test_close_writes_queued_runs(self):
+        self.history.record(InitializeRun("job", 0, 1))
+        self.history.close()
+        reopened = RunHistory(self.db_path)
+        self.addCleanup(reopened.close)
+        self.assertIsNotNone(reopened.last_run("job"))
+
+    def test_history_without_trace_column_is_upgraded(self):
+        self.history.close()
+        self.db_path.unlink()
+        with sqlite3.connect(self.db_path) as connection:
+            connection.execute("CREATE TABLE runs (id INTEGER PRIMARY KEY, job_id TEXT NOT NULL, started INTEGER NOT NULL, "
+                               "ended INTEGER NOT NULL, duration INTEGER NOT NULL, status TEXT NOT NULL, "
+                               "bytes_read INTEGER NOT NULL, bytes_written INTEGER NOT NULL, files INTEGER NOT NULL, "
+                               "exit_code INTEGER NOT NULL, log_path TEXT, error TEXT)")
+        connection.close()
+        self.history = RunHistory(self.db_path)
+        self.history.record(InitializeRun("job", 0, 1))
+        self.history.flush()
+        self.assertIsNone(self.history.last_run("job").trace_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
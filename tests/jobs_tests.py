@@ -1,7 +1,8 @@
 import unittest
 import abackup.jobs as jobs
 from pathlib import Path
-from datetime import time, tzinfo
+from abackup.cron import CronExpression
+from datetime import time, timedelta, tzinfo
 from zoneinfo import ZoneInfo
 
 def InitializeJobWithGoodValues(job_id="test-job-001"):
@@ -98,6 +99,81 @@ class TestJobDataValidation(unittest.TestCase):
         with self.assertRaises(ValueError) as context:
             job.validate()
     
+    def test_invalid_compression_level(self):
+        job = InitializeJobWithGoodValues()
+        job.compression_level = 10 # gzip levels go up to 9
+        with self.assertRaises(ValueError) as context:
+            job.validate()
+    
+    def test_valid_zstd_compression_level(self):
+        job = InitializeJobWithGoodValues()
+        job.compression_codec = jobs.CompressionCodec.ZSTD
+        job.compression_level = 19
+        job.validate()
+    
+    def test_invalid_compression_threads(self):
+        job = InitializeJobWithGoodValues()
+        job.compression_threads = 0
+        with self.assertRaises(ValueError) as context:
+            job.validate()
+    
+    def test_invalid_chunked_flag(self):
+        job = InitializeJobWithGoodValues()
+        job.chunked = "not_a_boolean"
+        with self.assertRaises(ValueError) as context:
+            job.validate()
+    
+    def test_interval_schedule_validation(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_recurrence_policy = jobs.JobRecurrence.INTERVAL
+        job.schedule_interval = timedelta(minutes=15)
+        job.validate()
+        job.schedule_interval = timedelta(seconds=30)
+        with self.assertRaises(ValueError):
+            job.validate()
+        job.schedule_interval = 15
+        with self.assertRaises(ValueError):
+            job.validate()
+
+    def test_cron_schedule_validation(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_recurrence_policy = jobs.JobRecurrence.CRON
+        job.schedule_cron = CronExpression("0 * * * *")
+        job.validate()
+        job.schedule_cron = "0 * * * *"
+        with self.assertRaises(ValueError):
+            job.validate()
+
+    def test_invalid_exclude_patterns(self):
+        job = InitializeJobWithGoodValues()
+        job.exclude_patterns = "*.tmp"
+        with self.assertRaises(ValueError):
+            job.validate()
+        job.exclude_patterns = ["*.tmp", ""]
+        with self.assertRaises(ValueError):
+            job.validate()
+
+    def test_invalid_bandwidth_limit(self):
+        job = InitializeJobWithGoodValues()
+        job.bandwidth_limit = 0
+        with self.assertRaises(ValueError):
+            job.validate()
+        job.bandwidth_limit = "10MB/s"
+        with self.assertRaises(ValueError):
+            job.validate()
+
+    def test_invalid_profile_mode(self):
+        job = InitializeJobWithGoodValues()
+        job.profile_mode = "spans"
+        with self.assertRaises(ValueError):
+            job.validate()
+
+    def test_invalid_misfire_policy(self):
+        job = InitializeJobWithGoodValues()
+        job.misfire_policy = "run once"
+        with self.assertRaises(ValueError) as context:
+            job.validate()
+    
     def test_invalid_backup_type(self):
         job = InitializeJobWithGoodValues()
         job.BackupType = "invalid_backup_type"
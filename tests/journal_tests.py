@@ -0,0 +1,70 @@
+import unittest
+import tempfile
+import abackup.journal as journal
+from abackup.jobs import JobStatus
+from abackup.journal import JournalEntry, SchedulerJournal
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import mock
+
+FIRE_TIME = datetime(2025, 11, 3, 10, 0, tzinfo=timezone.utc)
+
+class TestSchedulerJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tempdir.name) / "scheduler.journal"
+        self.journal = SchedulerJournal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        self.tempdir.cleanup()
+
+    def Reopen(self):
+        self.journal.close()
+        self.journal = SchedulerJournal(self.path)
+        return self.journal
+
+    def test_replay_restores_last_status_and_fire_time(self):
+        self.journal.record_fire("a", FIRE_TIME)
+        self.journal.record_status("a", JobStatus.RUNNING)
+        self.journal.record_fire("b", FIRE_TIME)
+        self.journal.record_status("b", JobStatus.SCHEDULED)
+        entries = self.Reopen().entries
+        self.assertEqual(entries, {"a": JournalEntry(JobStatus.RUNNING, FIRE_TIME),
+                                   "b": JournalEntry(JobStatus.SCHEDULED, FIRE_TIME)})
+
+    def test_forget_drops_job(self):
+        self.journal.record_fire("a", FIRE_TIME)
+        self.journal.forget("a")
+        self.assertEqual(self.Reopen().entries, {})
+
+    def test_torn_record_is_dropped(self):
+        self.journal.record_fire("a", FIRE_TIME)
+        self.journal.close()
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write('{"job":"a","sta')
+        with self.assertLogs("abackup.journal", "WARNING"):
+            self.Reopen()
+        self.journal.record_status("a", JobStatus.RUNNING)
+        self.assertEqual(self.Reopen().entries["a"], JournalEntry(JobStatus.RUNNING, FIRE_TIME))
+
+    def test_compaction_keeps_one_record_per_job(self):
+        with mock.patch.object(journal, "COMPACT_MIN_RECORDS", 10):
+            for _ in range(20):
+                self.journal.record_fire("a", FIRE_TIME)
+                self.journal.record_status("a", JobStatus.SCHEDULED)
+            self.assertLessEqual(len(self.path.read_text().splitlines()), 10)
+            self.assertEqual(self.Reopen().entries, {"a": JournalEntry(JobStatus.SCHEDULED, FIRE_TIME)})
+
+    def test_control_channel_state_survives_compaction(self):
+        self.journal.record_enabled("a", False, "d1")
+        self.journal.record_enabled("b", True)
+        self.journal.record_enabled("b", None)
+        self.journal.compact()
+        self.assertEqual(self.Reopen().entries, {"a": JournalEntry(enabled=False, definition="d1"),
+                                                 "b": JournalEntry()})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import threading
+import urllib.error
+import urllib.request
+from abackup.metrics import CONTENT_TYPE, MetricsRegistry, MetricsServer, parse_metrics_address
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_render_counters_and_gauges(self):
+        transferred = self.registry.counter("test_bytes", "Bytes moved.", ("job", "destination"))
+        transferred.labels("nightly", "gdrive:").inc(512)
+        transferred.labels("nightly", "gdrive:").inc(512)
+        transferred.labels('odd "job"\n', "/backups").inc()
+        queued = self.registry.gauge("test_queued", "Queued\\jobs.")
+        queued.inc(3)
+        queued.dec()
+        self.assertEqual(self.registry.render().splitlines(), [
+            "# HELP test_bytes Bytes moved.",
+            "# TYPE test_bytes counter",
+            'test_bytes_total{job="nightly",destination="gdrive:"} 1024',
+            'test_bytes_total{job="odd \\"job\\"\\n",destination="/backups"} 1',
+            "# HELP test_queued Queued\\\\jobs.",
+            "# TYPE test_queued gauge",
+            "test_queued 2",
+        ])
+        with self.assertRaises(ValueError):
+            transferred.labels("nightly").inc()
+        with self.assertRaises(ValueError):
+            transferred.labels("nightly", "gdrive:").inc(-1)
+
+    def test_render_histogram(self):
+        durations = self.registry.histogram("test_seconds", "Stage time.", ("stage",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 7.0):
+            durations.labels("walk").observe(value)
+        with durations.labels("upload").time():
+            pass
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[:3], ["# HELP test_seconds Stage time.", "# TYPE test_seconds histogram",
+                                     'test_seconds_bucket{stage="upload",le="0.1"} 1'])
+        self.assertIn('test_seconds_bucket{stage="walk",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="walk",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="walk",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_sum{stage="walk"} 7.65', lines)
+        self.assertIn('test_seconds_count{stage="upload"} 1', lines)
+        self.assertEqual(durations.labels("walk").count, 4)
+
+    def test_registration_is_idempotent(self):
+        counter = self.registry.counter("test_runs", "Runs.", ("job",))
+        self.assertIs(self.registry.counter("test_runs", "Runs.", ("job",)), counter)
+        with self.assertRaises(ValueError):
+            self.registry.gauge("test_runs", "Runs.", ("job",))
+        with self.assertRaises(ValueError):
+            self.registry.counter("test_runs", "Runs.", ("job", "status"))
+
+    def test_collectors_run_on_every_render(self):
+        jobs = self.registry.gauge("test_jobs", "Jobs by status.", ("status",))
+        counts = {("scheduled",): 2, ("running",): 1}
+        def collect():
+            jobs.set_all(counts)
+        def fail():
+            raise RuntimeError("unreachable")
+        self.registry.add_collector(fail)
+        self.registry.add_collector(collect)
+        with self.assertLogs("abackup.metrics", "ERROR"):
+            self.assertIn('test_jobs{status="running"} 1', self.registry.render())
+        self.registry.remove_collector(fail)
+        counts = {("scheduled",): 3}
+        text = self.registry.render()
+        self.assertIn('test_jobs{status="scheduled"} 3', text)
+        self.assertNotIn("running", text)
+
+    def test_concurrent_updates(self):
+        counter = self.registry.counter("test_chunks", "Chunks.", ("job",))
+        def work():
+            for _ in range(10000):
+                counter.labels("nightly").inc()
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.labels("nightly").value, 40000)
+
+class TestMetricsServer(unittest.TestCase):
+
+    def test_serves_metrics(self):
+        registry = MetricsRegistry()
+        registry.counter("test_requests", "Requests.").inc(5)
+        server = MetricsServer(registry, port=0)
+        server.start()
+        self.addCleanup(server.close)
+        host, port = server.address
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics") as response:
+            self.assertEqual(response.headers["Content-Type"], CONTENT_TYPE)
+            self.assertIn("test_requests_total 5", response.read().decode("utf-8").splitlines())
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            urllib.request.urlopen(f"http://{host}:{port}/other")
+        raised.exception.close()
+        self.assertEqual(raised.exception.code, 404)
+
+    def test_parse_address(self):
+        self.assertEqual(parse_metrics_address("0.0.0.0:9100"), ("0.0.0.0", 9100))
+        self.assertEqual(parse_metrics_address(":9464"), ("127.0.0.1", 9464))
+        self.assertEqual(parse_metrics_address("9464"), ("127.0.0.1", 9464))
+        self.assertEqual(parse_metrics_address("[::1]:9464"), ("::1", 9464))
+        for address in ("localhost", "localhost:99999"):
+            with self.assertRaises(ValueError):
+                parse_metrics_address(address)
+
+if __name__ == "__main__":
+    unittest.main()
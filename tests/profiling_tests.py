@@ -0,0 +1,142 @@
+import unittest
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+import abackup.profiling as profiling
+from abackup.compression import ParallelCompressor
+from abackup.jobs import ProfileMode
+from abackup.metrics import STAGE_DURATION
+from abackup.profiling import Trace, bind, current_trace, profile_run, stage
+from abackup.walker import ParallelWalker
+from jobs_tests import InitializeJobWithGoodValues
+
+# Keeps the current thread busy in a function of its own, for the sampler to find
+def SpinFor(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+def Walk():
+    with stage("walk"):
+        pass
+
+def SpanNames(trace: Trace, category: str = "stage") -> list:
+    return [event["name"] for event in trace.to_chrome_trace()["traceEvents"] if event.get("cat") == category]
+
+class TestStages(unittest.TestCase):
+
+    def test_stage_without_trace_only_feeds_the_metric(self):
+        runs = STAGE_DURATION.labels("test").count
+        with stage("test"):
+            pass
+        self.assertEqual(STAGE_DURATION.labels("test").count, runs + 1)
+        self.assertIsNone(current_trace())
+        self.assertIs(bind(SpinFor), SpinFor)
+
+    def test_stages_are_recorded_in_the_trace_of_their_run(self):
+        trace = Trace("job")
+        with trace.activate():
+            with stage("backup"):
+                with stage("upload"):
+                    pass
+                thread = threading.Thread(target=bind(Walk))
+                thread.start()
+                thread.join()
+        with stage("other"):
+            pass
+        self.assertEqual(SpanNames(trace), ["upload", "walk", "backup"])
+        events = {event["name"]: event for event in trace.to_chrome_trace()["traceEvents"] if event["ph"] == "X"}
+        self.assertNotEqual(events["walk"]["tid"], events["backup"]["tid"])
+        self.assertLessEqual(events["backup"]["ts"], events["upload"]["ts"])
+        self.assertIsNone(current_trace())
+
+    def test_worker_threads_join_the_trace(self):
+        source = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        for number in range(3):
+            Path(source.name, f"file{number}").write_bytes(os.urandom(1024) * 64)
+        trace = Trace("job")
+        with trace.activate():
+            entries = list(ParallelWalker(Path(source.name)))
+            with ParallelCompressor(io.BytesIO(), threads=2, block_size=16 * 1024) as compressor:
+                for entry in entries:
+                    compressor.write(Path(entry.path).read_bytes())
+        names = SpanNames(trace)
+        self.assertEqual(names.count("walk"), 1)
+        self.assertEqual(names.count("compress"), 12)
+        thread_names = {event["args"]["name"] for event in trace.to_chrome_trace()["traceEvents"]
+                        if event["name"] == "thread_name"}
+        self.assertTrue(any(name.startswith("abackup-compress") for name in thread_names))
+
+class TestSampling(unittest.TestCase):
+
+    def test_samples_show_the_running_function(self):
+        trace = Trace("job", sample_interval=0.001)
+        with trace.activate():
+            trace.start_sampling()
+            SpinFor(0.2)
+            trace.stop_sampling()
+        samples = SpanNames(trace, "sample")
+        self.assertTrue(any(name.startswith("SpinFor (profiling_tests.py:") for name in samples), samples[:10])
+        # Consecutive samples of the same stack are merged into one span per frame
+        self.assertLess(samples.count(next(name for name in samples if name.startswith("SpinFor"))), 20)
+
+    def test_events_are_capped(self):
+        trace = Trace("job")
+        with mock.patch.object(profiling, "MAX_TRACE_EVENTS", 2):
+            for _ in range(3):
+                trace.add_span("upload", 0.0, 1.0)
+        self.assertEqual((len(SpanNames(trace)), trace.dropped), (2, 1))
+
+class TestProfileRun(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tempdir.name)
+        self.job = InitializeJobWithGoodValues()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_unprofiled_job(self):
+        with profile_run(self.job, self.directory) as trace:
+            self.assertIsNone(trace)
+            self.assertIsNone(current_trace())
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_trace_is_written_even_when_the_run_fails(self):
+        self.job.profile_mode = ProfileMode.SAMPLING
+        with self.assertRaises(RuntimeError):
+            with profile_run(self.job, self.directory) as trace:
+                self.assertIs(current_trace(), trace)
+                with stage("pre_script"):
+                    SpinFor(0.05)
+                raise RuntimeError("backup failed")
+        self.assertEqual(trace.path.parent, self.directory)
+        data = json.loads(trace.path.read_text(encoding="utf-8"))
+        names = [event["name"] for event in data["traceEvents"] if event["ph"] == "X"]
+        self.assertIn("pre_script", names)
+        self.assertIn("run", names)
+        self.assertEqual(data["otherData"]["job_id"], self.job.job_id)
+        self.assertIsNone(current_trace())
+
+    def test_old_traces_are_deleted(self):
+        self.job.profile_mode = ProfileMode.SPANS
+        other = self.directory / f"{self.job.job_id}-other-20250101T000000000000Z.trace.json"
+        other.touch()
+        with mock.patch.object(profiling, "TRACES_KEPT_PER_JOB", 2):
+            for _ in range(3):
+                with profile_run(self.job, self.directory) as trace:
+                    pass
+                time.sleep(0.001)
+        self.assertTrue(other.exists())
+        traces = sorted(set(self.directory.iterdir()) - {other})
+        self.assertEqual((len(traces), traces[-1]), (2, trace.path))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import tempfile
+from abackup.retention import Artifact, RetentionCatalog, artifact_created
+from datetime import datetime, timezone
+from pathlib import Path
+
+def InitializeArtifact(day, size):
+    return Artifact(f"job-202511{day:02d}T020000Z.tar.gz", size, datetime(2025, 11, day, 2, 0, tzinfo=timezone.utc))
+
+class TestArtifactCreated(unittest.TestCase):
+
+    def test_parses_timestamp_and_suffix(self):
+        self.assertEqual(artifact_created("job", "job-20251103T020000Z.tar.gz"),
+                         datetime(2025, 11, 3, 2, 0, tzinfo=timezone.utc))
+        self.assertIsNotNone(artifact_created("job", "job-20251103T020000Z"))
+
+    def test_parses_microseconds(self):
+        self.assertEqual(artifact_created("job", "job-20251103T020000250000Z.tar.gz"),
+                         datetime(2025, 11, 3, 2, 0, 0, 250000, tzinfo=timezone.utc))
+
+    def test_rejects_other_jobs_and_partial_artifacts(self):
+        self.assertIsNone(artifact_created("job", "job-b-20251103T020000Z.tar.gz"))
+        self.assertIsNone(artifact_created("job", "job-20251103T020000Z.tar.gz.partial"))
+        self.assertIsNone(artifact_created("job", "notes.txt"))
+
+class TestRetentionCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.catalog = RetentionCatalog(Path(self.tempdir.name) / "retention.sqlite3")
+
+    def tearDown(self):
+        self.catalog.close()
+        self.tempdir.cleanup()
+
+    def test_running_total_follows_records_and_removals(self):
+        for day in (1, 2, 3):
+            self.catalog.record("job", InitializeArtifact(day, 100 * day))
+        self.assertEqual(self.catalog.total_size("job"), 600)
+        self.catalog.record("job", InitializeArtifact(2, 50)) # Re-recorded with a new size
+        self.assertEqual(self.catalog.total_size("job"), 450)
+        self.catalog.remove("job", [InitializeArtifact(1, 0).path])
+        self.assertEqual((self.catalog.total_size("job"), self.catalog.artifact_count("job")), (350, 2))
+        self.assertEqual(self.catalog.total_size("other"), 0)
+
+    def test_oldest_to_delete_stops_once_under_limit(self):
+        for day in (1, 2, 3, 4):
+            self.catalog.record("job", InitializeArtifact(day, 100))
+        self.assertEqual([artifact.path for artifact in self.catalog.oldest_to_delete("job", 250)],
+                         [InitializeArtifact(1, 0).path, InitializeArtifact(2, 0).path])
+        self.assertEqual(self.catalog.oldest_to_delete("job", 400), [])
+
+    def test_oldest_to_delete_keeps_newest(self):
+        for day in (1, 2):
+            self.catalog.record("job", InitializeArtifact(day, 100))
+        self.assertEqual([artifact.path for artifact in self.catalog.oldest_to_delete("job", 0)],
+                         [InitializeArtifact(1, 0).path])
+
+    def test_reconcile_repairs_drift(self):
+        self.catalog.record("job", InitializeArtifact(1, 100))
+        self.catalog.record("job", InitializeArtifact(2, 100))
+        added, removed = self.catalog.reconcile("job", [InitializeArtifact(2, 100), InitializeArtifact(3, 300)])
+        self.assertEqual(added, [InitializeArtifact(3, 0).path])
+        self.assertEqual(removed, [InitializeArtifact(1, 0).path])
+        self.assertEqual(self.catalog.total_size("job"), 400)
+        self.assertEqual(self.catalog.artifacts("job"), [InitializeArtifact(2, 100), InitializeArtifact(3, 300)])
+
+    def test_reconciliation_interval(self):
+        self.assertTrue(self.catalog.needs_reconciliation("job"))
+        self.catalog.reconcile("job", [], now=1000)
+        self.assertFalse(self.catalog.needs_reconciliation("job", interval=60, now=1030))
+        self.assertTrue(self.catalog.needs_reconciliation("job", interval=60, now=1060))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,287 @@
+import unittest
+import os
+import tempfile
+import abackup.jobs as jobs
+import abackup.schedule as schedule
+from abackup.cron import CronExpression
+from abackup.schedule import BackupJobScheduleFileParser, BackupJobScheduler
+from datetime import datetime, time, timedelta
+from pathlib import Path
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+LA = ZoneInfo("America/Los_Angeles")
+
+SCHEDULE_TEMPLATE = """version: 0.0
+jobs:
+    backup-job-1:
+        location: {source}
+        recursive: true
+        compression: true
+        type: Google Drive
+        destination: gdrive:backups/job-1
+        schedule:
+            time: 2:30
+            timezone: America/Los_Angeles
+            days: MWF
+        max-retention-size: 15GB
+
+    # The second job is disabled for now
+    backup-job-2:
+        location: {source}
+        type: googledrive
+        destination: gdrive:backups/job-2
+        enabled: false
+        schedule:
+            time: "18:00"
+            timezone: America/Chicago
+            day-of-month: 31
+"""
+
+def WriteSchedule(directory, text):
+    path = Path(directory) / "schedule.yaml"
+    path.write_text(text, encoding="utf-8")
+    return path
+
+class TestBackupJobScheduleFileParser(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.source = Path(self.tempdir.name)
+        self.schedule_text = SCHEDULE_TEMPLATE.format(source=self.source)
+        self.path = WriteSchedule(self.tempdir.name, self.schedule_text)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_iter_job_blocks_yields_one_block_per_job(self):
+        parser = BackupJobScheduleFileParser(self.path)
+        blocks = list(parser.iter_job_blocks())
+        self.assertEqual([job_id for job_id, _ in blocks], ["backup-job-1", "backup-job-2"])
+        self.assertTrue(blocks[0][1].startswith("backup-job-1:\n"))
+
+    def test_parse_job_fields(self):
+        job1, job2 = BackupJobScheduleFileParser(self.path).parse()
+        self.assertEqual(job1.status, jobs.JobStatus.SCHEDULED)
+        self.assertEqual(job1.source_path, self.source)
+        self.assertEqual(job1.BackupType, jobs.BackupType.GOOGLEDRIVE)
+        self.assertEqual(job1.destination_url, "gdrive:backups/job-1")
+        self.assertEqual(job1.schedule_time, time(2, 30, tzinfo=LA))
+        self.assertEqual(job1.schedule_recurrence_policy, jobs.JobRecurrence.WEEKLY)
+        self.assertEqual(job1.schedule_days,
+                         [jobs.JobScheduleDays.MONDAY, jobs.JobScheduleDays.WEDNESDAY, jobs.JobScheduleDays.FRIDAY])
+        self.assertEqual(job1.max_file_retention_size, 15 * 1024)
+        self.assertEqual(job2.status, jobs.JobStatus.DISABLED)
+        self.assertEqual(job2.schedule_time, time(18, 0, tzinfo=ZoneInfo("America/Chicago")))
+        self.assertEqual(job2.schedule_recurrence_policy, jobs.JobRecurrence.MONTHLY)
+        self.assertEqual(job2.schedule_day_of_month, 31)
+
+    def test_parse_chunked_flag(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("recursive: true", "recursive: true\n        chunked: true"))
+        job1, job2 = BackupJobScheduleFileParser(self.path).parse()
+        self.assertTrue(job1.chunked)
+        self.assertFalse(job2.chunked)
+
+    def test_parse_misfire_policy(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("days: MWF", "days: MWF\n            misfire: run all"))
+        job1, job2 = BackupJobScheduleFileParser(self.path).parse()
+        self.assertEqual(job1.misfire_policy, jobs.MisfirePolicy.RUN_ALL)
+        self.assertEqual(job2.misfire_policy, jobs.MisfirePolicy.RUN_ONCE)
+
+    def test_parse_profile_mode(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("recursive: true", "recursive: true\n        profile: sampling", 1))
+        job1, job2 = BackupJobScheduleFileParser(self.path).parse()
+        self.assertEqual(job1.profile_mode, jobs.ProfileMode.SAMPLING)
+        self.assertEqual(job2.profile_mode, jobs.ProfileMode.OFF)
+        for value, mode in (("on", jobs.ProfileMode.SPANS), ("off", jobs.ProfileMode.OFF)):
+            WriteSchedule(self.tempdir.name, self.schedule_text.replace("recursive: true", f"recursive: true\n        profile: {value}", 1))
+            self.assertEqual(BackupJobScheduleFileParser(self.path).parse()[0].profile_mode, mode)
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("recursive: true", "recursive: true\n        profile: always", 1))
+        with self.assertRaisesRegex(ValueError, "profile mode"):
+            BackupJobScheduleFileParser(self.path).parse()
+
+    def test_parse_include_and_exclude_patterns(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace(
+            "recursive: true", "recursive: true\n        include: '*.py'\n        exclude: [build, '*.tmp']", 1))
+        job1, job2 = BackupJobScheduleFileParser(self.path).parse()
+        self.assertEqual((job1.include_patterns, job1.exclude_patterns), (["*.py"], ["build", "*.tmp"]))
+        self.assertEqual((job2.include_patterns, job2.exclude_patterns), ([], []))
+
+    def test_parse_bandwidth_limit(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("recursive: true", "recursive: true\n        bandwidth: 2MB/s", 1))
+        job1, job2 = BackupJobScheduleFileParser(self.path).parse()
+        self.assertEqual(job1.bandwidth_limit, 2 * 1024 * 1024)
+        self.assertIsNone(job2.bandwidth_limit)
+
+    def test_parse_interval_and_cron_schedules(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace(
+            "time: 2:30\n            timezone: America/Los_Angeles\n            days: MWF", "interval: 1h30m").replace(
+            'time: "18:00"\n            timezone: America/Chicago\n            day-of-month: 31',
+            "cron: '*/15 * * * *'\n            timezone: America/Chicago"))
+        job1, job2 = BackupJobScheduleFileParser(self.path).parse()
+        self.assertEqual(job1.schedule_recurrence_policy, jobs.JobRecurrence.INTERVAL)
+        self.assertEqual(job1.schedule_interval, timedelta(hours=1, minutes=30))
+        self.assertEqual(job2.schedule_recurrence_policy, jobs.JobRecurrence.CRON)
+        self.assertEqual(job2.schedule_cron, CronExpression("*/15 * * * *"))
+        self.assertEqual(str(job2.schedule_timezone), "America/Chicago")
+
+    def test_cron_schedule_is_evaluated_in_its_timezone(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace(
+            "time: 2:30\n            timezone: America/Los_Angeles\n            days: MWF",
+            "cron: '0 3 * * *'\n            timezone: America/Los_Angeles"))
+        job = BackupJobScheduleFileParser(self.path).parse()[0]
+        self.assertEqual(job.schedule_timezone, LA)
+        self.assertEqual(schedule.next_fire_time(job, datetime(2026, 1, 5, tzinfo=LA)), datetime(2026, 1, 5, 3, tzinfo=LA))
+
+    def test_conflicting_recurrence_settings_raise(self):
+        for settings in ("days: MWF\n            day-of-month: 3", "days: MWF\n            interval: 1h",
+                         "cron: '0 3 * * *'", "days: MWF\n            recurrence: daily"):
+            WriteSchedule(self.tempdir.name, self.schedule_text.replace("days: MWF", settings))
+            with self.subTest(settings=settings), self.assertRaises(ValueError):
+                BackupJobScheduleFileParser(self.path).parse()
+
+    def test_invalid_cron_schedule_raises(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("days: MWF", "cron: '61 * * * *'"))
+        with self.assertRaises(ValueError):
+            BackupJobScheduleFileParser(self.path).parse()
+
+    def test_invalid_schedule_days_raise(self):
+        for days in ("MWX", "[Monday, Funday]"):
+            WriteSchedule(self.tempdir.name, self.schedule_text.replace("days: MWF", f"days: {days}"))
+            with self.subTest(days=days), self.assertRaisesRegex(ValueError, "Invalid schedule day"):
+                BackupJobScheduleFileParser(self.path).parse()
+
+    def test_parse_compression_settings(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace(
+            "compression: true", "compression:\n            codec: zstd\n            level: 9\n            threads: 8"))
+        job1, job2 = BackupJobScheduleFileParser(self.path).parse()
+        self.assertTrue(job1.compression)
+        self.assertEqual(job1.compression_codec, jobs.CompressionCodec.ZSTD)
+        self.assertEqual((job1.compression_level, job1.compression_threads), (9, 8))
+        self.assertEqual(job2.compression_codec, jobs.CompressionCodec.GZIP)
+
+    def test_unknown_compression_setting_raises(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("compression: true", "compression:\n            lvl: 9"))
+        with self.assertRaises(ValueError):
+            BackupJobScheduleFileParser(self.path).parse()
+
+    def test_first_reload_adds_all_jobs(self):
+        diff = BackupJobScheduleFileParser(self.path).reload()
+        self.assertEqual(set(diff.added), {"backup-job-1", "backup-job-2"})
+        self.assertEqual(diff.changed, {})
+        self.assertEqual(diff.removed, set())
+
+    def test_reload_of_unchanged_file_parses_nothing(self):
+        parser = BackupJobScheduleFileParser(self.path)
+        parser.reload()
+        with mock.patch.object(parser, "parse_job", wraps=parser.parse_job) as parse_job:
+            diff = parser.reload()
+        self.assertFalse(diff)
+        parse_job.assert_not_called()
+
+    def test_reload_reports_changed_and_removed_jobs(self):
+        parser = BackupJobScheduleFileParser(self.path)
+        parser.reload()
+        text = self.schedule_text.replace("gdrive:backups/job-1", "gdrive:backups/job-1b")
+        text = text[:text.index("    # The second job")]
+        WriteSchedule(self.tempdir.name, text)
+        with mock.patch.object(parser, "parse_job", wraps=parser.parse_job) as parse_job:
+            diff = parser.reload()
+        self.assertEqual(set(diff.changed), {"backup-job-1"})
+        self.assertEqual(diff.removed, {"backup-job-2"})
+        self.assertEqual(parse_job.call_count, 1)
+
+    def test_invalid_job_raises_and_keeps_state(self):
+        parser = BackupJobScheduleFileParser(self.path)
+        parser.reload()
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("location: " + str(self.source),
+                                                                     "location: /path/that/does/not/exist", 1))
+        with self.assertRaises(ValueError):
+            parser.reload()
+        WriteSchedule(self.tempdir.name, self.schedule_text)
+        self.assertFalse(parser.reload())
+
+    def test_unknown_setting_raises(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("recursive: true", "recursve: true"))
+        with self.assertRaises(ValueError):
+            BackupJobScheduleFileParser(self.path).parse()
+
+    def test_duplicate_job_id_raises(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("backup-job-2:", "backup-job-1:"))
+        with self.assertRaises(ValueError):
+            BackupJobScheduleFileParser(self.path).reload()
+
+    def test_scheduler_applies_diff_in_place(self):
+        parser = BackupJobScheduleFileParser(self.path)
+        scheduler = BackupJobScheduler()
+        now = datetime(2025, 11, 3, 0, 0, tzinfo=LA) # Monday
+        scheduler.apply_schedule_diff(parser.reload(), now)
+        self.assertEqual(len(scheduler.job_pool), 2)
+        self.assertEqual(scheduler.next_fire_time(), datetime(2025, 11, 3, 2, 30, tzinfo=LA))
+
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("time: 2:30", "time: 3:30"))
+        scheduler.apply_schedule_diff(parser.reload(), now)
+        self.assertEqual(scheduler.next_fire_time(), datetime(2025, 11, 3, 3, 30, tzinfo=LA))
+        self.assertEqual(scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 45, tzinfo=LA)), [])
+
+class TestScheduleCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.source = Path(self.tempdir.name)
+        self.schedule_text = SCHEDULE_TEMPLATE.format(source=self.source)
+        self.path = WriteSchedule(self.tempdir.name, self.schedule_text)
+        BackupJobScheduleFileParser(self.path).load()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_load_writes_cache(self):
+        self.assertTrue(BackupJobScheduleFileParser(self.path).cache_path.exists())
+
+    def test_fresh_cache_skips_parsing_and_validation(self):
+        parser = BackupJobScheduleFileParser(self.path)
+        with mock.patch.object(parser, "_parse_block") as parse_block, \
+             mock.patch.object(jobs.BackupJob, "validate") as validate:
+            diff = parser.load()
+        parse_block.assert_not_called()
+        validate.assert_not_called()
+        self.assertEqual(set(diff.added), {"backup-job-1", "backup-job-2"})
+        self.assertEqual(diff.added["backup-job-1"].schedule_time, time(2, 30, tzinfo=LA))
+
+    def test_cache_state_allows_incremental_reload(self):
+        parser = BackupJobScheduleFileParser(self.path)
+        parser.load()
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("gdrive:backups/job-2", "gdrive:backups/job-2b"))
+        diff = parser.reload()
+        self.assertEqual(set(diff.changed), {"backup-job-2"})
+        self.assertEqual(diff.added, {})
+
+    def test_touched_file_with_same_content_uses_cache(self):
+        stat = self.path.stat()
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 5_000_000_000))
+        parser = BackupJobScheduleFileParser(self.path)
+        self.assertIsNotNone(parser.read_cache())
+
+    def test_changed_file_invalidates_cache(self):
+        WriteSchedule(self.tempdir.name, self.schedule_text.replace("time: 2:30", "time: 3:30"))
+        parser = BackupJobScheduleFileParser(self.path)
+        self.assertIsNone(parser.read_cache())
+        diff = parser.load()
+        self.assertEqual(diff.added["backup-job-1"].schedule_time, time(3, 30, tzinfo=LA))
+        self.assertIsNotNone(BackupJobScheduleFileParser(self.path).read_cache())
+
+    def test_corrupt_cache_is_ignored(self):
+        parser = BackupJobScheduleFileParser(self.path)
+        parser.cache_path.write_bytes(parser.cache_path.read_bytes()[:-10])
+        self.assertIsNone(parser.read_cache())
+        self.assertEqual(len(parser.load().added), 2)
+
+    def test_other_format_version_is_ignored(self):
+        parser = BackupJobScheduleFileParser(self.path)
+        with mock.patch.object(schedule, "CACHE_FORMAT_VERSION", schedule.CACHE_FORMAT_VERSION + 1):
+            self.assertIsNone(parser.read_cache())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,554 @@
+import unittest
+import tempfile
+import abackup.jobs as jobs
+import abackup.schedule as schedule
+from abackup.cron import CronExpression
+from abackup.journal import SchedulerJournal
+from abackup.schedule import (BackupJobPool, BackupJobScheduler, ScheduleDiff, fire_times_between, missed_fire_times,
+                              next_fire_time, next_fire_time_batch, next_fire_times, smoothing_offsets)
+from datetime import datetime, time, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+from zoneinfo import ZoneInfo
+from jobs_tests import InitializeJobWithGoodValues
+
+LA = ZoneInfo("America/Los_Angeles")
+
+def InitializeSchedulerWithJobs(date_time, *jobs_to_add):
+    scheduler = BackupJobScheduler()
+    for job in jobs_to_add:
+        scheduler.add_job(job, date_time)
+    return scheduler
+
+class TestNextFireTime(unittest.TestCase):
+
+    def test_daily_fires_later_same_day(self):
+        job = InitializeJobWithGoodValues()
+        after = datetime(2025, 11, 3, 1, 0, tzinfo=LA)
+        self.assertEqual(next_fire_time(job, after), datetime(2025, 11, 3, 2, 0, tzinfo=LA))
+
+    def test_daily_fires_next_day_once_time_passed(self):
+        job = InitializeJobWithGoodValues()
+        after = datetime(2025, 11, 3, 2, 0, tzinfo=LA)
+        self.assertEqual(next_fire_time(job, after), datetime(2025, 11, 4, 2, 0, tzinfo=LA))
+
+    def test_fire_time_respects_job_timezone(self):
+        job = InitializeJobWithGoodValues()
+        after = datetime(2025, 11, 3, 9, 0, tzinfo=timezone.utc) # 01:00 in Los Angeles
+        self.assertEqual(next_fire_time(job, after), datetime(2025, 11, 3, 10, 0, tzinfo=timezone.utc))
+
+    def test_weekly_fires_on_listed_day(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_recurrence_policy = jobs.JobRecurrence.WEEKLY
+        job.schedule_days = [jobs.JobScheduleDays.FRIDAY]
+        after = datetime(2025, 11, 3, 12, 0, tzinfo=LA) # Monday
+        self.assertEqual(next_fire_time(job, after), datetime(2025, 11, 7, 2, 0, tzinfo=LA))
+
+    def test_weekly_without_days_never_fires(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_recurrence_policy = jobs.JobRecurrence.WEEKLY
+        job.schedule_days = []
+        self.assertIsNone(next_fire_time(job, datetime(2025, 11, 3, tzinfo=LA)))
+
+    def test_monthly_fires_on_day_of_month(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_recurrence_policy = jobs.JobRecurrence.MONTHLY
+        job.schedule_day_of_month = 15
+        after = datetime(2025, 11, 20, tzinfo=LA)
+        self.assertEqual(next_fire_time(job, after), datetime(2025, 12, 15, 2, 0, tzinfo=LA))
+
+    def test_no_schedule_time_never_fires(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_time = None
+        self.assertIsNone(next_fire_time(job, datetime(2025, 11, 3, tzinfo=LA)))
+
+    def test_monthly_day_clamped_to_short_months(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_recurrence_policy = jobs.JobRecurrence.MONTHLY
+        job.schedule_day_of_month = 31
+        self.assertEqual([fire_time.astimezone(LA).date().isoformat()
+                          for fire_time in next_fire_times(job, datetime(2026, 1, 1, tzinfo=LA), 4)],
+                         ["2026-01-31", "2026-02-28", "2026-03-31", "2026-04-30"])
+
+    def test_next_fire_times_after_fire_time_in_same_zone(self):
+        job = InitializeJobWithGoodValues()
+        after = datetime(2025, 11, 3, 2, 0, tzinfo=LA)
+        self.assertEqual(next_fire_times(job, after, 2), [datetime(2025, 11, 4, 10, 0, tzinfo=timezone.utc),
+                                                          datetime(2025, 11, 5, 10, 0, tzinfo=timezone.utc)])
+
+    def test_wall_time_skipped_by_dst_is_shifted_forward(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_time = time(2, 30, tzinfo=LA) # 2025-03-09 02:00 -> 03:00 in Los Angeles
+        fire_times = next_fire_times(job, datetime(2025, 3, 8, 12, 0, tzinfo=LA), 2)
+        self.assertEqual(fire_times[0].astimezone(LA).replace(tzinfo=None), datetime(2025, 3, 9, 3, 30))
+        self.assertEqual(fire_times[1].astimezone(LA).replace(tzinfo=None), datetime(2025, 3, 10, 2, 30))
+
+    def test_repeated_wall_time_fires_once(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_time = time(1, 30, tzinfo=LA) # 2025-11-02 02:00 -> 01:00 in Los Angeles
+        fire_times = next_fire_times(job, datetime(2025, 11, 1, 12, 0, tzinfo=LA), 2)
+        self.assertEqual(fire_times, [datetime(2025, 11, 2, 8, 30, tzinfo=timezone.utc), # 01:30 PDT
+                                      datetime(2025, 11, 3, 9, 30, tzinfo=timezone.utc)])
+        # Nothing fires at the second 01:30 (PST)
+        self.assertEqual(next_fire_time(job, fire_times[0]), fire_times[1])
+
+    def test_interval_fires_on_multiples_of_interval(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_recurrence_policy = jobs.JobRecurrence.INTERVAL
+        job.schedule_interval = timedelta(minutes=15)
+        after = datetime(2025, 11, 3, 2, 7, tzinfo=timezone.utc)
+        self.assertEqual(next_fire_times(job, after, 2), [datetime(2025, 11, 3, 2, 15, tzinfo=timezone.utc),
+                                                          datetime(2025, 11, 3, 2, 30, tzinfo=timezone.utc)])
+        self.assertEqual(next_fire_time(job, datetime(2025, 11, 3, 2, 15, tzinfo=timezone.utc)),
+                         datetime(2025, 11, 3, 2, 30, tzinfo=timezone.utc))
+
+    def test_cron_evaluated_in_schedule_timezone(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_recurrence_policy = jobs.JobRecurrence.CRON
+        job.schedule_cron = CronExpression("0 3 * * mon-fri")
+        job.schedule_timezone = LA
+        after = datetime(2025, 11, 7, 12, 0, tzinfo=LA) # Friday
+        self.assertEqual(next_fire_time(job, after), datetime(2025, 11, 10, 3, 0, tzinfo=LA))
+
+    def test_cron_fires_once_per_instant_across_dst(self):
+        job = InitializeJobWithGoodValues()
+        job.schedule_recurrence_policy = jobs.JobRecurrence.CRON
+        job.schedule_cron = CronExpression("*/30 * * * *")
+        job.schedule_timezone = LA
+        spring = next_fire_times(job, datetime(2025, 3, 9, 0, 45, tzinfo=LA), 4)
+        self.assertEqual([fire_time.astimezone(LA).strftime("%H:%M") for fire_time in spring],
+                         ["01:00", "01:30", "03:00", "03:30"])
+        autumn = next_fire_times(job, datetime(2025, 11, 2, 0, 45, tzinfo=LA), 4)
+        self.assertEqual([(autumn[i + 1] - autumn[i]).total_seconds() for i in range(3)], [1800, 5400, 1800])
+
+    def test_batch_matches_single_evaluation(self):
+        after = datetime(2025, 11, 3, 12, 0, tzinfo=LA)
+        weekly = InitializeJobWithGoodValues("weekly")
+        weekly.schedule_recurrence_policy = jobs.JobRecurrence.WEEKLY
+        weekly.schedule_days = [jobs.JobScheduleDays.FRIDAY]
+        unscheduled = InitializeJobWithGoodValues("unscheduled")
+        unscheduled.schedule_time = None
+        batch_jobs = [InitializeJobWithGoodValues(f"daily{i}") for i in range(3)] + [weekly, unscheduled]
+        self.assertEqual(next_fire_time_batch(batch_jobs, after),
+                         {job.job_id: next_fire_time(job, after) for job in batch_jobs})
+
+    def test_fire_times_between(self):
+        daily = InitializeJobWithGoodValues("daily")
+        late = InitializeJobWithGoodValues("late")
+        late.schedule_time = time(23, 0, tzinfo=LA)
+        after = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        fires = fire_times_between([late, daily], after, after + timedelta(days=2))
+        self.assertEqual([(fire_time.astimezone(LA).day, job.job_id) for fire_time, job in fires],
+                         [(3, "daily"), (3, "late"), (4, "daily"), (4, "late")])
+
+class TestBackupJobPool(unittest.TestCase):
+
+    def test_add_and_get_by_id(self):
+        pool = BackupJobPool()
+        job = InitializeJobWithGoodValues()
+        pool.add(job)
+        self.assertIs(pool.get_by_id("test-job-001"), job)
+        self.assertIn(job, pool)
+        self.assertIn("test-job-001", pool)
+        self.assertEqual(len(pool), 1)
+
+    def test_add_duplicate_raises(self):
+        pool = BackupJobPool()
+        pool.add(InitializeJobWithGoodValues())
+        with self.assertRaises(ValueError):
+            pool.add(InitializeJobWithGoodValues())
+
+    def test_add_invalid_job_raises(self):
+        pool = BackupJobPool()
+        job = InitializeJobWithGoodValues()
+        job.destination_url = None
+        with self.assertRaises(ValueError):
+            pool.add(job)
+        self.assertNotIn(job, pool)
+
+    def test_remove_by_id(self):
+        pool = BackupJobPool()
+        pool.add(InitializeJobWithGoodValues())
+        self.assertTrue(pool.remove_by_id("test-job-001"))
+        self.assertFalse(pool.remove_by_id("test-job-001"))
+        self.assertIsNone(pool.get_by_id("test-job-001"))
+        self.assertEqual(pool.get_by_status(jobs.JobStatus.SCHEDULED), [])
+
+    def test_replace_swaps_definition_and_indexes(self):
+        pool = BackupJobPool()
+        old_job = InitializeJobWithGoodValues()
+        pool.add(old_job)
+        new_job = InitializeJobWithGoodValues()
+        new_job.schedule_recurrence_policy = jobs.JobRecurrence.MONTHLY
+        new_job.schedule_day_of_month = 1
+        self.assertIs(pool.replace(new_job), old_job)
+        self.assertIs(pool.get_by_id("test-job-001"), new_job)
+        self.assertEqual(pool.get_by_recurrence(jobs.JobRecurrence.DAILY), [])
+        self.assertEqual(pool.get_by_recurrence(jobs.JobRecurrence.MONTHLY), [new_job])
+
+    def test_replace_missing_job_raises(self):
+        pool = BackupJobPool()
+        with self.assertRaises(ValueError):
+            pool.replace(InitializeJobWithGoodValues())
+
+    def test_status_index_follows_set_status(self):
+        pool = BackupJobPool()
+        job1 = InitializeJobWithGoodValues("job-001")
+        job2 = InitializeJobWithGoodValues("job-002")
+        pool.add(job1)
+        pool.add(job2)
+        pool.set_status("job-002", jobs.JobStatus.QUEUED)
+        self.assertEqual(job2.status, jobs.JobStatus.QUEUED)
+        self.assertEqual(pool.get_by_status(jobs.JobStatus.SCHEDULED), [job1])
+        self.assertEqual(pool.get_by_status(jobs.JobStatus.QUEUED), [job2])
+        self.assertEqual(pool.count_by_status(jobs.JobStatus.QUEUED), 1)
+
+    def test_reindex_after_direct_change(self):
+        pool = BackupJobPool()
+        job = InitializeJobWithGoodValues()
+        pool.add(job)
+        job.status = jobs.JobStatus.DISABLED
+        pool.reindex(job)
+        self.assertEqual(pool.get_by_status(jobs.JobStatus.DISABLED), [job])
+        self.assertEqual(pool.count_by_status(jobs.JobStatus.SCHEDULED), 0)
+
+    def test_backup_type_index(self):
+        pool = BackupJobPool()
+        job = InitializeJobWithGoodValues()
+        pool.add(job)
+        self.assertEqual(pool.get_by_backup_type(jobs.BackupType.GOOGLEDRIVE), [job])
+
+class TestBackupJobScheduler(unittest.TestCase):
+
+    def test_job_not_ready_before_its_time(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        scheduler = InitializeSchedulerWithJobs(start, InitializeJobWithGoodValues())
+        self.assertEqual(scheduler.get_ready_jobs(datetime(2025, 11, 3, 1, 59, tzinfo=LA)), [])
+
+    def test_job_ready_at_its_time_and_queued(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        job = InitializeJobWithGoodValues()
+        scheduler = InitializeSchedulerWithJobs(start, job)
+        ready = scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 0, tzinfo=LA))
+        self.assertEqual(ready, [job])
+        self.assertEqual(job.status, jobs.JobStatus.QUEUED)
+        # A job is only handed out once per fire time
+        self.assertEqual(scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 1, tzinfo=LA)), [])
+
+    def test_ready_jobs_in_fire_time_order(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        late = InitializeJobWithGoodValues("late")
+        late.schedule_time = time(3, 0, tzinfo=LA)
+        early = InitializeJobWithGoodValues("early")
+        scheduler = InitializeSchedulerWithJobs(start, late, early)
+        self.assertEqual(scheduler.next_fire_time(), datetime(2025, 11, 3, 10, 0, tzinfo=timezone.utc))
+        self.assertEqual(scheduler.get_ready_jobs(datetime(2025, 11, 3, 4, 0, tzinfo=LA)), [early, late])
+
+    def test_job_finished_reschedules_next_occurrence(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        job = InitializeJobWithGoodValues()
+        scheduler = InitializeSchedulerWithJobs(start, job)
+        scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 0, tzinfo=LA))
+        self.assertIsNone(scheduler.next_fire_time())
+        job.status = jobs.JobStatus.COMPLETED
+        self.assertTrue(scheduler.job_finished(job.job_id, datetime(2025, 11, 3, 2, 30, tzinfo=LA)))
+        self.assertEqual(job.status, jobs.JobStatus.SCHEDULED)
+        self.assertEqual(scheduler.next_fire_time(), datetime(2025, 11, 4, 10, 0, tzinfo=timezone.utc))
+
+    def test_disabled_job_is_skipped_but_stays_scheduled(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        job = InitializeJobWithGoodValues()
+        scheduler = InitializeSchedulerWithJobs(start, job)
+        job.status = jobs.JobStatus.DISABLED
+        self.assertEqual(scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 0, tzinfo=LA)), [])
+        self.assertEqual(scheduler.next_fire_time(), datetime(2025, 11, 4, 10, 0, tzinfo=timezone.utc))
+
+    def test_removed_job_is_never_ready(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        scheduler = InitializeSchedulerWithJobs(start, InitializeJobWithGoodValues())
+        self.assertTrue(scheduler.remove_job_by_id("test-job-001"))
+        self.assertFalse(scheduler.remove_job_by_id("test-job-001"))
+        self.assertIsNone(scheduler.next_fire_time())
+        self.assertEqual(scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 0, tzinfo=LA)), [])
+
+    def test_run_now_keeps_scheduled_fire(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        job = InitializeJobWithGoodValues()
+        scheduler = InitializeSchedulerWithJobs(start, job)
+        scheduler.run_now(job.job_id, datetime(2025, 11, 3, 0, 30, tzinfo=LA))
+        self.assertEqual(scheduler.get_ready_jobs(datetime(2025, 11, 3, 0, 30, tzinfo=LA)), [job])
+        self.assertEqual(scheduler.queued_fire_time(job.job_id), datetime(2025, 11, 3, 8, 30, tzinfo=timezone.utc))
+        with self.assertRaises(ValueError):
+            scheduler.run_now(job.job_id)
+        scheduler.job_finished(job.job_id, datetime(2025, 11, 3, 0, 40, tzinfo=LA))
+        self.assertIsNone(scheduler.queued_fire_time(job.job_id))
+        self.assertEqual(scheduler.next_fire_time(), datetime(2025, 11, 3, 10, 0, tzinfo=timezone.utc))
+        with self.assertRaises(ValueError):
+            scheduler.run_now("missing")
+
+    def test_disable_and_enable_job(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        job = InitializeJobWithGoodValues()
+        scheduler = InitializeSchedulerWithJobs(start, job)
+        self.assertTrue(scheduler.set_job_enabled(job.job_id, False, start))
+        self.assertFalse(scheduler.set_job_enabled(job.job_id, False, start))
+        self.assertEqual(job.status, jobs.JobStatus.DISABLED)
+        self.assertIsNone(scheduler.next_fire_time())
+        self.assertTrue(scheduler.set_job_enabled(job.job_id, True, datetime(2025, 11, 3, 3, 0, tzinfo=LA)))
+        self.assertEqual(job.status, jobs.JobStatus.SCHEDULED)
+        self.assertEqual(scheduler.job_next_fire_time(job.job_id), datetime(2025, 11, 4, 10, 0, tzinfo=timezone.utc))
+
+    def test_job_disabled_while_running_is_disabled_when_it_finishes(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        job = InitializeJobWithGoodValues()
+        scheduler = InitializeSchedulerWithJobs(start, job)
+        scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 0, tzinfo=LA))
+        self.assertTrue(scheduler.set_job_enabled(job.job_id, False))
+        self.assertEqual(job.status, jobs.JobStatus.QUEUED)
+        scheduler.job_finished(job.job_id, datetime(2025, 11, 3, 2, 30, tzinfo=LA))
+        self.assertEqual(job.status, jobs.JobStatus.DISABLED)
+        self.assertIsNone(scheduler.next_fire_time())
+
+    def test_seconds_until_next_fire(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        scheduler = InitializeSchedulerWithJobs(start, InitializeJobWithGoodValues())
+        self.assertEqual(scheduler.seconds_until_next_fire(start), 7200.0)
+
+    def test_upcoming_lists_enabled_jobs_within_window(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        disabled = InitializeJobWithGoodValues("disabled")
+        disabled.status = jobs.JobStatus.DISABLED
+        scheduler = InitializeSchedulerWithJobs(start, InitializeJobWithGoodValues("daily"), disabled)
+        self.assertEqual([(fire_time, job.job_id) for fire_time, job in scheduler.upcoming(start)],
+                         [(datetime(2025, 11, 3, 10, 0, tzinfo=timezone.utc), "daily")])
+
+    def test_naive_date_time_rejected(self):
+        scheduler = BackupJobScheduler()
+        with self.assertRaises(ValueError):
+            scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 0))
+
+class TestScheduleSmoothing(unittest.TestCase):
+
+    def test_jitter_is_deterministic_and_within_window(self):
+        window = timedelta(minutes=30)
+        group = [InitializeJobWithGoodValues(f"job{i}") for i in range(20)]
+        offsets = smoothing_offsets(group, window)
+        self.assertEqual(offsets, smoothing_offsets(list(reversed(group)), window))
+        self.assertTrue(all(timedelta(0) <= offset < window for offset in offsets.values()))
+        self.assertGreater(len(set(offsets.values())), 15)
+        self.assertEqual(smoothing_offsets(group[:1], window), {"job0": timedelta(0)})
+
+    def test_known_durations_are_packed_longest_first(self):
+        durations = {"a": 600, "b": 1200, "c": None}
+        group = [InitializeJobWithGoodValues(job_id) for job_id in durations]
+        offsets = smoothing_offsets(group, timedelta(hours=1), durations.get)
+        # c counts as the 900 s average; back to back, as they fit in the window
+        self.assertEqual(offsets, {"b": timedelta(0), "c": timedelta(seconds=1200), "a": timedelta(seconds=2100)})
+        compressed = smoothing_offsets(group, timedelta(minutes=10), durations.get)
+        self.assertEqual(compressed["a"], timedelta(seconds=2100 * 600 / 2700))
+
+    def test_jobs_sharing_a_trigger_are_spread(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        durations = {"a": 600, "b": 600}
+        scheduler = BackupJobScheduler(smoothing_window=timedelta(minutes=30), expected_duration=durations.get)
+        for job_id in ("a", "b"):
+            scheduler.add_job(InitializeJobWithGoodValues(job_id), start)
+        lone = InitializeJobWithGoodValues("lone")
+        lone.schedule_time = time(5, 0, tzinfo=LA)
+        scheduler.add_job(lone, start)
+        self.assertEqual([job.job_id for job in scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 0, tzinfo=LA))], ["a"])
+        self.assertEqual([job.job_id for job in scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 10, tzinfo=LA))], ["b"])
+        self.assertEqual([(fire_time.astimezone(LA).strftime("%H:%M"), job.job_id) for fire_time, job in
+                          scheduler.upcoming(datetime(2025, 11, 3, 2, 30, tzinfo=LA))],
+                         [("05:00", "lone"), ("02:00", "a"), ("02:10", "b")])
+
+    def test_moved_offset_does_not_repeat_a_fire(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        durations = {"a": 600, "b": 600}
+        scheduler = BackupJobScheduler(smoothing_window=timedelta(minutes=30), expected_duration=durations.get)
+        for job_id in ("a", "b"):
+            scheduler.add_job(InitializeJobWithGoodValues(job_id), start)
+        ready = scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 10, tzinfo=LA))
+        self.assertEqual([job.job_id for job in ready], ["a", "b"])
+        # The runs change the expected durations, and a new job replans the group:
+        # c still makes today's 02:20 slot, while a moves to 02:25 but already
+        # ran for today's 02:00
+        durations.update(a=60, b=1200, c=300)
+        scheduler.job_finished("a", datetime(2025, 11, 3, 2, 15, tzinfo=LA))
+        scheduler.job_finished("b", datetime(2025, 11, 3, 2, 15, tzinfo=LA))
+        scheduler.add_job(InitializeJobWithGoodValues("c"), datetime(2025, 11, 3, 2, 15, tzinfo=LA))
+        ready = scheduler.get_ready_jobs(datetime(2025, 11, 3, 3, 0, tzinfo=LA))
+        self.assertEqual([job.job_id for job in ready], ["c"])
+        scheduler.job_finished("c", datetime(2025, 11, 3, 3, 0, tzinfo=LA))
+        self.assertEqual([(fire_time.astimezone(LA).strftime("%H:%M"), job.job_id) for fire_time, job in
+                          scheduler.upcoming(datetime(2025, 11, 3, 3, 0, tzinfo=LA))],
+                         [("02:00", "b"), ("02:20", "c"), ("02:25", "a")])
+
+    def test_only_the_groups_a_change_touches_are_replanned(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        queried = []
+        def ExpectedDuration(job_id):
+            queried.append(job_id)
+            return 60 * (1 + len(job_id))
+        def Job(job_id, hour):
+            job = InitializeJobWithGoodValues(job_id)
+            job.schedule_time = time(hour, 0, tzinfo=LA)
+            return job
+        scheduler = BackupJobScheduler(smoothing_window=timedelta(minutes=30), expected_duration=ExpectedDuration)
+        diff = ScheduleDiff()
+        diff.added = {job.job_id: job for job in [Job(f"two{i}", 2) for i in range(20)] +
+                                                  [Job(f"three{i}", 3) for i in range(20)]}
+        scheduler.apply_schedule_diff(diff, start)
+        self.assertEqual(sorted(queried), sorted(diff.added)) # Each duration was asked for once
+
+        queried.clear()
+        diff = ScheduleDiff()
+        diff.added = {"two-new": Job("two-new", 2)}
+        diff.removed = {f"two{i}" for i in range(10)}
+        with mock.patch.object(schedule, "smoothing_offsets", wraps=smoothing_offsets) as replanned:
+            scheduler.apply_schedule_diff(diff, start)
+            scheduler.set_job_enabled("two10", False, start)
+        self.assertEqual(queried, ["two-new"])
+        self.assertEqual([len(call.args[0]) for call in replanned.call_args_list], [11, 10])
+
+        # The offsets are those of a scheduler that planned every group from scratch
+        fresh = BackupJobScheduler(smoothing_window=timedelta(minutes=30), expected_duration=ExpectedDuration)
+        for job in scheduler.job_pool:
+            fresh.add_job(Job(job.job_id, job.schedule_time.hour), start)
+        fresh.set_job_enabled("two10", False, start)
+        self.assertEqual(scheduler._offsets, fresh._offsets)
+        self.assertEqual(scheduler.upcoming(start), fresh.upcoming(start))
+
+class TestSchedulerRecovery(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.journal_path = Path(self.tempdir.name) / "scheduler.journal"
+        self.journal = SchedulerJournal(self.journal_path)
+
+    def tearDown(self):
+        self.journal.close()
+        self.tempdir.cleanup()
+
+    # Simulates a daemon restart: a new journal replayed from disk and a freshly loaded schedule
+    def Restart(self, date_time, *jobs_to_add):
+        self.journal.close()
+        self.journal = SchedulerJournal(self.journal_path)
+        scheduler = BackupJobScheduler(self.journal)
+        for job in jobs_to_add:
+            scheduler.add_job(job, date_time)
+        return scheduler, scheduler.recover(date_time)
+
+    def RunOnce(self, scheduler, date_time):
+        ready = scheduler.get_ready_jobs(date_time)
+        for job in ready:
+            scheduler.set_job_status(job.job_id, jobs.JobStatus.RUNNING)
+            scheduler.set_job_status(job.job_id, jobs.JobStatus.COMPLETED)
+            scheduler.job_finished(job.job_id, date_time)
+        return ready
+
+    def test_missed_fire_times_follow_policy(self):
+        job = InitializeJobWithGoodValues()
+        last_fire = datetime(2025, 11, 3, 2, 0, tzinfo=LA)
+        now = datetime(2025, 11, 6, 12, 0, tzinfo=LA)
+        self.assertEqual(missed_fire_times(job, last_fire, now), [datetime(2025, 11, 6, 10, 0, tzinfo=timezone.utc)])
+        job.misfire_policy = jobs.MisfirePolicy.RUN_ALL
+        self.assertEqual(len(missed_fire_times(job, last_fire, now)), 3)
+        job.misfire_policy = jobs.MisfirePolicy.SKIP
+        self.assertEqual(missed_fire_times(job, last_fire, now), [])
+
+    def test_interrupted_run_is_run_again(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        job = InitializeJobWithGoodValues()
+        scheduler = BackupJobScheduler(self.journal)
+        scheduler.add_job(job, start)
+        scheduler.get_ready_jobs(datetime(2025, 11, 3, 2, 0, tzinfo=LA))
+        scheduler.set_job_status(job.job_id, jobs.JobStatus.RUNNING)
+        # The daemon dies here and comes back before the next fire time
+        restart = datetime(2025, 11, 3, 3, 0, tzinfo=LA)
+        job = InitializeJobWithGoodValues()
+        job.misfire_policy = jobs.MisfirePolicy.SKIP
+        scheduler, recovered = self.Restart(restart, job)
+        self.assertEqual(recovered, 1)
+        self.assertEqual(self.RunOnce(scheduler, restart), [job])
+        self.assertEqual(scheduler.next_fire_time(), datetime(2025, 11, 4, 10, 0, tzinfo=timezone.utc))
+
+    def test_run_all_makes_up_every_missed_run(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        scheduler = BackupJobScheduler(self.journal)
+        scheduler.add_job(InitializeJobWithGoodValues(), start)
+        self.RunOnce(scheduler, datetime(2025, 11, 3, 2, 0, tzinfo=LA))
+        restart = datetime(2025, 11, 6, 12, 0, tzinfo=LA)
+        job = InitializeJobWithGoodValues()
+        job.misfire_policy = jobs.MisfirePolicy.RUN_ALL
+        scheduler, recovered = self.Restart(restart, job)
+        self.assertEqual(recovered, 3)
+        for minute in range(3):
+            self.assertEqual(self.RunOnce(scheduler, restart + timedelta(minutes=minute)), [job])
+        self.assertEqual(self.RunOnce(scheduler, restart + timedelta(minutes=3)), [])
+        self.assertEqual(self.journal.entries[job.job_id].last_fire, datetime(2025, 11, 6, 10, 0, tzinfo=timezone.utc))
+        self.assertEqual(scheduler.next_fire_time(), datetime(2025, 11, 7, 10, 0, tzinfo=timezone.utc))
+
+    def test_skip_and_run_once_policies(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        scheduler = BackupJobScheduler(self.journal)
+        scheduler.add_job(InitializeJobWithGoodValues("once"), start)
+        scheduler.add_job(InitializeJobWithGoodValues("skip"), start)
+        self.RunOnce(scheduler, datetime(2025, 11, 3, 2, 0, tzinfo=LA))
+        restart = datetime(2025, 11, 6, 12, 0, tzinfo=LA)
+        skip = InitializeJobWithGoodValues("skip")
+        skip.misfire_policy = jobs.MisfirePolicy.SKIP
+        scheduler, recovered = self.Restart(restart, InitializeJobWithGoodValues("once"), skip)
+        self.assertEqual(recovered, 1)
+        self.assertEqual([job.job_id for job in self.RunOnce(scheduler, restart)], ["once"])
+        self.assertEqual(self.RunOnce(scheduler, restart + timedelta(minutes=1)), [])
+
+    def test_jobs_removed_while_down_are_forgotten(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        scheduler = BackupJobScheduler(self.journal)
+        scheduler.add_job(InitializeJobWithGoodValues(), start)
+        self.RunOnce(scheduler, datetime(2025, 11, 3, 2, 0, tzinfo=LA))
+        _, recovered = self.Restart(datetime(2025, 11, 6, 12, 0, tzinfo=LA))
+        self.assertEqual(recovered, 0)
+        self.assertEqual(self.journal.entries, {})
+
+    def test_control_channel_state_is_restored_until_the_definition_changes(self):
+        start = datetime(2025, 11, 3, 0, 0, tzinfo=LA)
+        definitions = {"a": b"1", "b": b"1"}
+        scheduler = BackupJobScheduler(self.journal, definition_digest=definitions.get)
+        disabled_in_file = InitializeJobWithGoodValues("b")
+        disabled_in_file.status = jobs.JobStatus.DISABLED
+        scheduler.add_job(InitializeJobWithGoodValues("a"), start)
+        scheduler.add_job(disabled_in_file, start)
+        scheduler.set_job_enabled("a", False, start)
+        scheduler.set_job_enabled("b", True, start)
+
+        def Reloaded():
+            job = InitializeJobWithGoodValues("b")
+            job.status = jobs.JobStatus.DISABLED
+            return InitializeJobWithGoodValues("a"), job
+        restart = datetime(2025, 11, 3, 1, 0, tzinfo=LA)
+        self.journal.close()
+        self.journal = SchedulerJournal(self.journal_path)
+        scheduler = BackupJobScheduler(self.journal, definition_digest=definitions.get)
+        for job in Reloaded():
+            scheduler.add_job(job, restart)
+        scheduler.recover(restart)
+        self.assertEqual(scheduler.job_pool.get_by_id("a").status, jobs.JobStatus.DISABLED)
+        self.assertEqual(scheduler.job_pool.get_by_id("b").status, jobs.JobStatus.SCHEDULED)
+        self.assertEqual([job.job_id for job in self.RunOnce(scheduler, datetime(2025, 11, 3, 2, 0, tzinfo=LA))], ["b"])
+
+        definitions["a"] = b"2" # Edited while the daemon was down
+        self.journal.close()
+        self.journal = SchedulerJournal(self.journal_path)
+        scheduler = BackupJobScheduler(self.journal, definition_digest=definitions.get)
+        for job in Reloaded():
+            scheduler.add_job(job, restart)
+        scheduler.recover(restart)
+        self.assertEqual(scheduler.job_pool.get_by_id("a").status, jobs.JobStatus.SCHEDULED)
+        self.assertEqual(scheduler.job_pool.get_by_id("b").status, jobs.JobStatus.SCHEDULED)
+        self.assertIsNone(self.journal.entries["a"].enabled)
+
+
+if __name__ == '__main__':
+    unittest.main()
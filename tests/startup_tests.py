@@ -0,0 +1,53 @@
+import unittest
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+import abackup
+from abackup.ui import cli
+
+# Modules a client command must never load
+HEAVY_MODULES = {"asyncio", "logging", "sqlite3", "yaml", "concurrent.futures", "abackup.backup_daemon",
+                 "abackup.backupcore", "abackup.controlserver", "abackup.jobs", "abackup.schedule",
+                 "abackup.history", "abackup.throttle"}
+
+# Client invocations and their exit codes when no daemon is running
+CLIENT_COMMANDS = {("--help",): 0, ("status",): 1, ("list",): 1}
+
+# Runs python -X importtime with the given arguments and returns the self
+# time in microseconds of every module it imported, and its output
+def ImportTimes(*args) -> tuple[dict, subprocess.CompletedProcess]:
+    process = subprocess.run([sys.executable, "-X", "importtime", *args], capture_output=True, text=True)
+    times = {}
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:"):
+            self_time, _, name = line[len("import time:"):].split("|")
+            if self_time.strip().isdigit():
+                times[name.strip()] = int(self_time)
+    return times, process
+
+class TestCliStartup(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.socket = Path(self.tempdir.name) / "control.sock"
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    # How long the imports take depends on the machine; benchmarks/startup_bench.py measures it
+    def test_client_commands_load_none_of_the_daemon_modules(self):
+        for command, exit_code in CLIENT_COMMANDS.items():
+            with self.subTest(command=command):
+                times, process = ImportTimes("-m", "abackup", "--socket", str(self.socket), *command)
+                self.assertEqual(process.returncode, exit_code, process.stderr)
+                self.assertIn("abackup.ui", times)
+                self.assertEqual(HEAVY_MODULES & set(times), set())
+
+    def test_package_import_is_lazy(self):
+        times, _ = ImportTimes("-c", "import abackup.paths")
+        self.assertNotIn("abackup.ui", times)
+        self.assertIs(abackup.cli, cli)
+
+if __name__ == "__main__":
+    unittest.main()
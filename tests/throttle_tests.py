@@ -0,0 +1,170 @@
+import unittest
+import io
+import sys
+import threading
+import time as clock
+from datetime import datetime, time, timezone
+from unittest import mock
+from zoneinfo import ZoneInfo
+from abackup.core import destination_key
+from abackup.throttle import (TRANSFERRED_BYTES, IOPriority, JobLimiter, Throttle, ThrottleLimits, ThrottleProfile,
+                              ThrottleSchedule, TokenBucket, parse_bandwidth, parse_throttle_schedule, set_io_priority)
+from jobs_tests import InitializeJobWithGoodValues
+
+BERLIN = ZoneInfo("Europe/Berlin")
+
+def BusinessHoursSchedule():
+    return ThrottleSchedule(ThrottleLimits(bandwidth=100_000_000),
+                            [ThrottleProfile(time(8), time(18), ThrottleLimits(bandwidth=1_000_000,
+                                                                               io_priority=IOPriority("idle")))],
+                            tz=BERLIN)
+
+class TestParseBandwidth(unittest.TestCase):
+
+    def test_units(self):
+        self.assertEqual(parse_bandwidth("10MB/s"), 10 * 1024 * 1024)
+        self.assertEqual(parse_bandwidth("500K"), 500 * 1024)
+        self.assertEqual(parse_bandwidth("1.5 GB/s"), int(1.5 * 1024 ** 3))
+        self.assertEqual(parse_bandwidth(4096), 4096)
+        self.assertIsNone(parse_bandwidth("off"))
+        self.assertIsNone(parse_bandwidth(None))
+
+    def test_invalid_values(self):
+        for value in ("fast", "10 TB/s", 0, "-5MB"):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                parse_bandwidth(value)
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_unlimited_bucket_never_waits(self):
+        bucket = TokenBucket()
+        started = clock.monotonic()
+        for _ in range(1000):
+            bucket.consume(1 << 30)
+        self.assertLess(clock.monotonic() - started, 0.5)
+
+    def test_consumers_are_held_to_the_rate(self):
+        bucket = TokenBucket(4_000_000)
+        started = clock.monotonic()
+        for _ in range(4):
+            bucket.consume(200_000)
+        self.assertGreater(clock.monotonic() - started, 0.18)
+
+    def test_rate_change_releases_waiting_consumer(self):
+        bucket = TokenBucket(1000)
+        consumer = threading.Thread(target=bucket.consume, args=(1_000_000,))
+        consumer.start()
+        clock.sleep(0.05)
+        self.assertTrue(consumer.is_alive())
+        bucket.set_rate(None)
+        consumer.join(1)
+        self.assertFalse(consumer.is_alive())
+
+    def test_job_limiter_draws_from_both_buckets(self):
+        fast, slow = TokenBucket(), TokenBucket(4_000_000)
+        limiter = JobLimiter(fast, slow)
+        output = io.BytesIO()
+        started = clock.monotonic()
+        writer = limiter.writer(output)
+        for chunk in limiter.chunks([b"x" * 200_000] * 2):
+            writer.write(chunk)
+        self.assertEqual(len(output.getvalue()), 400_000)
+        self.assertGreater(clock.monotonic() - started, 0.18)
+
+class TestThrottleSchedule(unittest.TestCase):
+
+    def test_profile_limits_apply_during_their_hours(self):
+        schedule = BusinessHoursSchedule()
+        self.assertEqual(schedule.limits_at(datetime(2025, 6, 2, 9, 0, tzinfo=BERLIN)).bandwidth, 1_000_000)
+        self.assertEqual(schedule.limits_at(datetime(2025, 6, 2, 18, 0, tzinfo=BERLIN)).bandwidth, 100_000_000)
+        # 06:30 UTC is 08:30 in Berlin in summer
+        self.assertEqual(schedule.limits_at(datetime(2025, 6, 2, 6, 30, tzinfo=timezone.utc)).bandwidth, 1_000_000)
+
+    def test_profile_can_span_midnight(self):
+        night = ThrottleProfile(time(22), time(6), ThrottleLimits())
+        self.assertTrue(night.contains(time(23, 30)))
+        self.assertTrue(night.contains(time(5, 59)))
+        self.assertFalse(night.contains(time(6)))
+        with self.assertRaises(ValueError):
+            ThrottleProfile(time(6), time(6), ThrottleLimits())
+
+    def test_next_change_is_the_next_boundary(self):
+        schedule = BusinessHoursSchedule()
+        self.assertEqual(schedule.next_change(datetime(2025, 6, 2, 9, 0, tzinfo=BERLIN)),
+                         datetime(2025, 6, 2, 18, 0, tzinfo=BERLIN))
+        self.assertEqual(schedule.next_change(datetime(2025, 6, 2, 19, 0, tzinfo=BERLIN)),
+                         datetime(2025, 6, 3, 8, 0, tzinfo=BERLIN))
+        self.assertIsNone(ThrottleSchedule().next_change(datetime(2025, 6, 2, tzinfo=BERLIN)))
+
+    def test_parse_schedule(self):
+        schedule = parse_throttle_schedule({
+            "bandwidth": "50MB/s", "io-priority": "best-effort:6", "timezone": "Europe/Berlin",
+            "profiles": [{"start": "8:00", "end": 1080, "bandwidth": "5MB/s", "io-priority": "idle"}],
+        })
+        self.assertEqual(schedule.default, ThrottleLimits(50 * 1024 ** 2, None, IOPriority("best-effort", 6)))
+        profile = schedule.profiles[0]
+        self.assertEqual((profile.start, profile.end), (time(8), time(18)))
+        self.assertEqual(profile.limits, ThrottleLimits(5 * 1024 ** 2, None, IOPriority("idle")))
+        with self.assertRaises(ValueError):
+            parse_throttle_schedule({"bandwith": "5MB/s"})
+        with self.assertRaises(ValueError):
+            parse_throttle_schedule({"profiles": [{"start": "8:00", "bandwidth": "5MB/s"}]})
+
+class TestThrottle(unittest.TestCase):
+
+    def test_limits_reach_running_jobs_and_listeners(self):
+        throttle = Throttle(BusinessHoursSchedule())
+        applied = []
+        throttle.add_listener(applied.append)
+        job = InitializeJobWithGoodValues()
+        job.bandwidth_limit = 500_000
+        with mock.patch("abackup.throttle.set_process_io_priority") as set_priority, throttle.running(job) as limiter:
+            self.assertIs(throttle.limiter(job.job_id), limiter)
+            self.assertEqual((limiter.job_bucket.rate, limiter.global_bucket.rate), (500_000, None))
+            next_change = throttle.apply(datetime(2025, 6, 2, 9, 0, tzinfo=BERLIN))
+            self.assertEqual(next_change, datetime(2025, 6, 2, 18, 0, tzinfo=BERLIN))
+            self.assertEqual((limiter.job_bucket.rate, limiter.global_bucket.rate), (500_000, 1_000_000))
+            throttle.set_limits(ThrottleLimits(job_bandwidth=200_000))
+            self.assertEqual((limiter.job_bucket.rate, limiter.global_bucket.rate), (200_000, None))
+        self.assertIsNone(throttle.limiter(job.job_id))
+        self.assertEqual([limits.bandwidth for limits in applied], [None, 1_000_000, None])
+        self.assertEqual([call.args[0] for call in set_priority.call_args_list], [IOPriority("idle"), None])
+
+    def test_transferred_bytes_are_counted(self):
+        job = InitializeJobWithGoodValues()
+        transferred = TRANSFERRED_BYTES.labels(job.job_id, destination_key(job.destination_url))
+        before = transferred.value
+        with Throttle().running(job) as limiter:
+            limiter.writer(io.BytesIO()).write(b"x" * 1000)
+            list(limiter.chunks([b"y" * 24]))
+        self.assertEqual(transferred.value - before, 1024)
+
+    def test_unchanged_limits_are_not_reapplied(self):
+        throttle = Throttle(BusinessHoursSchedule())
+        applied = []
+        throttle.add_listener(applied.append)
+        throttle.apply(datetime(2025, 6, 2, 20, 0, tzinfo=BERLIN))
+        throttle.apply(datetime(2025, 6, 2, 21, 0, tzinfo=BERLIN))
+        throttle.remove_listener(applied.append)
+        throttle.apply(datetime(2025, 6, 2, 9, 0, tzinfo=BERLIN))
+        self.assertEqual(len(applied), 2)
+
+class TestIOPriority(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(IOPriority.parse("best-effort:7"), IOPriority("best-effort", 7))
+        self.assertEqual(IOPriority.parse("idle").value, 3 << 13)
+        for value in ("lowest", "best-effort:9"):
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                IOPriority.parse(value)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "I/O priorities are Linux-only")
+    def test_set_priority_of_current_thread(self):
+        thread_id = threading.get_native_id()
+        try:
+            self.assertTrue(set_io_priority(thread_id, IOPriority("best-effort", 7)))
+        finally:
+            set_io_priority(thread_id, None)
+
+if __name__ == "__main__":
+    unittest.main()
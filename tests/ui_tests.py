@@ -0,0 +1,111 @@
+import unittest
+import asyncio
+import contextlib
+import io
+import json
+import sys
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+import abackup.backup_daemon as backup_daemon
+from abackup.controlserver import ControlServer
+from abackup.ui import cli
+
+JOBS = [
+    {"job_id": "nightly", "status": "scheduled", "type": "Local", "destination": "/backups",
+     "next_fire_time": "2025-11-04T02:00:00+00:00",
+     "last_run": {"status": "completed", "started": "2025-11-03T02:00:00+00:00",
+                  "ended": "2025-11-03T02:10:00+00:00", "error": None}},
+    {"job_id": "photos", "status": "disabled", "type": "Google Drive", "destination": "gdrive:photos",
+     "next_fire_time": None, "last_run": None},
+]
+
+@unittest.skipIf(sys.platform == "win32", "the control channel uses Unix sockets")
+class TestCli(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tempdir.name) / "control.sock"
+        self.requests = []
+        self.server = ControlServer(self.path, {"list": self.List, "disable": self.Disable})
+        await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+        self.tempdir.cleanup()
+
+    async def List(self):
+        self.requests.append(("list",))
+        return JOBS
+
+    async def Disable(self, job_id):
+        self.requests.append(("disable", job_id))
+        if job_id != "nightly":
+            raise ValueError(f"No job with ID '{job_id}'.")
+        return {"job_id": job_id, "changed": True}
+
+    async def Cli(self, *argv):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            exit_code = await asyncio.to_thread(cli, ["--socket", str(self.path), *argv])
+        return exit_code, stdout.getvalue(), stderr.getvalue()
+
+    async def test_list(self):
+        exit_code, output, _ = await self.Cli("list")
+        self.assertEqual(exit_code, 0)
+        lines = output.splitlines()
+        self.assertEqual(lines[0].split(), ["JOB", "STATUS", "NEXT", "RUN", "LAST", "RUN"])
+        self.assertEqual(lines[2].split(), ["photos", "disabled", "-", "-"])
+        exit_code, output, _ = await self.Cli("--json", "list")
+        self.assertEqual(json.loads(output), JOBS)
+
+    async def test_commands_with_a_job(self):
+        self.assertEqual(await self.Cli("disable", "nightly"), (0, "Job 'nightly' disabled.\n", ""))
+        exit_code, _, error = await self.Cli("disable", "missing")
+        self.assertEqual((exit_code, error), (1, "abackup: No job with ID 'missing'.\n"))
+        self.assertEqual(self.requests, [("disable", "nightly"), ("disable", "missing")])
+
+    async def test_daemon_not_running(self):
+        await self.server.close()
+        exit_code, _, error = await self.Cli("status")
+        self.assertEqual(exit_code, 1)
+        self.assertIn("not running", error)
+class TestDaemonOptions(unittest.TestCase):
+
+    def RunDaemon(self, *options):
+        stderr = io.StringIO()
+        with mock.patch.object(backup_daemon, "BackupDaemon") as daemon_class, \
+             mock.patch.object(backup_daemon, "UnixBackupDaemon", daemon_class), contextlib.redirect_stderr(stderr):
+            exit_code = cli(["daemon", "schedule.yaml", *options])
+        return exit_code, daemon_class, stderr.getvalue()
+
+    def test_smoothing_window(self):
+        exit_code, daemon_class, _ = self.RunDaemon("--smoothing-window", "1h30m")
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(daemon_class.call_args.kwargs["smoothing_window"], timedelta(minutes=90))
+        self.assertIsNone(self.RunDaemon()[1].call_args.kwargs["smoothing_window"])
+        exit_code, daemon_class, error = self.RunDaemon("--smoothing-window", "soon")
+        self.assertEqual(exit_code, 2)
+        self.assertIn("Invalid smoothing window 'soon'", error)
+        daemon_class.assert_not_called()
+
+    def test_throttle_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "throttle.yaml"
+            path.write_text("bandwidth: 10MB/s\nprofiles:\n  - start: \"08:00\"\n    end: \"18:00\"\n"
+                            "    bandwidth: 1MB/s\n", encoding="utf-8")
+            exit_code, daemon_class, _ = self.RunDaemon("--throttle", str(path))
+            self.assertEqual(exit_code, 0)
+            throttle_schedule = daemon_class.call_args.kwargs["throttle_schedule"]
+            self.assertEqual(throttle_schedule.default.bandwidth, 10 * 1024 * 1024)
+            self.assertEqual(len(throttle_schedule.profiles), 1)
+            path.write_text("bandwidth: fast\n", encoding="utf-8")
+            exit_code, daemon_class, error = self.RunDaemon("--throttle", str(path))
+            self.assertEqual(exit_code, 2)
+            self.assertIn("Invalid throttle settings", error)
+            daemon_class.assert_not_called()
+        self.assertIn("Cannot read throttle settings", self.RunDaemon("--throttle", str(path))[2])
+
+if __name__ == "__main__":
+    unittest.main()
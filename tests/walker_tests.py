@@ -0,0 +1,116 @@
+import unittest
+import tempfile
+import threading
+from pathlib import Path
+from abackup.walker import ParallelWalker, PathMatcher, job_matcher
+from jobs_tests import InitializeJobWithGoodValues
+
+def CreateTree(root: Path, width: int = 3, depth: int = 3) -> set:
+    paths = set()
+    def Fill(directory: Path, relative: str, level: int):
+        for index in range(width):
+            name = f"{relative}f{index}.txt"
+            (directory / f"f{index}.txt").write_text(name)
+            paths.add(name)
+            if level < depth:
+                subdirectory = directory / f"d{index}"
+                subdirectory.mkdir()
+                paths.add(f"{relative}d{index}")
+                Fill(subdirectory, f"{relative}d{index}/", level + 1)
+    root.mkdir()
+    Fill(root, "", 1)
+    return paths
+
+def WalkerThreads() -> list:
+    return [thread for thread in threading.enumerate() if thread.name.startswith("abackup-walker-")]
+
+class TestParallelWalker(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tempdir.name) / "source"
+        self.paths = CreateTree(self.root)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_walks_whole_tree_with_parents_first(self):
+        seen = []
+        for entry in ParallelWalker(self.root, workers=4, max_queued=2):
+            parent = entry.relative_path.rpartition("/")[0]
+            self.assertTrue(parent == "" or parent in seen, entry.relative_path)
+            self.assertEqual(entry.is_dir, (self.root / entry.relative_path).is_dir())
+            seen.append(entry.relative_path)
+        self.assertEqual(sorted(seen), sorted(self.paths))
+
+    def test_non_recursive_walk_lists_top_level_files(self):
+        entries = list(ParallelWalker(self.root, recursive=False))
+        self.assertEqual(sorted(entry.relative_path for entry in entries), ["f0.txt", "f1.txt", "f2.txt"])
+        self.assertTrue(all(entry.is_file and entry.stat.st_size == 6 for entry in entries))
+
+    def test_matcher_prunes_excluded_directories(self):
+        matcher = PathMatcher(include=["*.txt"], exclude=["d1", "d0/d2/f*"])
+        paths = {entry.relative_path for entry in ParallelWalker(self.root, matcher=matcher)}
+        self.assertFalse(any(path == "d1" or path.startswith("d1/") for path in paths))
+        self.assertNotIn("d0/d2/f0.txt", paths)
+        self.assertIn("d0/d2", paths)
+        self.assertIn("d2/d0/f1.txt", paths)
+
+    def test_missing_root_raises(self):
+        with self.assertRaises(FileNotFoundError):
+            list(ParallelWalker(self.root / "missing"))
+        self.assertEqual(WalkerThreads(), [])
+
+    def test_abandoned_walk_stops_its_threads(self):
+        walk = iter(ParallelWalker(self.root, workers=4, max_queued=1))
+        next(walk)
+        self.assertTrue(WalkerThreads())
+        walk.close()
+        self.assertEqual(WalkerThreads(), [])
+
+class TestPathMatcher(unittest.TestCase):
+
+    def test_name_patterns_match_at_any_depth(self):
+        matcher = PathMatcher(exclude=["*.tmp", "node_modules"])
+        self.assertFalse(matcher.matches("a.tmp"))
+        self.assertFalse(matcher.matches("src/b.tmp"))
+        self.assertFalse(matcher.matches("web/node_modules", is_dir=True))
+        self.assertFalse(matcher.matches("web/node_modules/x/index.js"))
+        self.assertTrue(matcher.matches("src/tmp.txt"))
+
+    def test_patterns_with_slash_are_anchored(self):
+        matcher = PathMatcher(exclude=["build/cache", "/logs", "data/**/*.bak", "v[0-9].txt"])
+        self.assertFalse(matcher.matches("build/cache/object"))
+        self.assertTrue(matcher.matches("src/build/cache"))
+        self.assertFalse(matcher.matches("logs", is_dir=True))
+        self.assertTrue(matcher.matches("src/logs", is_dir=True))
+        self.assertFalse(matcher.matches("data/x.bak"))
+        self.assertFalse(matcher.matches("data/a/b/x.bak"))
+        self.assertFalse(matcher.matches("v1.txt"))
+        self.assertTrue(matcher.matches("vx.txt"))
+
+    def test_includes_select_files_and_excludes_win(self):
+        matcher = PathMatcher(include=["docs", "*.py"], exclude=["test_*.py"])
+        self.assertTrue(matcher.matches("docs/guide/index.md"))
+        self.assertTrue(matcher.matches("src/app.py"))
+        self.assertTrue(matcher.matches("src", is_dir=True))
+        self.assertFalse(matcher.matches("src/app.js"))
+        self.assertFalse(matcher.matches("src/test_app.py"))
+
+    def test_rclone_filter_rules(self):
+        matcher = PathMatcher(include=["*.py"], exclude=["build/cache/"])
+        self.assertEqual(matcher.rclone_filter(), {"FilterRule": ["- /build/cache", "- /build/cache/**",
+                                                                  "+ *.py", "+ *.py/**", "- **"]})
+        self.assertEqual(PathMatcher(exclude=["*.tmp"]).rclone_filter(), {"FilterRule": ["- *.tmp", "- *.tmp/**"]})
+        self.assertEqual(PathMatcher().rclone_filter(), {})
+
+    def test_job_matcher_is_compiled_once(self):
+        job = InitializeJobWithGoodValues()
+        self.assertIsNone(job_matcher(job))
+        job.exclude_patterns = ["*.tmp"]
+        other = InitializeJobWithGoodValues("other")
+        other.exclude_patterns = ["*.tmp"]
+        self.assertIs(job_matcher(job), job_matcher(other))
+
+if __name__ == "__main__":
+    unittest.main()